@@ -0,0 +1,411 @@
+"""
+Analytics Extract Module
+Keeps invoices and the section records behind them as columnar NumPy
+arrays in memory-mapped .npy files, refreshed incrementally from the
+database, for group-bys, cohorts and time buckets without SQLite
+"""
+import io
+import json
+import os
+import threading
+from datetime import datetime
+
+try:
+    import numpy as np
+    NUMPY_SUPPORT = True
+except ImportError:
+    NUMPY_SUPPORT = False
+
+from database import db
+from archive import ArchiveManager, archive_manager
+from app_logger import log_info
+
+# Extract -> source table, condition for rows that may still change, and
+# column -> (source expression, dtype). Ids are 0 where the source is NULL,
+# amounts 0.0 and times NaT.
+EXTRACTS = {
+    'invoices': {
+        'table': 'invoices',
+        'open': 'is_paid = 0',
+        'columns': {
+            'customer_id': ('customer_id', 'int64'),
+            'at': ('invoice_date', 'datetime64[s]'),
+            'amount': ('final_amount', 'float64'),
+            'discount': ('discount_amount', 'float64'),
+            'paid': ('is_paid', 'int8'),
+        },
+    },
+    'salon': {
+        'table': 'salon_service_records',
+        'open': 'invoice_id IS NULL',
+        'columns': {
+            'customer_id': ('customer_id', 'int64'),
+            'employee_id': ('stylist_id', 'int64'),
+            'item_id': ('service_id', 'int64'),
+            'invoice_id': ('invoice_id', 'int64'),
+            'at': ('service_date', 'datetime64[s]'),
+            'amount': ('price', 'float64'),
+        },
+    },
+    'cafe': {
+        'table': 'cafe_orders',
+        'open': 'invoice_id IS NULL',
+        'columns': {
+            'customer_id': ('customer_id', 'int64'),
+            'employee_id': ('barista_id', 'int64'),
+            'invoice_id': ('invoice_id', 'int64'),
+            'at': ('order_date', 'datetime64[s]'),
+            'amount': ('total_amount', 'float64'),
+        },
+    },
+    'gamnet': {
+        'table': 'gamnet_sessions',
+        'open': 'end_time IS NULL OR invoice_id IS NULL',
+        'columns': {
+            'customer_id': ('customer_id', 'int64'),
+            'item_id': ('device_id', 'int64'),
+            'invoice_id': ('invoice_id', 'int64'),
+            'at': ('start_time', 'datetime64[s]'),
+            'minutes': ('duration_minutes', 'int64'),
+            'amount': ('charge', 'float64'),
+        },
+    },
+}
+
+SECTIONS = {'salon': 'Salon', 'cafe': 'Cafe', 'gamnet': 'Gamnet'}
+
+# Time buckets: numpy datetime unit per period name
+UNITS = {'day': 'D', 'week': 'W', 'month': 'M', 'year': 'Y'}
+
+NAT = -2 ** 63
+
+if NUMPY_SUPPORT:
+    HEADER_FORMATS = {
+        (1, 0): (np.lib.format.read_array_header_1_0, np.lib.format.write_array_header_1_0),
+        (2, 0): (np.lib.format.read_array_header_2_0, np.lib.format.write_array_header_2_0),
+    }
+
+class AnalyticsError(Exception):
+    """Raised when the extract cannot be built or read"""
+
+class AnalyticsExtract:
+    """Columnar copies of invoices and section records
+    
+    Each extract is a folder of one .npy file per column (plus `id` and
+    `open`) under analytics/ next to the database, and a state.json with
+    its row count and the highest id read. refresh() appends the rows past
+    that watermark and reads the still-open rows again (unpaid invoices,
+    uninvoiced records, running sessions); open rows deleted in the
+    database keep their id with NaT time and no amount. History in the
+    archives is read through ArchiveManager, so a fresh extract covers it.
+    
+    The state also keeps the date of the watermark row. If that row is
+    gone or dated differently, the database was restored or replaced and
+    the extract is rebuilt from scratch; invalidate() forces the same.
+    
+    Columns are memory-mapped read-only, so the analytics below touch only
+    the pages they scan.
+    """
+    def __init__(self, database=None, directory=None):
+        self.db = database or db
+        self.archive = ArchiveManager(self.db) if database else archive_manager
+        self.directory = directory or os.path.join(os.path.dirname(os.path.abspath(self.db.path)), 'analytics')
+        self.lock = threading.RLock()
+        self._columns = {}
+    
+    def _require_numpy(self):
+        if not NUMPY_SUPPORT:
+            raise AnalyticsError("NumPy is not installed")
+    
+    def _path(self, extract, name):
+        return os.path.join(self.directory, extract, f"{name}.npy")
+    
+    def _state(self, extract):
+        try:
+            with open(os.path.join(self.directory, extract, 'state.json')) as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return {'rows': 0, 'last_id': 0, 'last_at': None}
+    
+    def _save_state(self, extract, state):
+        path = os.path.join(self.directory, extract, 'state.json')
+        with open(path + '.tmp', 'w') as f:
+            json.dump(state, f)
+        os.replace(path + '.tmp', path)
+    
+    def _last_at(self, extract, table, row_id):
+        """Date text of a source row, or None if there is no such row"""
+        row = self.db.fetchone(
+            f"SELECT {EXTRACTS[extract]['columns']['at'][0]} FROM {table} WHERE id = ?", (row_id,)
+        )
+        return row[0] if row else None
+    
+    def invalidate(self):
+        """Forget every extract so the next refresh() rebuilds them, e.g. after a backup restore"""
+        with self.lock:
+            self._columns = {}
+            for extract in EXTRACTS:
+                try:
+                    os.remove(os.path.join(self.directory, extract, 'state.json'))
+                except FileNotFoundError:
+                    pass
+    
+    def _dtypes(self, extract):
+        dtypes = {'id': 'int64', 'open': 'int8'}
+        dtypes.update({name: dtype for name, (source, dtype) in EXTRACTS[extract]['columns'].items()})
+        return dtypes
+    
+    def _select(self, extract):
+        """SELECT list for the extract's columns, in _dtypes() order"""
+        config = EXTRACTS[extract]
+        expressions = ['id', f"CASE WHEN {config['open']} THEN 1 ELSE 0 END"]
+        for source, dtype in config['columns'].values():
+            if dtype.startswith('datetime64'):
+                expressions.append(f"COALESCE(CAST(strftime('%s', {source}) AS INTEGER), {NAT + 1} - 1)")
+            else:
+                expressions.append(f"COALESCE({source}, 0)")
+        return ', '.join(expressions)
+    
+    def _arrays(self, extract, rows):
+        """Column arrays of fetched rows"""
+        arrays = {}
+        for index, (name, dtype) in enumerate(self._dtypes(extract).items()):
+            if dtype.startswith('datetime64'):
+                arrays[name] = np.fromiter((row[index] for row in rows), 'int64', len(rows)).astype(dtype)
+            else:
+                arrays[name] = np.fromiter((row[index] for row in rows), dtype, len(rows))
+        return arrays
+    
+    def _write(self, extract, rows, arrays):
+        """Write arrays after the first `rows` rows of each column file"""
+        for name, values in arrays.items():
+            path = self._path(extract, name)
+            if not os.path.exists(path) or rows == 0:
+                np.save(path, values)
+                continue
+            with open(path, 'r+b') as f:
+                version = np.lib.format.read_magic(f)
+                read_header, write_header = HEADER_FORMATS[version]
+                shape, fortran_order, dtype = read_header(f)
+                offset = f.tell()
+                # numpy leaves room in the header for the length to grow in place
+                header = io.BytesIO()
+                header.write(np.lib.format.magic(*version))
+                write_header(header, {'descr': np.lib.format.dtype_to_descr(dtype), 'fortran_order': False,
+                                      'shape': (rows + len(values),)})
+                if header.tell() == offset:
+                    f.seek(0)
+                    f.write(header.getvalue())
+                    f.seek(offset + rows * dtype.itemsize)
+                    f.write(values.astype(dtype).tobytes())
+                    f.truncate()
+                    continue
+            np.save(path, np.concatenate([np.load(path)[:rows], values]))
+    
+    def refresh(self, batch_size=10000):
+        """Bring every extract up to date; returns {extract: rows appended or read again}"""
+        self._require_numpy()
+        counts = {}
+        with self.lock:
+            self._columns = {}
+            try:
+                self._refresh(counts, batch_size)
+            except (OSError, ValueError) as e:
+                raise AnalyticsError(f"Analytics extract refresh failed: {e}") from e
+        log_info(f"Analytics extract refreshed: {counts}")
+        return counts
+    
+    def _refresh(self, counts, batch_size):
+        """refresh() with the lock held; counts are filled in per extract"""
+        for extract, config in EXTRACTS.items():
+            os.makedirs(os.path.join(self.directory, extract), exist_ok=True)
+            state = self._state(extract)
+            table = self.archive.table_for(config['table'])
+            select = self._select(extract)
+            counts[extract] = 0
+            if state['rows'] and self._last_at(extract, table, state['last_id']) != state.get('last_at'):
+                log_info(f"Analytics extract {extract} does not match the database, rebuilding")
+                state = {'rows': 0, 'last_id': 0, 'last_at': None}
+                self._save_state(extract, state)
+            
+            # Rows that were still open are read again where they sit
+            if state['rows']:
+                columns = {name: np.load(self._path(extract, name), mmap_mode='r+')
+                           for name in self._dtypes(extract)}
+                ids = columns['id'][:state['rows']]
+                reopen = ids[columns['open'][:state['rows']] == 1]
+                for start in range(0, len(reopen), batch_size):
+                    wanted = [int(row_id) for row_id in reopen[start:start + batch_size]]
+                    rows = self.db.fetchall(
+                        f"SELECT {select} FROM {table} WHERE id IN ({', '.join('?' for _ in wanted)}) ORDER BY id",
+                        wanted
+                    )
+                    found = self._arrays(extract, rows)
+                    positions = np.searchsorted(ids, found['id'])
+                    for name, values in found.items():
+                        columns[name][positions] = values
+                    gone = np.searchsorted(ids, np.setdiff1d(wanted, found['id']))
+                    columns['open'][gone] = 0
+                    columns['at'][gone] = np.datetime64('NaT')
+                    columns['amount'][gone] = 0
+                    counts[extract] += len(rows)
+                for values in columns.values():
+                    values.flush()
+                del columns
+            
+            # Rows past the watermark are appended
+            while True:
+                rows = self.db.fetchall(
+                    f"SELECT {select} FROM {table} WHERE id > ? ORDER BY id LIMIT ?",
+                    (state['last_id'], batch_size)
+                )
+                if not rows:
+                    break
+                self._write(extract, state['rows'], self._arrays(extract, rows))
+                state = {'rows': state['rows'] + len(rows), 'last_id': rows[-1][0],
+                         'last_at': self._last_at(extract, table, rows[-1][0])}
+                self._save_state(extract, state)
+                counts[extract] += len(rows)
+    
+    def columns(self, extract):
+        """{column: read-only memory-mapped array} of an extract"""
+        self._require_numpy()
+        with self.lock:
+            if extract not in self._columns:
+                rows = self._state(extract)['rows']
+                if not rows:
+                    self._columns[extract] = {name: np.empty(0, dtype) for name, dtype in self._dtypes(extract).items()}
+                else:
+                    self._columns[extract] = {name: np.load(self._path(extract, name), mmap_mode='r')[:rows]
+                                              for name in self._dtypes(extract)}
+            return self._columns[extract]
+    
+    def select(self, extract, start=None, end=None, paid=None):
+        """Columns of the rows dated within start..end (dates, inclusive); paid=True for paid invoices"""
+        columns = self.columns(extract)
+        days = columns['at'].astype('datetime64[D]')
+        mask = ~np.isnat(days)
+        if start:
+            mask &= days >= np.datetime64(start, 'D')
+        if end:
+            mask &= days <= np.datetime64(end, 'D')
+        if paid is not None:
+            mask &= columns['paid'] == (1 if paid else 0)
+        return {name: values[mask] for name, values in columns.items()}
+    
+    @staticmethod
+    def buckets(times, period='month'):
+        """Start of each time's period as datetime64[D]; weeks start on Monday"""
+        days = times.astype('datetime64[D]')
+        if period == 'week':
+            # Day 0 (1970-01-01) was a Thursday
+            number = days.astype('int64')
+            return (number - (number + 3) % 7).astype('datetime64[D]')
+        if period not in UNITS:
+            raise AnalyticsError(f"Unknown period '{period}'")
+        return days.astype(f"datetime64[{UNITS[period]}]").astype('datetime64[D]')
+    
+    @staticmethod
+    def group(keys, values=None):
+        """(unique keys, row count per key, sum of values per key)"""
+        keys, inverse = np.unique(keys, return_inverse=True)
+        counts = np.bincount(inverse, minlength=len(keys))
+        sums = np.bincount(inverse, weights=values, minlength=len(keys)) if values is not None else counts.astype(float)
+        return keys, counts, sums
+    
+    def revenue_by_period(self, period='month', start=None, end=None):
+        """[{'period', 'count', 'revenue'}] of paid invoices, oldest first"""
+        invoices = self.select('invoices', start, end, paid=True)
+        keys, counts, sums = self.group(self.buckets(invoices['at'], period), invoices['amount'])
+        return [{'period': str(key), 'count': int(count), 'revenue': float(total)}
+                for key, count, total in zip(keys, counts, sums)]
+    
+    def section_trends(self, period='month', start=None, end=None):
+        """{'periods': [...], 'sections': {section: [revenue per period]}} over the section records"""
+        selected = {extract: self.select(extract, start, end) for extract in SECTIONS}
+        periods = np.unique(np.concatenate([self.buckets(rows['at'], period) for rows in selected.values()]))
+        trends = {}
+        for extract, rows in selected.items():
+            positions = np.searchsorted(periods, self.buckets(rows['at'], period))
+            trends[SECTIONS[extract]] = np.bincount(positions, weights=rows['amount'],
+                                                   minlength=len(periods)).astype(float).tolist()
+        return {'periods': [str(p) for p in periods], 'sections': trends}
+    
+    def customer_summary(self, today=None):
+        """Per customer with paid invoices: {'customer_id', 'first', 'last', 'recency_days', 'frequency',
+        'monetary'} as aligned arrays"""
+        invoices = self.select('invoices', paid=True)
+        known = invoices['customer_id'] > 0
+        customers, inverse = np.unique(invoices['customer_id'][known], return_inverse=True)
+        times = invoices['at'][known]
+        first = np.full(len(customers), np.datetime64('9999-12-31T00:00:00'), dtype='datetime64[s]')
+        last = np.full(len(customers), np.datetime64('0001-01-01T00:00:00'), dtype='datetime64[s]')
+        np.minimum.at(first, inverse, times)
+        np.maximum.at(last, inverse, times)
+        today = np.datetime64((today or datetime.now()).strftime('%Y-%m-%d'), 'D')
+        return {
+            'customer_id': customers,
+            'first': first,
+            'last': last,
+            'recency_days': (today - last.astype('datetime64[D]')).astype('int64'),
+            'frequency': np.bincount(inverse, minlength=len(customers)),
+            'monetary': np.bincount(inverse, weights=invoices['amount'][known], minlength=len(customers)),
+        }
+    
+    def segments(self, today=None):
+        """Customers with paid invoices by spend and recency: {'customers', 'vip', 'active', 'at_risk', 'lost',
+        'average_value'}"""
+        summary = self.customer_summary(today)
+        monetary, recency = summary['monetary'], summary['recency_days']
+        average = float(monetary.mean()) if len(monetary) else 0.0
+        return {
+            'customers': int(len(monetary)),
+            'vip': int((monetary > average * 2).sum()),
+            'active': int((recency <= 30).sum()),
+            'at_risk': int(((recency > 30) & (recency <= 90)).sum()),
+            'lost': int((recency > 90).sum()),
+            'average_value': average,
+        }
+    
+    def cohorts(self, period='month', start=None, end=None):
+        """Retention by first-purchase cohort: {'cohorts': [...], 'sizes': [...], 'retention': [[customers
+        buying again 0, 1, 2 ... periods later]]}"""
+        invoices = self.select('invoices', start, end, paid=True)
+        known = invoices['customer_id'] > 0
+        customers, inverse = np.unique(invoices['customer_id'][known], return_inverse=True)
+        buckets = self.buckets(invoices['at'][known], period)
+        first = np.full(len(customers), np.datetime64('9999-12-31'), dtype='datetime64[D]')
+        np.minimum.at(first, inverse, buckets)
+        cohort_keys, cohort_of = np.unique(first, return_inverse=True)
+        if period == 'week':
+            offsets = (buckets - first[inverse]).astype('int64') // 7
+        elif period == 'day':
+            offsets = (buckets - first[inverse]).astype('int64')
+        else:
+            unit = UNITS[period]
+            offsets = (buckets.astype(f'datetime64[{unit}]') - first[inverse].astype(f'datetime64[{unit}]')).astype('int64')
+        width = int(offsets.max()) + 1 if len(offsets) else 0
+        # Each customer counts once per offset
+        visits = np.unique(inverse * max(width, 1) + offsets)
+        customer, offset = visits // max(width, 1), visits % max(width, 1)
+        retention = np.zeros((len(cohort_keys), width), dtype='int64')
+        np.add.at(retention, (cohort_of[customer], offset), 1)
+        return {
+            'cohorts': [str(key) for key in cohort_keys],
+            'sizes': np.bincount(cohort_of, minlength=len(cohort_keys)).tolist(),
+            'retention': retention.tolist(),
+        }
+    
+    def employee_performance(self, start=None, end=None):
+        """[{'employee_id', 'section', 'count', 'revenue'}] from salon services and cafe orders, best first"""
+        results = []
+        for extract in ('salon', 'cafe'):
+            rows = self.select(extract, start, end)
+            staffed = rows['employee_id'] > 0
+            keys, counts, sums = self.group(rows['employee_id'][staffed], rows['amount'][staffed])
+            results.extend({'employee_id': int(key), 'section': SECTIONS[extract], 'count': int(count),
+                            'revenue': float(total)} for key, count, total in zip(keys, counts, sums))
+        return sorted(results, key=lambda row: -row['revenue'])
+
+# Global analytics extract instance
+analytics_extract = AnalyticsExtract()
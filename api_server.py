@@ -0,0 +1,327 @@
+"""
+API Server Module
+Serves the services package to other POS terminals over HTTP/JSON, from
+one process that owns the database, with a pool of read connections and
+per endpoint latency metrics
+"""
+import argparse
+import hmac
+import os
+import queue
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlparse
+
+from database import db, Database
+from services.customers import CustomerService, customer_service
+from services.sessions import SessionService, session_service
+from services.orders import OrderService, order_service
+from services.appointments import AppointmentService, appointment_service
+from services.invoices import InvoiceService, invoice_service
+from services.payments import PaymentService, payment_service
+from services.inventory import InventoryService, inventory_service
+from services.reports import ReportService, report_service
+from services.sms import MessagingService, messaging_service
+from terminal_sync import SyncEngine, sync_engine
+from services.remote import REMOTE_METHODS, ERRORS, encode, decode
+from app_logger import log_info, log_warning, log_exception
+
+SERVICE_CLASSES = {
+    'customers': CustomerService,
+    'sessions': SessionService,
+    'orders': OrderService,
+    'appointments': AppointmentService,
+    'invoices': InvoiceService,
+    'payments': PaymentService,
+    'inventory': InventoryService,
+    'reports': ReportService,
+    'sms': MessagingService,
+    'sync': SyncEngine,
+}
+
+SHARED_SERVICES = {
+    'customers': customer_service,
+    'sessions': session_service,
+    'orders': order_service,
+    'appointments': appointment_service,
+    'invoices': invoice_service,
+    'payments': payment_service,
+    'inventory': inventory_service,
+    'reports': report_service,
+    'sms': messaging_service,
+    'sync': sync_engine,
+}
+
+TOKEN_HEADER = 'X-Api-Token'
+
+LOOPBACK = ('127.0.0.1', '::1', '::ffff:127.0.0.1', 'localhost')
+
+class ConnectionPool:
+    """Read-only connections to the served database, each with its own services
+    
+    Lookups and reports borrow a connection, so they run side by side
+    instead of queueing on the lock of the connection that writes. The
+    pooled payment services share `card`, the writer's card payments, so
+    they see the same gateway configuration.
+    """
+    def __init__(self, path, size=4, card=None):
+        self.size = size
+        self._idle = queue.Queue()
+        self._connections = []
+        for _ in range(size):
+            connection = Database(path, read_only=True)
+            self._connections.append(connection)
+            services = {name: cls(connection) for name, cls in SERVICE_CLASSES.items() if name != 'payments'}
+            services['payments'] = PaymentService(connection, card=card)
+            self._idle.put(services)
+    
+    @contextmanager
+    def services(self, timeout=30):
+        """Borrow a connection; yields its services by name"""
+        try:
+            services = self._idle.get(timeout=timeout)
+        except queue.Empty:
+            raise TimeoutError("No read connection free")
+        try:
+            yield services
+        finally:
+            self._idle.put(services)
+    
+    def close(self):
+        for connection in self._connections:
+            connection.close()
+        self._connections = []
+
+class ApiMetrics:
+    """Request count, errors and latency per endpoint, and requests in flight
+    
+    Percentiles are taken over the last `window` requests of an endpoint.
+    """
+    def __init__(self, window=1000):
+        self.window = window
+        self._lock = threading.Lock()
+        self._endpoints = {}
+        self.in_flight = 0
+        self.peak_in_flight = 0
+    
+    def begin(self):
+        with self._lock:
+            self.in_flight += 1
+            self.peak_in_flight = max(self.peak_in_flight, self.in_flight)
+    
+    def record(self, endpoint, seconds, ok=True):
+        """Count a finished request of an endpoint"""
+        with self._lock:
+            self.in_flight -= 1
+            stats = self._endpoints.get(endpoint)
+            if stats is None:
+                stats = self._endpoints[endpoint] = {'count': 0, 'errors': 0, 'total': 0.0, 'max': 0.0,
+                                                     'recent': deque(maxlen=self.window)}
+            stats['count'] += 1
+            stats['errors'] += 0 if ok else 1
+            stats['total'] += seconds
+            stats['max'] = max(stats['max'], seconds)
+            stats['recent'].append(seconds)
+    
+    def snapshot(self):
+        """{'in_flight', 'peak_in_flight', 'endpoints': {endpoint: {'count', 'errors', 'avg_ms', 'p50_ms',
+        'p95_ms', 'max_ms'}}}"""
+        with self._lock:
+            endpoints = {}
+            for endpoint, stats in self._endpoints.items():
+                recent = sorted(stats['recent'])
+                endpoints[endpoint] = {
+                    'count': stats['count'],
+                    'errors': stats['errors'],
+                    'avg_ms': round(stats['total'] / stats['count'] * 1000, 3),
+                    'p50_ms': round(recent[len(recent) // 2] * 1000, 3),
+                    'p95_ms': round(recent[min(len(recent) - 1, int(len(recent) * 0.95))] * 1000, 3),
+                    'max_ms': round(stats['max'] * 1000, 3),
+                }
+            return {'in_flight': self.in_flight, 'peak_in_flight': self.peak_in_flight, 'endpoints': endpoints}
+
+class _HTTPServer(ThreadingHTTPServer):
+    allow_reuse_address = True
+    daemon_threads = True
+
+class _ApiHandler(BaseHTTPRequestHandler):
+    """GET /health and /metrics, POST /api/<service>/<method>"""
+    def do_GET(self):
+        path = urlparse(self.path).path
+        if path == '/health':
+            self._send(200, encode({'status': 'ok', 'pool_size': self.server.api.pool.size}))
+        elif path == '/metrics':
+            self._send(200, encode(self.server.api.metrics.snapshot()))
+        else:
+            self._send(404, encode({'error': f"No endpoint {path}", 'type': 'ApiError'}))
+    
+    def do_POST(self):
+        parts = urlparse(self.path).path.strip('/').split('/')
+        if len(parts) != 3 or parts[0] != 'api' or parts[2] not in REMOTE_METHODS.get(parts[1], {}):
+            self._send(404, encode({'error': f"No endpoint {self.path}", 'type': 'ApiError'}))
+            return
+        
+        api = self.server.api
+        service, method = parts[1], parts[2]
+        refusal = api.refuse(self.client_address[0], self.headers.get(TOKEN_HEADER))
+        if refusal:
+            self._send(403, encode({'error': refusal, 'type': 'ApiError'}))
+            return
+        api.metrics.begin()
+        started = time.perf_counter()
+        status = 200
+        try:
+            length = int(self.headers.get('Content-Length') or 0)
+            payload = decode(self.rfile.read(length) or b'{}')
+            result = api.call(service, method, payload.get('args', []), payload.get('kwargs', {}))
+            data = encode({'result': result})
+        except tuple(ERRORS.values()) as e:
+            status, data = 400, encode({'error': str(e), 'type': type(e).__name__})
+        except (ValueError, TypeError, KeyError) as e:
+            status, data = 400, encode({'error': f"Bad request: {e}", 'type': 'ApiError'})
+        except Exception as e:
+            log_exception(f"API call {service}.{method} failed", e)
+            status, data = 500, encode({'error': str(e), 'type': 'ApiError'})
+        finally:
+            api.metrics.record(f"{service}/{method}", time.perf_counter() - started, status == 200)
+        self._send(status, data)
+    
+    def _send(self, status, data):
+        data = data.encode('utf-8')
+        try:
+            self.send_response(status)
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Content-Length', str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+        except (BrokenPipeError, ConnectionResetError):
+            pass
+    
+    def log_message(self, format, *args):
+        pass
+
+class ApiServer:
+    """The terminal API server
+    
+    Each request runs on its own thread. Methods REMOTE_METHODS marks as
+    reads run on a pooled read-only connection; everything else goes
+    through the services on the owning connection, whose lock serialises
+    the writes. The database is switched to WAL journaling on start so
+    the pooled readers do not wait for the writer, nor the writer for them.
+    
+    With a token set, every call must carry it in the X-Api-Token header.
+    Without one, only calls from this machine are served: reads return
+    customer names, phones and balances too.
+    """
+    def __init__(self, database=None, pool_size=4, card_timeout=60.0, token=None):
+        self.db = database or db
+        self.token = token or None
+        self.services = {name: cls(self.db) for name, cls in SERVICE_CLASSES.items()} if database else SHARED_SERVICES
+        self.pool_size = pool_size
+        self.card_timeout = card_timeout
+        self.metrics = ApiMetrics()
+        self.pool = None
+        self._server = None
+        self.address = None
+    
+    @property
+    def url(self):
+        return f"http://{self.address[0]}:{self.address[1]}" if self.address else None
+    
+    def is_running(self):
+        return self._server is not None
+    
+    def refuse(self, client, token):
+        """Why a call from client address with token may not run, or None when it may"""
+        if self.token:
+            if not token or not hmac.compare_digest(token, self.token):
+                return "Missing or wrong API token"
+            return None
+        if client not in LOOPBACK:
+            return "Set an API token to allow calls from other machines"
+        return None
+    
+    def call(self, service, method, args=(), kwargs=None):
+        """Run one allowed service method; reads go to the pool"""
+        if method not in REMOTE_METHODS.get(service, {}):
+            raise KeyError(f"{service}.{method} is not served")
+        kwargs = kwargs or {}
+        if method == 'pay_by_card':
+            return self.services[service].pay_by_card(*args, **kwargs).result(timeout=self.card_timeout)
+        if REMOTE_METHODS[service][method] and self.pool:
+            with self.pool.services() as services:
+                return getattr(services[service], method)(*args, **kwargs)
+        return getattr(self.services[service], method)(*args, **kwargs)
+    
+    def start(self, host='127.0.0.1', port=47820):
+        """Serve in a background thread; returns the base URL"""
+        if self._server:
+            return self.url
+        # fetchone: a PRAGMA left pending on the shared cursor keeps the pooled readers locked out
+        self.db.fetchone("PRAGMA journal_mode=WAL")
+        self.pool = ConnectionPool(self.db.path, self.pool_size, card=self.services['payments'].card)
+        self._server = _HTTPServer((host, port), _ApiHandler)
+        self._server.api = self
+        self.address = self._server.server_address[:2]
+        threading.Thread(target=self._server.serve_forever, name='api-server', daemon=True).start()
+        log_info(f"Terminal API server listening on {self.url} with {self.pool_size} read connection(s)")
+        return self.url
+    
+    def stop(self):
+        if not self._server:
+            return
+        self._server.shutdown()
+        self._server.server_close()
+        self._server = None
+        self.pool.close()
+        self.pool = None
+        log_info("Terminal API server stopped")
+    
+    def start_from_settings(self):
+        """Start the server if it is enabled in settings; returns its URL or None"""
+        settings = {
+            row['key']: row['value']
+            for row in self.db.fetchall(
+                """SELECT key, value FROM settings
+                   WHERE key IN ('api_server_enabled', 'api_server_host', 'api_server_port', 'api_pool_size',
+                                 'api_token')"""
+            )
+        }
+        if settings.get('api_server_enabled', '0') != '1':
+            return None
+        try:
+            self.pool_size = max(1, int(settings.get('api_pool_size') or 4))
+            self.token = settings.get('api_token') or None
+            host = settings.get('api_server_host') or '127.0.0.1'
+            if host not in LOOPBACK and not self.token:
+                log_warning("Terminal API server has no api_token; calls from other machines will be refused")
+            return self.start(host, int(settings.get('api_server_port') or 47820))
+        except (ValueError, OSError) as e:
+            log_warning(f"Could not start the terminal API server: {e}")
+            return None
+
+# Global API server instance
+api_server = ApiServer()
+
+def main():
+    """Run the API server without the window, until interrupted"""
+    parser = argparse.ArgumentParser(description="Serve the shop database to POS terminals over HTTP/JSON")
+    parser.add_argument('--host', default='127.0.0.1', help="0.0.0.0 to serve the LAN")
+    parser.add_argument('--port', type=int, default=47820)
+    parser.add_argument('--pool', type=int, default=4, help="read connections")
+    parser.add_argument('--token', default=os.environ.get('KAGAN_API_TOKEN'), help="shared token terminals send")
+    options = parser.parse_args()
+    api_server.pool_size = options.pool
+    api_server.token = options.token or None
+    print(f"Serving on {api_server.start(options.host, options.port)}; "
+          "point terminals at it with KAGAN_API_URL and KAGAN_API_TOKEN")
+    try:
+        threading.Event().wait()
+    except KeyboardInterrupt:
+        api_server.stop()
+
+if __name__ == '__main__':
+    main()
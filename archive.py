@@ -0,0 +1,220 @@
+"""
+Archive Module
+Moves history older than a horizon out of the hot tables into per-year
+archive databases, and reads across both through UNION ALL views
+"""
+import glob
+import os
+import re
+import sqlite3
+from datetime import datetime, timedelta
+
+from database import db, Database
+from app_logger import log_info, log_warning
+
+ARCHIVE_PREFIX = 'kagan_archive_'
+
+class ArchiveError(Exception):
+    """Raised when history cannot be archived"""
+
+class ArchiveManager:
+    """Per-year archive databases ATTACHed to the shared connection
+    
+    archive() moves finished rows dated before the horizon into
+    archive/kagan_archive_<year>.db next to the database. Each archived
+    table then has a TEMP view <table>_all over the hot table and every
+    attached year, and table_for() names the view only for date ranges
+    reaching back past what was archived, so recent reports keep reading
+    the small hot table. Archives are attached on first use.
+    
+    Archived rows still count towards customer_activity_totals and may
+    come from closed days: the delete triggers for those are dropped for
+    the move and recreated in the same transaction. So are terminal sync's
+    delete triggers, so that archiving on one node is not sent to the
+    others as deletions. Archived invoices leave the global search index.
+    """
+    # Table -> (the row's date, condition for a finished row)
+    ARCHIVE_SOURCES = {
+        'invoices': ('{row}.invoice_date', '{row}.is_paid = 1'),
+        'gamnet_sessions': ('{row}.start_time', '{row}.end_time IS NOT NULL'),
+        'cafe_order_items': ('(SELECT order_date FROM main.cafe_orders WHERE id = {row}.order_id)', None),
+        'sms_history': ('{row}.sent_date', "COALESCE({row}.status, '') != 'pending'"),
+        'attendance': ('{row}.date', None),
+    }
+    
+    def __init__(self, database=None, directory=None):
+        self.db = database or db
+        self.directory = directory or os.path.join(os.path.dirname(os.path.abspath(self.db.path)), 'archive')
+    
+    def horizon_days(self):
+        """Days of history kept in the hot tables, from the archive_after_days setting"""
+        row = self.db.fetchone("SELECT value FROM settings WHERE key = 'archive_after_days'")
+        try:
+            return max(int(row['value']), 1) if row else 365
+        except (TypeError, ValueError):
+            return 365
+    
+    def archived_before(self):
+        """Date before which history may be in the archives, or None"""
+        row = self.db.fetchone("SELECT value FROM settings WHERE key = 'archived_before'")
+        return row['value'] if row and row['value'] else None
+    
+    def archive_path(self, year):
+        return os.path.join(self.directory, f"{ARCHIVE_PREFIX}{year}.db")
+    
+    def years(self):
+        """Years with an archive file, oldest first"""
+        pattern = os.path.join(glob.escape(self.directory), f"{ARCHIVE_PREFIX}[0-9][0-9][0-9][0-9].db")
+        return sorted(int(os.path.basename(path)[len(ARCHIVE_PREFIX):-3]) for path in glob.glob(pattern))
+    
+    def _attached(self):
+        return {row['name'] for row in self.db.fetchall("PRAGMA database_list")}
+    
+    def _columns(self, schema, table):
+        return [row['name'] for row in self.db.fetchall(f"PRAGMA {schema}.table_info({table})")]
+    
+    def _attach(self, year):
+        """Attach a year's archive, creating it or adding columns the hot tables gained since"""
+        schema = f"archive_{year}"
+        if schema in self._attached():
+            return schema
+        os.makedirs(self.directory, exist_ok=True)
+        self.db.execute("ATTACH DATABASE ? AS " + schema, (self.archive_path(year),))
+        for table in self.ARCHIVE_SOURCES:
+            archived = self._columns(schema, table)
+            if not archived:
+                sql = self.db.fetchone(
+                    "SELECT sql FROM main.sqlite_master WHERE type = 'table' AND name = ?", (table,)
+                )['sql']
+                self.db.execute(re.sub(r'^CREATE TABLE\s+"?\w+"?', f"CREATE TABLE {schema}.{table}", sql))
+                continue
+            for column in self.db.fetchall(f"PRAGMA main.table_info({table})"):
+                if column['name'] not in archived:
+                    self.db.execute(
+                        f"ALTER TABLE {schema}.{table} ADD COLUMN {column['name']} {column['type']}"
+                    )
+        return schema
+    
+    def _create_views(self, schemas):
+        """(Re)create the <table>_all TEMP views over main and the given archive schemas"""
+        for table in self.ARCHIVE_SOURCES:
+            columns = ', '.join(self._columns('main', table))
+            selects = [f"SELECT {columns} FROM {schema}.{table}" for schema in ['main'] + schemas]
+            self.db.execute(f"DROP VIEW IF EXISTS temp.{table}_all")
+            self.db.execute(f"CREATE TEMP VIEW {table}_all AS {' UNION ALL '.join(selects)}")
+    
+    def attach_all(self):
+        """Attach every archive year and build the views; returns the years"""
+        with self.db.lock:
+            if self.db._transaction_depth:
+                raise ArchiveError("Archives cannot be attached inside an open transaction")
+            years = self.years()
+            self._create_views([self._attach(year) for year in years])
+            return years
+    
+    def table_for(self, table, since=None):
+        """Table or view to read `table` rows dated from `since` (a date, None for all time)
+        
+        Tables that are never archived are returned as they are, and so is
+        the hot table inside an open transaction, where archives cannot be
+        attached.
+        """
+        if table not in self.ARCHIVE_SOURCES:
+            return table
+        before = self.archived_before()
+        if not before or (since and since >= before):
+            return table
+        with self.db.lock:
+            view_exists = self.db.fetchone(
+                "SELECT 1 FROM sqlite_temp_master WHERE type = 'view' AND name = ?", (f"{table}_all",)
+            )
+            if not view_exists:
+                if self.db._transaction_depth:
+                    return table
+                self.attach_all()
+        return f"{table}_all"
+    
+    def _delete_triggers(self):
+        """Names of the delete triggers suspended while rows move to the archives"""
+        names = []
+        for table in self.ARCHIVE_SOURCES:
+            if table in Database.DAY_LOCKS:
+                names.append(f"trg_{table}_day_lock_delete")
+            if table in Database.ACTIVITY_SOURCES:
+                names.append(f"trg_{table}_activity_delete")
+        return names
+    
+    def archive(self, before=None, vacuum=True):
+        """Move finished rows dated before `before` (default: the horizon) into the archives
+        
+        Returns {table: rows moved}. The hot database is vacuumed
+        afterwards so that its file shrinks.
+        """
+        before = before or (datetime.now() - timedelta(days=self.horizon_days())).strftime('%Y-%m-%d')
+        moved = {}
+        with self.db.lock:
+            if self.db._transaction_depth:
+                raise ArchiveError("Cannot archive inside an open transaction")
+            # Which years each table has to archive; attaching must happen outside the transaction
+            plans = {}
+            for table, (date, condition) in self.ARCHIVE_SOURCES.items():
+                where = f"{date.format(row=table)} < ?" + (f" AND {condition.format(row=table)}" if condition else '')
+                plans[table] = (where, [
+                    row['year'] for row in self.db.fetchall(
+                        f"SELECT DISTINCT substr({date.format(row=table)}, 1, 4) as year FROM main.{table} WHERE {where}",
+                        (before,)
+                    )
+                ])
+            schemas = {year: self._attach(year) for _, years in plans.values() for year in years}
+            
+            try:
+                with self.db.transaction() as cursor:
+                    if not self.db.conn.in_transaction:
+                        cursor.execute("BEGIN")  # Keep the trigger changes below in the transaction
+                    for name in self._delete_triggers():
+                        cursor.execute(f"DROP TRIGGER IF EXISTS {name}")
+                    # Sync triggers exist only where sync is enabled; they are put back as they were
+                    sync_triggers = cursor.execute(
+                        f"""SELECT name, sql FROM sqlite_master WHERE type = 'trigger'
+                            AND name IN ({','.join('?' * len(self.ARCHIVE_SOURCES))})""",
+                        [f"trg_{table}_sync_delete" for table in self.ARCHIVE_SOURCES]
+                    ).fetchall()
+                    for trigger in sync_triggers:
+                        cursor.execute(f"DROP TRIGGER {trigger['name']}")
+                    for table, (where, years) in plans.items():
+                        date = self.ARCHIVE_SOURCES[table][0].format(row=table)
+                        columns = ', '.join(self._columns('main', table))
+                        moved[table] = 0
+                        for year in years:
+                            in_year = f"{where} AND substr({date}, 1, 4) = ?"
+                            cursor.execute(
+                                f"""INSERT INTO {schemas[year]}.{table} ({columns})
+                                    SELECT {columns} FROM main.{table} WHERE {in_year}""",
+                                (before, year)
+                            )
+                            cursor.execute(f"DELETE FROM main.{table} WHERE {in_year}", (before, year))
+                            moved[table] += cursor.rowcount
+                    self.db.create_day_lock_triggers()
+                    self.db.create_activity_triggers()
+                    for trigger in sync_triggers:
+                        cursor.execute(trigger['sql'])
+                    cursor.execute(
+                        """INSERT INTO settings (key, value, category, description)
+                           VALUES ('archived_before', ?, 'system', 'History before this date may be archived')
+                           ON CONFLICT(key) DO UPDATE SET value = MAX(COALESCE(value, ''), excluded.value)""",
+                        (before,)
+                    )
+            except sqlite3.Error as e:
+                raise ArchiveError(f"Archiving failed: {e}") from e
+            
+            self.attach_all()
+            if vacuum and any(moved.values()):
+                try:
+                    self.db.execute("VACUUM main")
+                except sqlite3.OperationalError as e:
+                    log_warning(f"Archived, but could not vacuum the database: {e}")
+        log_info(f"Archived history before {before}: {moved}")
+        return moved
+
+# Global archive manager instance
+archive_manager = ArchiveManager()
@@ -0,0 +1,444 @@
+"""
+Backup Module
+Online backups of the live database through the SQLite backup API, with
+compression, incremental chunk storage, integrity checks, retention and a
+schedule from settings
+"""
+import glob
+import gzip
+import hashlib
+import json
+import os
+import shutil
+import sqlite3
+import tempfile
+import threading
+import time
+import zlib
+from datetime import datetime, timedelta
+
+from database import db
+from app_logger import log_info, log_exception
+
+TIME_FORMAT = '%Y-%m-%d %H:%M:%S'
+BACKUP_PREFIX = 'kagan_backup_'
+MANIFEST_SUFFIX = '.manifest.json'
+CHUNK_DIR = 'chunks'
+CHUNK_SIZE = 64 * 1024  # A whole number of SQLite pages for every page size up to 64 KB
+
+# backup_frequency setting -> time between automatic backups
+FREQUENCIES = {
+    'daily': timedelta(days=1),
+    'weekly': timedelta(weeks=1),
+    'monthly': timedelta(days=30),
+}
+
+class BackupError(Exception):
+    """Raised when a backup cannot be written or does not verify"""
+
+def file_checksum(path):
+    """SHA-256 of a file, read in 1 MB blocks"""
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(1 << 20), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+def check_integrity(path):
+    """Raise BackupError unless the SQLite file at path passes integrity_check"""
+    conn = sqlite3.connect(path)
+    try:
+        result = conn.execute("PRAGMA integrity_check").fetchone()[0]
+    except sqlite3.DatabaseError as e:
+        raise BackupError(f"Not a usable database: {e}") from e
+    finally:
+        conn.close()
+    if result != 'ok':
+        raise BackupError(f"Integrity check failed: {result}")
+
+def chunk_path(store, name):
+    """File of the chunk with SHA-256 name in a chunk store"""
+    return os.path.join(store, name[:2], name)
+
+class BackupManager:
+    """Backups of the shared database connection
+    
+    Pages are copied pages_per_step at a time. The database lock is held
+    only while a step runs and released for step_pause in between, so the
+    UI and background services keep reading and writing during a backup;
+    their changes go through the same connection, which SQLite applies to
+    the copy as well instead of restarting it.
+    
+    Full backups are a (gzipped) database file. Incremental backups are a
+    manifest listing the SHA-256 of each CHUNK_SIZE block of the copy; the
+    blocks live once each in the CHUNK_DIR store next to the manifests, so
+    a backup only writes the blocks that changed since any earlier one.
+    """
+    def __init__(self, database=None, pages_per_step=256, step_pause=0.005):
+        self.db = database or db
+        self.pages_per_step = pages_per_step
+        self.step_pause = step_pause
+        self._stop = threading.Event()
+        self._scheduler = None
+        self._busy = threading.Lock()  # One backup at a time, so pruning never races a new manifest
+        self._restore_listeners = []
+    
+    def settings(self):
+        """Backup settings with their defaults"""
+        values = {'backup_path': './backups', 'auto_backup': '1', 'backup_frequency': 'daily',
+                  'backup_keep': '10', 'backup_mode': 'incremental'}
+        values.update({
+            row['key']: row['value']
+            for row in self.db.fetchall(
+                f"SELECT key, value FROM settings WHERE key IN ({', '.join('?' * len(values))})", tuple(values)
+            )
+            if row['value']
+        })
+        return values
+    
+    def _between_steps(self, status, remaining, total):
+        """Let other threads use the connection between backup steps"""
+        self.db.lock.release()
+        try:
+            time.sleep(self.step_pause)
+        finally:
+            self.db.lock.acquire()
+    
+    def _copy(self, target_path):
+        """Copy the live database to target_path; returns its page count"""
+        target = sqlite3.connect(target_path)
+        try:
+            with self.db.lock:
+                if self.db._transaction_depth:
+                    raise BackupError("Cannot back up inside an open transaction")
+                self.db.conn.backup(target, pages=self.pages_per_step, progress=self._between_steps)
+            return target.execute("PRAGMA page_count").fetchone()[0]
+        finally:
+            target.close()
+    
+    def _new_path(self, directory, when, extension):
+        """Unused backup file name for a backup taken at `when`"""
+        stem = os.path.join(directory, f"{BACKUP_PREFIX}{when.strftime('%Y%m%d_%H%M%S')}")
+        path, n = stem + extension, 1
+        while os.path.exists(path):
+            n += 1
+            path = f"{stem}_{n}{extension}"
+        return path
+    
+    def _record(self, when, path, size, status, notes, checksum=None):
+        """Add a backup_history row; returns its id"""
+        with self.db.transaction() as cursor:
+            cursor.execute(
+                """INSERT INTO backup_history (backup_date, backup_path, backup_size, status, notes, checksum)
+                   VALUES (?, ?, ?, ?, ?, ?)""",
+                (when.strftime(TIME_FORMAT), path, size, status, notes, checksum)
+            )
+            return cursor.lastrowid
+    
+    def _store_chunk(self, store, name, data):
+        """Add a chunk to the store unless it is there; returns the bytes written"""
+        path = chunk_path(store, name)
+        if os.path.exists(path):
+            return 0
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        packed = zlib.compress(data, 6)
+        with open(path + '.partial', 'wb') as f:
+            f.write(packed)
+        os.replace(path + '.partial', path)
+        return len(packed)
+    
+    def _write_incremental(self, path):
+        """Snapshot the database and write its manifest and new chunks
+        
+        The snapshot is taken next to the live database, so the backup
+        location only receives the chunks it lacks. Returns (pages,
+        bytes written, new chunks, total chunks).
+        """
+        fd, snapshot = tempfile.mkstemp(suffix='.db', dir=os.path.dirname(os.path.abspath(self.db.path)))
+        os.close(fd)
+        try:
+            pages = self._copy(snapshot)
+            check_integrity(snapshot)
+            store = os.path.join(os.path.dirname(path), CHUNK_DIR)
+            digest, chunks, written, new = hashlib.sha256(), [], 0, 0
+            with open(snapshot, 'rb') as f:
+                for data in iter(lambda: f.read(CHUNK_SIZE), b''):
+                    digest.update(data)
+                    name = hashlib.sha256(data).hexdigest()
+                    chunks.append(name)
+                    stored = self._store_chunk(store, name, data)
+                    written += stored
+                    new += bool(stored)
+            manifest = {
+                'chunk_size': CHUNK_SIZE,
+                'size': os.path.getsize(snapshot),
+                'sha256': digest.hexdigest(),
+                'chunks': chunks,
+            }
+        finally:
+            os.remove(snapshot)
+        with open(path + '.partial', 'w') as f:
+            json.dump(manifest, f)
+        os.replace(path + '.partial', path)
+        return pages, written + os.path.getsize(path), new, len(chunks)
+    
+    def create_backup(self, directory=None, compress=True, notes=None, when=None, incremental=None):
+        """Back up the database, verify the copy and prune old backups
+        
+        incremental defaults to the backup_mode setting; compress applies
+        to full backups. Returns {'id', 'path', 'size', 'pages', 'seconds'},
+        where size is the bytes the backup added to the backup location;
+        failures are recorded in backup_history and raised as BackupError.
+        """
+        with self._busy:
+            settings = self.settings()
+            directory = directory or settings['backup_path']
+            when = when or datetime.now()
+            if incremental is None:
+                incremental = settings['backup_mode'] == 'incremental'
+            started = time.perf_counter()
+            path = self._new_path(directory, when, MANIFEST_SUFFIX if incremental else '.db.gz' if compress else '.db')
+            partial = path + '.partial'
+            try:
+                os.makedirs(directory, exist_ok=True)
+                if incremental:
+                    pages, size, new, total = self._write_incremental(path)
+                    summary = f"{pages} pages, integrity ok, {new} of {total} chunks new"
+                else:
+                    pages = self._copy(partial)
+                    check_integrity(partial)
+                    if compress:
+                        with open(partial, 'rb') as source, gzip.open(path, 'wb', compresslevel=6) as target:
+                            shutil.copyfileobj(source, target, 1 << 20)
+                        os.remove(partial)
+                    else:
+                        os.replace(partial, path)
+                    size = os.path.getsize(path)
+                    summary = f"{pages} pages, integrity ok"
+            except (sqlite3.Error, OSError, BackupError) as e:
+                for leftover in (partial, path):
+                    if os.path.exists(leftover):
+                        os.remove(leftover)
+                self._record(when, path, 0, 'failed', str(e))
+                log_exception("Backup failed", e)
+                if isinstance(e, BackupError):
+                    raise
+                raise BackupError(f"Backup failed: {e}") from e
+            
+            summary += f"; {notes}" if notes else ''
+            backup_id = self._record(when, path, size, 'success', summary, file_checksum(path))
+            seconds = time.perf_counter() - started
+            log_info(f"Backup {path}: {summary}, {size} bytes written in {seconds:.2f}s")
+            try:
+                keep = int(settings['backup_keep'])
+            except ValueError:
+                keep = 10
+            self.prune(keep)
+            return {'id': backup_id, 'path': path, 'size': size, 'pages': pages, 'seconds': seconds}
+    
+    def _assemble(self, manifest_path, destination):
+        """Rebuild the database file of an incremental backup from its chunks"""
+        with open(manifest_path) as f:
+            manifest = json.load(f)
+        store = os.path.join(os.path.dirname(manifest_path), CHUNK_DIR)
+        digest = hashlib.sha256()
+        with open(destination, 'wb') as target:
+            for name in manifest['chunks']:
+                path = chunk_path(store, name)
+                if not os.path.exists(path):
+                    raise BackupError(f"Missing chunk {name}")
+                with open(path, 'rb') as f:
+                    data = zlib.decompress(f.read())
+                if hashlib.sha256(data).hexdigest() != name:
+                    raise BackupError(f"Damaged chunk {name}")
+                digest.update(data)
+                target.write(data)
+        if digest.hexdigest() != manifest['sha256']:
+            raise BackupError(f"Reassembled database does not match {manifest_path}")
+    
+    def extract(self, backup_path, destination):
+        """Write the plain database file of a backup (full, gzipped or incremental) to destination"""
+        if backup_path.endswith(MANIFEST_SUFFIX):
+            self._assemble(backup_path, destination)
+        elif backup_path.endswith('.gz'):
+            with gzip.open(backup_path, 'rb') as source, open(destination, 'wb') as target:
+                shutil.copyfileobj(source, target, 1 << 20)
+        else:
+            shutil.copyfile(backup_path, destination)
+    
+    def _checked_extract(self, backup_path, destination):
+        """extract() after checking the recorded checksum, then run integrity_check on the result"""
+        if not os.path.exists(backup_path):
+            raise BackupError(f"Backup file not found: {backup_path}")
+        row = self.db.fetchone(
+            "SELECT checksum FROM backup_history WHERE backup_path = ? AND status = 'success'",
+            (backup_path,)
+        )
+        if row and row['checksum'] and row['checksum'] != file_checksum(backup_path):
+            raise BackupError(f"Checksum mismatch: {backup_path}")
+        try:
+            self.extract(backup_path, destination)
+        except (OSError, EOFError, ValueError, KeyError, zlib.error) as e:
+            raise BackupError(f"Cannot read backup: {e}") from e
+        check_integrity(destination)
+    
+    def verify(self, backup_path):
+        """Check a backup file against its recorded checksum and run integrity_check
+        
+        Raises BackupError if it does not verify.
+        """
+        fd, scratch = tempfile.mkstemp(suffix='.db')
+        os.close(fd)
+        try:
+            self._checked_extract(backup_path, scratch)
+        finally:
+            os.remove(scratch)
+        return True
+    
+    def on_restore(self, callback):
+        """Call callback() after every restore, from the restoring thread"""
+        self._restore_listeners.append(callback)
+    
+    def restore(self, backup_path, safety_backup=True):
+        """Replace the live database with a backup without reconnecting
+        
+        The backup is verified, then copied into the shared connection with
+        the SQLite backup API while the database lock is held, so no other
+        thread sees a partly restored database and every holder of `db`
+        keeps working. An older backup's schema is brought up to date, and
+        backup_history is kept as it was, since it describes the backup
+        files rather than the shop's data. By default the current state is
+        backed up first. Returns {'path', 'safety', 'seconds'}.
+        """
+        started = time.perf_counter()
+        fd, scratch = tempfile.mkstemp(suffix='.db', dir=os.path.dirname(os.path.abspath(self.db.path)))
+        os.close(fd)
+        try:
+            self._checked_extract(backup_path, scratch)
+            safety = self.create_backup(notes='before restore')['path'] if safety_backup else None
+            source = sqlite3.connect(scratch)
+            try:
+                with self._busy, self.db.lock:
+                    if self.db._transaction_depth:
+                        raise BackupError("Cannot restore inside an open transaction")
+                    history = self.db.fetchall("SELECT * FROM backup_history ORDER BY id")
+                    source.backup(self.db.conn)
+                    self.db.create_tables()
+                    with self.db.transaction() as cursor:
+                        cursor.execute("DELETE FROM backup_history")
+                        for row in history:
+                            cursor.execute(
+                                f"INSERT INTO backup_history ({', '.join(row.keys())}) VALUES ({', '.join('?' * len(row))})",
+                                tuple(row)
+                            )
+            finally:
+                source.close()
+        except sqlite3.Error as e:
+            log_exception("Restore failed", e)
+            raise BackupError(f"Restore failed: {e}") from e
+        finally:
+            os.remove(scratch)
+        
+        seconds = time.perf_counter() - started
+        self._record(datetime.now(), backup_path, os.path.getsize(backup_path), 'restored',
+                     f"restored in {seconds:.1f}s" + (f"; previous state in {safety}" if safety else ''))
+        log_info(f"Restored {backup_path} in {seconds:.2f}s")
+        for callback in self._restore_listeners:
+            try:
+                callback()
+            except Exception as e:
+                log_exception("Restore listener failed", e)
+        return {'path': backup_path, 'safety': safety, 'seconds': seconds}
+    
+    def prune(self, keep):
+        """Delete all but the newest `keep` successful backups; returns the paths removed
+        
+        Chunks no longer listed by any manifest are deleted as well.
+        """
+        old = self.db.fetchall(
+            """SELECT id, backup_path FROM backup_history
+               WHERE status = 'success'
+               ORDER BY backup_date DESC, id DESC
+               LIMIT -1 OFFSET ?""",
+            (max(keep, 1),)
+        )
+        removed = []
+        for row in old:
+            if row['backup_path'] and os.path.exists(row['backup_path']):
+                os.remove(row['backup_path'])
+            self.db.execute("UPDATE backup_history SET status = 'pruned' WHERE id = ?", (row['id'],))
+            removed.append(row['backup_path'])
+        for directory in {os.path.dirname(path) for path in removed if path and path.endswith(MANIFEST_SUFFIX)}:
+            self.collect_chunks(directory)
+        return removed
+    
+    def collect_chunks(self, directory):
+        """Delete chunks in directory's store that no manifest there lists; returns how many"""
+        referenced = set()
+        for manifest_path in glob.glob(os.path.join(glob.escape(directory), f"*{MANIFEST_SUFFIX}")):
+            try:
+                with open(manifest_path) as f:
+                    referenced.update(json.load(f)['chunks'])
+            except (OSError, ValueError, KeyError) as e:
+                log_exception(f"Unreadable manifest {manifest_path}; keeping all chunks", e)
+                return 0
+        removed = 0
+        for path in glob.glob(os.path.join(glob.escape(directory), CHUNK_DIR, '*', '*')):
+            if os.path.basename(path) not in referenced:
+                os.remove(path)
+                removed += 1
+        return removed
+    
+    def history(self, limit=20):
+        """Most recent backup_history rows"""
+        return [dict(row) for row in self.db.fetchall(
+            "SELECT * FROM backup_history ORDER BY backup_date DESC, id DESC LIMIT ?", (limit,)
+        )]
+    
+    def is_due(self, now=None):
+        """Whether auto_backup is on and backup_frequency has passed since the last good backup"""
+        settings = self.settings()
+        if settings['auto_backup'] != '1':
+            return False
+        interval = FREQUENCIES.get(settings['backup_frequency'], FREQUENCIES['daily'])
+        last = self.db.fetchone(
+            "SELECT MAX(backup_date) as last FROM backup_history WHERE status IN ('success', 'pruned')"
+        )['last']
+        now = now or datetime.now()
+        return not last or datetime.strptime(last, TIME_FORMAT) <= now - interval
+    
+    def run_scheduled(self, now=None):
+        """Take a backup if one is due; returns it or None"""
+        if not self.is_due(now):
+            return None
+        return self.create_backup(notes='scheduled', when=now)
+    
+    def start_scheduler(self, interval=600):
+        """Check every `interval` seconds in the background whether a backup is due"""
+        if self._scheduler and self._scheduler.is_alive():
+            return
+        self._stop.clear()
+        
+        def loop():
+            while True:
+                try:
+                    self.run_scheduled()
+                except BackupError:
+                    pass  # Recorded in backup_history; retried at the next check
+                except Exception as e:
+                    log_exception("Scheduled backup failed", e)
+                if self._stop.wait(interval):
+                    break
+        
+        self._scheduler = threading.Thread(target=loop, name='backup-scheduler', daemon=True)
+        self._scheduler.start()
+    
+    def stop(self):
+        """Stop the scheduler"""
+        self._stop.set()
+        if self._scheduler:
+            self._scheduler.join(timeout=5)
+            self._scheduler = None
+
+# Global backup manager instance
+backup_manager = BackupManager()
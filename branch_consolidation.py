@@ -0,0 +1,346 @@
+"""
+Branch Consolidation Module
+Ingests the rows of many branch databases into one central analytics
+database with a branch column, and runs the usual reports on it for one
+branch or all of them
+"""
+import argparse
+import os
+import queue
+import sqlite3
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from urllib.request import pathname2url
+
+from database import Database
+from services.reports import ReportService
+from services.inventory import InventoryService
+from app_logger import log_info, log_warning, log_exception
+
+TIME_FORMAT = '%Y-%m-%d %H:%M:%S'
+
+# Table -> condition for rows that may still change after they were
+# ingested; those are read again on every run unless the branch's sync
+# change log says exactly which rows changed. None: rows never change.
+CONSOLIDATED_TABLES = {
+    'customers': '1',
+    'employees': '1',
+    'salon_services': '1',
+    'salon_service_records': 'invoice_id IS NULL',
+    'cafe_menu': '1',
+    'cafe_orders': 'invoice_id IS NULL',
+    'cafe_order_items': None,
+    'gamnet_devices': '1',
+    'gamnet_sessions': 'end_time IS NULL OR invoice_id IS NULL',
+    'invoices': 'is_paid = 0',
+    'expenses': None,
+    'inventory_items': '1',
+    'suppliers': '1',
+}
+
+# Ids of the all-branches views are id * BRANCH_ID_FACTOR + branch number,
+# so rows of different branches never join
+BRANCH_ID_FACTOR = 1024
+
+class ConsolidationError(Exception):
+    """Raised when a branch cannot be registered or read"""
+
+class _IngestStopped(Exception):
+    """Raised in a reader thread when the writer gave up on the run"""
+
+def read_only(path):
+    """A read-only sqlite3 connection to an existing database file"""
+    conn = sqlite3.connect('file:' + pathname2url(os.path.abspath(path)) + '?mode=ro', uri=True,
+                           check_same_thread=False)
+    conn.row_factory = sqlite3.Row
+    return conn
+
+def quoted(text):
+    return "'" + str(text).replace("'", "''") + "'"
+
+class Consolidator:
+    """The central analytics database and the branches feeding it
+    
+    Each consolidated table is stored once with a `branch` column in front
+    and (branch, id) as its key. ingest() reads every branch in a thread
+    of its own and streams batches through a bounded queue to the one
+    thread writing the central file, which commits each batch together
+    with the branch's high-water mark, so an interrupted run resumes
+    where it stopped. If a central write fails, the readers are told to
+    stop and the queue is drained before ConsolidationError is raised.
+    """
+    def __init__(self, central_path):
+        self.path = central_path
+        self.conn = sqlite3.connect(central_path, check_same_thread=False)
+        self.conn.row_factory = sqlite3.Row
+        self.lock = threading.RLock()
+        with self.lock:
+            self.conn.executescript('''
+                CREATE TABLE IF NOT EXISTS branches (
+                    branch_no INTEGER PRIMARY KEY,
+                    name TEXT UNIQUE NOT NULL,
+                    path TEXT NOT NULL,
+                    log_mark INTEGER DEFAULT 0,
+                    last_ingested TEXT
+                );
+                CREATE TABLE IF NOT EXISTS ingest_marks (
+                    branch TEXT NOT NULL,
+                    table_name TEXT NOT NULL,
+                    last_id INTEGER DEFAULT 0,
+                    PRIMARY KEY (branch, table_name)
+                );
+            ''')
+    
+    def close(self):
+        self.conn.close()
+    
+    def add_branch(self, name, path):
+        """Register a branch database, or move an existing branch to a new path"""
+        if not name:
+            raise ConsolidationError("A branch needs a name")
+        if not os.path.exists(path):
+            raise ConsolidationError(f"No database at {path}")
+        with self.lock, self.conn:
+            count = self.conn.execute("SELECT COUNT(*) FROM branches").fetchone()[0]
+            if count >= BRANCH_ID_FACTOR - 1:
+                raise ConsolidationError("Too many branches")
+            self.conn.execute(
+                "INSERT INTO branches (name, path) VALUES (?, ?) ON CONFLICT(name) DO UPDATE SET path = excluded.path",
+                (name, os.path.abspath(path))
+            )
+    
+    def branches(self):
+        """Registered branches with when they were last ingested"""
+        with self.lock:
+            return self.conn.execute("SELECT * FROM branches ORDER BY branch_no").fetchall()
+    
+    def _columns(self, table):
+        return [row['name'] for row in self.conn.execute(f"PRAGMA table_info({table})")]
+    
+    def _ensure_table(self, table, columns):
+        """Create a central table, or add the columns a branch has and it lacks"""
+        existing = self._columns(table)
+        if not existing:
+            definitions = ', '.join(f"{name} {kind}" for name, kind in columns)
+            self.conn.execute(f"CREATE TABLE {table} (branch TEXT NOT NULL, {definitions}, PRIMARY KEY (branch, id))")
+            return
+        for name, kind in columns:
+            if name not in existing:
+                self.conn.execute(f"ALTER TABLE {table} ADD COLUMN {name} {kind}")
+    
+    def _plan(self, branch):
+        """Per table (last ingested id, ids to read again) for a branch's reader"""
+        plan = {}
+        for table, reopen in CONSOLIDATED_TABLES.items():
+            mark = self.conn.execute("SELECT last_id FROM ingest_marks WHERE branch = ? AND table_name = ?",
+                                     (branch, table)).fetchone()
+            refresh = []
+            if reopen and self._columns(table):
+                refresh = [row[0] for row in self.conn.execute(
+                    f"SELECT id FROM {table} WHERE branch = ? AND ({reopen})", (branch,)
+                )]
+            plan[table] = (mark[0] if mark else 0, refresh)
+        return plan
+    
+    def _read_branch(self, branch, batches, batch_size, stop):
+        """Reader thread: stream one branch's new and changed rows into batches until `stop` is set"""
+        name = branch['name']
+        def put(item):
+            while not stop.is_set():
+                try:
+                    batches.put(item, timeout=0.1)
+                    return
+                except queue.Full:
+                    pass
+            raise _IngestStopped()
+        
+        try:
+            conn = read_only(branch['path'])
+        except sqlite3.Error as e:
+            put(('failed', name, f"Cannot open {branch['path']}: {e}"))
+            return
+        try:
+            tables = {row[0] for row in conn.execute("SELECT name FROM sqlite_master WHERE type = 'table'")}
+            # With sync enabled the change log names exactly the rows that changed
+            log_mark = branch['log_mark']
+            changed = None
+            if 'sync_log' in tables and conn.execute("SELECT 1 FROM sync_state").fetchone():
+                changed = {}
+                for row in conn.execute("SELECT id, table_name, row_key FROM sync_log WHERE id > ? AND op = 'U'",
+                                        (log_mark,)):
+                    if row['table_name'] in CONSOLIDATED_TABLES:
+                        changed.setdefault(row['table_name'], set()).add(int(row['row_key']))
+                    log_mark = row['id']
+                log_mark = conn.execute("SELECT COALESCE(MAX(id), ?) FROM sync_log", (log_mark,)).fetchone()[0]
+            
+            for table, (last_id, refresh) in branch['plan'].items():
+                if table not in tables:
+                    continue
+                info = conn.execute(f"PRAGMA table_info({table})").fetchall()
+                columns = [(row['name'], row['type']) for row in info]
+                names = [name for name, kind in columns]
+                put(('schema', name, table, columns))
+                
+                rows = conn.execute(f"SELECT * FROM {table} WHERE id > ? ORDER BY id", (last_id,))
+                while True:
+                    chunk = rows.fetchmany(batch_size)
+                    if not chunk:
+                        break
+                    put(('rows', name, table, names, [tuple(row) for row in chunk], chunk[-1]['id']))
+                
+                again = sorted(changed.get(table, ())) if changed is not None else refresh
+                again = [row_id for row_id in again if row_id <= last_id]
+                for start in range(0, len(again), batch_size):
+                    ids = again[start:start + batch_size]
+                    chunk = conn.execute(
+                        f"SELECT * FROM {table} WHERE id IN ({', '.join('?' for _ in ids)})", ids
+                    ).fetchall()
+                    if chunk:
+                        put(('rows', name, table, names, [tuple(row) for row in chunk], None))
+            put(('done', name, log_mark))
+        except sqlite3.Error as e:
+            put(('failed', name, str(e)))
+        except _IngestStopped:
+            pass
+        finally:
+            conn.close()
+    
+    def _write(self, item, counts):
+        """Writer: apply one message from a reader"""
+        kind, branch = item[0], item[1]
+        with self.lock, self.conn:
+            if kind == 'schema':
+                self._ensure_table(item[2], item[3])
+            elif kind == 'rows':
+                table, names, rows, last_id = item[2:]
+                self.conn.executemany(
+                    f"INSERT OR REPLACE INTO {table} (branch, {', '.join(names)}) "
+                    f"VALUES (?, {', '.join('?' for _ in names)})",
+                    [(branch,) + row for row in rows]
+                )
+                if last_id is not None:
+                    self.conn.execute(
+                        """INSERT INTO ingest_marks (branch, table_name, last_id) VALUES (?, ?, ?)
+                           ON CONFLICT(branch, table_name) DO UPDATE SET last_id = excluded.last_id""",
+                        (branch, table, last_id)
+                    )
+                counts[branch][table] = counts[branch].get(table, 0) + len(rows)
+            elif kind == 'done':
+                self.conn.execute("UPDATE branches SET log_mark = ?, last_ingested = ? WHERE name = ?",
+                                  (item[2], datetime.now().strftime(TIME_FORMAT), branch))
+    
+    def ingest(self, names=None, workers=4, batch_size=1000):
+        """Bring the central database up to date with the branches (all, or those named)
+        
+        Returns {branch: {table: rows written}}; a branch that cannot be
+        read is logged and reported as {'error': message}.
+        """
+        with self.lock:
+            branches = [dict(row) for row in self.branches() if names is None or row['name'] in names]
+            for branch in branches:
+                branch['plan'] = self._plan(branch['name'])
+        counts = {branch['name']: {} for branch in branches}
+        if not branches:
+            return counts
+        
+        batches = queue.Queue(maxsize=workers * 4)
+        stop = threading.Event()
+        failure = None
+        with ThreadPoolExecutor(max_workers=workers, thread_name_prefix='branch-reader') as pool:
+            for branch in branches:
+                pool.submit(self._read_branch, branch, batches, batch_size, stop)
+            remaining = len(branches)
+            while remaining:
+                item = batches.get()
+                if item[0] == 'failed':
+                    log_warning(f"Branch '{item[1]}' not ingested: {item[2]}")
+                    counts[item[1]] = {'error': item[2]}
+                    remaining -= 1
+                    continue
+                try:
+                    self._write(item, counts)
+                except sqlite3.Error as e:
+                    log_exception(f"Writing branch '{item[1]}' rows failed", e)
+                    failure = e
+                    break
+                if item[0] == 'done':
+                    remaining -= 1
+            if failure:
+                # Readers blocked on the full queue see the flag within their put timeout
+                stop.set()
+                while True:
+                    try:
+                        batches.get_nowait()
+                    except queue.Empty:
+                        break
+        if failure:
+            raise ConsolidationError(f"Central database write failed: {failure}") from failure
+        log_info(f"Consolidated {len(branches)} branch(es): {counts}")
+        return counts
+
+class BranchReports:
+    """ReportService and InventoryService over the central database
+    
+    report_database() opens the central file read-only and shadows the
+    consolidated tables with TEMP views of the same names, so the services
+    run their usual SQL: one branch's rows as they are, or every branch
+    with ids offset by branch number. Customers of several branches count
+    once per branch.
+    """
+    def __init__(self, central_path):
+        self.path = central_path
+    
+    def branches(self):
+        conn = read_only(self.path)
+        try:
+            return [row['name'] for row in conn.execute("SELECT name FROM branches ORDER BY branch_no")]
+        finally:
+            conn.close()
+    
+    def report_database(self, branch=None):
+        """A read-only Database showing one branch, or all of them when branch is None"""
+        database = Database(self.path, read_only=True)
+        tables = {row['name'] for row in database.fetchall("SELECT name FROM sqlite_master WHERE type = 'table'")}
+        for table in CONSOLIDATED_TABLES:
+            if table not in tables:
+                continue
+            columns = [row['name'] for row in database.fetchall(f"PRAGMA main.table_info({table})")
+                       if row['name'] != 'branch']
+            if branch is None:
+                select = ', '.join(
+                    f"t.{column} * {BRANCH_ID_FACTOR} + b.branch_no AS {column}"
+                    if column == 'id' or column.endswith('_id') else f"t.{column}"
+                    for column in columns
+                )
+                source = "JOIN main.branches b ON b.name = t.branch"
+            else:
+                select = ', '.join(f"t.{column}" for column in columns)
+                source = f"WHERE t.branch = {quoted(branch)}"
+            database.execute(f"CREATE TEMP VIEW {table} AS SELECT {select} FROM main.{table} t {source}")
+        # Reports look for the archive horizon in settings; nothing here is archived
+        database.execute("CREATE TEMP VIEW settings AS SELECT NULL AS key, NULL AS value WHERE 0")
+        return database
+    
+    def reports(self, branch=None):
+        return ReportService(self.report_database(branch))
+    
+    def inventory(self, branch=None):
+        return InventoryService(self.report_database(branch))
+
+def main():
+    """Register branch files and ingest them: central.db [name=path ...]"""
+    parser = argparse.ArgumentParser(description="Consolidate branch databases into a central analytics database")
+    parser.add_argument('central')
+    parser.add_argument('branches', nargs='*', help="name=path of a branch database to register")
+    parser.add_argument('--workers', type=int, default=4)
+    options = parser.parse_args()
+    consolidator = Consolidator(options.central)
+    for branch in options.branches:
+        name, _, path = branch.partition('=')
+        consolidator.add_branch(name, path)
+    for name, tables in consolidator.ingest(workers=options.workers).items():
+        print(f"{name}: {tables}")
+
+if __name__ == '__main__':
+    main()
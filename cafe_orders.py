@@ -0,0 +1,191 @@
+"""
+Cafe Orders Module
+Saves cafe orders, singly or in queued batches, and deducts recipe
+ingredients from inventory in the same transaction, reporting items that
+fall to their reorder level
+"""
+from datetime import datetime
+
+from database import db
+from app_logger import log_warning, log_exception
+
+class CafeOrders:
+    """Order placement and recipe-based stock deduction
+    
+    Listeners added with add_low_stock_listener() are called after commit
+    with a list of items whose stock just reached their reorder level.
+    """
+    def __init__(self, database=None):
+        self.db = database or db
+        self._listeners = []
+    
+    def add_low_stock_listener(self, callback):
+        """Call callback(items) whenever an order pushes stock to reorder level"""
+        self._listeners.append(callback)
+    
+    def remove_low_stock_listener(self, callback):
+        """Stop notifying a previously added listener"""
+        if callback in self._listeners:
+            self._listeners.remove(callback)
+    
+    def get_recipe(self, menu_item_id):
+        """Ingredients of a menu item with their per-unit quantities"""
+        return self.db.fetchall(
+            """SELECT r.inventory_item_id, r.quantity, i.name, i.unit
+               FROM cafe_recipes r
+               JOIN inventory_items i ON i.id = r.inventory_item_id
+               WHERE r.menu_item_id = ?
+               ORDER BY i.name""",
+            (menu_item_id,)
+        )
+    
+    def set_recipe_item(self, menu_item_id, inventory_item_id, quantity):
+        """Set how much of an ingredient one unit of a menu item uses (0 removes it)"""
+        if quantity < 0:
+            raise ValueError("Recipe quantity cannot be negative")
+        if quantity == 0:
+            self.db.execute(
+                "DELETE FROM cafe_recipes WHERE menu_item_id = ? AND inventory_item_id = ?",
+                (menu_item_id, inventory_item_id)
+            )
+        else:
+            self.db.execute(
+                """INSERT INTO cafe_recipes (menu_item_id, inventory_item_id, quantity) VALUES (?, ?, ?)
+                   ON CONFLICT(menu_item_id, inventory_item_id) DO UPDATE SET quantity = excluded.quantity""",
+                (menu_item_id, inventory_item_id, quantity)
+            )
+    
+    def place_order(self, phone, barista_id, items, split_count=1, when=None, invoice_id=None):
+        """Save an order with its items and deduct ingredients in one transaction
+        
+        items are dicts with 'id' (menu item), 'price' and 'quantity'.
+        Returns {'order_id', 'customer_id', 'total', 'low_stock'}.
+        """
+        return self.place_orders([{'phone': phone, 'barista_id': barista_id, 'items': items,
+                                   'split_count': split_count, 'when': when, 'invoice_id': invoice_id}])[0]
+    
+    def place_orders(self, orders):
+        """Save a batch of queued orders in one transaction
+        
+        Each order is a dict with 'phone', 'items' and optionally
+        'barista_id', 'split_count', 'when' and 'invoice_id'. Returns one
+        result per order, as place_order() does; low_stock lists the
+        crossings caused by that order.
+        """
+        for order in orders:
+            if not order.get('items'):
+                raise ValueError("Order has no items")
+        if not orders:
+            return []
+        now = datetime.now()
+        
+        results = []
+        with self.db.transaction() as cursor:
+            cursor.executemany(
+                "INSERT OR IGNORE INTO customers (name, phone, registration_date) VALUES (?, ?, ?)",
+                [(f"Customer {o['phone']}", o['phone'], (o.get('when') or now).strftime('%Y-%m-%d'))
+                 for o in orders]
+            )
+            phones = sorted({o['phone'] for o in orders})
+            placeholders = ','.join('?' * len(phones))
+            customers = {
+                row['phone']: row['id']
+                for row in cursor.execute(
+                    f"SELECT id, phone FROM customers WHERE phone IN ({placeholders})", phones
+                ).fetchall()
+            }
+            
+            for order in orders:
+                when = order.get('when') or now
+                items = order['items']
+                total = sum(item['price'] * item['quantity'] for item in items)
+                customer_id = customers[order['phone']]
+                cursor.execute(
+                    """INSERT INTO cafe_orders
+                       (customer_id, barista_id, order_date, total_amount, split_count, invoice_id)
+                       VALUES (?, ?, ?, ?, ?, ?)""",
+                    (customer_id, order.get('barista_id'), when.strftime('%Y-%m-%d %H:%M:%S'), total,
+                     order.get('split_count') or 1, order.get('invoice_id'))
+                )
+                order_id = cursor.lastrowid
+                cursor.executemany(
+                    """INSERT INTO cafe_order_items (order_id, menu_item_id, quantity, price)
+                       VALUES (?, ?, ?, ?)""",
+                    [(order_id, item['id'], item['quantity'], item['price']) for item in items]
+                )
+                low_stock = self._deduct_stock(cursor, order_id, when)
+                results.append({'order_id': order_id, 'customer_id': customer_id,
+                                'total': total, 'low_stock': low_stock})
+        
+        self._notify([item for result in results for item in result['low_stock']])
+        return results
+    
+    def link_invoice(self, order_ids, invoice_id):
+        """Set the invoice of already saved orders; returns the number linked"""
+        if not order_ids:
+            return 0
+        placeholders = ','.join('?' * len(order_ids))
+        with self.db.transaction() as cursor:
+            cursor.execute(
+                f"UPDATE cafe_orders SET invoice_id = ? WHERE id IN ({placeholders})",
+                [invoice_id] + list(order_ids)
+            )
+            return cursor.rowcount
+    
+    def _deduct_stock(self, cursor, order_id, when):
+        """Deduct an order's ingredients with one UPDATE; returns reorder-level crossings"""
+        usage = cursor.execute(
+            """SELECT i.id, i.name, i.unit, i.quantity, i.reorder_level,
+                      SUM(r.quantity * oi.quantity) as used
+               FROM cafe_order_items oi
+               JOIN cafe_recipes r ON r.menu_item_id = oi.menu_item_id
+               JOIN inventory_items i ON i.id = r.inventory_item_id
+               WHERE oi.order_id = ?
+               GROUP BY i.id""",
+            (order_id,)
+        ).fetchall()
+        if not usage:
+            return []
+        
+        cursor.execute(
+            """UPDATE inventory_items
+               SET quantity = COALESCE(quantity, 0) - (
+                       SELECT SUM(r.quantity * oi.quantity)
+                       FROM cafe_order_items oi
+                       JOIN cafe_recipes r ON r.menu_item_id = oi.menu_item_id
+                       WHERE oi.order_id = ? AND r.inventory_item_id = inventory_items.id),
+                   last_updated = ?
+               WHERE id IN (
+                       SELECT r.inventory_item_id
+                       FROM cafe_order_items oi
+                       JOIN cafe_recipes r ON r.menu_item_id = oi.menu_item_id
+                       WHERE oi.order_id = ?)""",
+            (order_id, when.strftime('%Y-%m-%d %H:%M:%S'), order_id)
+        )
+        
+        crossings = []
+        for row in usage:
+            if row['reorder_level'] is None:
+                continue
+            before = row['quantity'] or 0
+            after = before - row['used']
+            if before > row['reorder_level'] >= after:
+                crossings.append({'id': row['id'], 'name': row['name'], 'unit': row['unit'],
+                                  'quantity': after, 'reorder_level': row['reorder_level']})
+        return crossings
+    
+    def _notify(self, low_stock):
+        """Pass reorder-level crossings to every listener"""
+        if not low_stock:
+            return
+        for item in low_stock:
+            log_warning(f"Stock of {item['name']} fell to {item['quantity']:g} "
+                        f"(reorder level {item['reorder_level']:g})")
+        for callback in list(self._listeners):
+            try:
+                callback(low_stock)
+            except Exception as e:
+                log_exception("Low stock listener failed", e)
+
+# Global cafe orders instance
+cafe_orders = CafeOrders()
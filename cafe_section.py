@@ -4,15 +4,21 @@ Handles menu management, orders, bill splitting, and sales reports
 """
 import customtkinter as ctk
 from datetime import datetime
+from tkinter import messagebox
 from ui_utils import *
 from database import db
+from cafe_orders import cafe_orders
+from day_close import day_closer
+from services import order_service, OrderError
 
 class CafeSection:
     def __init__(self, parent):
         self.parent = parent
         self.frame = GlassScrollableFrame(parent)
         self.current_order_items = []
+        self.queued_orders = []
         self.setup_ui()
+        cafe_orders.add_low_stock_listener(self.on_low_stock)
     
     def setup_ui(self):
         """Setup the cafe section UI"""
@@ -81,6 +87,47 @@ class CafeSection:
         self.menu_text.pack(fill='both', expand=True, padx=10, pady=10)
         
         self.refresh_menu()
+        
+        # Recipe ingredients deducted from inventory on each order
+        recipe_frame = GlassFrame(tab)
+        recipe_frame.pack(fill='x', padx=10, pady=10)
+        
+        GlassLabel(recipe_frame, text="Recipe Ingredients", font=FONTS['subheading']).pack(pady=10)
+        
+        GlassLabel(recipe_frame, text="Menu Item:").pack(pady=5)
+        self.recipe_item_var = ctk.StringVar(value="Select Item")
+        ctk.CTkOptionMenu(
+            recipe_frame,
+            variable=self.recipe_item_var,
+            values=self.get_menu_items(),
+            fg_color=COLORS['surface'],
+            button_color=COLORS['primary'],
+            command=lambda _: self.refresh_recipe()
+        ).pack(pady=5)
+        
+        GlassLabel(recipe_frame, text="Ingredient:").pack(pady=5)
+        self.ingredient_var = ctk.StringVar(value="Select Ingredient")
+        ctk.CTkOptionMenu(
+            recipe_frame,
+            variable=self.ingredient_var,
+            values=self.get_ingredients(),
+            fg_color=COLORS['surface'],
+            button_color=COLORS['primary']
+        ).pack(pady=5)
+        
+        GlassLabel(recipe_frame, text="Quantity per Item (0 removes):").pack(pady=5)
+        self.ingredient_qty_entry = GlassEntry(recipe_frame, width=300)
+        self.ingredient_qty_entry.pack(pady=5)
+        
+        GlassButton(recipe_frame, text="Set Ingredient", command=self.set_recipe_ingredient).pack(pady=10)
+        
+        self.recipe_text = ctk.CTkTextbox(
+            recipe_frame,
+            fg_color=COLORS['surface'],
+            text_color=COLORS['text'],
+            height=120
+        )
+        self.recipe_text.pack(fill='x', padx=10, pady=10)
     
     def setup_orders_tab(self):
         """Setup orders management interface"""
@@ -128,9 +175,13 @@ class CafeSection:
         self.split_entry.insert(0, "1")
         self.split_entry.pack(pady=5)
         
-        GlassButton(form_frame, text="Complete Order", command=self.complete_order, 
+        GlassButton(form_frame, text="Complete Order", command=self.complete_order,
                    fg_color=COLORS['success']).pack(pady=20)
         
+        # Busy hours: take orders now, save them together
+        GlassButton(form_frame, text="Queue Order", command=self.queue_order).pack(pady=5)
+        GlassButton(form_frame, text="Send Queued Orders", command=self.send_queued_orders).pack(pady=5)
+        
         # Current order display
         order_frame = GlassFrame(tab)
         order_frame.pack(fill='both', expand=True, padx=10, pady=10)
@@ -155,9 +206,9 @@ class CafeSection:
         
         GlassLabel(options_frame, text="Sales Reports", font=FONTS['heading']).pack(pady=10)
         
-        GlassButton(options_frame, text="Daily Sales Report", 
+        GlassButton(options_frame, text="Daily Sales Report",
                    command=self.show_daily_sales).pack(pady=5)
-        GlassButton(options_frame, text="Popular Items", 
+        GlassButton(options_frame, text="Popular Items",
                    command=self.show_popular_items).pack(pady=5)
         
         # Report display
@@ -180,23 +231,63 @@ class CafeSection:
     
     def get_menu_items(self):
         """Get list of menu items from database"""
-        items = db.fetchall("SELECT id, name, price FROM cafe_menu WHERE is_available = 1")
+        items = order_service.menu()
         if items:
             return [f"{i['id']}: {i['name']} (${i['price']})" for i in items]
         return ["No items available"]
     
+    def get_ingredients(self):
+        """Get list of cafe inventory items from database"""
+        items = db.fetchall("SELECT id, name, unit FROM inventory_items WHERE section = 'Cafe' ORDER BY name")
+        if items:
+            return [f"{i['id']}: {i['name']} ({i['unit'] or 'unit'})" for i in items]
+        return ["No ingredients available"]
+    
+    def set_recipe_ingredient(self):
+        """Add, change or remove an ingredient of the selected menu item"""
+        item_text = self.recipe_item_var.get()
+        ingredient_text = self.ingredient_var.get()
+        if ':' not in item_text or ':' not in ingredient_text:
+            messagebox.showwarning("Recipe", "Please select a menu item and an ingredient")
+            return
+        try:
+            quantity = float(self.ingredient_qty_entry.get())
+            cafe_orders.set_recipe_item(int(item_text.split(':')[0]), int(ingredient_text.split(':')[0]), quantity)
+        except ValueError:
+            messagebox.showerror("Recipe", "Quantity must be a non-negative number")
+            return
+        self.ingredient_qty_entry.delete(0, 'end')
+        self.refresh_recipe()
+    
+    def refresh_recipe(self):
+        """Show the ingredients of the selected menu item"""
+        self.recipe_text.delete('1.0', 'end')
+        item_text = self.recipe_item_var.get()
+        if ':' not in item_text:
+            return
+        recipe = cafe_orders.get_recipe(int(item_text.split(':')[0]))
+        if not recipe:
+            self.recipe_text.insert('end', "No ingredients set; orders will not change stock.")
+        for row in recipe:
+            self.recipe_text.insert('end', f"{row['name']}: {row['quantity']:g} {row['unit'] or 'unit'}\n")
+    
+    def on_low_stock(self, items):
+        """Warn when an order pushes ingredients down to their reorder level"""
+        lines = [f"{i['name']}: {i['quantity']:g} {i['unit'] or 'unit'} left (reorder at {i['reorder_level']:g})"
+                 for i in items]
+        self.frame.after(0, lambda: messagebox.showwarning("Low Stock", "\n".join(lines)))
+    
     def add_menu_item(self):
         """Add a new menu item"""
-        name = self.item_name_entry.get()
-        category = self.category_var.get()
-        price = float(self.item_price_entry.get())
-        description = self.item_description_entry.get()
-        
-        db.execute(
-            """INSERT INTO cafe_menu (name, category, price, description)
-               VALUES (?, ?, ?, ?)""",
-            (name, category, price, description)
-        )
+        try:
+            order_service.add_menu_item(self.item_name_entry.get(), self.category_var.get(),
+                                        float(self.item_price_entry.get()), self.item_description_entry.get())
+        except ValueError:
+            messagebox.showerror("Menu", "Price must be a number")
+            return
+        except OrderError as e:
+            messagebox.showerror("Menu", str(e))
+            return
         
         self.refresh_menu()
         
@@ -211,37 +302,22 @@ class CafeSection:
         if ':' not in item_text:
             return
         
-        item_id = int(item_text.split(':')[0])
-        quantity = int(self.quantity_entry.get())
-        
-        # Get item details
-        item = db.fetchone("SELECT name, price FROM cafe_menu WHERE id = ?", (item_id,))
-        
-        self.current_order_items.append({
-            'id': item_id,
-            'name': item['name'],
-            'price': item['price'],
-            'quantity': quantity
-        })
+        try:
+            self.current_order_items.append(order_service.line(int(item_text.split(':')[0]),
+                                                               int(self.quantity_entry.get())))
+        except ValueError:
+            messagebox.showerror("Order", "Quantity must be a whole number")
+            return
+        except OrderError as e:
+            messagebox.showerror("Order", str(e))
+            return
         
         self.refresh_current_order()
     
-    def complete_order(self):
-        """Complete and save the order"""
-        if not self.current_order_items:
-            return
-        
+    def build_order(self):
+        """Collect the current order from the form"""
         phone = self.order_customer_entry.get()
         
-        # Get or create customer
-        customer = db.fetchone("SELECT id FROM customers WHERE phone = ?", (phone,))
-        if not customer:
-            db.execute(
-                "INSERT INTO customers (name, phone, registration_date) VALUES (?, ?, ?)",
-                (f"Customer {phone}", phone, datetime.now().strftime('%Y-%m-%d'))
-            )
-            customer = db.fetchone("SELECT id FROM customers WHERE phone = ?", (phone,))
-        
         # Get barista ID
         barista_text = self.barista_var.get()
         if ':' in barista_text:
@@ -249,31 +325,58 @@ class CafeSection:
         else:
             barista_id = None
         
-        # Calculate total
-        total = sum(item['price'] * item['quantity'] for item in self.current_order_items)
         split_count = int(self.split_entry.get())
         
-        # Create order
-        db.execute(
-            """INSERT INTO cafe_orders (customer_id, barista_id, order_date, total_amount, split_count)
-               VALUES (?, ?, ?, ?, ?)""",
-            (customer['id'], barista_id, datetime.now().strftime('%Y-%m-%d %H:%M:%S'), total, split_count)
-        )
+        return {'phone': phone, 'barista_id': barista_id, 'items': self.current_order_items,
+                'split_count': split_count, 'when': datetime.now()}
+    
+    def clear_order(self):
+        """Clear the current order form"""
+        self.current_order_items = []
+        self.refresh_current_order()
+        self.order_customer_entry.delete(0, 'end')
+    
+    def complete_order(self):
+        """Complete and save the order"""
+        if not self.current_order_items:
+            return
         
-        order_id = db.fetchone("SELECT last_insert_rowid() as id")['id']
+        # Save order and deduct recipe ingredients from inventory
+        try:
+            order_service.place_batch([self.build_order()])
+        except ValueError:
+            messagebox.showerror("Order", "Split count must be a whole number")
+            return
+        except OrderError as e:
+            messagebox.showerror("Order", str(e))
+            return
         
-        # Add order items
-        for item in self.current_order_items:
-            db.execute(
-                """INSERT INTO cafe_order_items (order_id, menu_item_id, quantity, price)
-                   VALUES (?, ?, ?, ?)""",
-                (order_id, item['id'], item['quantity'], item['price'])
-            )
+        self.clear_order()
+    
+    def queue_order(self):
+        """Hold the current order to be saved with the next batch"""
+        if not self.current_order_items:
+            return
         
-        # Clear current order
-        self.current_order_items = []
+        try:
+            self.queued_orders.append(self.build_order())
+        except ValueError:
+            messagebox.showerror("Order", "Split count must be a whole number")
+            return
+        self.clear_order()
+    
+    def send_queued_orders(self):
+        """Save all queued orders in one transaction"""
+        if not self.queued_orders:
+            return
+        
+        try:
+            order_service.place_batch(self.queued_orders)
+        except Exception as e:
+            messagebox.showerror("Queued Orders", f"Could not save queued orders: {e}")
+            return
+        self.queued_orders = []
         self.refresh_current_order()
-        self.order_customer_entry.delete(0, 'end')
     
     def refresh_current_order(self):
         """Refresh current order display"""
@@ -286,11 +389,13 @@ class CafeSection:
                 f"{item['name']} x{item['quantity']} = ${subtotal:.2f}\n"
             )
         self.current_order_text.insert('end', f"\nTotal: ${total:.2f}")
+        if self.queued_orders:
+            self.current_order_text.insert('end', f"\n\nQueued orders: {len(self.queued_orders)}")
     
     def refresh_menu(self):
         """Refresh menu display"""
         self.menu_text.delete('1.0', 'end')
-        items = db.fetchall("SELECT * FROM cafe_menu ORDER BY category, name")
+        items = order_service.menu(available_only=False)
         
         current_category = None
         for item in items:
@@ -305,19 +410,13 @@ class CafeSection:
     def show_daily_sales(self):
         """Show daily sales report"""
         self.report_text.delete('1.0', 'end')
-        today = datetime.now().strftime('%Y-%m-%d')
-        
-        orders = db.fetchall(
-            """SELECT SUM(total_amount) as total, COUNT(*) as count
-               FROM cafe_orders
-               WHERE DATE(order_date) = ?""",
-            (today,)
-        )
+        summary = day_closer.daily_summary()
+        cafe = summary['sections']['Cafe']
         
-        if orders and orders[0]['total']:
-            self.report_text.insert('end', f"Daily Sales Report for {today}\n\n")
-            self.report_text.insert('end', f"Total Orders: {orders[0]['count']}\n")
-            self.report_text.insert('end', f"Total Revenue: ${orders[0]['total']:.2f}\n")
+        if cafe['count']:
+            self.report_text.insert('end', f"Daily Sales Report for {summary['date']}\n\n")
+            self.report_text.insert('end', f"Total Orders: {cafe['count']}\n")
+            self.report_text.insert('end', f"Total Revenue: ${cafe['amount']:.2f}\n")
         else:
             self.report_text.insert('end', "No sales today yet.")
     
@@ -325,14 +424,7 @@ class CafeSection:
         """Show popular items report"""
         self.report_text.delete('1.0', 'end')
         
-        items = db.fetchall(
-            """SELECT m.name, SUM(oi.quantity) as total_sold, SUM(oi.price * oi.quantity) as revenue
-               FROM cafe_order_items oi
-               JOIN cafe_menu m ON oi.menu_item_id = m.id
-               GROUP BY m.id
-               ORDER BY total_sold DESC
-               LIMIT 10"""
-        )
+        items = order_service.popular_items(10)
         
         self.report_text.insert('end', "Top 10 Popular Items\n\n")
         for item in items:
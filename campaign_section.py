@@ -6,6 +6,8 @@ import customtkinter as ctk
 from datetime import datetime
 from ui_utils import *
 from database import db
+from vouchers import voucher_engine, VoucherError
+from tkinter import filedialog, messagebox
 import random
 import string
 
@@ -67,6 +69,30 @@ class CampaignSection:
         
         GlassButton(form_frame, text="Create Campaign", command=self.create_campaign).pack(pady=20)
         
+        # Single-use vouchers
+        voucher_frame = GlassFrame(tab)
+        voucher_frame.pack(fill='x', padx=10, pady=10)
+        
+        GlassLabel(voucher_frame, text="Issue Vouchers", font=FONTS['heading']).pack(pady=10)
+        
+        GlassLabel(voucher_frame, text="Campaign:").pack(pady=5)
+        self.voucher_campaign_var = ctk.StringVar(value="Select Campaign")
+        self.voucher_campaign_menu = ctk.CTkOptionMenu(
+            voucher_frame,
+            variable=self.voucher_campaign_var,
+            values=self.get_campaign_options(),
+            fg_color=COLORS['surface'],
+            button_color=COLORS['primary']
+        )
+        self.voucher_campaign_menu.pack(pady=5)
+        
+        GlassLabel(voucher_frame, text="Number of Vouchers:").pack(pady=5)
+        self.voucher_count_entry = GlassEntry(voucher_frame, width=300)
+        self.voucher_count_entry.insert(0, "100")
+        self.voucher_count_entry.pack(pady=5)
+        
+        GlassButton(voucher_frame, text="Issue and Export", command=self.issue_vouchers).pack(pady=20)
+        
         # Campaigns list
         list_frame = GlassFrame(tab)
         list_frame.pack(fill='both', expand=True, padx=10, pady=10)
@@ -144,6 +170,38 @@ class CampaignSection:
         """Generate a random campaign code"""
         return ''.join(random.choices(string.ascii_uppercase + string.digits, k=8))
     
+    def get_campaign_options(self):
+        """Get list of active campaigns for the voucher form"""
+        campaigns = db.fetchall("SELECT id, name FROM campaigns WHERE is_active = 1 ORDER BY start_date DESC")
+        if campaigns:
+            return [f"{c['id']}: {c['name']}" for c in campaigns]
+        return ["No campaigns available"]
+    
+    def issue_vouchers(self):
+        """Issue single-use vouchers for a campaign and export them to CSV"""
+        campaign_text = self.voucher_campaign_var.get()
+        if ':' not in campaign_text:
+            messagebox.showwarning("Vouchers", "Please select a campaign")
+            return
+        try:
+            count = int(self.voucher_count_entry.get())
+            codes = voucher_engine.generate(int(campaign_text.split(':')[0]), count)
+        except (ValueError, VoucherError) as e:
+            messagebox.showerror("Vouchers", f"Could not issue vouchers: {e}")
+            return
+        
+        path = filedialog.asksaveasfilename(
+            defaultextension='.csv',
+            filetypes=[("CSV files", "*.csv")],
+            initialfile=f"vouchers_{campaign_text.split(':')[0]}_{datetime.now().strftime('%Y%m%d_%H%M%S')}.csv"
+        )
+        if path:
+            with open(path, 'w', encoding='utf-8') as f:
+                f.write("code\n")
+                f.write("\n".join(codes) + "\n")
+        messagebox.showinfo("Vouchers", f"Issued {len(codes)} vouchers" + (f"\nSaved to {path}" if path else ""))
+        self.refresh_campaigns()
+    
     def create_campaign(self):
         """Create a new campaign"""
         name = self.campaign_name_entry.get()
@@ -159,8 +217,10 @@ class CampaignSection:
                VALUES (?, ?, ?, ?, ?, ?)""",
             (name, description, discount, code, start_date, end_date)
         )
+        voucher_engine.refresh()
         
         self.refresh_campaigns()
+        self.voucher_campaign_menu.configure(values=self.get_campaign_options())
         
         # Clear form
         self.campaign_name_entry.delete(0, 'end')
@@ -178,10 +238,12 @@ class CampaignSection:
         )
         
         for campaign in campaigns:
+            vouchers = voucher_engine.campaign_usage(campaign['id'])
             self.campaigns_text.insert('end',
                 f"{campaign['name']} - {campaign['discount_percentage']}% off\n"
                 f"  Code: {campaign['code']}\n"
                 f"  Valid: {campaign['start_date']} to {campaign['end_date']}\n"
+                f"  Vouchers: {vouchers['issued']} issued, {vouchers['redeemed']} redeemed\n"
                 f"  {campaign['description']}\n\n"
             )
     
@@ -279,7 +341,9 @@ class CampaignSection:
         campaigns = db.fetchall(
             """SELECT c.name, c.code, COUNT(i.id) as uses, SUM(i.discount_amount) as total_discount
                FROM campaigns c
-               LEFT JOIN invoices i ON c.code = i.campaign_code
+               LEFT JOIN invoices i ON i.campaign_code = c.code
+                 OR i.id IN (SELECT invoice_id FROM campaign_vouchers
+                             WHERE campaign_id = c.id AND redeemed_at IS NOT NULL)
                GROUP BY c.id
                ORDER BY uses DESC"""
         )
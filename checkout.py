@@ -0,0 +1,177 @@
+"""
+Checkout Module
+Builds one invoice from a customer's unbilled salon services, cafe orders
+and gamnet sessions, and links those rows to it
+"""
+from datetime import datetime, timedelta
+
+from database import db, DayClosedError
+from vouchers import VoucherEngine, VoucherError, voucher_engine
+from archive import ArchiveManager, archive_manager
+
+# Section -> (table, query for a customer's unbilled rows as invoice lines)
+SECTION_SOURCES = {
+    'Salon': ('salon_service_records', """
+        SELECT r.id, r.service_date as date, COALESCE(s.name, 'Salon service') as description,
+               COALESCE(r.price, 0) as amount
+        FROM salon_service_records r
+        LEFT JOIN salon_services s ON s.id = r.service_id
+        WHERE r.customer_id = ? AND r.invoice_id IS NULL
+        ORDER BY r.id"""),
+    'Cafe': ('cafe_orders', """
+        SELECT o.id, o.order_date as date, 'Cafe order #' || o.id as description,
+               COALESCE(o.total_amount, 0) as amount
+        FROM cafe_orders o
+        WHERE o.customer_id = ? AND o.invoice_id IS NULL
+        ORDER BY o.id"""),
+    'Gamnet': ('gamnet_sessions', """
+        SELECT g.id, g.start_time as date,
+               COALESCE(d.device_number, 'Device') || ' (' || COALESCE(g.duration_minutes, 0) || ' min)'
+                   as description,
+               COALESCE(g.charge, 0) as amount
+        FROM gamnet_sessions g
+        LEFT JOIN gamnet_devices d ON d.id = g.device_id
+        WHERE g.customer_id = ? AND g.invoice_id IS NULL AND g.end_time IS NOT NULL
+        ORDER BY g.id"""),
+}
+
+class CheckoutError(Exception):
+    """Raised when an invoice cannot be created"""
+
+class CheckoutEngine:
+    """Unified checkout across the salon, cafe and gamnet sections"""
+    def __init__(self, database=None):
+        self.db = database or db
+        self.vouchers = VoucherEngine(self.db) if database else voucher_engine
+        self.archive = ArchiveManager(self.db) if database else archive_manager
+    
+    def tax_rate(self):
+        """Tax percentage from the tax_rate setting"""
+        row = self.db.fetchone("SELECT value FROM settings WHERE key = 'tax_rate'")
+        try:
+            return float(row['value']) if row else 0.0
+        except (TypeError, ValueError):
+            return 0.0
+    
+    def find_campaign(self, code, today=None):
+        """Active campaign for a campaign or voucher code on a date, or None"""
+        return self.vouchers.validate(code, today)
+    
+    def unbilled_lines(self, customer_id, cursor=None):
+        """A customer's unbilled section rows as invoice lines"""
+        lines = []
+        for section, (table, query) in SECTION_SOURCES.items():
+            if cursor is None:
+                rows = self.db.fetchall(query, (customer_id,))
+            else:
+                rows = cursor.execute(query, (customer_id,)).fetchall()
+            for row in rows:
+                lines.append({'section': section, 'table': table, 'id': row['id'], 'date': row['date'],
+                              'description': row['description'], 'amount': row['amount']})
+        return lines
+    
+    def totals(self, lines, campaign=None, tax_rate=None):
+        """Subtotal, campaign discount, tax on the discounted amount, and final amount"""
+        subtotal = round(sum(line['amount'] for line in lines), 2)
+        discount = 0.0
+        if campaign and campaign['discount_percentage']:
+            discount = round(subtotal * campaign['discount_percentage'] / 100, 2)
+        rate = self.tax_rate() if tax_rate is None else tax_rate
+        tax = round((subtotal - discount) * rate / 100, 2)
+        return {'subtotal': subtotal, 'discount': discount, 'tax': tax, 'final': round(subtotal - discount + tax, 2)}
+    
+    def quote(self, customer_id, campaign_code=None, extra_items=()):
+        """Preview the invoice checkout() would create, without saving anything"""
+        lines = self.unbilled_lines(customer_id) + [dict(item, id=None, table=None) for item in extra_items]
+        result = self.totals(lines, self.find_campaign(campaign_code))
+        result['lines'] = lines
+        return result
+    
+    def checkout(self, phone, campaign_code=None, extra_items=(), when=None):
+        """Create one invoice for everything the customer has not been billed for
+        
+        extra_items are hand-entered lines ({'section', 'description',
+        'amount'}) added to the section rows. The invoice and the invoice_id
+        of every linked row are written in one transaction. Returns the
+        totals, the lines and 'invoice_id'.
+        """
+        when = when or datetime.now()
+        campaign = self.find_campaign(campaign_code, when.strftime('%Y-%m-%d'))
+        if campaign_code and not campaign:
+            raise CheckoutError(f"Campaign code {campaign_code!r} is not valid")
+        tax_rate = self.tax_rate()
+        
+        try:
+            with self.db.transaction() as cursor:
+                customer = cursor.execute("SELECT id FROM customers WHERE phone = ?", (phone,)).fetchone()
+                if customer:
+                    customer_id = customer['id']
+                    lines = self.unbilled_lines(customer_id, cursor)
+                else:
+                    cursor.execute(
+                        "INSERT INTO customers (name, phone, registration_date) VALUES (?, ?, ?)",
+                        (f"Customer {phone}", phone, when.strftime('%Y-%m-%d'))
+                    )
+                    customer_id = cursor.lastrowid
+                    lines = []
+                lines += [dict(item, id=None, table=None) for item in extra_items]
+                if not lines:
+                    raise CheckoutError("Nothing to invoice for this customer")
+                
+                result = self.totals(lines, campaign, tax_rate)
+                cursor.execute(
+                    """INSERT INTO invoices
+                       (customer_id, invoice_date, total_amount, discount_amount, tax_amount, final_amount, campaign_code)
+                       VALUES (?, ?, ?, ?, ?, ?, ?)""",
+                    (customer_id, when.strftime('%Y-%m-%d %H:%M:%S'), result['subtotal'], result['discount'],
+                     result['tax'], result['final'], campaign['code'] if campaign else None)
+                )
+                invoice_id = cursor.lastrowid
+                
+                if campaign and campaign['voucher']:
+                    try:
+                        self.vouchers.redeem(campaign['code'], invoice_id, customer_id, when, cursor=cursor)
+                    except VoucherError as e:
+                        raise CheckoutError(str(e))
+                
+                for table, _ in SECTION_SOURCES.values():
+                    ids = [line['id'] for line in lines if line['table'] == table]
+                    if not ids:
+                        continue
+                    placeholders = ','.join('?' * len(ids))
+                    cursor.execute(
+                        f"UPDATE {table} SET invoice_id = ? WHERE id IN ({placeholders}) AND invoice_id IS NULL",
+                        [invoice_id] + ids
+                    )
+                    if cursor.rowcount != len(ids):
+                        raise CheckoutError(f"Some {table} rows were billed on another invoice")
+        except DayClosedError:
+            raise CheckoutError(f"{when:%Y-%m-%d} is closed; no more invoices can be dated on it")
+        if campaign and campaign['voucher']:
+            self.vouchers.discard(campaign['code'])
+        
+        result.update({'invoice_id': invoice_id, 'customer_id': customer_id, 'lines': lines})
+        return result
+    
+    def section_revenue(self, start_date, end_date, paid_only=True):
+        """Billed amount per section for invoices dated start_date..end_date
+        
+        Reads section rows through their invoice_id, so hand-entered lines
+        are not counted.
+        """
+        end = (datetime.strptime(end_date, '%Y-%m-%d') + timedelta(days=1)).strftime('%Y-%m-%d')
+        paid_filter = "AND i.is_paid = 1" if paid_only else ""
+        invoices = self.archive.table_for('invoices', start_date)
+        amounts = {'Salon': 'COALESCE(r.price, 0)', 'Cafe': 'COALESCE(r.total_amount, 0)',
+                   'Gamnet': 'COALESCE(r.charge, 0)'}
+        parts = [
+            f"""SELECT '{section}' as section, SUM({amounts[section]}) as total
+                FROM {invoices} i JOIN {self.archive.table_for(table, start_date)} r ON r.invoice_id = i.id
+                WHERE i.invoice_date >= ? AND i.invoice_date < ? {paid_filter}"""
+            for section, (table, _) in SECTION_SOURCES.items()
+        ]
+        rows = self.db.fetchall(" UNION ALL ".join(parts), (start_date, end) * len(parts))
+        return {row['section']: row['total'] or 0 for row in rows}
+
+# Global checkout engine instance
+checkout_engine = CheckoutEngine()
@@ -0,0 +1,57 @@
+"""
+Command Palette Module
+Keyboard-driven jump to any section or record (Ctrl+K)
+"""
+import customtkinter as ctk
+from ui_utils import *
+from global_search import global_search
+
+class CommandPalette(ctk.CTkToplevel):
+    """Search box over the app's sections and the global search index
+    
+    commands is a list of (label, callback) for going to a section;
+    open_result(result) is called with the chosen global_search result.
+    """
+    def __init__(self, master, commands, open_result):
+        super().__init__(master)
+        self.commands = commands
+        self.open_result = open_result
+        
+        self.title("Search")
+        self.geometry("640x460")
+        self.configure(fg_color=COLORS['background'])
+        self.transient(master)
+        
+        self.entry = SuggestionEntry(
+            self,
+            self.search,
+            describe=self.describe,
+            value=lambda item: item['title'],
+            on_select=self.choose,
+            delay_ms=120,
+            width=600,
+            placeholder_text="Customers, menu, services, inventory, suppliers, employees, invoice # or a section"
+        )
+        self.entry.pack(fill='x', padx=20, pady=20)
+        self.bind('<Escape>', lambda event: self.destroy())
+        self.after(50, self.entry.entry.focus_set)
+    
+    def search(self, text):
+        """Matching sections, then matching records"""
+        typed = text.lower()
+        sections = [{'label': 'Go to', 'title': label, 'action': callback}
+                    for label, callback in self.commands if label.lower().startswith(typed)]
+        return sections + global_search.search(text)
+    
+    def describe(self, item):
+        """One suggestion line"""
+        detail = f"  ({item['body']})" if item.get('body') else ''
+        return f"{item['label']}: {item['title']}{detail}"
+    
+    def choose(self, item):
+        """Close the palette and open the chosen section or record"""
+        self.destroy()
+        if 'action' in item:
+            item['action']()
+        else:
+            self.open_result(item)
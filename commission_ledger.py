@@ -0,0 +1,143 @@
+"""
+Commission Ledger Module
+Records salon services atomically and reads per-employee commission
+balances from the employee_commission_balances aggregate table
+"""
+from datetime import datetime
+
+from database import db, DayClosedError
+
+class CommissionLedger:
+    """Salon service recording and commission balance queries"""
+    def __init__(self, database=None):
+        self.db = database or db
+    
+    def record_salon_service(self, phone, stylist_id, service_id, rating=None, review=None, when=None):
+        """Record a completed salon service and its commission in one transaction
+        
+        The customer is created on first visit. Returns
+        {'success': True, 'record_id', 'customer_id', 'price', 'commission'}
+        or {'success': False, 'message': ...}.
+        """
+        if rating is not None and not 1 <= rating <= 5:
+            return {'success': False, 'message': 'Rating must be between 1 and 5'}
+        
+        when = when or datetime.now()
+        try:
+            with self.db.transaction() as cursor:
+                service = cursor.execute(
+                    "SELECT price, commission_rate FROM salon_services WHERE id = ?", (service_id,)
+                ).fetchone()
+                if not service:
+                    return {'success': False, 'message': 'Service not found'}
+                
+                cursor.execute(
+                    "INSERT OR IGNORE INTO customers (name, phone, registration_date) VALUES (?, ?, ?)",
+                    (f"Customer {phone}", phone, when.strftime('%Y-%m-%d'))
+                )
+                customer_id = cursor.execute("SELECT id FROM customers WHERE phone = ?", (phone,)).fetchone()['id']
+                
+                price = service['price']
+                commission = price * ((service['commission_rate'] or 0) / 100)
+                cursor.execute(
+                    """INSERT INTO salon_service_records
+                       (customer_id, stylist_id, service_id, service_date, price, commission, rating, review)
+                       VALUES (?, ?, ?, ?, ?, ?, ?, ?)""",
+                    (customer_id, stylist_id, service_id, when.strftime('%Y-%m-%d %H:%M:%S'),
+                     price, commission, rating, review)
+                )
+                record_id = cursor.lastrowid
+                cursor.execute(
+                    """INSERT INTO employee_commissions (employee_id, service_date, service_type, amount)
+                       VALUES (?, ?, 'Salon', ?)""",
+                    (stylist_id, when.strftime('%Y-%m-%d'), commission)
+                )
+        except DayClosedError:
+            return {'success': False, 'message': f"{when:%Y-%m-%d} is closed; no more services can be recorded on it"}
+        
+        return {'success': True, 'record_id': record_id, 'customer_id': customer_id,
+                'price': price, 'commission': commission}
+    
+    def balances(self, period=None, active_only=True):
+        """One row per employee with totals for a period ('YYYY-MM') or all time"""
+        period_filter = "AND b.period = ?" if period else ""
+        params = (period,) if period else ()
+        active_filter = "WHERE e.is_active = 1" if active_only else ""
+        return self.db.fetchall(
+            f"""SELECT e.id, e.name, e.role, e.section, e.base_salary, e.commission_rate,
+                       COALESCE(SUM(b.commission_earned), 0) as commission_earned,
+                       COALESCE(SUM(b.commission_paid), 0) as commission_paid,
+                       COALESCE(SUM(b.commission_earned - b.commission_paid), 0) as commission_due,
+                       COALESCE(SUM(b.service_count), 0) as service_count,
+                       COALESCE(SUM(b.service_revenue), 0) as service_revenue,
+                       CASE WHEN SUM(b.rating_count) > 0
+                            THEN CAST(SUM(b.rating_total) AS REAL) / SUM(b.rating_count) END as avg_rating
+                FROM employees e
+                LEFT JOIN employee_commission_balances b ON b.employee_id = e.id {period_filter}
+                {active_filter}
+                GROUP BY e.id
+                ORDER BY commission_earned DESC""",
+            params
+        )
+    
+    def employee_summary(self, employee_id, period=None):
+        """Totals for one employee, for a period or all time"""
+        period_filter = "AND period = ?" if period else ""
+        params = (employee_id, period) if period else (employee_id,)
+        return self.db.fetchone(
+            f"""SELECT COALESCE(SUM(commission_earned), 0) as commission_earned,
+                       COALESCE(SUM(commission_paid), 0) as commission_paid,
+                       COALESCE(SUM(commission_earned - commission_paid), 0) as commission_due,
+                       COALESCE(SUM(service_count), 0) as service_count,
+                       COALESCE(SUM(service_revenue), 0) as service_revenue,
+                       CASE WHEN SUM(rating_count) > 0
+                            THEN CAST(SUM(rating_total) AS REAL) / SUM(rating_count) END as avg_rating
+                FROM employee_commission_balances
+                WHERE employee_id = ? {period_filter}""",
+            params
+        )
+    
+    def mark_paid(self, employee_id, period):
+        """Mark an employee's commissions for a period as paid; returns the amount"""
+        with self.db.transaction() as cursor:
+            due = cursor.execute(
+                """SELECT COALESCE(SUM(amount), 0) as due FROM employee_commissions
+                   WHERE employee_id = ? AND substr(service_date, 1, 7) = ? AND is_paid = 0""",
+                (employee_id, period)
+            ).fetchone()['due']
+            cursor.execute(
+                """UPDATE employee_commissions SET is_paid = 1
+                   WHERE employee_id = ? AND substr(service_date, 1, 7) = ? AND is_paid = 0""",
+                (employee_id, period)
+            )
+        return due
+    
+    def verify(self):
+        """Rebuild the aggregate table from its source rows
+        
+        Returns the (key, stored, expected) rows that were out of step.
+        """
+        with self.db.lock:
+            current = {
+                (r['employee_id'], r['period']): tuple(r)[2:]
+                for r in self.db.fetchall("SELECT * FROM employee_commission_balances")
+            }
+            with self.db.transaction():
+                self.db.rebuild_commission_balances()
+                expected = {
+                    (r['employee_id'], r['period']): tuple(r)[2:]
+                    for r in self.db.fetchall("SELECT * FROM employee_commission_balances")
+                }
+        mismatches = []
+        for key in set(current) | set(expected):
+            got = current.get(key)
+            want = expected.get(key)
+            if got is None or want is None or any(abs((a or 0) - (b or 0)) > 1e-6 for a, b in zip(got, want)):
+                # Rows that net to zero after deletes are harmless
+                if want is None and all(abs(v or 0) < 1e-6 for v in got):
+                    continue
+                mismatches.append((key, got, want))
+        return mismatches
+
+# Global commission ledger instance
+commission_ledger = CommissionLedger()
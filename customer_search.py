@@ -0,0 +1,76 @@
+"""
+Customer Search Module
+As-you-type customer lookup by partial name (Persian or Latin) and/or the
+first digits of a phone number
+"""
+import re
+
+from database import db, Database
+
+RESULT_LIMIT = 8
+
+# Persian and Arabic-Indic digits -> ASCII, as phones are stored
+DIGITS = str.maketrans('۰۱۲۳۴۵۶۷۸۹٠١٢٣٤٥٦٧٨٩', '0123456789' * 2)
+
+class CustomerSearch:
+    """Top matches for what has been typed so far
+    
+    Words are matched as name prefixes through the customer_name_search
+    FTS5 index and digits as a phone prefix range on the unique phone
+    index. FTS results come back in descending rowid order, which the
+    LIMIT can stop early, so a one-letter prefix matching most customers
+    costs no more than a full name.
+    """
+    def __init__(self, database=None):
+        self.db = database or db
+    
+    def parse(self, text):
+        """(phone prefix, name words) from typed text"""
+        text = text.translate(DIGITS)
+        for source, target in Database.NAME_FOLDS.items():
+            text = text.replace(source, target)
+        phone, words = '', []
+        for token in text.split():
+            if re.fullmatch(r'[+\d-]+', token):
+                phone += token.replace('-', '')
+            else:
+                words += re.findall(r'\w+', token)
+        return phone, words
+    
+    def query(self, text, limit=RESULT_LIMIT):
+        """(sql, params) of a search, or None when nothing was typed"""
+        phone, words = self.parse(text)
+        if not phone and not words:
+            return None
+        where, params = [], []
+        if phone:
+            # A name match is narrowed by the phone; the FTS index still drives the lookup
+            where.append("c.phone >= ? AND c.phone < ?")
+            params += [phone, phone[:-1] + chr(ord(phone[-1]) + 1)]
+        columns = "c.id, c.name, c.phone, c.loyalty_points, c.wallet_balance"
+        if words and self.db.name_search:
+            sql = f"""SELECT {columns}
+                      FROM customer_name_search s JOIN customers c ON c.id = s.rowid
+                      WHERE customer_name_search MATCH ? {''.join(' AND ' + w for w in where)}
+                      ORDER BY s.rowid DESC
+                      LIMIT ?"""
+            return sql, [' '.join(f'"{word}"*' for word in words)] + params + [limit]
+        for word in words:
+            where.append("c.name LIKE ?")
+            params.append(f"%{word}%")
+        sql = f"""SELECT {columns}
+                  FROM customers c
+                  WHERE {' AND '.join(where)}
+                  ORDER BY {'c.id DESC' if words else 'c.phone'}
+                  LIMIT ?"""
+        return sql, params + [limit]
+    
+    def search(self, text, limit=RESULT_LIMIT):
+        """Up to limit customers matching the typed text (newest first, or by phone for digits only)"""
+        query = self.query(text, limit)
+        if not query:
+            return []
+        return [dict(row) for row in self.db.fetchall(*query)]
+
+# Global customer search instance
+customer_search = CustomerSearch()
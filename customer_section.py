@@ -3,14 +3,19 @@ Customer Management Section Module
 Handles customer registration, loyalty points, wallet, and history
 """
 import customtkinter as ctk
-from datetime import datetime
 from ui_utils import *
-from database import db
+from payments import payment_ledger, PaymentError
+from services import customer_service, CustomerError
+from customer_timeline import customer_timeline, TIMELINE_SOURCES
+from customer_search import customer_search
+from tkinter import messagebox
 
 class CustomerSection:
     def __init__(self, parent):
         self.parent = parent
         self.frame = GlassScrollableFrame(parent)
+        self.history_customer = None
+        self.history_next = None
         self.setup_ui()
     
     def setup_ui(self):
@@ -81,11 +86,22 @@ class CustomerSection:
         
         GlassLabel(search_frame, text="Customer History", font=FONTS['heading']).pack(pady=10)
         
-        GlassLabel(search_frame, text="Phone Number:").pack(pady=5)
-        self.history_phone_entry = GlassEntry(search_frame, width=300)
+        GlassLabel(search_frame, text="Name or Phone Number:").pack(pady=5)
+        self.history_phone_entry = self.create_customer_entry(search_frame, lambda customer: self.view_history())
         self.history_phone_entry.pack(pady=5)
         
-        GlassButton(search_frame, text="View History", command=self.view_history).pack(pady=20)
+        self.history_section_var = ctk.StringVar(value="All Sections")
+        ctk.CTkOptionMenu(
+            search_frame,
+            variable=self.history_section_var,
+            values=["All Sections"] + list(TIMELINE_SOURCES),
+            width=300,
+            fg_color=COLORS['surface'],
+            button_color=COLORS['primary']
+        ).pack(pady=5)
+        
+        GlassButton(search_frame, text="View History", command=self.view_history).pack(pady=(20, 5))
+        GlassButton(search_frame, text="Older Activity", command=self.show_older_history).pack(pady=(5, 20))
         
         # History display
         history_frame = GlassFrame(tab)
@@ -108,8 +124,8 @@ class CustomerSection:
         
         GlassLabel(form_frame, text="Manage Loyalty & Wallet", font=FONTS['heading']).pack(pady=10)
         
-        GlassLabel(form_frame, text="Phone Number:").pack(pady=5)
-        self.loyalty_phone_entry = GlassEntry(form_frame, width=300)
+        GlassLabel(form_frame, text="Name or Phone Number:").pack(pady=5)
+        self.loyalty_phone_entry = self.create_customer_entry(form_frame, lambda customer: self.view_customer_info())
         self.loyalty_phone_entry.pack(pady=5)
         
         GlassLabel(form_frame, text="Add Points:").pack(pady=5)
@@ -135,28 +151,25 @@ class CustomerSection:
         )
         self.loyalty_text.pack(fill='both', expand=True, padx=10, pady=10)
     
+    def create_customer_entry(self, parent, on_select):
+        """Phone entry that suggests customers by partial name or phone"""
+        return SuggestionEntry(
+            parent,
+            customer_search.search,
+            describe=lambda customer: f"{customer['name']} - {customer['phone']}",
+            value=lambda customer: customer['phone'],
+            on_select=on_select,
+            width=300
+        )
+    
     def register_customer(self):
-        """Register a new customer"""
-        name = self.customer_name_entry.get()
-        phone = self.customer_phone_entry.get()
-        birthdate = self.customer_birthdate_entry.get()
-        
-        # Check if customer exists
-        existing = db.fetchone("SELECT id FROM customers WHERE phone = ?", (phone,))
-        
-        if existing:
-            # Update existing customer
-            db.execute(
-                """UPDATE customers SET name = ?, birthdate = ? WHERE phone = ?""",
-                (name, birthdate, phone)
-            )
-        else:
-            # Create new customer
-            db.execute(
-                """INSERT INTO customers (name, phone, birthdate, registration_date)
-                   VALUES (?, ?, ?, ?)""",
-                (name, phone, birthdate, datetime.now().strftime('%Y-%m-%d'))
-            )
+        """Register a new customer, or update the one with this phone"""
+        try:
+            customer_service.register(self.customer_name_entry.get(), self.customer_phone_entry.get(),
+                                      self.customer_birthdate_entry.get())
+        except CustomerError as e:
+            messagebox.showerror("Register Customer", str(e))
+            return
         
         self.refresh_customers()
         
@@ -168,13 +181,8 @@ class CustomerSection:
     def refresh_customers(self):
         """Refresh customers list"""
         self.customers_text.delete('1.0', 'end')
-        customers = db.fetchall(
-            """SELECT * FROM customers 
-               ORDER BY registration_date DESC 
-               LIMIT 50"""
-        )
         
-        for customer in customers:
+        for customer in customer_service.recent():
             self.customers_text.insert('end',
                 f"{customer['name']} - {customer['phone']} - "
                 f"Points: {customer['loyalty_points']} - "
@@ -182,91 +190,85 @@ class CustomerSection:
             )
     
     def view_history(self):
-        """View customer purchase history"""
+        """View a customer's activity across all sections, newest first"""
         phone = self.history_phone_entry.get()
-        customer = db.fetchone("SELECT * FROM customers WHERE phone = ?", (phone,))
+        customer = customer_service.find(phone)
         
         if not customer:
+            self.history_customer = None
             self.history_text.delete('1.0', 'end')
             self.history_text.insert('end', "Customer not found.")
             return
         
-        self.history_text.delete('1.0', 'end')
-        self.history_text.insert('end', f"History for {customer['name']} ({phone})\n\n")
-        
-        # Salon services
-        salon = db.fetchall(
-            """SELECT s.service_date, sv.name, s.price
-               FROM salon_service_records s
-               JOIN salon_services sv ON s.service_id = sv.id
-               WHERE s.customer_id = ?
-               ORDER BY s.service_date DESC
-               LIMIT 10""",
-            (customer['id'],)
-        )
-        
-        if salon:
-            self.history_text.insert('end', "=== Salon Services ===\n")
-            for svc in salon:
-                self.history_text.insert('end', f"{svc['service_date']}: {svc['name']} - ${svc['price']:.2f}\n")
-        
-        # Cafe orders
-        cafe = db.fetchall(
-            """SELECT order_date, total_amount
-               FROM cafe_orders
-               WHERE customer_id = ?
-               ORDER BY order_date DESC
-               LIMIT 10""",
-            (customer['id'],)
-        )
-        
-        if cafe:
-            self.history_text.insert('end', "\n=== Cafe Orders ===\n")
-            for order in cafe:
-                self.history_text.insert('end', f"{order['order_date']}: ${order['total_amount']:.2f}\n")
-        
-        # Gaming sessions
-        gaming = db.fetchall(
-            """SELECT start_time, duration_minutes, charge
-               FROM gamnet_sessions
-               WHERE customer_id = ? AND end_time IS NOT NULL
-               ORDER BY start_time DESC
-               LIMIT 10""",
-            (customer['id'],)
-        )
+        self.history_customer = customer
+        self.show_history_page(None)
+    
+    def show_customer(self, phone):
+        """Open the history tab for a customer"""
+        self.tabview.set("History")
+        self.history_phone_entry.delete(0, 'end')
+        self.history_phone_entry.insert(0, phone)
+        self.view_history()
+    
+    def show_older_history(self):
+        """Show the next page of the current customer's history"""
+        if not self.history_customer:
+            return
+        if not self.history_next:
+            self.history_text.insert('end', "\nNo older activity.\n")
+            return
+        self.show_history_page(self.history_next)
+    
+    def show_history_page(self, after):
+        """Show the summary header and one page of the customer's timeline"""
+        customer = self.history_customer
+        section = self.history_section_var.get()
+        sections = None if section == "All Sections" else (section,)
+        page = customer_timeline.page(customer['id'], after=after, sections=sections)
+        self.history_next = page['next']
         
-        if gaming:
-            self.history_text.insert('end', "\n=== Gaming Sessions ===\n")
-            for session in gaming:
-                self.history_text.insert('end', 
-                    f"{session['start_time']}: {session['duration_minutes']} min - ${session['charge']:.2f}\n")
+        self.history_text.delete('1.0', 'end')
+        self.history_text.insert('end', f"History for {customer['name']} ({customer['phone']})\n")
+        self.history_text.insert('end',
+            f"Points: {customer['loyalty_points'] or 0} - Wallet: ${customer['wallet_balance'] or 0:.2f}\n")
+        for name, totals in customer_timeline.summary(customer['id']).items():
+            self.history_text.insert('end', f"{name}: {totals['visits']} visit(s), ${totals['spend']:.2f}   ")
+        self.history_text.insert('end', "\n\n")
+        
+        for event in page['rows']:
+            amount = '' if event['amount'] is None else (
+                f" - {event['amount']} pts" if event['section'] == 'Loyalty' else f" - ${event['amount']:.2f}")
+            self.history_text.insert('end',
+                f"{(event['event_date'] or '')[:16]}  [{event['section']}] {event['title']}{amount}\n")
+        if not page['rows']:
+            self.history_text.insert('end', "No activity found.\n")
+        elif self.history_next:
+            self.history_text.insert('end', "\nMore activity: press Older Activity.\n")
     
     def add_points(self):
-        """Add loyalty points to customer"""
-        phone = self.loyalty_phone_entry.get()
-        points = int(self.points_entry.get())
-        
-        db.execute(
-            """UPDATE customers 
-               SET loyalty_points = loyalty_points + ?
-               WHERE phone = ?""",
-            (points, phone)
-        )
+        """Add (or redeem, if negative) loyalty points for a customer"""
+        try:
+            customer_service.adjust_points(self.loyalty_phone_entry.get(), int(self.points_entry.get()))
+        except ValueError:
+            messagebox.showerror("Loyalty", "Points must be a whole number")
+            return
+        except (CustomerError, PaymentError) as e:
+            messagebox.showerror("Loyalty", str(e))
+            return
         
         self.points_entry.delete(0, 'end')
         self.view_customer_info()
     
     def add_to_wallet(self):
-        """Add money to customer wallet"""
-        phone = self.loyalty_phone_entry.get()
-        amount = float(self.wallet_entry.get())
-        
-        db.execute(
-            """UPDATE customers 
-               SET wallet_balance = wallet_balance + ?
-               WHERE phone = ?""",
-            (amount, phone)
-        )
+        """Add money to (or withdraw, if negative, from) a customer wallet"""
+        try:
+            customer_service.adjust_wallet(self.loyalty_phone_entry.get(), float(self.wallet_entry.get()))
+        except ValueError:
+            messagebox.showerror("Wallet", "Amount must be a number")
+            return
+        except (CustomerError, PaymentError) as e:
+            messagebox.showerror("Wallet", str(e))
+            return
         
         self.wallet_entry.delete(0, 'end')
         self.view_customer_info()
@@ -274,7 +276,7 @@ class CustomerSection:
     def view_customer_info(self):
         """View customer loyalty and wallet info"""
         phone = self.loyalty_phone_entry.get()
-        customer = db.fetchone("SELECT * FROM customers WHERE phone = ?", (phone,))
+        customer = customer_service.find(phone)
         
         if not customer:
             self.loyalty_text.delete('1.0', 'end')
@@ -288,6 +290,14 @@ class CustomerSection:
         self.loyalty_text.insert('end', f"Wallet Balance: ${customer['wallet_balance']:.2f}\n")
         self.loyalty_text.insert('end', f"Total Spent: ${customer['total_spent']:.2f}\n")
         self.loyalty_text.insert('end', f"Last Visit: {customer['last_visit_date'] or 'Never'}\n")
+        
+        # Recent ledger movements
+        self.loyalty_text.insert('end', "\nRecent Wallet Activity:\n")
+        for row in payment_ledger.wallet_history(customer['id'], limit=5):
+            self.loyalty_text.insert('end', f"  {row['transaction_date']}: {row['amount']:+.2f} ({row['description']})\n")
+        self.loyalty_text.insert('end', "\nRecent Points Activity:\n")
+        for row in payment_ledger.points_history(customer['id'], limit=5):
+            self.loyalty_text.insert('end', f"  {row['transaction_date']}: {row['points']:+d} ({row['description']})\n")
     
     def get_frame(self):
         """Return the main frame"""
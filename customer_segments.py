@@ -0,0 +1,108 @@
+"""
+Customer Segments Module
+RFM (recency, frequency, monetary) scores and segment labels for every
+customer with paid invoices, kept in customer_rfm and refreshed only for
+customers whose invoices changed
+"""
+from datetime import datetime
+
+from database import db
+from archive import ArchiveManager, archive_manager
+from app_logger import log_info
+
+TIME_FORMAT = '%Y-%m-%d %H:%M:%S'
+
+# Segment label -> condition on the 1-5 scores r, f and m; the first match wins
+RFM_SEGMENTS = (
+    ('Champions', 'r >= 4 AND f >= 4 AND m >= 4'),
+    ('Loyal', 'r >= 3 AND f >= 3'),
+    ('New', 'r >= 4 AND f <= 2'),
+    ('Promising', 'r >= 3'),
+    ('At risk', 'f >= 3'),
+    ('Hibernating', 'r = 2'),
+    ('Lost', '1'),
+)
+
+SEGMENT_NAMES = tuple(name for name, condition in RFM_SEGMENTS)
+
+def quintile(column):
+    """SQL for a 1-5 score by percent rank over all scored customers; equal values share a score"""
+    return f"1 + MIN(4, CAST(PERCENT_RANK() OVER (ORDER BY {column}) * 5 AS INTEGER))"
+
+class RfmScorer:
+    """RFM scoring over customer_rfm
+    
+    Triggers on invoices mark a customer's row dirty; refresh() recomputes
+    last purchase, paid invoice count and paid total for the dirty rows
+    only (reading archived invoices too), then ranks every row again with
+    window functions and labels it from RFM_SEGMENTS. Recency is ranked by
+    the last purchase date, so scores only move when invoices do and the
+    job has nothing to do on a quiet day. Counts and lists read the stored
+    labels.
+    """
+    def __init__(self, database=None):
+        self.db = database or db
+        self.archive = ArchiveManager(self.db) if database else archive_manager
+    
+    def refresh(self, when=None):
+        """Rescore after invoice changes; returns the number of customers recomputed"""
+        scored_at = (when or datetime.now()).strftime(TIME_FORMAT)
+        invoices = self.archive.table_for('invoices')
+        segment = "CASE " + ' '.join(f"WHEN {condition} THEN '{name}'" for name, condition in RFM_SEGMENTS) + " END"
+        with self.db.transaction() as cursor:
+            changed = cursor.execute(
+                f"""UPDATE customer_rfm SET (last_purchase, frequency, monetary) = (
+                        SELECT MAX(invoice_date), COUNT(*), COALESCE(SUM(final_amount), 0)
+                        FROM {invoices} WHERE customer_id = customer_rfm.customer_id AND is_paid = 1
+                    ), dirty = 0
+                    WHERE dirty = 1"""
+            ).rowcount
+            if not changed:
+                return 0
+            cursor.execute("DELETE FROM customer_rfm WHERE frequency = 0")
+            cursor.execute(
+                f"""UPDATE customer_rfm SET recency_score = ranked.r, frequency_score = ranked.f,
+                           monetary_score = ranked.m, segment = ranked.segment, scored_at = ?
+                    FROM (
+                        SELECT customer_id, r, f, m, {segment} as segment
+                        FROM (SELECT customer_id, {quintile('last_purchase')} as r, {quintile('frequency')} as f,
+                                     {quintile('monetary')} as m
+                              FROM customer_rfm)
+                    ) ranked
+                    WHERE ranked.customer_id = customer_rfm.customer_id""",
+                (scored_at,)
+            )
+        log_info(f"RFM scores refreshed for {changed} customer(s)")
+        return changed
+    
+    def counts(self):
+        """{segment: customers} in RFM_SEGMENTS order, with empty segments"""
+        counts = dict.fromkeys(SEGMENT_NAMES, 0)
+        for row in self.db.fetchall("SELECT segment, COUNT(*) as count FROM customer_rfm GROUP BY segment"):
+            if row['segment'] in counts:
+                counts[row['segment']] = row['count']
+        return counts
+    
+    def average_monetary(self):
+        """Average paid total of the scored customers, 0 before any are scored"""
+        return self.db.fetchone("SELECT COALESCE(AVG(monetary), 0) as average FROM customer_rfm")['average']
+    
+    def customers(self, segment, today=None):
+        """Customers of a segment with their scores and days since their last purchase, best first"""
+        today = (today or datetime.now()).strftime('%Y-%m-%d')
+        return self.db.fetchall(
+            """SELECT c.*, r.recency_score, r.frequency_score, r.monetary_score, r.segment,
+                      r.frequency, r.monetary,
+                      CAST(julianday(?) - julianday(DATE(r.last_purchase)) AS INTEGER) as recency_days
+               FROM customer_rfm r JOIN customers c ON c.id = r.customer_id
+               WHERE r.segment = ?
+               ORDER BY r.monetary DESC, c.id""",
+            (today, segment)
+        )
+    
+    def score(self, customer_id):
+        """A customer's customer_rfm row, or None before their first paid invoice"""
+        return self.db.fetchone("SELECT * FROM customer_rfm WHERE customer_id = ?", (customer_id,))
+
+# Global RFM scorer instance
+rfm_scorer = RfmScorer()
@@ -0,0 +1,133 @@
+"""
+Customer Timeline Module
+One newest-first stream of everything a customer did: salon services,
+cafe orders, gaming sessions, invoices, card payments, wallet and loyalty
+movements and SMS messages
+"""
+from database import db
+from archive import ArchiveManager, archive_manager
+
+PAGE_SIZE = 30
+
+# Section -> (date column, id column, SELECT of event_date, section, ref_id,
+# title and amount for one customer). Sections are compared as strings to
+# break ties between events with the same date. Archived tables are written
+# as {table} and replaced by ArchiveManager.table_for().
+TIMELINE_SOURCES = {
+    'Salon': ('s.service_date', 's.id', """
+        SELECT s.service_date as event_date, 'Salon' as section, s.id as ref_id,
+               COALESCE(sv.name, 'Salon service') as title, s.price as amount
+        FROM salon_service_records s LEFT JOIN salon_services sv ON sv.id = s.service_id
+        WHERE s.customer_id = :customer"""),
+    'Cafe': ('o.order_date', 'o.id', """
+        SELECT o.order_date as event_date, 'Cafe' as section, o.id as ref_id,
+               'Cafe order #' || o.id as title, o.total_amount as amount
+        FROM cafe_orders o
+        WHERE o.customer_id = :customer"""),
+    'Gamnet': ('g.start_time', 'g.id', """
+        SELECT g.start_time as event_date, 'Gamnet' as section, g.id as ref_id,
+               COALESCE(d.device_number, 'Device') || CASE WHEN g.end_time IS NULL THEN ' (running)'
+                   ELSE ' - ' || COALESCE(g.duration_minutes, 0) || ' min' END as title,
+               g.charge as amount
+        FROM {gamnet_sessions} g LEFT JOIN gamnet_devices d ON d.id = g.device_id
+        WHERE g.customer_id = :customer"""),
+    'Invoices': ('i.invoice_date', 'i.id', """
+        SELECT i.invoice_date as event_date, 'Invoices' as section, i.id as ref_id,
+               'Invoice #' || i.id || CASE WHEN i.is_paid = 1 THEN ' (paid)' ELSE ' (unpaid)' END as title,
+               i.final_amount as amount
+        FROM {invoices} i
+        WHERE i.customer_id = :customer"""),
+    'Payments': ('p.transaction_date', 'p.id', """
+        SELECT p.transaction_date as event_date, 'Payments' as section, p.id as ref_id,
+               'Card ' || COALESCE(p.status, '') || ' for invoice #' || p.invoice_id as title, p.amount as amount
+        FROM payment_transactions p JOIN {invoices} pi ON pi.id = p.invoice_id
+        WHERE pi.customer_id = :customer"""),
+    'Wallet': ('w.transaction_date', 'w.id', """
+        SELECT w.transaction_date as event_date, 'Wallet' as section, w.id as ref_id,
+               COALESCE(w.description, w.transaction_type) as title, w.amount as amount
+        FROM wallet_transactions w
+        WHERE w.customer_id = :customer"""),
+    'Loyalty': ('l.transaction_date', 'l.id', """
+        SELECT l.transaction_date as event_date, 'Loyalty' as section, l.id as ref_id,
+               COALESCE(l.description, l.transaction_type) as title, l.points as amount
+        FROM loyalty_transactions l
+        WHERE l.customer_id = :customer"""),
+    'SMS': ('m.sent_date', 'm.id', """
+        SELECT m.sent_date as event_date, 'SMS' as section, m.id as ref_id,
+               COALESCE(m.sms_type, 'SMS') || ': ' || COALESCE(m.message, '') as title, NULL as amount
+        FROM {sms_history} m
+        WHERE m.customer_id = :customer"""),
+}
+
+# customer_activity_totals sections shown in the history header
+SUMMARY_SECTIONS = ('Salon', 'Cafe', 'Gamnet', 'Invoices')
+
+class CustomerTimeline:
+    """Paged customer history across all sections
+    
+    Every source is read newest-first from a (customer_id, date) index,
+    limited to one page, and the pages are merged by a single UNION ALL
+    query, so a page costs the same however long the history is. Pages
+    are continued from the (event_date, section, ref_id) of the last row.
+    Once history has been archived, invoices, sessions and SMS are read
+    through the archive views.
+    """
+    def __init__(self, database=None):
+        self.db = database or db
+        self.archive = ArchiveManager(self.db) if database else archive_manager
+    
+    def query(self, customer_id, after=None, limit=PAGE_SIZE, sections=None):
+        """(sql, params) of one timeline page; exposed for query plan checks"""
+        params = {'customer': customer_id, 'limit': limit}
+        tables = {table: self.archive.table_for(table) for table in ArchiveManager.ARCHIVE_SOURCES}
+        branches = []
+        for section, (date_column, id_column, select) in TIMELINE_SOURCES.items():
+            if sections and section not in sections:
+                continue
+            condition = ''
+            if after:
+                params.update(after_date=after[0], after_id=after[2])
+                # Rows ordered after the cursor on (date, section, id) descending
+                if section == after[1]:
+                    condition = f" AND ({date_column}, {id_column}) < (:after_date, :after_id)"
+                elif section < after[1]:
+                    condition = f" AND {date_column} <= :after_date"
+                else:
+                    condition = f" AND {date_column} < :after_date"
+            branches.append(
+                f"SELECT * FROM ({select.format(**tables)}{condition}\n"
+                f"        ORDER BY {date_column} DESC, {id_column} DESC LIMIT :limit)"
+            )
+        if not branches:
+            raise ValueError("No timeline sections selected")
+        sql = ("\nUNION ALL\n".join(branches)
+               + "\nORDER BY event_date DESC, section DESC, ref_id DESC LIMIT :limit")
+        return sql, params
+    
+    def page(self, customer_id, after=None, limit=PAGE_SIZE, sections=None):
+        """One page of a customer's timeline
+        
+        sections limits the stream to some of TIMELINE_SOURCES. Returns
+        {'rows': [...], 'next': key or None}; pass 'next' as `after` to
+        fetch the following page.
+        """
+        sql, params = self.query(customer_id, after, limit + 1, sections)
+        rows = [dict(row) for row in self.db.fetchall(sql, params)]
+        has_more = len(rows) > limit
+        rows = rows[:limit]
+        next_key = (rows[-1]['event_date'], rows[-1]['section'], rows[-1]['ref_id']) if has_more else None
+        return {'rows': rows, 'next': next_key}
+    
+    def summary(self, customer_id):
+        """Visits and spend per section from the trigger-maintained totals"""
+        totals = {section: {'visits': 0, 'spend': 0.0} for section in SUMMARY_SECTIONS}
+        rows = self.db.fetchall(
+            "SELECT section, visits, spend FROM customer_activity_totals WHERE customer_id = ?",
+            (customer_id,)
+        )
+        for row in rows:
+            totals[row['section']] = {'visits': row['visits'], 'spend': row['spend']}
+        return totals
+
+# Global customer timeline instance
+customer_timeline = CustomerTimeline()
@@ -3,17 +3,39 @@ Database module for Kagan Collection Management Software
 Handles all database operations and schema creation
 """
 import sqlite3
+import threading
+from contextlib import contextmanager
 from datetime import datetime
 import os
+from urllib.request import pathname2url
 
 DATABASE_PATH = os.path.join(os.path.dirname(__file__), 'kagan.db')
 
+# RAISE message of the closed-day lock triggers; Database turns errors carrying it into DayClosedError
+DAY_CLOSED = 'Day is closed'
+
+class DayClosedError(sqlite3.IntegrityError):
+    """Raised when a write touches a day locked by its Z-report"""
+
 class Database:
-    def __init__(self):
-        self.conn = sqlite3.connect(DATABASE_PATH, check_same_thread=False)
+    def __init__(self, db_path=None, read_only=False):
+        self.path = db_path or DATABASE_PATH
+        self.read_only = read_only
+        if read_only:
+            # Extra reader connections (the API server's pool) never write
+            # and expect the schema to exist already
+            uri = 'file:' + pathname2url(os.path.abspath(self.path)) + '?mode=ro'
+            self.conn = sqlite3.connect(uri, uri=True, check_same_thread=False)
+        else:
+            self.conn = sqlite3.connect(self.path, check_same_thread=False)
         self.conn.row_factory = sqlite3.Row
         self.cursor = self.conn.cursor()
-        self.create_tables()
+        # Background services (telemetry listener, schedulers) share this
+        # connection with the UI thread, so statements are serialised.
+        self.lock = threading.RLock()
+        self._transaction_depth = 0
+        if not read_only:
+            self.create_tables()
     
     def create_tables(self):
         """Create all necessary database tables"""
@@ -60,10 +82,15 @@ class Database:
                 service_type TEXT,
                 status TEXT DEFAULT 'pending',
                 notes TEXT,
+                service_id INTEGER,
+                duration_minutes INTEGER,
                 FOREIGN KEY (customer_id) REFERENCES customers(id),
-                FOREIGN KEY (stylist_id) REFERENCES employees(id)
+                FOREIGN KEY (stylist_id) REFERENCES employees(id),
+                FOREIGN KEY (service_id) REFERENCES salon_services(id)
             )
         ''')
+        self._add_column_if_missing('salon_appointments', 'service_id', 'INTEGER')
+        self._add_column_if_missing('salon_appointments', 'duration_minutes', 'INTEGER')
         
         # Salon services
         self.cursor.execute('''
@@ -143,9 +170,11 @@ class Database:
                 device_type TEXT,
                 hourly_rate REAL NOT NULL,
                 is_available INTEGER DEFAULT 1,
-                status TEXT DEFAULT 'available'
+                status TEXT DEFAULT 'available',
+                last_heartbeat TEXT
             )
         ''')
+        self._add_column_if_missing('gamnet_devices', 'last_heartbeat', 'TEXT')
         
         # Gamnet sessions
         self.cursor.execute('''
@@ -190,9 +219,11 @@ class Database:
                 payment_method TEXT,
                 campaign_code TEXT,
                 is_paid INTEGER DEFAULT 0,
+                tax_amount REAL DEFAULT 0,
                 FOREIGN KEY (customer_id) REFERENCES customers(id)
             )
         ''')
+        self._add_column_if_missing('invoices', 'tax_amount', 'REAL DEFAULT 0')
         
         # Campaigns
         self.cursor.execute('''
@@ -401,9 +432,11 @@ class Database:
                 backup_path TEXT,
                 backup_size INTEGER,
                 status TEXT,
-                notes TEXT
+                notes TEXT,
+                checksum TEXT
             )
         ''')
+        self._add_column_if_missing('backup_history', 'checksum', 'TEXT')
         
         # Payment gateway transactions
         self.cursor.execute('''
@@ -416,27 +449,657 @@ class Database:
                 status TEXT,
                 transaction_date TEXT,
                 notes TEXT,
+                idempotency_key TEXT,
+                updated_at TEXT,
+                FOREIGN KEY (invoice_id) REFERENCES invoices(id)
+            )
+        ''')
+        self._add_column_if_missing('payment_transactions', 'idempotency_key', 'TEXT')
+        self._add_column_if_missing('payment_transactions', 'updated_at', 'TEXT')
+        
+        # Per-employee, per-month commission and service totals
+        balances_exist = self.cursor.execute(
+            "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'employee_commission_balances'"
+        ).fetchone()
+        self.cursor.execute('''
+            CREATE TABLE IF NOT EXISTS employee_commission_balances (
+                employee_id INTEGER NOT NULL,
+                period TEXT NOT NULL,
+                commission_earned REAL DEFAULT 0,
+                commission_paid REAL DEFAULT 0,
+                service_count INTEGER DEFAULT 0,
+                service_revenue REAL DEFAULT 0,
+                rating_total INTEGER DEFAULT 0,
+                rating_count INTEGER DEFAULT 0,
+                PRIMARY KEY (employee_id, period),
+                FOREIGN KEY (employee_id) REFERENCES employees(id)
+            )
+        ''')
+        self.create_balance_triggers()
+        if not balances_exist:
+            self.rebuild_commission_balances()
+        
+        # Wallet ledger; customers.wallet_balance is the running total
+        wallet_ledger_exists = self.cursor.execute(
+            "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'wallet_transactions'"
+        ).fetchone()
+        self.cursor.execute('''
+            CREATE TABLE IF NOT EXISTS wallet_transactions (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                customer_id INTEGER NOT NULL,
+                transaction_type TEXT,
+                amount REAL NOT NULL,
+                description TEXT,
+                transaction_date TEXT,
+                invoice_id INTEGER,
+                FOREIGN KEY (customer_id) REFERENCES customers(id),
                 FOREIGN KEY (invoice_id) REFERENCES invoices(id)
             )
         ''')
+        if not wallet_ledger_exists:
+            self.open_customer_ledgers()
+        
+        # Single-use campaign vouchers
+        self.cursor.execute('''
+            CREATE TABLE IF NOT EXISTS campaign_vouchers (
+                code TEXT PRIMARY KEY,
+                campaign_id INTEGER NOT NULL,
+                issued_at TEXT,
+                redeemed_at TEXT,
+                invoice_id INTEGER,
+                customer_id INTEGER,
+                FOREIGN KEY (campaign_id) REFERENCES campaigns(id),
+                FOREIGN KEY (invoice_id) REFERENCES invoices(id),
+                FOREIGN KEY (customer_id) REFERENCES customers(id)
+            )
+        ''')
+        
+        # Cafe recipes (ingredients used per unit of a menu item)
+        self.cursor.execute('''
+            CREATE TABLE IF NOT EXISTS cafe_recipes (
+                menu_item_id INTEGER NOT NULL,
+                inventory_item_id INTEGER NOT NULL,
+                quantity REAL NOT NULL,
+                PRIMARY KEY (menu_item_id, inventory_item_id),
+                FOREIGN KEY (menu_item_id) REFERENCES cafe_menu(id),
+                FOREIGN KEY (inventory_item_id) REFERENCES inventory_items(id)
+            )
+        ''')
+        
+        # End-of-day closings (Z-reports); rows are never changed once written
+        self.cursor.execute('''
+            CREATE TABLE IF NOT EXISTS day_closings (
+                close_date TEXT PRIMARY KEY,
+                closed_at TEXT NOT NULL,
+                closed_by TEXT,
+                invoice_count INTEGER DEFAULT 0,
+                revenue REAL DEFAULT 0,
+                totals TEXT NOT NULL
+            )
+        ''')
+        self.create_day_lock_triggers()
+        
+        # Per-customer visit and spend totals for each section
+        activity_totals_exist = self.cursor.execute(
+            "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'customer_activity_totals'"
+        ).fetchone()
+        self.cursor.execute('''
+            CREATE TABLE IF NOT EXISTS customer_activity_totals (
+                customer_id INTEGER NOT NULL,
+                section TEXT NOT NULL,
+                visits INTEGER DEFAULT 0,
+                spend REAL DEFAULT 0,
+                PRIMARY KEY (customer_id, section),
+                FOREIGN KEY (customer_id) REFERENCES customers(id)
+            )
+        ''')
+        self.create_activity_triggers()
+        if not activity_totals_exist:
+            self.rebuild_activity_totals()
+        
+        # Customer name search (rowid is the customer id); needs SQLite FTS5
+        self.name_search = self.create_customer_search_index()
+        
+        # Search over customers, menu, services, inventory, suppliers, employees and invoices
+        self.search_index = self.name_search
+        if self.search_index:
+            self.create_global_search_index()
+
+        # Terminal sync (terminal_sync.py): this node's name, the change log
+        # its triggers write, ids of rows that came from peers, and progress
+        self.cursor.execute('''
+            CREATE TABLE IF NOT EXISTS sync_state (
+                id INTEGER PRIMARY KEY CHECK (id = 1),
+                node TEXT NOT NULL,
+                upstream TEXT,
+                applying_origin TEXT,
+                applying_at TEXT
+            )
+        ''')
+        self.cursor.execute('''
+            CREATE TABLE IF NOT EXISTS sync_log (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                table_name TEXT NOT NULL,
+                row_key TEXT NOT NULL,
+                op TEXT NOT NULL,
+                old_row TEXT,
+                new_row TEXT,
+                origin TEXT NOT NULL,
+                changed_at TEXT NOT NULL
+            )
+        ''')
+        self.cursor.execute('''
+            CREATE TABLE IF NOT EXISTS sync_ids (
+                table_name TEXT NOT NULL,
+                peer TEXT NOT NULL,
+                peer_id INTEGER NOT NULL,
+                local_id INTEGER NOT NULL,
+                announced INTEGER DEFAULT 0,
+                PRIMARY KEY (table_name, peer, peer_id)
+            )
+        ''')
+        self.cursor.execute('''
+            CREATE TABLE IF NOT EXISTS sync_peers (
+                peer TEXT PRIMARY KEY,
+                pushed_through INTEGER DEFAULT 0,
+                pulled_through INTEGER DEFAULT 0,
+                applied_through INTEGER DEFAULT 0,
+                last_sync TEXT
+            )
+        ''')
+        self.cursor.execute('''
+            CREATE TABLE IF NOT EXISTS sync_conflicts (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                peer TEXT,
+                table_name TEXT,
+                row_key TEXT,
+                op TEXT,
+                reason TEXT,
+                change TEXT,
+                occurred_at TEXT
+            )
+        ''')
+        self.cursor.execute(
+            "CREATE INDEX IF NOT EXISTS idx_sync_log_row ON sync_log(table_name, row_key)"
+        )
+        self.cursor.execute(
+            "CREATE INDEX IF NOT EXISTS idx_sync_log_origin ON sync_log(origin, id)"
+        )
+        
+        # RFM scores per customer with paid invoices; dirty rows are rescored by customer_segments.py
+        rfm_exists = self.cursor.execute(
+            "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'customer_rfm'"
+        ).fetchone()
+        self.cursor.execute('''
+            CREATE TABLE IF NOT EXISTS customer_rfm (
+                customer_id INTEGER PRIMARY KEY,
+                last_purchase TEXT,
+                frequency INTEGER DEFAULT 0,
+                monetary REAL DEFAULT 0,
+                recency_score INTEGER,
+                frequency_score INTEGER,
+                monetary_score INTEGER,
+                segment TEXT,
+                scored_at TEXT,
+                dirty INTEGER DEFAULT 1,
+                FOREIGN KEY (customer_id) REFERENCES customers(id)
+            )
+        ''')
+        self.cursor.execute(
+            "CREATE INDEX IF NOT EXISTS idx_customer_rfm_segment ON customer_rfm(segment)"
+        )
+        self.cursor.execute(
+            "CREATE INDEX IF NOT EXISTS idx_customer_rfm_dirty ON customer_rfm(dirty)"
+        )
+        self.create_rfm_triggers()
+        if not rfm_exists:
+            self.cursor.execute(
+                "INSERT INTO customer_rfm (customer_id) SELECT DISTINCT customer_id FROM invoices WHERE customer_id IS NOT NULL"
+            )
+        
+        # Salon schedule versions: bumped by triggers whenever a day's appointments change
+        self.cursor.execute('''
+            CREATE TABLE IF NOT EXISTS salon_schedule_versions (
+                appointment_date TEXT PRIMARY KEY,
+                version INTEGER NOT NULL DEFAULT 0
+            )
+        ''')
+        self.create_schedule_triggers()
+
+        # Indexes
+        self.cursor.execute(
+            "CREATE INDEX IF NOT EXISTS idx_gamnet_sessions_open ON gamnet_sessions(device_id, end_time)"
+        )
+        self.cursor.execute(
+            "CREATE INDEX IF NOT EXISTS idx_salon_appointments_day ON salon_appointments(appointment_date, stylist_id)"
+        )
+        self.cursor.execute(
+            "CREATE INDEX IF NOT EXISTS idx_cafe_order_items_order ON cafe_order_items(order_id)"
+        )
+        # Unbilled rows per customer at checkout, and section revenue by invoice
+        for table in ('salon_service_records', 'cafe_orders', 'gamnet_sessions'):
+            self.cursor.execute(
+                f"CREATE INDEX IF NOT EXISTS idx_{table}_unbilled ON {table}(customer_id, invoice_id)"
+            )
+            self.cursor.execute(
+                f"CREATE INDEX IF NOT EXISTS idx_{table}_invoice ON {table}(invoice_id)"
+            )
+        self.cursor.execute(
+            "CREATE INDEX IF NOT EXISTS idx_invoices_date ON invoices(invoice_date)"
+        )
+        # Invoice search: each filter's index also yields newest-first order
+        for name, column in (('customer', 'customer_id'), ('method', 'payment_method'),
+                             ('campaign', 'campaign_code'), ('paid', 'is_paid')):
+            self.cursor.execute(
+                f"CREATE INDEX IF NOT EXISTS idx_invoices_{name}_date ON invoices({column}, invoice_date)"
+            )
+        # Invoice search by amount range, sorted by date afterwards
+        self.cursor.execute(
+            "CREATE INDEX IF NOT EXISTS idx_invoices_amount_date ON invoices(final_amount, invoice_date)"
+        )
+        # Daily totals by activity date
+        for table, column in (('salon_service_records', 'service_date'), ('cafe_orders', 'order_date'),
+                              ('gamnet_sessions', 'start_time')):
+            self.cursor.execute(
+                f"CREATE INDEX IF NOT EXISTS idx_{table}_{column} ON {table}({column})"
+            )
+        # Customer timeline: each source in newest-first order per customer
+        for table, column in (('salon_service_records', 'service_date'), ('cafe_orders', 'order_date'),
+                              ('gamnet_sessions', 'start_time'), ('wallet_transactions', 'transaction_date'),
+                              ('loyalty_transactions', 'transaction_date'), ('sms_history', 'sent_date')):
+            self.cursor.execute(
+                f"CREATE INDEX IF NOT EXISTS idx_{table}_customer_date ON {table}(customer_id, {column})"
+            )
+        self.cursor.execute(
+            "CREATE INDEX IF NOT EXISTS idx_payment_transactions_invoice ON payment_transactions(invoice_id)"
+        )
+        self.cursor.execute(
+            "CREATE INDEX IF NOT EXISTS idx_wallet_transactions_customer ON wallet_transactions(customer_id)"
+        )
+        self.cursor.execute(
+            "CREATE INDEX IF NOT EXISTS idx_campaign_vouchers_campaign ON campaign_vouchers(campaign_id, redeemed_at)"
+        )
+        self.cursor.execute(
+            "CREATE INDEX IF NOT EXISTS idx_loyalty_transactions_customer ON loyalty_transactions(customer_id)"
+        )
+        self.cursor.execute(
+            "CREATE UNIQUE INDEX IF NOT EXISTS idx_payment_transactions_key ON payment_transactions(idempotency_key)"
+        )
+        self.cursor.execute(
+            "CREATE INDEX IF NOT EXISTS idx_payment_transactions_status ON payment_transactions(status, invoice_id)"
+        )
         
         self.conn.commit()
     
+    # Column deltas applied to employee_commission_balances for each source row
+    BALANCE_SOURCES = {
+        'employee_commissions': ('employee_id', 'service_date', {
+            'commission_earned': 'COALESCE({row}.amount, 0)',
+            'commission_paid': 'CASE WHEN {row}.is_paid THEN COALESCE({row}.amount, 0) ELSE 0 END',
+        }),
+        'salon_service_records': ('stylist_id', 'service_date', {
+            'service_count': '1',
+            'service_revenue': 'COALESCE({row}.price, 0)',
+            'rating_total': 'COALESCE({row}.rating, 0)',
+            'rating_count': 'CASE WHEN {row}.rating IS NULL THEN 0 ELSE 1 END',
+        }),
+    }
+    
+    def _balance_upsert(self, table, row, sign):
+        """SQL adding (sign=1) or removing (sign=-1) one row's share of a balance"""
+        employee_col, date_col, deltas = self.BALANCE_SOURCES[table]
+        columns = ', '.join(deltas)
+        values = ', '.join(f"{sign} * ({expr.format(row=row)})" for expr in deltas.values())
+        updates = ', '.join(f"{col} = {col} + excluded.{col}" for col in deltas)
+        return f"""
+            INSERT INTO employee_commission_balances (employee_id, period, {columns})
+            SELECT {row}.{employee_col}, COALESCE(substr({row}.{date_col}, 1, 7), ''), {values}
+            WHERE {row}.{employee_col} IS NOT NULL
+            ON CONFLICT(employee_id, period) DO UPDATE SET {updates};"""
+    
+    def create_balance_triggers(self):
+        """Keep employee_commission_balances in step with its source tables"""
+        for table in self.BALANCE_SOURCES:
+            self.cursor.execute(f"""
+                CREATE TRIGGER IF NOT EXISTS trg_{table}_balance_insert
+                AFTER INSERT ON {table}
+                BEGIN {self._balance_upsert(table, 'NEW', 1)}
+                END""")
+            self.cursor.execute(f"""
+                CREATE TRIGGER IF NOT EXISTS trg_{table}_balance_delete
+                AFTER DELETE ON {table}
+                BEGIN {self._balance_upsert(table, 'OLD', -1)}
+                END""")
+            self.cursor.execute(f"""
+                CREATE TRIGGER IF NOT EXISTS trg_{table}_balance_update
+                AFTER UPDATE ON {table}
+                BEGIN {self._balance_upsert(table, 'OLD', -1)} {self._balance_upsert(table, 'NEW', 1)}
+                END""")
+    
+    # Table -> (customer_activity_totals section, amount column)
+    ACTIVITY_SOURCES = {
+        'salon_service_records': ('Salon', 'price'),
+        'cafe_orders': ('Cafe', 'total_amount'),
+        'gamnet_sessions': ('Gamnet', 'charge'),
+        'invoices': ('Invoices', 'final_amount'),
+    }
+    
+    def _activity_upsert(self, table, row, sign):
+        """SQL adding (sign=1) or removing (sign=-1) one row's visit and spend"""
+        section, amount = self.ACTIVITY_SOURCES[table]
+        return f"""
+            INSERT INTO customer_activity_totals (customer_id, section, visits, spend)
+            SELECT {row}.customer_id, '{section}', {sign}, {sign} * COALESCE({row}.{amount}, 0)
+            WHERE {row}.customer_id IS NOT NULL
+            ON CONFLICT(customer_id, section) DO UPDATE SET
+                visits = visits + excluded.visits, spend = spend + excluded.spend;"""
+    
+    def create_activity_triggers(self):
+        """Keep customer_activity_totals in step with its source tables"""
+        for table, (section, amount) in self.ACTIVITY_SOURCES.items():
+            self.cursor.execute(f"""
+                CREATE TRIGGER IF NOT EXISTS trg_{table}_activity_insert
+                AFTER INSERT ON {table}
+                BEGIN {self._activity_upsert(table, 'NEW', 1)}
+                END""")
+            self.cursor.execute(f"""
+                CREATE TRIGGER IF NOT EXISTS trg_{table}_activity_delete
+                AFTER DELETE ON {table}
+                BEGIN {self._activity_upsert(table, 'OLD', -1)}
+                END""")
+            self.cursor.execute(f"""
+                CREATE TRIGGER IF NOT EXISTS trg_{table}_activity_update
+                AFTER UPDATE OF customer_id, {amount} ON {table}
+                BEGIN {self._activity_upsert(table, 'OLD', -1)} {self._activity_upsert(table, 'NEW', 1)}
+                END""")
+    
+    def create_rfm_triggers(self):
+        """Mark a customer's RFM row dirty when one of their invoices changes"""
+        def mark(row):
+            return f"""
+                INSERT INTO customer_rfm (customer_id) SELECT {row}.customer_id WHERE {row}.customer_id IS NOT NULL
+                ON CONFLICT(customer_id) DO UPDATE SET dirty = 1;"""
+        for name, event, body in (('insert', 'INSERT', mark('NEW')), ('delete', 'DELETE', mark('OLD')),
+                                  ('update', 'UPDATE OF customer_id, invoice_date, final_amount, is_paid',
+                                   mark('OLD') + mark('NEW'))):
+            self.cursor.execute(f"""
+                CREATE TRIGGER IF NOT EXISTS trg_invoices_rfm_{name}
+                AFTER {event} ON invoices
+                BEGIN {body}
+                END""")
+    
+    def create_schedule_triggers(self):
+        """Bump the version of every appointment date touched, for the scheduler's interval cache"""
+        def bump(row):
+            return f"""
+                INSERT INTO salon_schedule_versions (appointment_date, version)
+                SELECT {row}.appointment_date, 1 WHERE {row}.appointment_date IS NOT NULL
+                ON CONFLICT(appointment_date) DO UPDATE SET version = version + 1;"""
+        for name, event, body in (('insert', 'INSERT', bump('NEW')), ('delete', 'DELETE', bump('OLD')),
+                                  ('update', 'UPDATE OF appointment_date, appointment_time, stylist_id, status, '
+                                             'service_id, service_type, duration_minutes', bump('OLD') + bump('NEW'))):
+            self.cursor.execute(f"""
+                CREATE TRIGGER IF NOT EXISTS trg_salon_appointments_schedule_{name}
+                AFTER {event} ON salon_appointments
+                BEGIN {body}
+                END""")
+    
+    # Arabic letters typed on some keyboards -> the Persian letters stored in names
+    NAME_FOLDS = {'\u064a': '\u06cc', '\u0643': '\u06a9', '\u0649': '\u06cc'}
+    
+    def _folded_name(self, expression):
+        """SQL applying NAME_FOLDS to a name expression"""
+        for source, target in self.NAME_FOLDS.items():
+            expression = f"replace({expression}, '{source}', '{target}')"
+        return expression
+    
+    def create_customer_search_index(self):
+        """Full-text index of customer names kept in step by triggers
+        
+        Returns False when this SQLite build has no FTS5; name search then
+        falls back to LIKE.
+        """
+        index_exists = self.cursor.execute(
+            "SELECT 1 FROM sqlite_master WHERE name = 'customer_name_search'"
+        ).fetchone()
+        try:
+            self.cursor.execute('''
+                CREATE VIRTUAL TABLE IF NOT EXISTS customer_name_search USING fts5(
+                    name, tokenize = 'unicode61 remove_diacritics 2', prefix = '1 2 3'
+                )
+            ''')
+        except sqlite3.OperationalError:
+            return False
+        insert = f"INSERT INTO customer_name_search (rowid, name) VALUES (NEW.id, {self._folded_name('NEW.name')});"
+        delete = "DELETE FROM customer_name_search WHERE rowid = OLD.id;"
+        for name, event, body in (('insert', 'INSERT', insert), ('delete', 'DELETE', delete),
+                                  ('update', 'UPDATE OF name', delete + ' ' + insert)):
+            self.cursor.execute(f"""
+                CREATE TRIGGER IF NOT EXISTS trg_customers_name_search_{name}
+                AFTER {event} ON customers
+                BEGIN {body}
+                END""")
+        if not index_exists:
+            self.cursor.execute(
+                f"INSERT INTO customer_name_search (rowid, name) SELECT id, {self._folded_name('name')} FROM customers"
+            )
+        return True
+    
+    # Table -> (kind stored in the global_search rowid, title, body, columns
+    # that change them). A row's rowid is id * SEARCH_KINDS + kind.
+    SEARCH_KINDS = 8
+    SEARCH_SOURCES = {
+        'customers': (1, '{row}.name', '{row}.phone', 'name, phone'),
+        'cafe_menu': (2, '{row}.name', "COALESCE({row}.category, '') || ' ' || COALESCE({row}.description, '')",
+                      'name, category, description'),
+        'salon_services': (3, '{row}.name', "''", 'name'),
+        'inventory_items': (4, '{row}.name', "COALESCE({row}.sku, '') || ' ' || COALESCE({row}.category, '')",
+                            'name, sku, category'),
+        'suppliers': (5, '{row}.name',
+                      "COALESCE({row}.contact_person, '') || ' ' || COALESCE({row}.phone, '') || ' ' || "
+                      "COALESCE({row}.email, '')", 'name, contact_person, phone, email'),
+        'employees': (6, '{row}.name',
+                      "COALESCE({row}.role, '') || ' ' || COALESCE({row}.section, '') || ' ' || COALESCE({row}.phone, '')",
+                      'name, role, section, phone'),
+        # The customer's name as it was when the invoice was written
+        'invoices': (7, "'#' || {row}.id",
+                     "COALESCE((SELECT name || ' ' || phone FROM customers WHERE id = {row}.customer_id), '') "
+                     "|| ' ' || COALESCE({row}.campaign_code, '')", 'customer_id, campaign_code'),
+    }
+    
+    def create_global_search_index(self):
+        """Full-text index of searchable rows from SEARCH_SOURCES, kept in step by triggers"""
+        index_exists = self.cursor.execute(
+            "SELECT 1 FROM sqlite_master WHERE name = 'global_search'"
+        ).fetchone()
+        self.cursor.execute('''
+            CREATE VIRTUAL TABLE IF NOT EXISTS global_search USING fts5(
+                title, body, tokenize = 'unicode61 remove_diacritics 2', prefix = '1 2 3'
+            )
+        ''')
+        for table, (kind, title, body, columns) in self.SEARCH_SOURCES.items():
+            def values(row):
+                return (f"{row}.id * {self.SEARCH_KINDS} + {kind}, {self._folded_name(title.format(row=row))}, "
+                        f"{self._folded_name(body.format(row=row))}")
+            insert = f"INSERT INTO global_search (rowid, title, body) VALUES ({values('NEW')});"
+            delete = f"DELETE FROM global_search WHERE rowid = OLD.id * {self.SEARCH_KINDS} + {kind};"
+            for name, event, action in (('insert', 'INSERT', insert), ('delete', 'DELETE', delete),
+                                        ('update', f'UPDATE OF {columns}', delete + ' ' + insert)):
+                self.cursor.execute(f"""
+                    CREATE TRIGGER IF NOT EXISTS trg_{table}_global_search_{name}
+                    AFTER {event} ON {table}
+                    BEGIN {action}
+                    END""")
+            if not index_exists:
+                self.cursor.execute(
+                    f"INSERT INTO global_search (rowid, title, body) SELECT {values(table)} FROM {table}"
+                )
+    
+    # Table -> (the row's business day, columns frozen once that day is closed,
+    # extra condition for updates). Linking rows to invoices and settling
+    # invoices stay possible after closing.
+    DAY_LOCKS = {
+        'invoices': ('DATE({row}.invoice_date)',
+                     'customer_id, invoice_date, total_amount, discount_amount, tax_amount, final_amount, campaign_code',
+                     None),
+        'salon_service_records': ('DATE({row}.service_date)',
+                                  'customer_id, stylist_id, service_id, service_date, price, commission', None),
+        'cafe_orders': ('DATE({row}.order_date)', 'customer_id, barista_id, order_date, total_amount, split_count',
+                        None),
+        'cafe_order_items': ('(SELECT DATE(order_date) FROM cafe_orders WHERE id = {row}.order_id)',
+                             'order_id, menu_item_id, quantity, price', None),
+        # Sessions still running at closing time may be ended later
+        'gamnet_sessions': ('DATE({row}.start_time)',
+                            'device_id, customer_id, start_time, end_time, duration_minutes, charge',
+                            'OLD.end_time IS NOT NULL'),
+    }
+    
+    def create_day_lock_triggers(self):
+        """Refuse changes to closed days and to the closing records themselves"""
+        for action in ('UPDATE', 'DELETE'):
+            self.cursor.execute(f"""
+                CREATE TRIGGER IF NOT EXISTS trg_day_closings_no_{action.lower()}
+                BEFORE {action} ON day_closings
+                BEGIN SELECT RAISE(ABORT, 'Day closings cannot be changed'); END""")
+        for table, (day, columns, update_condition) in self.DAY_LOCKS.items():
+            old_day, new_day = day.format(row='OLD'), day.format(row='NEW')
+            old_closed = f"EXISTS (SELECT 1 FROM day_closings WHERE close_date = {old_day})"
+            new_closed = f"EXISTS (SELECT 1 FROM day_closings WHERE close_date = {new_day})"
+            frozen = f"{update_condition} AND {old_closed}" if update_condition else old_closed
+            whens = {
+                'insert': ('INSERT', new_closed),
+                'delete': ('DELETE', old_closed),
+                # A closed day's row, or a row moved into a closed day
+                'update': (f'UPDATE OF {columns}', f"({frozen}) OR ({new_day} IS NOT {old_day} AND {new_closed})"),
+            }
+            for name, (event, when) in whens.items():
+                self.cursor.execute(f"""
+                    CREATE TRIGGER IF NOT EXISTS trg_{table}_day_lock_{name}
+                    BEFORE {event} ON {table}
+                    WHEN {when}
+                    BEGIN SELECT RAISE(ABORT, '{DAY_CLOSED}'); END""")
+    
+    def open_customer_ledgers(self):
+        """Record existing wallet and loyalty balances as opening ledger rows"""
+        today = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+        self.cursor.execute(
+            """INSERT INTO wallet_transactions (customer_id, transaction_type, amount, description, transaction_date)
+               SELECT id, 'opening', wallet_balance, 'Opening balance', ?
+               FROM customers WHERE COALESCE(wallet_balance, 0) != 0""",
+            (today,)
+        )
+        self.cursor.execute(
+            """INSERT INTO loyalty_transactions (customer_id, transaction_type, points, description, transaction_date)
+               SELECT c.id, 'opening', c.loyalty_points - COALESCE(l.points, 0), 'Opening balance', ?
+               FROM customers c
+               LEFT JOIN (SELECT customer_id, SUM(points) as points FROM loyalty_transactions
+                          GROUP BY customer_id) l ON l.customer_id = c.id
+               WHERE COALESCE(c.loyalty_points, 0) != COALESCE(l.points, 0)""",
+            (today,)
+        )
+    
+    def rebuild_commission_balances(self):
+        """Recompute employee_commission_balances from the source tables"""
+        with self.lock:
+            self.cursor.execute("DELETE FROM employee_commission_balances")
+            self.cursor.execute("""
+                INSERT INTO employee_commission_balances (employee_id, period, commission_earned, commission_paid)
+                SELECT employee_id, COALESCE(substr(service_date, 1, 7), ''),
+                       SUM(COALESCE(amount, 0)),
+                       SUM(CASE WHEN is_paid THEN COALESCE(amount, 0) ELSE 0 END)
+                FROM employee_commissions
+                WHERE employee_id IS NOT NULL
+                GROUP BY 1, 2""")
+            self.cursor.execute("""
+                INSERT INTO employee_commission_balances
+                    (employee_id, period, service_count, service_revenue, rating_total, rating_count)
+                SELECT stylist_id, COALESCE(substr(service_date, 1, 7), ''),
+                       COUNT(*), SUM(COALESCE(price, 0)), SUM(COALESCE(rating, 0)), COUNT(rating)
+                FROM salon_service_records
+                WHERE stylist_id IS NOT NULL
+                GROUP BY 1, 2
+                ON CONFLICT(employee_id, period) DO UPDATE SET
+                    service_count = excluded.service_count,
+                    service_revenue = excluded.service_revenue,
+                    rating_total = excluded.rating_total,
+                    rating_count = excluded.rating_count""")
+            if not self._transaction_depth:
+                self.conn.commit()
+    
+    def rebuild_activity_totals(self):
+        """Recompute customer_activity_totals from the source tables"""
+        with self.lock:
+            self.cursor.execute("DELETE FROM customer_activity_totals")
+            for table, (section, amount) in self.ACTIVITY_SOURCES.items():
+                self.cursor.execute(f"""
+                    INSERT INTO customer_activity_totals (customer_id, section, visits, spend)
+                    SELECT customer_id, '{section}', COUNT(*), SUM(COALESCE({amount}, 0))
+                    FROM {table}
+                    WHERE customer_id IS NOT NULL
+                    GROUP BY customer_id""")
+            if not self._transaction_depth:
+                self.conn.commit()
+    
+    def _add_column_if_missing(self, table, column, definition):
+        """Add a column to a table created by an older version of the schema"""
+        columns = [row[1] for row in self.cursor.execute(f"PRAGMA table_info({table})")]
+        if column not in columns:
+            self.cursor.execute(f"ALTER TABLE {table} ADD COLUMN {column} {definition}")
+    
     def execute(self, query, params=()):
         """Execute a query"""
-        self.cursor.execute(query, params)
-        self.conn.commit()
-        return self.cursor
+        with self.lock:
+            try:
+                self.cursor.execute(query, params)
+            except sqlite3.IntegrityError as e:
+                raise self._day_closed(e)
+            if not self._transaction_depth:
+                self.conn.commit()
+            return self.cursor
     
     def fetchone(self, query, params=()):
         """Fetch one result"""
-        self.cursor.execute(query, params)
-        return self.cursor.fetchone()
+        with self.lock:
+            self.cursor.execute(query, params)
+            return self.cursor.fetchone()
     
     def fetchall(self, query, params=()):
         """Fetch all results"""
-        self.cursor.execute(query, params)
-        return self.cursor.fetchall()
+        with self.lock:
+            self.cursor.execute(query, params)
+            return self.cursor.fetchall()
+    
+    @contextmanager
+    def transaction(self):
+        """Run several statements atomically; commits on success, rolls back on error.
+        
+        Nested calls join the outermost transaction.
+        """
+        with self.lock:
+            self._transaction_depth += 1
+            try:
+                yield self.cursor
+                if self._transaction_depth == 1:
+                    self.conn.commit()
+            except sqlite3.IntegrityError as e:
+                if self._transaction_depth == 1:
+                    self.conn.rollback()
+                raise self._day_closed(e)
+            except Exception:
+                if self._transaction_depth == 1:
+                    self.conn.rollback()
+                raise
+            finally:
+                self._transaction_depth -= 1
+    
+    @staticmethod
+    def _day_closed(error):
+        """The error to raise for an IntegrityError: DayClosedError when a day lock trigger refused it"""
+        if str(error) == DAY_CLOSED and not isinstance(error, DayClosedError):
+            closed = DayClosedError(DAY_CLOSED)
+            closed.__cause__ = error
+            return closed
+        return error
     
     def close(self):
         """Close database connection"""
@@ -462,6 +1125,7 @@ class Database:
             ('theme', 'dark', 'appearance', 'Application theme'),
             ('language', 'fa', 'appearance', 'Interface language (fa/en)'),
             ('font_family', 'Vazir', 'appearance', 'Font family'),
+            ('business_name', 'Kagan Collection', 'business', 'Name printed on receipts'),
             ('currency', 'Toman', 'business', 'Default currency'),
             ('tax_rate', '9', 'business', 'Tax rate percentage'),
             ('business_hours', '09:00-22:00', 'business', 'Business hours'),
@@ -474,6 +1138,22 @@ class Database:
             ('backup_path', './backups', 'system', 'Database backup directory'),
             ('auto_backup', '1', 'system', 'Enable automatic backups'),
             ('backup_frequency', 'daily', 'system', 'Backup frequency'),
+            ('backup_keep', '10', 'system', 'Number of backups kept'),
+            ('backup_mode', 'incremental', 'system', 'Backup format (incremental/full)'),
+            ('archive_after_days', '365', 'system', 'Days of history kept before archiving'),
+            ('telemetry_enabled', '0', 'gamnet', 'Accept session events from gamnet device agents'),
+            ('telemetry_port', '47810', 'gamnet', 'TCP/UDP port for gamnet device agents'),
+            ('telemetry_idle_minutes', '5', 'gamnet', 'Close sessions after this many minutes without a heartbeat'),
+            ('payment_gateway', 'none', 'payments', 'Card gateway: none, local (stand-in server) or gateway URL'),
+            ('payment_gateway_timeout', '10', 'payments', 'Seconds to wait for a card authorisation'),
+            ('api_server_enabled', '0', 'system', 'Serve the services to other terminals over HTTP/JSON'),
+            ('api_server_host', '127.0.0.1', 'system', 'Address the API server listens on (0.0.0.0 for the LAN)'),
+            ('api_server_port', '47820', 'system', 'Port of the terminal API server'),
+            ('api_token', '', 'system', 'Token terminals send to the API server; needed for writes over the LAN'),
+            ('api_pool_size', '4', 'system', 'Read connections kept open by the API server'),
+            ('sync_upstream_url', '', 'system', 'API server of the main node this terminal syncs with'),
+            ('sync_interval_seconds', '60', 'system', 'Seconds between syncs with the main node'),
+            ('central_db_path', '', 'system', 'Central analytics database of all branches, for branch reports'),
             ('loyalty_points_rate', '1', 'loyalty', 'Points per dollar spent'),
             ('loyalty_redemption_rate', '100', 'loyalty', 'Points needed for $1 discount'),
         ]
@@ -0,0 +1,165 @@
+"""
+Day Close Module
+End-of-day closing: computes the day's totals in one pass, stores them as
+an immutable Z-report and locks the day's transactional rows
+"""
+import json
+from datetime import datetime, timedelta
+
+from database import db
+from app_logger import log_info
+
+# One UNION ALL pass over a [day, next day) range; every part returns
+# (dimension, key, count, amount, discount, tax, extra)
+DAILY_TOTALS_QUERY = """
+    SELECT 'invoices' as dimension, 'all' as key, COUNT(*) as count, SUM(final_amount) as amount,
+           SUM(discount_amount) as discount, SUM(tax_amount) as tax, COUNT(DISTINCT customer_id) as extra
+    FROM invoices WHERE invoice_date >= :day AND invoice_date < :next_day
+    UNION ALL
+    SELECT 'payment_method', CASE WHEN is_paid = 1 THEN COALESCE(payment_method, 'Other') ELSE 'Unpaid' END,
+           COUNT(*), SUM(final_amount), NULL, NULL, NULL
+    FROM invoices WHERE invoice_date >= :day AND invoice_date < :next_day
+    GROUP BY 2
+    UNION ALL
+    SELECT 'campaign', campaign_code, COUNT(*), SUM(final_amount), SUM(discount_amount), NULL, NULL
+    FROM invoices WHERE invoice_date >= :day AND invoice_date < :next_day AND campaign_code IS NOT NULL
+    GROUP BY campaign_code
+    UNION ALL
+    SELECT 'section', 'Salon', COUNT(*), SUM(price), NULL, NULL, NULL
+    FROM salon_service_records WHERE service_date >= :day AND service_date < :next_day
+    UNION ALL
+    SELECT 'section', 'Cafe', COUNT(*), SUM(total_amount), NULL, NULL, NULL
+    FROM cafe_orders WHERE order_date >= :day AND order_date < :next_day
+    UNION ALL
+    SELECT 'section', 'Gamnet', COUNT(*), SUM(charge), NULL, NULL, SUM(duration_minutes)
+    FROM gamnet_sessions WHERE start_time >= :day AND start_time < :next_day AND end_time IS NOT NULL
+    UNION ALL
+    SELECT 'gamnet_open', 'running', COUNT(*), NULL, NULL, NULL, NULL
+    FROM gamnet_sessions WHERE start_time >= :day AND start_time < :next_day AND end_time IS NULL
+    UNION ALL
+    SELECT 'employee', COALESCE(e.name, 'Employee #' || r.stylist_id), COUNT(*), SUM(r.price), NULL, NULL, NULL
+    FROM salon_service_records r LEFT JOIN employees e ON e.id = r.stylist_id
+    WHERE r.service_date >= :day AND r.service_date < :next_day AND r.stylist_id IS NOT NULL
+    GROUP BY r.stylist_id
+    UNION ALL
+    SELECT 'employee', COALESCE(e.name, 'Employee #' || o.barista_id), COUNT(*), SUM(o.total_amount),
+           NULL, NULL, NULL
+    FROM cafe_orders o LEFT JOIN employees e ON e.id = o.barista_id
+    WHERE o.order_date >= :day AND o.order_date < :next_day AND o.barista_id IS NOT NULL
+    GROUP BY o.barista_id"""
+
+class DayCloseError(Exception):
+    """Raised when a day cannot be closed"""
+
+class DayCloser:
+    """Z-reports over the day_closings table
+    
+    A closed day's totals are read back from its single day_closings row;
+    open days are computed live with the same query. Triggers created by
+    Database refuse changes to a closed day's rows and to the closings;
+    Database raises DayClosedError for them, which the services turn into
+    their own errors. Today may be closed before midnight, so later sales
+    dated today are refused the same way.
+    """
+    def __init__(self, database=None):
+        self.db = database or db
+    
+    def compute(self, day, cursor=None):
+        """All of a day's totals from raw rows, as a dict"""
+        next_day = (datetime.strptime(day, '%Y-%m-%d') + timedelta(days=1)).strftime('%Y-%m-%d')
+        params = {'day': day, 'next_day': next_day}
+        if cursor is None:
+            rows = self.db.fetchall(DAILY_TOTALS_QUERY, params)
+        else:
+            rows = cursor.execute(DAILY_TOTALS_QUERY, params).fetchall()
+        
+        totals = {
+            'date': day, 'invoice_count': 0, 'customers': 0, 'billed': 0.0, 'discount': 0.0, 'tax': 0.0,
+            'paid_count': 0, 'revenue': 0.0, 'gamnet_minutes': 0, 'gamnet_running': 0,
+            'sections': {section: {'count': 0, 'amount': 0.0} for section in ('Salon', 'Cafe', 'Gamnet')},
+            'payment_methods': {}, 'campaigns': {}, 'employees': {},
+        }
+        for row in rows:
+            dimension, key, count, amount = row['dimension'], row['key'], row['count'], round(row['amount'] or 0, 2)
+            if dimension == 'invoices':
+                totals.update(invoice_count=count, customers=row['extra'], billed=amount,
+                              discount=round(row['discount'] or 0, 2), tax=round(row['tax'] or 0, 2))
+            elif dimension == 'payment_method':
+                totals['payment_methods'][key] = {'count': count, 'amount': amount}
+                if key != 'Unpaid':
+                    totals['paid_count'] += count
+                    totals['revenue'] = round(totals['revenue'] + amount, 2)
+            elif dimension == 'campaign':
+                totals['campaigns'][key] = {'count': count, 'amount': amount, 'discount': round(row['discount'] or 0, 2)}
+            elif dimension == 'section':
+                totals['sections'][key] = {'count': count, 'amount': amount}
+                if key == 'Gamnet':
+                    totals['gamnet_minutes'] = row['extra'] or 0
+            elif dimension == 'gamnet_open':
+                totals['gamnet_running'] = count
+            elif dimension == 'employee':
+                employee = totals['employees'].setdefault(key, {'count': 0, 'amount': 0.0})
+                employee['count'] += count
+                employee['amount'] = round(employee['amount'] + amount, 2)
+        return totals
+    
+    def get_closing(self, day):
+        """The stored Z-report of a closed day, or None"""
+        row = self.db.fetchone("SELECT * FROM day_closings WHERE close_date = ?", (day,))
+        if not row:
+            return None
+        totals = json.loads(row['totals'])
+        totals.update(closed_at=row['closed_at'], closed_by=row['closed_by'])
+        return totals
+    
+    def daily_summary(self, day=None):
+        """A day's totals: the Z-report if closed, else computed live
+        
+        The result has 'closed_at' (None for open days).
+        """
+        day = day or datetime.now().strftime('%Y-%m-%d')
+        closing = self.get_closing(day)
+        if closing:
+            return closing
+        totals = self.compute(day)
+        totals.update(closed_at=None, closed_by=None)
+        return totals
+    
+    def close_day(self, day=None, closed_by=None, when=None):
+        """Compute and store a day's Z-report, locking the day
+        
+        Returns the stored totals. Raises DayCloseError if the day is
+        already closed or still in the future.
+        """
+        when = when or datetime.now()
+        day = day or when.strftime('%Y-%m-%d')
+        if day > when.strftime('%Y-%m-%d'):
+            raise DayCloseError(f"{day} has not started yet")
+        with self.db.transaction() as cursor:
+            if cursor.execute("SELECT 1 FROM day_closings WHERE close_date = ?", (day,)).fetchone():
+                raise DayCloseError(f"{day} is already closed")
+            totals = self.compute(day, cursor)
+            cursor.execute(
+                """INSERT INTO day_closings (close_date, closed_at, closed_by, invoice_count, revenue, totals)
+                   VALUES (?, ?, ?, ?, ?, ?)""",
+                (day, when.strftime('%Y-%m-%d %H:%M:%S'), closed_by, totals['invoice_count'], totals['revenue'],
+                 json.dumps(totals, ensure_ascii=False, sort_keys=True))
+            )
+        log_info(f"Closed {day}: {totals['invoice_count']} invoices, revenue {totals['revenue']:.2f}")
+        totals.update(closed_at=when.strftime('%Y-%m-%d %H:%M:%S'), closed_by=closed_by)
+        return totals
+    
+    def is_closed(self, day):
+        """Whether a day has been closed"""
+        return self.db.fetchone("SELECT 1 FROM day_closings WHERE close_date = ?", (day,)) is not None
+    
+    def closings(self, limit=30):
+        """Latest closings without their detailed totals"""
+        return self.db.fetchall(
+            """SELECT close_date, closed_at, closed_by, invoice_count, revenue
+               FROM day_closings ORDER BY close_date DESC LIMIT ?""",
+            (limit,)
+        )
+
+# Global day closer instance
+day_closer = DayCloser()
@@ -9,13 +9,14 @@ import os
 sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
 
 import database
+from payments import payment_ledger
 from datetime import datetime, timedelta
 
 def clear_database():
     """Clear all data from database"""
     db = database.db
     tables = [
-        'messages', 'employee_commissions', 'attendance', 'campaigns',
+        'messages', 'wallet_transactions', 'loyalty_transactions', 'employee_commissions', 'attendance', 'campaigns',
         'invoices', 'gamnet_reservations', 'gamnet_sessions', 'gamnet_devices',
         'cafe_order_items', 'cafe_orders', 'cafe_menu',
         'salon_service_records', 'salon_appointments', 'salon_services',
@@ -119,10 +120,13 @@ def setup_demo_data():
     
     for cust in customers:
         db.execute(
-            '''INSERT INTO customers (name, phone, birthdate, registration_date, loyalty_points, wallet_balance)
-               VALUES (?, ?, ?, ?, ?, ?)''',
-            (*cust, datetime.now().strftime('%Y-%m-%d'), 100, 50.0)
+            '''INSERT INTO customers (name, phone, birthdate, registration_date)
+               VALUES (?, ?, ?, ?)''',
+            (*cust, datetime.now().strftime('%Y-%m-%d'))
         )
+        customer_id = db.fetchone('SELECT id FROM customers WHERE phone = ?', (cust[1],))['id']
+        payment_ledger.adjust_points(customer_id, 100, 'Welcome points')
+        payment_ledger.adjust_wallet(customer_id, 50.0, 'Welcome credit')
         print(f'   ✓ {cust[0]} - {cust[1]}')
     
     # 6. Create Sample Appointments
@@ -166,21 +170,15 @@ def setup_demo_data():
     for inv in invoices:
         db.execute(
             '''INSERT INTO invoices (customer_id, invoice_date, total_amount, discount_amount, 
-                                    final_amount, payment_method, campaign_code, is_paid)
-               VALUES (?, ?, ?, ?, ?, ?, ?, 1)''',
-            (inv[0], datetime.now().strftime('%Y-%m-%d %H:%M:%S'), *inv[1:])
+                                    final_amount, campaign_code)
+               VALUES (?, ?, ?, ?, ?, ?)''',
+            (inv[0], datetime.now().strftime('%Y-%m-%d %H:%M:%S'), *inv[1:4], inv[5])
         )
-        print(f'   ✓ Invoice for Customer {inv[0]} - ${inv[3]} ({inv[4]})')
+        invoice_id = db.fetchone('SELECT MAX(id) as id FROM invoices')['id']
         
-        # Update customer stats
-        db.execute(
-            '''UPDATE customers 
-               SET total_spent = total_spent + ?, 
-                   last_visit_date = ?,
-                   loyalty_points = loyalty_points + ?
-               WHERE id = ?''',
-            (inv[3], datetime.now().strftime('%Y-%m-%d'), int(inv[3]), inv[0])
-        )
+        # Mark paid, update customer stats, wallet and loyalty ledgers
+        payment_ledger.pay_invoice(invoice_id, inv[4])
+        print(f'   ✓ Invoice for Customer {inv[0]} - ${inv[3]} ({inv[4]})')
     
     print('\n=== Demo Data Setup Complete! ===\n')
 
@@ -6,6 +6,7 @@ import customtkinter as ctk
 from datetime import datetime
 from ui_utils import *
 from database import db
+from commission_ledger import commission_ledger
 
 class EmployeeSection:
     def __init__(self, parent):
@@ -155,6 +156,8 @@ class EmployeeSection:
                    command=self.show_commissions).pack(pady=5)
         GlassButton(options_frame, text="Attendance Report", 
                    command=self.show_attendance_report).pack(pady=5)
+        GlassButton(options_frame, text="Payroll (This Month)", 
+                   command=self.show_payroll).pack(pady=5)
         
         # Report display
         report_frame = GlassFrame(tab)
@@ -297,26 +300,16 @@ class EmployeeSection:
         self.report_text.delete('1.0', 'end')
         self.report_text.insert('end', f"Performance Report for {emp['name']}\n\n")
         
-        # Get service records and ratings
-        if emp['section'] == 'Salon':
-            records = db.fetchall(
-                """SELECT COUNT(*) as count, AVG(rating) as avg_rating, SUM(price) as revenue
-                   FROM salon_service_records
-                   WHERE stylist_id = ?""",
-                (emp_id,)
-            )
-            if records and records[0]['count']:
-                self.report_text.insert('end', f"Services Performed: {records[0]['count']}\n")
-                self.report_text.insert('end', f"Average Rating: {records[0]['avg_rating']:.2f}\n")
-                self.report_text.insert('end', f"Total Revenue: ${records[0]['revenue']:.2f}\n")
+        # Totals come from the per-month balance table
+        summary = commission_ledger.employee_summary(emp_id)
+        if emp['section'] == 'Salon' and summary['service_count']:
+            self.report_text.insert('end', f"Services Performed: {summary['service_count']}\n")
+            if summary['avg_rating'] is not None:
+                self.report_text.insert('end', f"Average Rating: {summary['avg_rating']:.2f}\n")
+            self.report_text.insert('end', f"Total Revenue: ${summary['service_revenue']:.2f}\n")
         
-        # Get commissions
-        commissions = db.fetchall(
-            """SELECT SUM(amount) as total FROM employee_commissions WHERE employee_id = ?""",
-            (emp_id,)
-        )
-        if commissions and commissions[0]['total']:
-            self.report_text.insert('end', f"Total Commissions: ${commissions[0]['total']:.2f}\n")
+        if summary['commission_earned']:
+            self.report_text.insert('end', f"Total Commissions: ${summary['commission_earned']:.2f}\n")
     
     def show_commissions(self):
         """Show employee commission report"""
@@ -338,15 +331,16 @@ class EmployeeSection:
             (emp_id,)
         )
         
-        total = 0
         for comm in commissions:
             paid = "Paid" if comm['is_paid'] else "Unpaid"
             self.report_text.insert('end',
                 f"{comm['service_date']} - {comm['service_type']}: ${comm['amount']:.2f} ({paid})\n"
             )
-            total += comm['amount']
         
-        self.report_text.insert('end', f"\nTotal: ${total:.2f}\n")
+        summary = commission_ledger.employee_summary(emp_id)
+        self.report_text.insert('end', f"\nTotal Earned: ${summary['commission_earned']:.2f}\n")
+        self.report_text.insert('end', f"Paid: ${summary['commission_paid']:.2f}\n")
+        self.report_text.insert('end', f"Outstanding: ${summary['commission_due']:.2f}\n")
     
     def show_attendance_report(self):
         """Show employee attendance report"""
@@ -379,6 +373,24 @@ class EmployeeSection:
         
         self.report_text.insert('end', f"\nTotal Days: {len(attendance)}, Late: {late_count}\n")
     
+    def show_payroll(self):
+        """Show this month's payroll for all active employees"""
+        period = datetime.now().strftime('%Y-%m')
+        
+        self.report_text.delete('1.0', 'end')
+        self.report_text.insert('end', f"Payroll for {period}\n\n")
+        
+        total = 0
+        for emp in commission_ledger.balances(period):
+            pay = (emp['base_salary'] or 0) + emp['commission_due']
+            total += pay
+            self.report_text.insert('end',
+                f"{emp['name']} ({emp['section']}): Salary ${emp['base_salary'] or 0:.2f} + "
+                f"Commission ${emp['commission_due']:.2f} = ${pay:.2f}\n"
+            )
+        
+        self.report_text.insert('end', f"\nTotal Payroll: ${total:.2f}\n")
+    
     def get_frame(self):
         """Return the main frame"""
         return self.frame
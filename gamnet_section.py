@@ -4,15 +4,23 @@ Handles device management, timers, reservations, and customer credits
 """
 import customtkinter as ctk
 from datetime import datetime, timedelta
+from tkinter import messagebox
 from ui_utils import *
 from database import db
+from gamnet_telemetry import telemetry_ingestor
+from day_close import day_closer
+from services import session_service, SessionError, CustomerError
+
+TELEMETRY_POLL_MS = 2000
 
 class GamnetSection:
     def __init__(self, parent):
         self.parent = parent
         self.frame = GlassScrollableFrame(parent)
         self.active_sessions = {}
+        self.telemetry_revision = telemetry_ingestor.revision
         self.setup_ui()
+        self.frame.after(TELEMETRY_POLL_MS, self.poll_telemetry)
     
     def setup_ui(self):
         """Setup the gamnet section UI"""
@@ -189,11 +197,11 @@ class GamnetSection:
         
         GlassLabel(options_frame, text="Usage Reports", font=FONTS['heading']).pack(pady=10)
         
-        GlassButton(options_frame, text="Daily Usage Report", 
+        GlassButton(options_frame, text="Daily Usage Report",
                    command=self.show_daily_usage).pack(pady=5)
-        GlassButton(options_frame, text="Peak Hours Analysis", 
+        GlassButton(options_frame, text="Peak Hours Analysis",
                    command=self.show_peak_hours).pack(pady=5)
-        GlassButton(options_frame, text="Device Performance", 
+        GlassButton(options_frame, text="Device Performance",
                    command=self.show_device_performance).pack(pady=5)
         
         # Report display
@@ -209,29 +217,34 @@ class GamnetSection:
     
     def get_available_devices(self):
         """Get list of available devices"""
-        devices = db.fetchall("SELECT id, device_number, device_type FROM gamnet_devices WHERE is_available = 1")
+        devices = session_service.devices(available_only=True)
         if devices:
             return [f"{d['id']}: {d['device_number']} ({d['device_type']})" for d in devices]
         return ["No devices available"]
     
     def get_all_devices(self):
         """Get list of all devices"""
-        devices = db.fetchall("SELECT id, device_number, device_type FROM gamnet_devices")
+        devices = session_service.devices()
         if devices:
             return [f"{d['id']}: {d['device_number']} ({d['device_type']})" for d in devices]
         return ["No devices"]
     
+    def selected_device(self, var):
+        """Device id of an 'id: number' dropdown value, or None"""
+        text = var.get()
+        return int(text.split(':')[0]) if ':' in text else None
+    
     def add_device(self):
         """Add a new gaming device"""
-        number = self.device_number_entry.get()
-        device_type = self.device_type_var.get()
-        rate = float(self.hourly_rate_entry.get())
-        
-        db.execute(
-            """INSERT INTO gamnet_devices (device_number, device_type, hourly_rate)
-               VALUES (?, ?, ?)""",
-            (number, device_type, rate)
-        )
+        try:
+            session_service.add_device(self.device_number_entry.get(), self.device_type_var.get(),
+                                       float(self.hourly_rate_entry.get()))
+        except ValueError:
+            messagebox.showerror("Add Device", "Hourly rate must be a number")
+            return
+        except SessionError as e:
+            messagebox.showerror("Add Device", str(e))
+            return
         
         self.refresh_devices()
         
@@ -241,108 +254,48 @@ class GamnetSection:
     
     def start_session(self):
         """Start a gaming session"""
-        phone = self.session_customer_entry.get()
-        
-        # Get or create customer
-        customer = db.fetchone("SELECT id FROM customers WHERE phone = ?", (phone,))
-        if not customer:
-            db.execute(
-                "INSERT INTO customers (name, phone, registration_date) VALUES (?, ?, ?)",
-                (f"Customer {phone}", phone, datetime.now().strftime('%Y-%m-%d'))
-            )
-            customer = db.fetchone("SELECT id FROM customers WHERE phone = ?", (phone,))
-        
-        # Get device ID
-        device_text = self.session_device_var.get()
-        if ':' not in device_text:
+        device_id = self.selected_device(self.session_device_var)
+        if not device_id:
             return
         
-        device_id = int(device_text.split(':')[0])
-        
-        # Start session
-        db.execute(
-            """INSERT INTO gamnet_sessions (device_id, customer_id, start_time)
-               VALUES (?, ?, ?)""",
-            (device_id, customer['id'], datetime.now().strftime('%Y-%m-%d %H:%M:%S'))
-        )
-        
-        # Mark device as unavailable
-        db.execute("UPDATE gamnet_devices SET is_available = 0, status = 'in_use' WHERE id = ?", (device_id,))
+        try:
+            session_service.start(device_id, self.session_customer_entry.get())
+        except (SessionError, CustomerError) as e:
+            messagebox.showwarning("Start Session", str(e))
+            return
         
         self.refresh_sessions()
+        self.refresh_devices()
         self.session_customer_entry.delete(0, 'end')
     
     def end_session(self):
         """End a gaming session"""
-        device_text = self.session_device_var.get()
-        if ':' not in device_text:
+        device_id = self.selected_device(self.session_device_var)
+        if not device_id:
             return
         
-        device_id = int(device_text.split(':')[0])
-        
-        # Get active session
-        session = db.fetchone(
-            """SELECT * FROM gamnet_sessions 
-               WHERE device_id = ? AND end_time IS NULL
-               ORDER BY start_time DESC LIMIT 1""",
-            (device_id,)
-        )
-        
-        if not session:
+        if session_service.end(device_id) is None:
             return
         
-        # Calculate duration and charge
-        start_time = datetime.strptime(session['start_time'], '%Y-%m-%d %H:%M:%S')
-        end_time = datetime.now()
-        duration = (end_time - start_time).total_seconds() / 60  # in minutes
-        
-        # Get device rate
-        device = db.fetchone("SELECT hourly_rate FROM gamnet_devices WHERE id = ?", (device_id,))
-        charge = (duration / 60) * device['hourly_rate']
-        
-        # Update session
-        db.execute(
-            """UPDATE gamnet_sessions 
-               SET end_time = ?, duration_minutes = ?, charge = ?
-               WHERE id = ?""",
-            (end_time.strftime('%Y-%m-%d %H:%M:%S'), int(duration), charge, session['id'])
-        )
-        
-        # Mark device as available
-        db.execute("UPDATE gamnet_devices SET is_available = 1, status = 'available' WHERE id = ?", (device_id,))
-        
         self.refresh_sessions()
+        self.refresh_devices()
     
     def make_reservation(self):
         """Make a device reservation"""
-        phone = self.reservation_customer_entry.get()
-        
-        # Get or create customer
-        customer = db.fetchone("SELECT id FROM customers WHERE phone = ?", (phone,))
-        if not customer:
-            db.execute(
-                "INSERT INTO customers (name, phone, registration_date) VALUES (?, ?, ?)",
-                (f"Customer {phone}", phone, datetime.now().strftime('%Y-%m-%d'))
-            )
-            customer = db.fetchone("SELECT id FROM customers WHERE phone = ?", (phone,))
-        
-        # Get device ID
-        device_text = self.reservation_device_var.get()
-        if ':' not in device_text:
+        device_id = self.selected_device(self.reservation_device_var)
+        if not device_id:
             return
         
-        device_id = int(device_text.split(':')[0])
-        date = self.reservation_date_entry.get()
-        time = self.reservation_time_entry.get()
-        duration = int(self.reservation_duration_entry.get())
-        
-        # Create reservation
-        db.execute(
-            """INSERT INTO gamnet_reservations 
-               (device_id, customer_id, reservation_date, reservation_time, duration_minutes)
-               VALUES (?, ?, ?, ?, ?)""",
-            (device_id, customer['id'], date, time, duration)
-        )
+        try:
+            session_service.reserve(device_id, self.reservation_customer_entry.get(),
+                                    self.reservation_date_entry.get(), self.reservation_time_entry.get(),
+                                    int(self.reservation_duration_entry.get()))
+        except ValueError:
+            messagebox.showerror("Reservation", "Duration must be a whole number of minutes")
+            return
+        except (SessionError, CustomerError) as e:
+            messagebox.showwarning("Reservation", str(e))
+            return
         
         self.refresh_reservations()
         
@@ -354,9 +307,8 @@ class GamnetSection:
     def refresh_devices(self):
         """Refresh devices list"""
         self.devices_text.delete('1.0', 'end')
-        devices = db.fetchall("SELECT * FROM gamnet_devices")
         
-        for device in devices:
+        for device in session_service.devices():
             status = "Available" if device['is_available'] else "In Use"
             self.devices_text.insert('end',
                 f"{device['device_number']} ({device['device_type']}) - "
@@ -366,15 +318,8 @@ class GamnetSection:
     def refresh_sessions(self):
         """Refresh active sessions list"""
         self.sessions_text.delete('1.0', 'end')
-        sessions = db.fetchall(
-            """SELECT s.*, d.device_number, c.name as customer_name, c.phone
-               FROM gamnet_sessions s
-               JOIN gamnet_devices d ON s.device_id = d.id
-               JOIN customers c ON s.customer_id = c.id
-               WHERE s.end_time IS NULL"""
-        )
         
-        for session in sessions:
+        for session in session_service.active():
             start_time = datetime.strptime(session['start_time'], '%Y-%m-%d %H:%M:%S')
             duration = (datetime.now() - start_time).total_seconds() / 60
             self.sessions_text.insert('end',
@@ -382,19 +327,21 @@ class GamnetSection:
                 f"{int(duration)} minutes\n"
             )
     
+    def poll_telemetry(self):
+        """Refresh the live board when device agents have changed sessions"""
+        try:
+            if telemetry_ingestor.revision != self.telemetry_revision:
+                self.telemetry_revision = telemetry_ingestor.revision
+                self.refresh_sessions()
+                self.refresh_devices()
+        finally:
+            self.frame.after(TELEMETRY_POLL_MS, self.poll_telemetry)
+    
     def refresh_reservations(self):
         """Refresh reservations list"""
         self.reservations_text.delete('1.0', 'end')
-        reservations = db.fetchall(
-            """SELECT r.*, d.device_number, c.name as customer_name, c.phone
-               FROM gamnet_reservations r
-               JOIN gamnet_devices d ON r.device_id = d.id
-               JOIN customers c ON r.customer_id = c.id
-               WHERE r.status = 'pending'
-               ORDER BY r.reservation_date, r.reservation_time"""
-        )
         
-        for res in reservations:
+        for res in session_service.pending_reservations():
             self.reservations_text.insert('end',
                 f"{res['reservation_date']} {res['reservation_time']} - "
                 f"{res['device_number']} - {res['customer_name']} ({res['phone']}) - "
@@ -404,20 +351,14 @@ class GamnetSection:
     def show_daily_usage(self):
         """Show daily usage report"""
         self.report_text.delete('1.0', 'end')
-        today = datetime.now().strftime('%Y-%m-%d')
-        
-        sessions = db.fetchall(
-            """SELECT COUNT(*) as count, SUM(duration_minutes) as total_minutes, SUM(charge) as revenue
-               FROM gamnet_sessions
-               WHERE DATE(start_time) = ? AND end_time IS NOT NULL""",
-            (today,)
-        )
-        
-        if sessions and sessions[0]['count']:
-            self.report_text.insert('end', f"Daily Usage Report for {today}\n\n")
-            self.report_text.insert('end', f"Total Sessions: {sessions[0]['count']}\n")
-            self.report_text.insert('end', f"Total Minutes: {sessions[0]['total_minutes']}\n")
-            self.report_text.insert('end', f"Total Revenue: ${sessions[0]['revenue']:.2f}\n")
+        summary = day_closer.daily_summary()
+        gamnet = summary['sections']['Gamnet']
+        
+        if gamnet['count']:
+            self.report_text.insert('end', f"Daily Usage Report for {summary['date']}\n\n")
+            self.report_text.insert('end', f"Total Sessions: {gamnet['count']}\n")
+            self.report_text.insert('end', f"Total Minutes: {summary['gamnet_minutes']}\n")
+            self.report_text.insert('end', f"Total Revenue: ${gamnet['amount']:.2f}\n")
         else:
             self.report_text.insert('end', "No sessions today yet.")
     
@@ -434,7 +375,7 @@ class GamnetSection:
         self.report_text.delete('1.0', 'end')
         
         devices = db.fetchall(
-            """SELECT d.device_number, d.device_type, 
+            """SELECT d.device_number, d.device_type,
                       COUNT(s.id) as sessions, SUM(s.charge) as revenue
                FROM gamnet_devices d
                LEFT JOIN gamnet_sessions s ON d.id = s.device_id
@@ -0,0 +1,379 @@
+"""
+Gamnet Device Telemetry Module
+Receives heartbeat, login and logout events from device agents on the LAN
+and turns them into gamnet sessions
+"""
+import json
+import socketserver
+import threading
+from collections import deque
+from datetime import datetime, timedelta
+
+from database import db
+from app_logger import log_info, log_warning, log_exception
+
+TIME_FORMAT = '%Y-%m-%d %H:%M:%S'
+EVENT_TYPES = ('heartbeat', 'login', 'logout')
+
+def session_charge(start_time, end_time, hourly_rate):
+    """Return (duration_minutes, charge) for a session, same rule as manual end"""
+    start = datetime.strptime(start_time, TIME_FORMAT)
+    end = datetime.strptime(end_time, TIME_FORMAT)
+    duration = max((end - start).total_seconds() / 60, 0)
+    return int(duration), (duration / 60) * hourly_rate
+
+def normalize_ts(ts):
+    """An event timestamp as TIME_FORMAT text, or None if it cannot be read.
+    
+    Agents send either TIME_FORMAT text or Unix seconds; anything else
+    (ISO 'T'/'Z' strings included) would be stored as-is and break every
+    later charge calculation on that session.
+    """
+    try:
+        if isinstance(ts, (int, float)) and not isinstance(ts, bool):
+            return datetime.fromtimestamp(ts).strftime(TIME_FORMAT)
+        if isinstance(ts, str):
+            return datetime.strptime(ts, TIME_FORMAT).strftime(TIME_FORMAT)
+    except (ValueError, OverflowError, OSError):
+        pass
+    return None
+
+class _TCPHandler(socketserver.StreamRequestHandler):
+    """Newline-delimited JSON events over a persistent agent connection"""
+    def handle(self):
+        for line in self.rfile:
+            self.server.ingestor.submit_raw(line)
+
+class _UDPHandler(socketserver.BaseRequestHandler):
+    """One or more newline-delimited JSON events per datagram"""
+    def handle(self):
+        self.server.ingestor.submit_raw(self.request[0])
+
+class _TCPServer(socketserver.ThreadingTCPServer):
+    allow_reuse_address = True
+    daemon_threads = True
+    # A whole room of agents reconnects at once after a network blip
+    request_queue_size = 256
+
+class _UDPServer(socketserver.UDPServer):
+    allow_reuse_address = True
+
+class TelemetryIngestor:
+    """Buffers device agent events and batch-writes them to the database"""
+    def __init__(self, database=None, idle_minutes=5, flush_interval=1.0):
+        self.db = database or db
+        self.idle_minutes = idle_minutes
+        self.flush_interval = flush_interval
+        self.revision = 0
+        self.stats = {'received': 0, 'rejected': 0, 'written': 0, 'batches': 0, 'idle_closed': 0}
+        self._buffer = deque()
+        self._stats_lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._servers = []
+        self._threads = []
+        self._stop = threading.Event()
+        self.address = None
+    
+    def submit(self, event):
+        """Queue a parsed event dict; returns False if it is malformed"""
+        if (not isinstance(event, dict) or event.get('event') not in EVENT_TYPES
+                or not event.get('device')):
+            self._count('rejected')
+            return False
+        
+        if event.get('ts') in (None, ''):
+            event['ts'] = datetime.now().strftime(TIME_FORMAT)
+        else:
+            event['ts'] = normalize_ts(event['ts'])
+            if event['ts'] is None:
+                self._count('rejected')
+                return False
+        self._buffer.append(event)
+        self._count('received')
+        return True
+    
+    def submit_raw(self, data):
+        """Queue every JSON line found in a raw packet"""
+        if isinstance(data, bytes):
+            data = data.decode('utf-8', errors='replace')
+        for line in data.splitlines():
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                self.submit(json.loads(line))
+            except ValueError:
+                self._count('rejected')
+    
+    def _count(self, key, amount=1):
+        """Bump a stats counter; listener threads call this concurrently"""
+        with self._stats_lock:
+            self.stats[key] += amount
+    
+    def pending(self):
+        """Number of events waiting for the next flush"""
+        return len(self._buffer)
+    
+    def flush(self, now=None):
+        """Write all buffered events in one transaction and close idle sessions.
+        
+        If the write fails the batch goes back to the front of the buffer,
+        ahead of anything received meanwhile, and the error is raised.
+        """
+        with self._flush_lock:
+            events = []
+            while self._buffer:
+                events.append(self._buffer.popleft())
+            
+            changed = 0
+            try:
+                with self.db.transaction() as cursor:
+                    if events:
+                        changed += self._write_events(cursor, events)
+                    changed += self._close_idle_sessions(cursor, now)
+            except Exception:
+                self._buffer.extendleft(reversed(events))
+                raise
+            
+            if events:
+                self._count('written', len(events))
+                self._count('batches')
+            if changed:
+                self.revision += 1
+            return len(events)
+    
+    def _write_events(self, cursor, events):
+        """Apply a batch of events; returns the number of session changes"""
+        devices = {
+            row['device_number']: row
+            for row in cursor.execute("SELECT id, device_number, hourly_rate FROM gamnet_devices").fetchall()
+        }
+        open_sessions = {
+            row['device_id']: (row['id'], row['start_time'])
+            for row in cursor.execute(
+                "SELECT id, device_id, start_time FROM gamnet_sessions WHERE end_time IS NULL"
+            ).fetchall()
+        }
+        customers = self._resolve_customers(cursor, events)
+        # Logins dated on a day whose Z-report is taken would be refused by its lock
+        closed_days = {
+            row['close_date']
+            for row in cursor.execute(
+                "SELECT close_date FROM day_closings WHERE close_date >= ?", (min(e['ts'] for e in events)[:10],)
+            ).fetchall()
+        }
+        
+        last_seen = {}
+        device_status = {}
+        closed = []
+        changed = 0
+        
+        for event in events:
+            device = devices.get(event['device'])
+            if device is None:
+                self._count('rejected')
+                continue
+            
+            device_id = device['id']
+            ts = event['ts']
+            if ts > last_seen.get(device_id, ''):
+                last_seen[device_id] = ts
+            
+            if event['event'] == 'login' and device_id not in open_sessions:
+                if ts[:10] in closed_days:
+                    log_warning(f"Telemetry refused login on {event['device']} at {ts}: the day is closed")
+                    self._count('rejected')
+                    continue
+                cursor.execute(
+                    """INSERT INTO gamnet_sessions (device_id, customer_id, start_time)
+                       VALUES (?, ?, ?)""",
+                    (device_id, customers.get(event.get('phone')), ts)
+                )
+                open_sessions[device_id] = (cursor.lastrowid, ts)
+                device_status[device_id] = (0, 'in_use')
+                changed += 1
+            elif event['event'] == 'logout' and device_id in open_sessions:
+                session_id, start_time = open_sessions.pop(device_id)
+                try:
+                    duration, charge = session_charge(start_time, ts, device['hourly_rate'])
+                except ValueError:
+                    log_warning(f"Telemetry skipped logout of gamnet session {session_id} with unreadable times")
+                    continue
+                closed.append((ts, duration, charge, session_id))
+                device_status[device_id] = (1, 'available')
+                changed += 1
+        
+        if last_seen:
+            cursor.executemany(
+                "UPDATE gamnet_devices SET last_heartbeat = ? WHERE id = ?",
+                [(ts, device_id) for device_id, ts in last_seen.items()]
+            )
+        if closed:
+            cursor.executemany(
+                """UPDATE gamnet_sessions SET end_time = ?, duration_minutes = ?, charge = ?
+                   WHERE id = ?""",
+                closed
+            )
+        if device_status:
+            cursor.executemany(
+                "UPDATE gamnet_devices SET is_available = ?, status = ? WHERE id = ?",
+                [(available, status, device_id) for device_id, (available, status) in device_status.items()]
+            )
+        return changed
+    
+    def _resolve_customers(self, cursor, events):
+        """Get or create customers for every phone in a batch of logins"""
+        phones = {e['phone'] for e in events if e['event'] == 'login' and e.get('phone')}
+        if not phones:
+            return {}
+        
+        today = datetime.now().strftime('%Y-%m-%d')
+        cursor.executemany(
+            "INSERT OR IGNORE INTO customers (name, phone, registration_date) VALUES (?, ?, ?)",
+            [(f"Customer {phone}", phone, today) for phone in phones]
+        )
+        
+        customers = {}
+        phones = list(phones)
+        for start in range(0, len(phones), 500):
+            chunk = phones[start:start + 500]
+            placeholders = ','.join('?' * len(chunk))
+            for row in cursor.execute(
+                f"SELECT id, phone FROM customers WHERE phone IN ({placeholders})", chunk
+            ).fetchall():
+                customers[row['phone']] = row['id']
+        return customers
+    
+    def _close_idle_sessions(self, cursor, now=None):
+        """End open sessions on devices whose agent stopped sending heartbeats.
+        
+        Only sessions the agent has reported on since they started are
+        considered, so sessions started by hand on agent-less devices, or on
+        a device whose agent went offline earlier, are left alone. The
+        session is charged up to the last heartbeat, not the sweep time.
+        """
+        now = now or datetime.now()
+        cutoff = (now - timedelta(minutes=self.idle_minutes)).strftime(TIME_FORMAT)
+        
+        idle = cursor.execute(
+            """SELECT s.id, s.device_id, s.start_time, d.last_heartbeat, d.hourly_rate
+               FROM gamnet_sessions s
+               JOIN gamnet_devices d ON s.device_id = d.id
+               WHERE s.end_time IS NULL
+               AND d.last_heartbeat IS NOT NULL AND d.last_heartbeat < ?
+               AND s.start_time <= d.last_heartbeat""",
+            (cutoff,)
+        ).fetchall()
+        if not idle:
+            return 0
+        
+        closed = []
+        freed = []
+        for row in idle:
+            end_time = max(row['last_heartbeat'], row['start_time'])
+            try:
+                duration, charge = session_charge(row['start_time'], end_time, row['hourly_rate'])
+            except ValueError:
+                # A hand-edited or legacy row; leave it for staff instead of failing every sweep
+                log_warning(f"Telemetry skipped gamnet session {row['id']} with unreadable times")
+                continue
+            closed.append((end_time, duration, charge, row['id']))
+            freed.append((row['device_id'],))
+        if not closed:
+            return 0
+        
+        cursor.executemany(
+            """UPDATE gamnet_sessions SET end_time = ?, duration_minutes = ?, charge = ?
+               WHERE id = ?""",
+            closed
+        )
+        cursor.executemany(
+            "UPDATE gamnet_devices SET is_available = 1, status = 'available' WHERE id = ?",
+            freed
+        )
+        self._count('idle_closed', len(closed))
+        log_info(f"Telemetry closed {len(closed)} idle gamnet session(s)")
+        return len(closed)
+    
+    def close_idle_sessions(self, now=None):
+        """Run the idle-session sweep on its own"""
+        with self._flush_lock:
+            with self.db.transaction() as cursor:
+                closed = self._close_idle_sessions(cursor, now)
+            if closed:
+                self.revision += 1
+            return closed
+    
+    def is_running(self):
+        """Check if the listeners are up"""
+        return bool(self._servers)
+    
+    def start(self, host='0.0.0.0', port=47810):
+        """Start the TCP and UDP listeners and the background flusher"""
+        if self.is_running():
+            return self.address
+        
+        self._stop.clear()
+        tcp = _TCPServer((host, port), _TCPHandler)
+        port = tcp.server_address[1]
+        udp = _UDPServer((host, port), _UDPHandler)
+        for server in (tcp, udp):
+            server.ingestor = self
+            self._servers.append(server)
+            thread = threading.Thread(target=server.serve_forever, daemon=True)
+            thread.start()
+            self._threads.append(thread)
+        
+        flusher = threading.Thread(target=self._flush_loop, daemon=True)
+        flusher.start()
+        self._threads.append(flusher)
+        
+        self.address = (host, port)
+        log_info(f"Gamnet telemetry listening on {host}:{port} (TCP/UDP)")
+        return self.address
+    
+    def stop(self):
+        """Stop listeners and write whatever is still buffered"""
+        if not self.is_running():
+            return
+        
+        self._stop.set()
+        for server in self._servers:
+            server.shutdown()
+            server.server_close()
+        for thread in self._threads:
+            thread.join(timeout=5)
+        self._servers = []
+        self._threads = []
+        self.flush()
+        log_info("Gamnet telemetry stopped")
+    
+    def _flush_loop(self):
+        """Flush the buffer every flush_interval seconds until stopped"""
+        while not self._stop.wait(self.flush_interval):
+            try:
+                self.flush()
+            except Exception as e:
+                log_exception("Telemetry flush failed", e)
+    
+    def start_from_settings(self):
+        """Start the listeners if telemetry is enabled in settings"""
+        enabled = self._get_setting('telemetry_enabled', '0')
+        if enabled != '1':
+            return None
+        
+        try:
+            self.idle_minutes = float(self._get_setting('telemetry_idle_minutes', '5'))
+            port = int(self._get_setting('telemetry_port', '47810'))
+            return self.start(port=port)
+        except (ValueError, OSError) as e:
+            log_warning(f"Could not start gamnet telemetry: {e}")
+            return None
+    
+    def _get_setting(self, key, default=''):
+        """Get setting value from database"""
+        result = self.db.fetchone("SELECT value FROM settings WHERE key = ?", (key,))
+        return result['value'] if result else default
+
+# Global telemetry ingestor instance
+telemetry_ingestor = TelemetryIngestor()
@@ -0,0 +1,99 @@
+"""
+Global Search Module
+Ranked search over customers, cafe menu, salon services, inventory,
+suppliers, employees and invoices
+"""
+import re
+
+from database import db, Database
+from customer_search import DIGITS
+
+RESULT_LIMIT = 12
+
+# Source table -> label shown with its results
+KIND_LABELS = {
+    'customers': 'Customer',
+    'cafe_menu': 'Menu Item',
+    'salon_services': 'Salon Service',
+    'inventory_items': 'Inventory',
+    'suppliers': 'Supplier',
+    'employees': 'Employee',
+    'invoices': 'Invoice',
+}
+
+KIND_TABLES = {kind: table for table, (kind, *_) in Database.SEARCH_SOURCES.items()}
+
+class GlobalSearch:
+    """Search of the trigger-maintained global_search FTS5 index
+    
+    Every typed word is matched as a prefix of a word in a row's title
+    (names, invoice numbers) or body (phones, SKUs, categories, ...).
+    Rows whose title has the typed words come first, then rows whose title
+    has words starting with them, then body matches; each group is ranked
+    by bm25. Only the newest CANDIDATES matches of each
+    are ranked, so a first letter matching most of the index costs about
+    as much as a full word.
+    """
+    TITLE_WEIGHT = 5.0
+    CANDIDATES = 500
+    
+    def __init__(self, database=None):
+        self.db = database or db
+    
+    def match_expression(self, text, prefix=True):
+        """FTS5 query for typed text, or None if it has no words"""
+        text = text.translate(DIGITS)
+        for source, target in Database.NAME_FOLDS.items():
+            text = text.replace(source, target)
+        words = re.findall(r'\w+', text)
+        return ' '.join(f'"{word}"{"*" if prefix else ""}' for word in words) or None
+    
+    def search(self, text, limit=RESULT_LIMIT, tables=None):
+        """Best matches for text, optionally only from some source tables
+        
+        Returns dicts with table, label, ref_id (the row id in its table),
+        title and body.
+        """
+        expression = self.match_expression(text)
+        if not expression or not self.db.search_index:
+            return []
+        kinds = [Database.SEARCH_SOURCES[table][0] for table in tables or ()]
+        # Whole words in the title first, then title prefixes, then matches
+        # anywhere, each ranked on its own
+        results, seen = [], set()
+        exact = self.match_expression(text, prefix=False)
+        for match in (f"title : ({exact})", f"title : ({expression})", expression):
+            for row in self._ranked(match, kinds, limit):
+                if row['rowid'] in seen or len(results) == limit:
+                    continue
+                seen.add(row['rowid'])
+                table = KIND_TABLES[row['rowid'] % Database.SEARCH_KINDS]
+                results.append({
+                    'table': table,
+                    'label': KIND_LABELS[table],
+                    'ref_id': row['rowid'] // Database.SEARCH_KINDS,
+                    'title': row['title'],
+                    'body': row['body'].strip(),
+                })
+        return results
+    
+    def _ranked(self, match, kinds, limit):
+        """Best limit rows among the newest CANDIDATES matching an FTS5 query"""
+        where, params = "global_search MATCH ?", [match]
+        if kinds:
+            where += f" AND rowid % {Database.SEARCH_KINDS} IN ({', '.join('?' * len(kinds))})"
+            params += kinds
+        return self.db.fetchall(
+            f"""SELECT rowid, title, body FROM (
+                    SELECT rowid, title, body, bm25(global_search, {self.TITLE_WEIGHT}, 1.0) as score
+                    FROM global_search
+                    WHERE {where}
+                    ORDER BY rowid DESC
+                    LIMIT {self.CANDIDATES})
+                ORDER BY score
+                LIMIT ?""",
+            params + [limit]
+        )
+
+# Global search instance
+global_search = GlobalSearch()
@@ -4,16 +4,17 @@ Handles product inventory, stock levels, and alerts
 """
 import customtkinter as ctk
 from ui_utils import *
-from database import db
+from cafe_orders import cafe_orders
+from services import inventory_service, InventoryError
 from translations import tr
 from tkinter import messagebox
-from datetime import datetime
 
 class InventorySection:
     def __init__(self, parent):
         self.parent = parent
         self.frame = GlassScrollableFrame(parent)
         self.setup_ui()
+        cafe_orders.add_low_stock_listener(self.on_low_stock)
     
     def setup_ui(self):
         """Setup the inventory section UI"""
@@ -79,24 +80,9 @@ class InventorySection:
         """Refresh products display"""
         self.products_text.delete('1.0', 'end')
         
-        if section == "all":
-            products = db.fetchall(
-                """SELECT i.*, s.name as supplier_name 
-                   FROM inventory_items i
-                   LEFT JOIN suppliers s ON i.supplier_id = s.id
-                   ORDER BY i.section, i.name"""
-            )
-        else:
-            products = db.fetchall(
-                """SELECT i.*, s.name as supplier_name 
-                   FROM inventory_items i
-                   LEFT JOIN suppliers s ON i.supplier_id = s.id
-                   WHERE i.section = ?
-                   ORDER BY i.name""",
-                (section,)
-            )
+        products = inventory_service.products(None if section == "all" else section)
         
-        self.products_text.insert('end', 
+        self.products_text.insert('end',
             f"{'ID':<5} {'Name':<30} {'Section':<10} {'Qty':<10} {'Unit':<8} "
             f"{'Cost':<10} {'Price':<10} {'Reorder':<10}\n"
             f"{'-'*100}\n"
@@ -125,21 +111,25 @@ class InventorySection:
         
         GlassLabel(alerts_frame, text="Low Stock Items", font=FONTS['heading']).pack(pady=10)
         
-        alerts_text = ctk.CTkTextbox(
+        self.alerts_text = ctk.CTkTextbox(
             alerts_frame,
             fg_color=COLORS['surface'],
             text_color=COLORS['text']
         )
-        alerts_text.pack(fill='both', expand=True, padx=10, pady=10)
-        
-        # Get low stock items
-        low_stock = db.fetchall(
-            """SELECT i.*, s.name as supplier_name 
-               FROM inventory_items i
-               LEFT JOIN suppliers s ON i.supplier_id = s.id
-               WHERE i.quantity <= i.reorder_level
-               ORDER BY (i.reorder_level - i.quantity) DESC"""
-        )
+        self.alerts_text.pack(fill='both', expand=True, padx=10, pady=10)
+        
+        self.refresh_alerts()
+    
+    def on_low_stock(self, items):
+        """Refresh alerts as soon as a cafe order pushes stock to reorder level"""
+        self.frame.after(0, self.refresh_alerts)
+    
+    def refresh_alerts(self):
+        """Refresh low stock alerts display"""
+        alerts_text = self.alerts_text
+        alerts_text.delete('1.0', 'end')
+        
+        low_stock = inventory_service.low_stock()
         
         if not low_stock:
             alerts_text.insert('end', "No low stock alerts at this time.\n\n")
@@ -227,36 +217,33 @@ class InventorySection:
         
         def add_product():
             try:
-                name = name_entry.get().strip()
-                if not name:
-                    messagebox.showerror("Error", "Product name is required")
-                    return
-                
-                db.execute(
-                    """INSERT INTO inventory_items 
-                       (name, category, section, sku, quantity, unit, reorder_level, 
-                        unit_cost, selling_price, supplier_id, last_updated)
-                       VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)""",
-                    (name, category_entry.get(), section_var.get(), sku_entry.get(),
-                     float(qty_entry.get() or 0), unit_entry.get(),
-                     float(reorder_entry.get() or 0),
-                     float(cost_entry.get() or 0), float(price_entry.get() or 0),
-                     int(supplier_entry.get()) if supplier_entry.get() else None,
-                     datetime.now().strftime('%Y-%m-%d %H:%M:%S'))
+                inventory_service.add_product(
+                    name_entry.get().strip(), section_var.get(), category=category_entry.get(),
+                    sku=sku_entry.get().strip(), quantity=float(qty_entry.get() or 0), unit=unit_entry.get(),
+                    reorder_level=float(reorder_entry.get() or 0), unit_cost=float(cost_entry.get() or 0),
+                    selling_price=float(price_entry.get() or 0),
+                    supplier_id=int(supplier_entry.get()) if supplier_entry.get() else None
                 )
-                
-                messagebox.showinfo("Success", "Product added successfully!")
-                
-                # Clear form
-                for entry in [name_entry, category_entry, sku_entry, qty_entry,
-                             cost_entry, price_entry, reorder_entry, supplier_entry]:
-                    entry.delete(0, 'end')
-                unit_entry.delete(0, 'end')
-                unit_entry.insert(0, "piece")
-                
-                self.refresh_products()
+            except ValueError:
+                messagebox.showerror("Error", "Quantities, prices and the supplier ID must be numbers")
+                return
+            except InventoryError as e:
+                messagebox.showerror("Error", str(e))
+                return
             except Exception as e:
                 messagebox.showerror("Error", f"Failed to add product: {str(e)}")
+                return
+            
+            messagebox.showinfo("Success", "Product added successfully!")
+            
+            # Clear form
+            for entry in [name_entry, category_entry, sku_entry, qty_entry,
+                         cost_entry, price_entry, reorder_entry, supplier_entry]:
+                entry.delete(0, 'end')
+            unit_entry.delete(0, 'end')
+            unit_entry.insert(0, "piece")
+            
+            self.refresh_products()
         
         GlassButton(
             form_frame,
@@ -0,0 +1,179 @@
+"""
+Invoice Renderer Module
+Renders invoices as PDF receipts with a QR code, using the bundled Vazir
+fonts, and archives a period's invoices in parallel
+"""
+import json
+import os
+import subprocess
+import sys
+import tempfile
+from datetime import datetime, timedelta
+
+from database import db
+from archive import ArchiveManager, archive_manager
+from app_logger import log_info, log_warning
+from receipt_pdf import RenderError, PDF_SUPPORT, qr_payload, receipt_rows, shape, render_pdf, render_job
+
+# Batch render workers run this script, so they never import the database module
+RENDER_WORKER = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'receipt_pdf.py')
+
+# Invoice id -> its linked section rows, one indexed lookup per section;
+# {gamnet_sessions} is the hot table or its archive view
+INVOICE_LINES_QUERY = """
+    SELECT r.invoice_id, 'Salon' as section, r.service_date as date,
+           COALESCE(s.name, 'Salon service') as description, COALESCE(r.price, 0) as amount
+    FROM salon_service_records r LEFT JOIN salon_services s ON s.id = r.service_id
+    WHERE r.invoice_id IN ({ids})
+    UNION ALL
+    SELECT o.invoice_id, 'Cafe', o.order_date, 'Cafe order #' || o.id, COALESCE(o.total_amount, 0)
+    FROM cafe_orders o
+    WHERE o.invoice_id IN ({ids})
+    UNION ALL
+    SELECT g.invoice_id, 'Gamnet', g.start_time,
+           COALESCE(d.device_number, 'Device') || ' (' || COALESCE(g.duration_minutes, 0) || ' min)',
+           COALESCE(g.charge, 0)
+    FROM {gamnet_sessions} g LEFT JOIN gamnet_devices d ON d.id = g.device_id
+    WHERE g.invoice_id IN ({ids})
+    ORDER BY 1, 3"""
+
+class InvoiceRenderer:
+    """Loads invoices from the database and renders them as PDF receipts
+    
+    The receipt template (title, currency, contact phone) is read from
+    settings once and reused until invalidate(). Batch renders load every
+    invoice in two queries here and hand plain dicts to worker processes.
+    The workers are fresh interpreters running receipt_pdf.py rather than
+    multiprocessing children: forking copies the app's threads and open
+    connection, and spawn re-imports the launching script, which for the
+    app pulls in the database module and opens kagan.db.
+    Invoices and sessions are read through the archive views for dates
+    before the archive horizon, so past months can be rendered again.
+    """
+    def __init__(self, database=None, output_dir=None):
+        self.db = database or db
+        self.archive = ArchiveManager(self.db) if database else archive_manager
+        self.output_dir = output_dir or os.path.join(os.path.dirname(self.db.path) or '.', 'invoices')
+        self._template = None
+    
+    def invalidate(self):
+        """Drop the cached template, e.g. after settings change"""
+        self._template = None
+    
+    def template(self):
+        """Receipt header and currency from settings, cached"""
+        if self._template is None:
+            settings = {
+                row['key']: row['value']
+                for row in self.db.fetchall(
+                    "SELECT key, value FROM settings WHERE key IN ('business_name', 'currency', 'contact_phone')"
+                )
+            }
+            self._template = {
+                'title': settings.get('business_name') or 'Kagan Collection',
+                'currency': settings.get('currency') or 'Toman',
+                'contact_phone': settings.get('contact_phone') or '',
+            }
+        return self._template
+    
+    def invoice_ids(self, start_date, end_date):
+        """Ids of the invoices dated start_date..end_date, archived ones included"""
+        end = (datetime.strptime(end_date, '%Y-%m-%d') + timedelta(days=1)).strftime('%Y-%m-%d')
+        return [
+            row['id'] for row in self.db.fetchall(
+                f"""SELECT id FROM {self.archive.table_for('invoices', start_date)}
+                    WHERE invoice_date >= ? AND invoice_date < ? ORDER BY id""",
+                (start_date, end)
+            )
+        ]
+    
+    def load_invoices(self, invoice_ids, since=None):
+        """Invoices with customer details and section lines, keyed by id
+        
+        `since` is the earliest invoice date wanted (None: any), which
+        decides whether the archives are read.
+        """
+        if not invoice_ids:
+            return {}
+        placeholders = ','.join('?' * len(invoice_ids))
+        invoices = {
+            row['id']: dict(row, lines=[])
+            for row in self.db.fetchall(
+                f"""SELECT i.*, c.name as customer_name, c.phone as customer_phone
+                    FROM {self.archive.table_for('invoices', since)} i
+                    LEFT JOIN customers c ON c.id = i.customer_id
+                    WHERE i.id IN ({placeholders})""",
+                list(invoice_ids)
+            )
+        }
+        query = INVOICE_LINES_QUERY.format(ids=placeholders,
+                                           gamnet_sessions=self.archive.table_for('gamnet_sessions', since))
+        for row in self.db.fetchall(query, list(invoice_ids) * 3):
+            invoices[row['invoice_id']]['lines'].append(dict(row))
+        return invoices
+    
+    def pdf_path(self, invoice, directory=None):
+        """Archive path of an invoice PDF: <dir>/<YYYY-MM>/invoice_<id>.pdf"""
+        month = (invoice['invoice_date'] or '')[:7] or 'undated'
+        return os.path.join(directory or self.output_dir, month, f"invoice_{invoice['id']}.pdf")
+    
+    def render(self, invoice_id, path=None):
+        """Render one invoice and return the PDF path"""
+        invoice = self.load_invoices([invoice_id]).get(invoice_id)
+        if not invoice:
+            raise RenderError(f"Invoice #{invoice_id} not found")
+        path = path or self.pdf_path(invoice)
+        os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+        render_pdf(invoice, self.template(), path)
+        log_info(f"Rendered invoice #{invoice_id} to {path}")
+        return path
+    
+    def render_batch(self, start_date, end_date, directory=None, workers=None):
+        """Render every invoice dated start_date..end_date across a process pool
+        
+        Returns the list of PDF paths written; failures are logged and left out.
+        """
+        if not PDF_SUPPORT:
+            raise RenderError("PDF rendering needs the reportlab package")
+        ids = self.invoice_ids(start_date, end_date)
+        template = self.template()
+        jobs = []
+        for offset in range(0, len(ids), 500):
+            for invoice in self.load_invoices(ids[offset:offset + 500], start_date).values():
+                path = self.pdf_path(invoice, directory)
+                os.makedirs(os.path.dirname(path), exist_ok=True)
+                jobs.append((invoice, template, path))
+        if not jobs:
+            return []
+        
+        workers = min(workers or os.cpu_count() or 1, len(jobs))
+        if workers == 1:
+            paths = [render_job(job) for job in jobs]
+        else:
+            paths = self._render_in_workers(jobs, workers)
+        written = [path for path in paths if path]
+        log_info(f"Rendered {len(written)} of {len(jobs)} invoices for {start_date}..{end_date}")
+        return written
+
+    def _render_in_workers(self, jobs, workers):
+        """Split jobs across `workers` receipt_pdf.py processes; returns their paths"""
+        flags = subprocess.CREATE_NO_WINDOW if sys.platform == 'win32' else 0
+        paths = []
+        with tempfile.TemporaryDirectory() as job_dir:
+            processes = []
+            for n in range(workers):
+                job_file = os.path.join(job_dir, f"jobs_{n}.json")
+                with open(job_file, 'w', encoding='utf-8') as f:
+                    json.dump(jobs[n::workers], f)
+                processes.append(subprocess.Popen([sys.executable, RENDER_WORKER, job_file],
+                                                  stdout=subprocess.PIPE, creationflags=flags))
+            for process in processes:
+                output, _ = process.communicate()
+                try:
+                    paths += json.loads(output)
+                except ValueError:
+                    log_warning(f"Render worker exited with code {process.returncode} and no result")
+        return paths
+
+# Global invoice renderer instance
+invoice_renderer = InvoiceRenderer()
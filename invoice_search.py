@@ -0,0 +1,147 @@
+"""
+Invoice Search Module
+Filtered invoice search across all history, newest first, with keyset
+paging over the invoice date indexes
+"""
+from datetime import datetime, timedelta
+
+from database import db
+from archive import ArchiveManager, archive_manager
+
+PAGE_SIZE = 50
+
+# An amount range matching fewer invoices than this is read by amount and sorted
+AMOUNT_SORT_ROWS = 5000
+
+def _prefix_upper_bound(prefix):
+    """Smallest string greater than every string starting with prefix"""
+    return prefix[:-1] + chr(ord(prefix[-1]) + 1)
+
+class InvoiceSearch:
+    """Invoice search by customer phone, dates, amounts, payment method,
+    campaign code and paid status
+    
+    Results are ordered by (invoice_date, id) descending. A page returns
+    the key of its last row; passing it back as `after` continues from
+    there with an index seek instead of an OFFSET, so page 1000 costs
+    the same as page 1. Every filter is served by an index that also
+    yields that order (see the invoice indexes in Database.create_tables);
+    only a phone prefix matching several customers sorts their invoices.
+    An amount range with no other filter is read from the amount index
+    and sorted when it matches few invoices; a wide range walks the date
+    index instead, where matches are dense enough to fill a page quickly.
+    
+    Searches without a start date, or starting before the archive
+    horizon, read the invoices_all view over the archives as reports do;
+    those are not served by the hot table's indexes.
+    """
+    def __init__(self, database=None):
+        self.db = database or db
+        self.archive = ArchiveManager(self.db) if database else archive_manager
+    
+    def _conditions(self, phone=None, start_date=None, end_date=None, min_amount=None, max_amount=None,
+                    payment_method=None, campaign_code=None, is_paid=None, invoice_id=None):
+        """(where, params, by_amount) for the given filters
+        
+        Only the most selective equality filter (customer, then campaign,
+        payment method, paid status) may drive the index; the others are
+        written as +column so the planner cannot pick a weaker index.
+        by_amount is True when the amount range drives instead.
+        """
+        where, params = [], []
+        if invoice_id:
+            where.append("i.id = ?")
+            params.append(invoice_id)
+        if phone:
+            # A full phone or its first digits: a range on the unique phone index
+            bounds = [phone, _prefix_upper_bound(phone)]
+            customers = self.db.fetchall("SELECT id FROM customers WHERE phone >= ? AND phone < ? LIMIT 2", bounds)
+            if len(customers) == 1:
+                where.append("i.customer_id = ?")
+                params.append(customers[0]['id'])
+            else:
+                where.append("i.customer_id IN (SELECT id FROM customers WHERE phone >= ? AND phone < ?)")
+                params += bounds
+        equalities = [('campaign_code', campaign_code), ('payment_method', payment_method),
+                      ('is_paid', None if is_paid is None else (1 if is_paid else 0))]
+        indexed = not phone
+        for column, value in equalities:
+            if value is None or value == '':
+                continue
+            where.append(f"{'i.' if indexed else '+i.'}{column} = ?")
+            params.append(value)
+            indexed = False
+        if start_date:
+            where.append("i.invoice_date >= ?")
+            params.append(start_date)
+        if end_date:
+            where.append("i.invoice_date < ?")
+            params.append((datetime.strptime(end_date, '%Y-%m-%d') + timedelta(days=1)).strftime('%Y-%m-%d'))
+        amounts, bounds = [], []
+        if min_amount is not None:
+            amounts.append("final_amount >= ?")
+            bounds.append(min_amount)
+        if max_amount is not None:
+            amounts.append("final_amount <= ?")
+            bounds.append(max_amount)
+        by_amount = (bool(amounts) and indexed and not (start_date or end_date or invoice_id)
+                     and self._narrow(amounts, bounds))
+        where += [f"{'i.' if by_amount else '+i.'}{amount}" for amount in amounts]
+        params += bounds
+        return where, params, by_amount
+    
+    def _narrow(self, amounts, bounds):
+        """Whether an amount range matches fewer than AMOUNT_SORT_ROWS invoices, counted on the amount index"""
+        row = self.db.fetchone(
+            f"SELECT COUNT(*) FROM (SELECT 1 FROM invoices WHERE {' AND '.join(amounts)} LIMIT ?)",
+            bounds + [AMOUNT_SORT_ROWS]
+        )
+        return row[0] < AMOUNT_SORT_ROWS
+    
+    def query(self, after=None, limit=PAGE_SIZE, **filters):
+        """(sql, params) of one search page; exposed for query plan checks"""
+        where, params, by_amount = self._conditions(**filters)
+        # Sorted reads must not be steered onto the date index by the keyset or the order
+        date = '+i.invoice_date' if by_amount else 'i.invoice_date'
+        if after:
+            where.append(f"({date}, i.id) < (?, ?)")
+            params += list(after)
+        invoices = self.archive.table_for('invoices', filters.get('start_date'))
+        sql = f"""SELECT i.id, i.invoice_date, i.customer_id, c.name, c.phone, i.total_amount, i.discount_amount,
+                         i.tax_amount, i.final_amount, i.payment_method, i.campaign_code, i.is_paid
+                  FROM {invoices} i LEFT JOIN customers c ON c.id = i.customer_id
+                  {'WHERE ' + ' AND '.join(where) if where else ''}
+                  ORDER BY {date} DESC, i.id DESC
+                  LIMIT ?"""
+        return sql, params + [limit]
+    
+    def search(self, after=None, limit=PAGE_SIZE, **filters):
+        """One page of matching invoices
+        
+        Filters: phone, start_date, end_date (YYYY-MM-DD, inclusive),
+        min_amount, max_amount, payment_method, campaign_code, is_paid,
+        invoice_id.
+        Returns {'rows': [...], 'next': key or None}; pass 'next' as
+        `after` to fetch the following page.
+        """
+        sql, params = self.query(after, limit + 1, **filters)
+        rows = [dict(row) for row in self.db.fetchall(sql, params)]
+        has_more = len(rows) > limit
+        rows = rows[:limit]
+        next_key = (rows[-1]['invoice_date'], rows[-1]['id']) if has_more else None
+        return {'rows': rows, 'next': next_key}
+    
+    def totals(self, **filters):
+        """Count and amount of all matching invoices"""
+        where, params, _ = self._conditions(**filters)
+        invoices = self.archive.table_for('invoices', filters.get('start_date'))
+        row = self.db.fetchone(
+            f"""SELECT COUNT(*) as count, COALESCE(SUM(i.final_amount), 0) as amount,
+                       COALESCE(SUM(CASE WHEN i.is_paid = 1 THEN i.final_amount ELSE 0 END), 0) as paid
+                FROM {invoices} i {'WHERE ' + ' AND '.join(where) if where else ''}""",
+            params
+        )
+        return dict(row)
+
+# Global invoice search instance
+invoice_search = InvoiceSearch()
@@ -3,15 +3,27 @@ Invoice and Cashier Section Module
 Handles unified invoicing, payments, and cashier operations
 """
 import customtkinter as ctk
+import threading
 from datetime import datetime
+from tkinter import messagebox
 from ui_utils import *
-from database import db
+from checkout import CheckoutError
+from payments import PaymentError
+from invoice_renderer import invoice_renderer, RenderError
+from day_close import DayCloseError
+from services import invoice_service, payment_service
+from auth import session
 
 class InvoiceSection:
     def __init__(self, parent):
         self.parent = parent
         self.frame = GlassScrollableFrame(parent)
         self.current_invoice_items = []
+        self.unbilled_lines = []
+        self.campaign = None
+        self.last_invoice_id = None
+        self.search_filters = {}
+        self.search_next = None
         self.setup_ui()
     
     def setup_ui(self):
@@ -47,6 +59,8 @@ class InvoiceSection:
         self.invoice_customer_entry = GlassEntry(form_frame, width=300)
         self.invoice_customer_entry.pack(pady=5)
         
+        GlassButton(form_frame, text="Load Unbilled Services", command=self.load_unbilled).pack(pady=10)
+        
         GlassLabel(form_frame, text="Add Services/Items:").pack(pady=10)
         
         # Service type selection
@@ -77,7 +91,9 @@ class InvoiceSection:
         GlassButton(form_frame, text="Apply Campaign", command=self.apply_campaign).pack(pady=10)
         
         GlassButton(form_frame, text="Create Invoice", command=self.create_invoice,
-                   fg_color=COLORS['success']).pack(pady=20)
+                   fg_color=COLORS['success']).pack(pady=(20, 5))
+        
+        GlassButton(form_frame, text="Save Receipt PDF", command=self.save_receipt).pack(pady=(5, 20))
         
         # Current invoice display
         invoice_frame = GlassFrame(tab)
@@ -91,8 +107,6 @@ class InvoiceSection:
             text_color=COLORS['text']
         )
         self.current_invoice_text.pack(fill='both', expand=True, padx=10, pady=10)
-        
-        self.discount_amount = 0
     
     def setup_payment_tab(self):
         """Setup payment processing interface"""
@@ -142,9 +156,47 @@ class InvoiceSection:
         
         GlassLabel(search_frame, text="Invoice History", font=FONTS['heading']).pack(pady=10)
         
-        GlassButton(search_frame, text="Show Today's Invoices", 
+        GlassButton(search_frame, text="Show Today's Invoices",
                    command=self.show_todays_invoices).pack(pady=10)
         
+        # Search filters
+        filters_frame = GlassFrame(search_frame)
+        filters_frame.pack(fill='x', padx=10, pady=5)
+        self.search_entries = {}
+        for key, placeholder in (('phone', "Phone"), ('start_date', "From (YYYY-MM-DD)"),
+                                 ('end_date', "To (YYYY-MM-DD)"), ('min_amount', "Min $"),
+                                 ('max_amount', "Max $"), ('campaign_code', "Campaign")):
+            entry = GlassEntry(filters_frame, width=120, placeholder_text=placeholder)
+            entry.pack(side='left', padx=3, pady=5)
+            self.search_entries[key] = entry
+        self.search_method_var = ctk.StringVar(value="Any Method")
+        ctk.CTkOptionMenu(
+            filters_frame,
+            variable=self.search_method_var,
+            values=["Any Method", "Cash", "Card", "Wallet"],
+            width=110,
+            fg_color=COLORS['surface'],
+            button_color=COLORS['primary']
+        ).pack(side='left', padx=3)
+        self.search_paid_var = ctk.StringVar(value="Paid or Unpaid")
+        ctk.CTkOptionMenu(
+            filters_frame,
+            variable=self.search_paid_var,
+            values=["Paid or Unpaid", "Paid", "Unpaid"],
+            width=120,
+            fg_color=COLORS['surface'],
+            button_color=COLORS['primary']
+        ).pack(side='left', padx=3)
+        
+        GlassButton(search_frame, text="Search Invoices", command=self.search_invoices).pack(pady=5)
+        GlassButton(search_frame, text="Next Page", command=self.show_next_page).pack(pady=5)
+        
+        GlassButton(search_frame, text="Archive This Month's PDFs",
+                   command=self.archive_month).pack(pady=10)
+        
+        GlassButton(search_frame, text="Close Day (Z-Report)", command=self.close_day,
+                   fg_color=COLORS['warning']).pack(pady=10)
+        
         # History display
         history_frame = GlassFrame(tab)
         history_frame.pack(fill='both', expand=True, padx=10, pady=10)
@@ -163,7 +215,7 @@ class InvoiceSection:
         amount = float(self.item_amount_entry.get())
         
         self.current_invoice_items.append({
-            'type': service_type,
+            'section': service_type,
             'description': description,
             'amount': amount
         })
@@ -174,160 +226,235 @@ class InvoiceSection:
         self.item_desc_entry.delete(0, 'end')
         self.item_amount_entry.delete(0, 'end')
     
+    def load_unbilled(self):
+        """Load the customer's unbilled salon services, cafe orders and gamnet sessions"""
+        self.unbilled_lines = invoice_service.unbilled(self.invoice_customer_entry.get())
+        self.refresh_current_invoice()
+    
     def apply_campaign(self):
         """Apply campaign code discount"""
         code = self.campaign_code_entry.get()
-        
-        campaign = db.fetchone(
-            """SELECT * FROM campaigns 
-               WHERE code = ? AND is_active = 1 
-               AND date('now') BETWEEN start_date AND end_date""",
-            (code,)
-        )
-        
-        if campaign:
-            total = sum(item['amount'] for item in self.current_invoice_items)
-            self.discount_amount = total * (campaign['discount_percentage'] / 100)
-            self.refresh_current_invoice()
+        self.campaign = invoice_service.find_campaign(code)
+        self.refresh_current_invoice()
+        if not self.campaign:
+            self.current_invoice_text.insert('end', f"\nCampaign code '{code}' is not valid.\n")
     
     def refresh_current_invoice(self):
         """Refresh current invoice display"""
         self.current_invoice_text.delete('1.0', 'end')
         
-        total = 0
-        for item in self.current_invoice_items:
+        lines = self.unbilled_lines + self.current_invoice_items
+        for item in lines:
             self.current_invoice_text.insert('end',
-                f"[{item['type']}] {item['description']}: ${item['amount']:.2f}\n"
+                f"[{item['section']}] {item['description']}: ${item['amount']:.2f}\n"
             )
-            total += item['amount']
         
-        self.current_invoice_text.insert('end', f"\nSubtotal: ${total:.2f}\n")
-        if self.discount_amount > 0:
-            self.current_invoice_text.insert('end', f"Discount: -${self.discount_amount:.2f}\n")
-        final = total - self.discount_amount
-        self.current_invoice_text.insert('end', f"Total: ${final:.2f}\n")
+        totals = invoice_service.totals(lines, self.campaign)
+        self.current_invoice_text.insert('end', f"\nSubtotal: ${totals['subtotal']:.2f}\n")
+        if totals['discount'] > 0:
+            self.current_invoice_text.insert('end', f"Discount: -${totals['discount']:.2f}\n")
+        if totals['tax'] > 0:
+            self.current_invoice_text.insert('end', f"Tax: ${totals['tax']:.2f}\n")
+        self.current_invoice_text.insert('end', f"Total: ${totals['final']:.2f}\n")
     
     def create_invoice(self):
-        """Create and save invoice"""
-        if not self.current_invoice_items:
+        """Create and save invoice for all unbilled services plus added items"""
+        campaign_code = self.campaign['code'] if self.campaign else None
+        try:
+            result = invoice_service.create(self.invoice_customer_entry.get(), campaign_code,
+                                            self.current_invoice_items)
+        except CheckoutError as e:
+            self.current_invoice_text.insert('end', f"\n{e}\n")
             return
         
-        phone = self.invoice_customer_entry.get()
-        
-        # Get or create customer
-        customer = db.fetchone("SELECT id FROM customers WHERE phone = ?", (phone,))
-        if not customer:
-            db.execute(
-                "INSERT INTO customers (name, phone, registration_date) VALUES (?, ?, ?)",
-                (f"Customer {phone}", phone, datetime.now().strftime('%Y-%m-%d'))
-            )
-            customer = db.fetchone("SELECT id FROM customers WHERE phone = ?", (phone,))
-        
-        # Calculate totals
-        total = sum(item['amount'] for item in self.current_invoice_items)
-        final = total - self.discount_amount
-        
-        # Create invoice
-        campaign_code = self.campaign_code_entry.get() or None
-        
-        db.execute(
-            """INSERT INTO invoices 
-               (customer_id, invoice_date, total_amount, discount_amount, final_amount, campaign_code)
-               VALUES (?, ?, ?, ?, ?, ?)""",
-            (customer['id'], datetime.now().strftime('%Y-%m-%d %H:%M:%S'), 
-             total, self.discount_amount, final, campaign_code)
-        )
-        
-        invoice_id = db.fetchone("SELECT last_insert_rowid() as id")['id']
+        self.unbilled_lines = [line for line in result['lines'] if line['table']]
+        self.refresh_current_invoice()
         
         # Show invoice ID
-        self.current_invoice_text.insert('end', f"\n\nInvoice #{invoice_id} created!\n")
+        self.current_invoice_text.insert('end', f"\n\nInvoice #{result['invoice_id']} created!\n")
+        self.last_invoice_id = result['invoice_id']
         
         # Clear for next invoice
         self.current_invoice_items = []
-        self.discount_amount = 0
+        self.unbilled_lines = []
+        self.campaign = None
         self.invoice_customer_entry.delete(0, 'end')
         self.campaign_code_entry.delete(0, 'end')
     
+    def save_receipt(self):
+        """Render the last created invoice as a PDF receipt in the background"""
+        invoice_id = self.last_invoice_id
+        if not invoice_id:
+            self.current_invoice_text.insert('end', "\nCreate an invoice first.\n")
+            return
+        
+        def work():
+            try:
+                message = f"\nReceipt saved to {invoice_renderer.render(invoice_id)}\n"
+            except RenderError as e:
+                message = f"\n{e}\n"
+            self.frame.after(0, lambda: self.current_invoice_text.insert('end', message))
+        
+        threading.Thread(target=work, daemon=True).start()
+    
+    def archive_month(self):
+        """Render every invoice of the current month to PDF in the background"""
+        today = datetime.now().strftime('%Y-%m-%d')
+        self.history_text.delete('1.0', 'end')
+        self.history_text.insert('end', "Rendering this month's invoices...\n")
+        
+        def work():
+            try:
+                paths = invoice_renderer.render_batch(today[:8] + '01', today)
+                message = f"Archived {len(paths)} invoice PDFs to {invoice_renderer.output_dir}\n"
+            except RenderError as e:
+                message = f"{e}\n"
+            self.frame.after(0, lambda: self.history_text.insert('end', message))
+        
+        threading.Thread(target=work, daemon=True).start()
+    
     def process_payment(self):
         """Process payment for an invoice"""
         invoice_id = int(self.payment_invoice_entry.get())
         payment_method = self.payment_method_var.get()
         
-        invoice = db.fetchone("SELECT * FROM invoices WHERE id = ?", (invoice_id,))
-        
-        if not invoice:
-            self.payment_text.delete('1.0', 'end')
-            self.payment_text.insert('end', "Invoice not found.")
+        if payment_service.uses_gateway(payment_method):
+            self.process_card_payment(invoice_id)
             return
         
-        if invoice['is_paid']:
+        try:
+            result = payment_service.pay(invoice_id, payment_method)
+        except PaymentError as e:
             self.payment_text.delete('1.0', 'end')
-            self.payment_text.insert('end', "Invoice already paid.")
+            self.payment_text.insert('end', f"{e}.")
             return
         
-        # Process payment
-        if payment_method == "Wallet":
-            # Deduct from wallet
-            db.execute(
-                """UPDATE customers 
-                   SET wallet_balance = wallet_balance - ?
-                   WHERE id = ?""",
-                (invoice['final_amount'], invoice['customer_id'])
-            )
-        
-        # Mark as paid
-        db.execute(
-            """UPDATE invoices 
-               SET is_paid = 1, payment_method = ?
-               WHERE id = ?""",
-            (payment_method, invoice_id)
-        )
-        
-        # Update customer stats
-        db.execute(
-            """UPDATE customers 
-               SET total_spent = total_spent + ?, 
-                   last_visit_date = ?,
-                   loyalty_points = loyalty_points + ?
-               WHERE id = ?""",
-            (invoice['final_amount'], datetime.now().strftime('%Y-%m-%d'), 
-             int(invoice['final_amount']), invoice['customer_id'])
-        )
-        
         self.payment_text.delete('1.0', 'end')
         self.payment_text.insert('end', f"Payment processed successfully!\n")
         self.payment_text.insert('end', f"Invoice #{invoice_id}\n")
-        self.payment_text.insert('end', f"Amount: ${invoice['final_amount']:.2f}\n")
+        self.payment_text.insert('end', f"Amount: ${result['amount']:.2f}\n")
         self.payment_text.insert('end', f"Method: {payment_method}\n")
+        if result['points']:
+            self.payment_text.insert('end', f"Loyalty points earned: {result['points']}\n")
         
         self.payment_invoice_entry.delete(0, 'end')
     
+    def process_card_payment(self, invoice_id):
+        """Send a card payment to the gateway without blocking the window"""
+        self.payment_text.delete('1.0', 'end')
+        try:
+            payment_service.pay_by_card(invoice_id, callback=lambda t: self.frame.after(0, self.show_card_result, t))
+        except PaymentError as e:
+            self.payment_text.insert('end', f"{e}.")
+            return
+        self.payment_text.insert('end', f"Invoice #{invoice_id}: waiting for card authorisation...\n")
+        self.payment_invoice_entry.delete(0, 'end')
+    
+    def show_card_result(self, transaction):
+        """Show the outcome of a card payment"""
+        messages = {
+            'approved': "Card payment approved!",
+            'declined': "Card payment declined.",
+            'failed': "Card payment failed.",
+            'pending': "No answer from the gateway yet; the payment will be checked again automatically.",
+        }
+        self.payment_text.insert('end', f"\nInvoice #{transaction['invoice_id']}: {messages.get(transaction['status'], transaction['status'])}\n")
+        self.payment_text.insert('end', f"Amount: ${transaction['amount']:.2f}\n")
+        if transaction['transaction_id']:
+            self.payment_text.insert('end', f"Transaction: {transaction['transaction_id']}\n")
+        if transaction['notes']:
+            self.payment_text.insert('end', f"{transaction['notes']}\n")
+    
     def show_todays_invoices(self):
         """Show today's invoices"""
-        self.history_text.delete('1.0', 'end')
         today = datetime.now().strftime('%Y-%m-%d')
+        self.search_filters = {'start_date': today, 'end_date': today}
+        self.show_search_page(None, limit=500)
         
-        invoices = db.fetchall(
-            """SELECT i.*, c.name, c.phone
-               FROM invoices i
-               JOIN customers c ON i.customer_id = c.id
-               WHERE DATE(i.invoice_date) = ?
-               ORDER BY i.invoice_date DESC""",
-            (today,)
-        )
+        summary = invoice_service.daily_summary(today)
+        self.history_text.insert('end', f"\nTotal Revenue Today: ${summary['revenue']:.2f}\n")
+        if summary['closed_at']:
+            self.history_text.insert('end', f"Day closed at {summary['closed_at']}\n")
+    
+    def search_invoices(self):
+        """Search invoices with the filters entered above"""
+        filters = {key: entry.get().strip() for key, entry in self.search_entries.items() if entry.get().strip()}
+        try:
+            for key in ('min_amount', 'max_amount'):
+                if key in filters:
+                    filters[key] = float(filters[key])
+            for key in ('start_date', 'end_date'):
+                if key in filters:
+                    datetime.strptime(filters[key], '%Y-%m-%d')
+        except ValueError:
+            self.history_text.delete('1.0', 'end')
+            self.history_text.insert('end', "Amounts must be numbers and dates YYYY-MM-DD.\n")
+            return
+        if self.search_method_var.get() != "Any Method":
+            filters['payment_method'] = self.search_method_var.get()
+        if self.search_paid_var.get() != "Paid or Unpaid":
+            filters['is_paid'] = self.search_paid_var.get() == "Paid"
+        
+        self.search_filters = filters
+        self.show_search_page(None)
+        totals = invoice_service.search_totals(**filters)
+        self.history_text.insert('end', f"\n{totals['count']} invoice(s), ${totals['amount']:.2f} billed, "
+                                        f"${totals['paid']:.2f} paid\n")
+    
+    def show_next_page(self):
+        """Show the next page of the last search"""
+        if not self.search_next:
+            self.history_text.insert('end', "\nNo more invoices.\n")
+            return
+        self.show_search_page(self.search_next)
+    
+    def show_invoice(self, invoice_id):
+        """Show a single invoice in the history tab"""
+        self.tabview.set("Invoice History")
+        self.search_filters = {'invoice_id': invoice_id}
+        self.show_search_page(None)
+    
+    def show_search_page(self, after, limit=50):
+        """Show one page of invoices matching self.search_filters"""
+        self.history_text.delete('1.0', 'end')
+        page = invoice_service.search(after=after, limit=limit, **self.search_filters)
+        self.search_next = page['next']
         
-        total_revenue = 0
-        for inv in invoices:
+        for inv in page['rows']:
             paid = "Paid" if inv['is_paid'] else "Unpaid"
             self.history_text.insert('end',
-                f"Invoice #{inv['id']} - {inv['name']} ({inv['phone']}) - "
-                f"${inv['final_amount']:.2f} - {inv['payment_method'] or 'N/A'} - {paid}\n"
+                f"Invoice #{inv['id']} - {(inv['invoice_date'] or '')[:16]} - {inv['name'] or 'Walk-in'} "
+                f"({inv['phone'] or '-'}) - ${inv['final_amount'] or 0:.2f} - {inv['payment_method'] or 'N/A'} - {paid}\n"
             )
-            if inv['is_paid']:
-                total_revenue += inv['final_amount']
+        if not page['rows']:
+            self.history_text.insert('end', "No invoices found.\n")
+        elif self.search_next:
+            self.history_text.insert('end', "\nMore results: press Next Page.\n")
+    
+    def close_day(self):
+        """Close today and show its Z-report"""
+        if not messagebox.askyesno("Close Day",
+                                   "Close today? Today's sales can no longer be changed afterwards."):
+            return
+        user = session.get_user()
+        try:
+            report = invoice_service.close_day(closed_by=user['username'] if user else None)
+        except DayCloseError as e:
+            messagebox.showerror("Close Day", str(e))
+            return
         
-        self.history_text.insert('end', f"\nTotal Revenue Today: ${total_revenue:.2f}\n")
+        self.history_text.delete('1.0', 'end')
+        self.history_text.insert('end', f"Z-Report - {report['date']} (closed {report['closed_at']})\n\n")
+        self.history_text.insert('end', f"Invoices: {report['invoice_count']}  Customers: {report['customers']}\n")
+        self.history_text.insert('end', f"Billed: ${report['billed']:.2f}  Discounts: ${report['discount']:.2f}  "
+                                        f"Tax: ${report['tax']:.2f}\n")
+        self.history_text.insert('end', f"Revenue (paid): ${report['revenue']:.2f}\n")
+        for title, key in (("Sections", 'sections'), ("Payment Methods", 'payment_methods'),
+                           ("Employees", 'employees'), ("Campaigns", 'campaigns')):
+            if report[key]:
+                self.history_text.insert('end', f"\n{title}:\n")
+            for name, totals in report[key].items():
+                self.history_text.insert('end', f"  {name}: ${totals['amount']:.2f} ({totals['count']})\n")
     
     def get_frame(self):
         """Return the main frame"""
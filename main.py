@@ -14,6 +14,7 @@ campaigns, and comprehensive reporting.
 
 import sys
 import traceback
+import threading
 
 import customtkinter as ctk
 
@@ -35,6 +36,18 @@ from settings_section import SettingsSection
 from sms_section import SMSSection
 from inventory_section import InventorySection
 from supplier_expense_section import SupplierSection, ExpenseSection
+from gamnet_telemetry import telemetry_ingestor
+from payments import payment_ledger
+from payment_gateway import card_payments
+from backup import backup_manager
+from api_server import api_server
+from terminal_sync import sync_engine
+from vouchers import voucher_engine
+from salon_scheduler import salon_scheduler
+from invoice_renderer import invoice_renderer
+from analytics_extract import analytics_extract
+from command_palette import CommandPalette
+from database import db
 
 class SimpleLoginWindow(ctk.CTk):
     def __init__(self, on_success_callback):
@@ -157,6 +170,25 @@ class KaganManagementApp(ctk.CTk):
             self.init_sample_data()
             print("Sample data initialization completed")
             
+            # Start gamnet device telemetry if enabled
+            print("Starting gamnet telemetry")
+            self.start_telemetry()
+            
+            # Check wallet and loyalty balances against their ledgers
+            self.start_reconciliation()
+            
+            # Card payment gateway and its pending-transaction reconciler
+            self.start_card_payments()
+            
+            # Scheduled backups per the backup settings
+            self.start_backups()
+            
+            # Serve the services to other terminals if enabled
+            self.start_api_server()
+            
+            # Offline-first terminals sync with their main node
+            self.start_sync()
+            
             # Show main window
             print("Making main window visible")
             self.deiconify()
@@ -179,10 +211,92 @@ class KaganManagementApp(ctk.CTk):
             self.init_complete = False
             raise
     
+    def start_telemetry(self):
+        """Start the gamnet device telemetry listener if enabled in settings"""
+        try:
+            address = telemetry_ingestor.start_from_settings()
+            if address:
+                print(f"Gamnet telemetry listening on port {address[1]}")
+            else:
+                print("Gamnet telemetry disabled")
+        except Exception as e:
+            print(f"Error starting gamnet telemetry: {e}")
+            print("Continuing application startup without telemetry")
+    
+    def start_reconciliation(self):
+        """Reconcile customer balances with the ledgers in the background"""
+        def run():
+            try:
+                mismatches = payment_ledger.reconcile()
+                print(f"Balance reconciliation found {len(mismatches)} mismatch(es)")
+            except Exception as e:
+                print(f"Error reconciling balances: {e}")
+        threading.Thread(target=run, name='balance-reconciliation', daemon=True).start()
+    
+    def start_card_payments(self):
+        """Connect the card payment gateway if one is configured in settings"""
+        try:
+            url = card_payments.start_from_settings()
+            print(f"Card payments via {url}" if url else "Card payment gateway disabled")
+        except Exception as e:
+            print(f"Error starting card payments: {e}")
+            print("Continuing application startup without a card gateway")
+    
+    def start_backups(self):
+        """Check in the background whether an automatic backup is due"""
+        try:
+            backup_manager.on_restore(self.after_restore)
+            backup_manager.start_scheduler()
+            print("Backup scheduler started")
+        except Exception as e:
+            print(f"Error starting backup scheduler: {e}")
+            print("Continuing application startup without scheduled backups")
+    
+    def start_api_server(self):
+        """Start the terminal API server if enabled in settings"""
+        try:
+            url = api_server.start_from_settings()
+            print(f"Terminal API server on {url}" if url else "Terminal API server disabled")
+        except Exception as e:
+            print(f"Error starting terminal API server: {e}")
+            print("Continuing application startup without the API server")
+    
+    def start_sync(self):
+        """Sync this terminal's replica with the main node in the background"""
+        try:
+            url = sync_engine.start_from_settings()
+            print(f"Syncing with main node at {url}" if url else "Terminal sync disabled")
+        except Exception as e:
+            print(f"Error starting terminal sync: {e}")
+            print("Continuing application startup without sync")
+    
+    def after_restore(self):
+        """Drop cached data after a backup is restored and rebuild the sections"""
+        voucher_engine.invalidate()
+        salon_scheduler.invalidate()
+        invoice_renderer.invalidate()
+        analytics_extract.invalidate()
+        self.after(0, self.reload_sections)
+    
+    def reload_sections(self):
+        """Rebuild the sections from the database, staying on the one in view"""
+        showing = next((name for name, section in self.sections.items()
+                        if section.get_frame() is self.current_section), 'dashboard')
+        for child in self.content_frame.winfo_children():
+            child.destroy()
+        self.sections.clear()
+        self.current_section = None
+        getattr(self, f'show_{showing}', self.show_dashboard)()
+    
     def on_window_close(self):
         """Handle window close event"""
         try:
             print("Window close event triggered by user")
+            telemetry_ingestor.stop()
+            card_payments.stop()
+            backup_manager.stop()
+            api_server.stop()
+            sync_engine.stop()
             self.destroy()
         except Exception as e:
             print(f"Error during window close: {e}")
@@ -246,6 +360,18 @@ class KaganManagementApp(ctk.CTk):
                 btn.pack(pady=3, padx=10)
                 self.nav_buttons[text] = btn
             
+            # Search everything (Ctrl+K)
+            self.nav_items = nav_items + [("Inventory", self.show_inventory), ("Suppliers", self.show_suppliers)]
+            GlassButton(
+                self.sidebar,
+                text="Search (Ctrl+K)",
+                command=self.open_command_palette,
+                width=200,
+                height=35,
+                fg_color=COLORS['secondary']
+            ).pack(pady=(15, 3), padx=10)
+            self.bind_all('<Control-k>', self.open_command_palette)
+            
             # Logout button
             print("Adding logout button")
             logout_btn = GlassButton(
@@ -402,7 +528,7 @@ class KaganManagementApp(ctk.CTk):
                 except:
                     activity_text.insert('end', "No recent activity data available.\n")
                 
-                self.sections['dashboard'] = type('Dashboard', (), {'get_frame': lambda: dashboard})()
+                self.sections['dashboard'] = type('Dashboard', (), {'get_frame': staticmethod(lambda: dashboard)})()
             
             self.current_section = self.sections['dashboard'].get_frame()
             self.current_section.pack(fill='both', expand=True)
@@ -450,6 +576,45 @@ class KaganManagementApp(ctk.CTk):
         """Show reports section"""
         self.show_section('reports', ReportsSection)
     
+    def show_inventory(self):
+        """Show inventory section"""
+        self.show_section('inventory', InventorySection)
+    
+    def show_suppliers(self):
+        """Show suppliers section"""
+        self.show_section('suppliers', SupplierSection)
+    
+    # Global search result table -> (method showing its section, tab to select)
+    SEARCH_TARGETS = {
+        'customers': ('show_customers', 'History'),
+        'cafe_menu': ('show_cafe', 'Menu'),
+        'salon_services': ('show_salon', 'Services'),
+        'inventory_items': ('show_inventory', None),
+        'suppliers': ('show_suppliers', 'Suppliers List'),
+        'employees': ('show_employees', 'Employees'),
+        'invoices': ('show_invoices', 'Invoice History'),
+    }
+    
+    def open_command_palette(self, event=None):
+        """Open the search palette over the current section"""
+        CommandPalette(self, self.nav_items, self.open_search_result)
+    
+    def open_search_result(self, result):
+        """Show the section holding a global search result"""
+        show, tab = self.SEARCH_TARGETS[result['table']]
+        getattr(self, show)()
+        section = self.sections.get(show[len('show_'):])
+        if section is None:
+            return
+        if result['table'] == 'customers':
+            customer = db.fetchone("SELECT phone FROM customers WHERE id = ?", (result['ref_id'],))
+            if customer:
+                section.show_customer(customer['phone'])
+        elif result['table'] == 'invoices':
+            section.show_invoice(result['ref_id'])
+        elif tab:
+            section.tabview.set(tab)
+    
     def get_today_revenue(self):
         """Get today's total revenue"""
         try:
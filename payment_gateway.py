@@ -0,0 +1,367 @@
+"""
+Payment Gateway Module
+Card authorisation through a JSON/HTTP payment gateway, recorded in
+payment_transactions, with a local stand-in gateway server and a
+background reconciler for transactions left pending
+"""
+import json
+import threading
+import urllib.error
+import urllib.request
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from database import db
+from payments import PaymentLedger, PaymentError, payment_ledger
+from app_logger import log_info, log_warning, log_exception
+
+TIME_FORMAT = '%Y-%m-%d %H:%M:%S'
+FINAL_STATUSES = ('approved', 'declined', 'failed')
+
+class GatewayError(Exception):
+    """Raised when the gateway cannot be reached or gives no usable answer"""
+
+class PaymentGateway:
+    """A card payment gateway speaking the JSON protocol of LocalGatewayServer
+    
+    POST /authorize {idempotency_key, amount, reference} -> {status,
+    transaction_id, message}; a repeated key returns the first answer.
+    POST /lookup {keys: [...]} -> {results: {key: answer}} for the keys
+    the gateway has seen.
+    """
+    def __init__(self, url, name='gateway', timeout=10.0):
+        self.url = url.rstrip('/')
+        self.name = name
+        self.timeout = timeout
+    
+    def _post(self, path, payload):
+        request = urllib.request.Request(
+            self.url + path, data=json.dumps(payload).encode('utf-8'),
+            headers={'Content-Type': 'application/json'}, method='POST'
+        )
+        try:
+            with urllib.request.urlopen(request, timeout=self.timeout) as response:
+                return json.loads(response.read().decode('utf-8'))
+        except (urllib.error.URLError, OSError, ValueError) as e:
+            raise GatewayError(f"{self.name}: {getattr(e, 'reason', e)}")
+    
+    def authorize(self, idempotency_key, amount, reference=None):
+        """Ask for a card authorisation; returns the gateway's answer dict"""
+        return self._post('/authorize', {'idempotency_key': idempotency_key, 'amount': round(amount, 2),
+                                         'reference': reference})
+    
+    def lookup(self, keys):
+        """Current answers for many idempotency keys in one request"""
+        return self._post('/lookup', {'keys': list(keys)}).get('results', {})
+
+class _GatewayHandler(BaseHTTPRequestHandler):
+    """JSON endpoints of the stand-in gateway"""
+    def do_POST(self):
+        try:
+            length = int(self.headers.get('Content-Length') or 0)
+            payload = json.loads(self.rfile.read(length) or b'{}')
+            if self.path == '/authorize':
+                body = self.server.gateway.authorize(payload)
+            elif self.path == '/lookup':
+                body = {'results': self.server.gateway.lookup(payload.get('keys', []))}
+            else:
+                self.send_error(404)
+                return
+        except (ValueError, KeyError, TypeError) as e:
+            self.send_error(400, str(e))
+            return
+        data = json.dumps(body).encode('utf-8')
+        try:
+            self.send_response(200)
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Content-Length', str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+        except (BrokenPipeError, ConnectionResetError):
+            # The client timed out; it will find the answer through /lookup
+            pass
+    
+    def log_message(self, format, *args):
+        pass
+
+class _HTTPServer(ThreadingHTTPServer):
+    allow_reuse_address = True
+    daemon_threads = True
+
+class LocalGatewayServer:
+    """Stand-in card gateway on localhost, for setups without a real one
+    
+    Approves every authorisation up to decline_over (if set). `delay`
+    seconds are spent after the transaction is recorded and before
+    answering, which is how a slow or timing-out gateway behaves.
+    """
+    def __init__(self, delay=0.0, decline_over=None):
+        self.delay = delay
+        self.decline_over = decline_over
+        self._answers = {}
+        self._lock = threading.Lock()
+        self._server = None
+        self.address = None
+    
+    def authorize(self, payload):
+        key = payload['idempotency_key']
+        amount = float(payload['amount'])
+        with self._lock:
+            answer = self._answers.get(key)
+            if answer is None:
+                if amount <= 0:
+                    answer = {'status': 'declined', 'transaction_id': None, 'message': 'Invalid amount'}
+                elif self.decline_over is not None and amount > self.decline_over:
+                    answer = {'status': 'declined', 'transaction_id': None, 'message': 'Insufficient funds'}
+                else:
+                    answer = {'status': 'approved', 'transaction_id': f"LG-{len(self._answers) + 1:06d}",
+                              'message': 'Approved'}
+                self._answers[key] = answer
+        if self.delay:
+            threading.Event().wait(self.delay)
+        return answer
+    
+    def lookup(self, keys):
+        with self._lock:
+            return {key: self._answers[key] for key in keys if key in self._answers}
+    
+    @property
+    def url(self):
+        return f"http://{self.address[0]}:{self.address[1]}" if self.address else None
+    
+    def start(self, host='127.0.0.1', port=0):
+        """Serve in a background thread; returns the base URL"""
+        if self._server:
+            return self.url
+        self._server = _HTTPServer((host, port), _GatewayHandler)
+        self._server.gateway = self
+        self.address = self._server.server_address[:2]
+        threading.Thread(target=self._server.serve_forever, daemon=True).start()
+        log_info(f"Local payment gateway listening on {self.url}")
+        return self.url
+    
+    def stop(self):
+        if self._server:
+            self._server.shutdown()
+            self._server.server_close()
+            self._server = None
+            self.address = None
+
+class CardPayments:
+    """Card payments of invoices through a PaymentGateway
+    
+    Every attempt is a payment_transactions row with an idempotency key,
+    written as 'pending' before the gateway is called. Authorisations run
+    on a worker pool, so callers get a Future straight away. A timeout
+    leaves the row pending; the reconciler later asks the gateway about
+    all pending keys in one request. Retrying an invoice reuses its
+    pending key, so the customer is never charged twice.
+    """
+    def __init__(self, database=None, gateway=None, workers=4, pending_expiry_minutes=15):
+        self.db = database or db
+        self.ledger = PaymentLedger(self.db) if database else payment_ledger
+        self.gateway = gateway
+        self.pending_expiry_minutes = pending_expiry_minutes
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='card-payment')
+        self._stop = threading.Event()
+        self._reconciler = None
+        self._local_server = None
+    
+    def is_configured(self):
+        """Whether card payments go through a gateway"""
+        return self.gateway is not None
+    
+    def _begin(self, invoice_id, when):
+        """Create or reuse the pending transaction of an invoice"""
+        with self.db.transaction() as cursor:
+            invoice = cursor.execute(
+                "SELECT id, final_amount, is_paid FROM invoices WHERE id = ?", (invoice_id,)
+            ).fetchone()
+            if not invoice:
+                raise PaymentError("Invoice not found")
+            if invoice['is_paid']:
+                raise PaymentError("Invoice already paid")
+            pending = cursor.execute(
+                """SELECT * FROM payment_transactions
+                   WHERE invoice_id = ? AND status = 'pending' ORDER BY id DESC LIMIT 1""",
+                (invoice_id,)
+            ).fetchone()
+            if pending:
+                return dict(pending)
+            key = uuid.uuid4().hex
+            cursor.execute(
+                """INSERT INTO payment_transactions
+                   (invoice_id, gateway, amount, status, transaction_date, idempotency_key, updated_at)
+                   VALUES (?, ?, ?, 'pending', ?, ?, ?)""",
+                (invoice_id, self.gateway.name, invoice['final_amount'] or 0, when, key, when)
+            )
+            return dict(cursor.execute("SELECT * FROM payment_transactions WHERE id = ?",
+                                       (cursor.lastrowid,)).fetchone())
+    
+    def pay_invoice(self, invoice_id, callback=None, when=None):
+        """Start a card payment; returns a Future of the final transaction dict
+        
+        The transaction row is written before this returns. callback, if
+        given, is called with the transaction dict from a worker thread.
+        """
+        if not self.is_configured():
+            raise PaymentError("No card payment gateway is configured")
+        transaction = self._begin(invoice_id, (when or datetime.now()).strftime(TIME_FORMAT))
+        future = self._executor.submit(self._authorize, transaction)
+        if callback:
+            def notify(done):
+                try:
+                    result = done.result()
+                except Exception as e:
+                    log_exception(f"Card payment for invoice #{invoice_id} failed", e)
+                    result = dict(transaction, notes=str(e))
+                callback(result)
+            future.add_done_callback(notify)
+        return future
+    
+    def _authorize(self, transaction):
+        """Worker: ask the gateway and record its answer"""
+        try:
+            answer = self.gateway.authorize(transaction['idempotency_key'], transaction['amount'],
+                                            f"Invoice #{transaction['invoice_id']}")
+        except GatewayError as e:
+            log_warning(f"Card payment for invoice #{transaction['invoice_id']} left pending: {e}")
+            self.db.execute(
+                "UPDATE payment_transactions SET notes = ? WHERE id = ? AND status = 'pending'",
+                (f"No answer from gateway: {e}", transaction['id'])
+            )
+        else:
+            self._apply(transaction['idempotency_key'], answer)
+        return dict(self.db.fetchone("SELECT * FROM payment_transactions WHERE id = ?", (transaction['id'],)))
+    
+    def _apply(self, key, answer, now=None):
+        """Record a gateway answer once; an approval marks the invoice paid"""
+        status = answer.get('status')
+        if status not in FINAL_STATUSES:
+            return False
+        now = (now or datetime.now()).strftime(TIME_FORMAT)
+        with self.db.transaction() as cursor:
+            cursor.execute(
+                """UPDATE payment_transactions SET status = ?, transaction_id = ?, notes = ?, updated_at = ?
+                   WHERE idempotency_key = ? AND status = 'pending'""",
+                (status, answer.get('transaction_id'), answer.get('message'), now, key)
+            )
+            if cursor.rowcount != 1:
+                return False
+            if status == 'approved':
+                invoice_id = cursor.execute(
+                    "SELECT invoice_id FROM payment_transactions WHERE idempotency_key = ?", (key,)
+                ).fetchone()['invoice_id']
+                try:
+                    self.ledger.pay_invoice(invoice_id, 'Card')
+                except PaymentError as e:
+                    # Settled some other way meanwhile; the card charge needs a refund
+                    cursor.execute(
+                        "UPDATE payment_transactions SET notes = ? WHERE idempotency_key = ?",
+                        (f"Approved but not applied: {e}", key)
+                    )
+                    log_warning(f"Card payment {answer.get('transaction_id')} approved for invoice #{invoice_id}, "
+                                f"which was already settled")
+        return True
+    
+    def reconcile_pending(self, now=None, limit=500):
+        """Resolve pending transactions with one gateway lookup
+        
+        Pending rows the gateway has never seen are marked 'failed' once
+        older than pending_expiry_minutes. Returns {'checked', 'resolved',
+        'expired'}.
+        """
+        result = {'checked': 0, 'resolved': 0, 'expired': 0}
+        if not self.is_configured():
+            return result
+        now = now or datetime.now()
+        pending = self.db.fetchall(
+            """SELECT idempotency_key, transaction_date FROM payment_transactions
+               WHERE status = 'pending' ORDER BY id LIMIT ?""",
+            (limit,)
+        )
+        if not pending:
+            return result
+        result['checked'] = len(pending)
+        answers = self.gateway.lookup(row['idempotency_key'] for row in pending)
+        expiry = (now - timedelta(minutes=self.pending_expiry_minutes)).strftime(TIME_FORMAT)
+        for row in pending:
+            answer = answers.get(row['idempotency_key'])
+            if answer:
+                result['resolved'] += self._apply(row['idempotency_key'], answer, now)
+            elif row['transaction_date'] < expiry:
+                result['expired'] += self._apply(
+                    row['idempotency_key'],
+                    {'status': 'failed', 'message': 'Never reached the gateway'}, now
+                )
+        if result['resolved'] or result['expired']:
+            log_info(f"Card reconciliation: {result}")
+        return result
+    
+    def invoice_transactions(self, invoice_id):
+        """All card attempts for an invoice, newest first"""
+        return self.db.fetchall(
+            "SELECT * FROM payment_transactions WHERE invoice_id = ? ORDER BY id DESC", (invoice_id,)
+        )
+    
+    def start_reconciler(self, interval=30):
+        """Poll pending transactions every `interval` seconds in the background"""
+        if self._reconciler and self._reconciler.is_alive():
+            return
+        self._stop.clear()
+        
+        def loop():
+            while not self._stop.wait(interval):
+                try:
+                    self.reconcile_pending()
+                except GatewayError as e:
+                    log_warning(f"Card reconciliation skipped: {e}")
+                except Exception as e:
+                    log_exception("Card reconciliation failed", e)
+        
+        self._reconciler = threading.Thread(target=loop, name='card-reconciler', daemon=True)
+        self._reconciler.start()
+    
+    def stop(self):
+        """Stop the reconciler, the worker pool and the local gateway, if any"""
+        self._stop.set()
+        if self._reconciler:
+            self._reconciler.join(timeout=5)
+            self._reconciler = None
+        self._executor.shutdown(wait=False)
+        if self._local_server:
+            self._local_server.stop()
+            self._local_server = None
+    
+    def start_from_settings(self):
+        """Set up the gateway from settings and start the reconciler
+        
+        payment_gateway is 'none', 'local' (the stand-in server) or a
+        gateway base URL. Returns the gateway URL or None.
+        """
+        settings = {
+            row['key']: row['value']
+            for row in self.db.fetchall(
+                "SELECT key, value FROM settings WHERE key IN ('payment_gateway', 'payment_gateway_timeout')"
+            )
+        }
+        target = (settings.get('payment_gateway') or 'none').strip()
+        if target == 'none':
+            return None
+        try:
+            timeout = float(settings.get('payment_gateway_timeout') or 10)
+        except ValueError:
+            timeout = 10.0
+        if target == 'local':
+            self._local_server = LocalGatewayServer()
+            url, name = self._local_server.start(), 'local'
+        else:
+            url, name = target, 'gateway'
+        self.gateway = PaymentGateway(url, name, timeout)
+        self.start_reconciler()
+        return url
+
+# Global card payments instance
+card_payments = CardPayments()
@@ -0,0 +1,181 @@
+"""
+Payments Module
+Invoice payment, wallet and loyalty movements recorded as ledger rows,
+with the running balances kept on the customers table
+"""
+from datetime import datetime
+
+from database import db
+from app_logger import log_info, log_warning
+
+TIME_FORMAT = '%Y-%m-%d %H:%M:%S'
+# Wallet balances are compared to the cent
+BALANCE_TOLERANCE = 0.005
+
+class PaymentError(Exception):
+    """Raised when a payment or balance movement is refused"""
+
+class PaymentLedger:
+    """Wallet and loyalty ledgers over wallet_transactions and loyalty_transactions
+    
+    Every movement appends a ledger row and updates the balance on
+    customers in the same transaction. Debits only apply if the balance
+    covers them, so balances never go negative.
+    """
+    def __init__(self, database=None):
+        self.db = database or db
+    
+    def points_rate(self):
+        """Loyalty points earned per unit spent, from the loyalty_points_rate setting"""
+        row = self.db.fetchone("SELECT value FROM settings WHERE key = 'loyalty_points_rate'")
+        try:
+            return float(row['value']) if row else 1.0
+        except (TypeError, ValueError):
+            return 1.0
+    
+    def _move_wallet(self, cursor, customer_id, amount, transaction_type, description, invoice_id, when):
+        """Apply a wallet movement; a debit fails unless the balance covers it"""
+        cursor.execute(
+            """UPDATE customers SET wallet_balance = ROUND(COALESCE(wallet_balance, 0) + ?, 2)
+               WHERE id = ? AND COALESCE(wallet_balance, 0) + ? > ?""",
+            (amount, customer_id, amount, -BALANCE_TOLERANCE)
+        )
+        if cursor.rowcount != 1:
+            if not cursor.execute("SELECT 1 FROM customers WHERE id = ?", (customer_id,)).fetchone():
+                raise PaymentError("Customer not found")
+            raise PaymentError("Insufficient wallet balance")
+        cursor.execute(
+            """INSERT INTO wallet_transactions
+               (customer_id, transaction_type, amount, description, transaction_date, invoice_id)
+               VALUES (?, ?, ?, ?, ?, ?)""",
+            (customer_id, transaction_type, round(amount, 2), description, when.strftime(TIME_FORMAT), invoice_id)
+        )
+    
+    def _move_points(self, cursor, customer_id, points, transaction_type, description, invoice_id, when):
+        """Apply a loyalty points movement; a redemption fails unless enough points are held"""
+        cursor.execute(
+            """UPDATE customers SET loyalty_points = COALESCE(loyalty_points, 0) + ?
+               WHERE id = ? AND COALESCE(loyalty_points, 0) + ? >= 0""",
+            (points, customer_id, points)
+        )
+        if cursor.rowcount != 1:
+            if not cursor.execute("SELECT 1 FROM customers WHERE id = ?", (customer_id,)).fetchone():
+                raise PaymentError("Customer not found")
+            raise PaymentError("Not enough loyalty points")
+        cursor.execute(
+            """INSERT INTO loyalty_transactions
+               (customer_id, transaction_type, points, description, transaction_date, invoice_id)
+               VALUES (?, ?, ?, ?, ?, ?)""",
+            (customer_id, transaction_type, points, description, when.strftime(TIME_FORMAT), invoice_id)
+        )
+    
+    def adjust_wallet(self, customer_id, amount, description=None, when=None):
+        """Top up (positive) or withdraw from (negative) a customer's wallet"""
+        if not amount:
+            raise PaymentError("Amount must not be zero")
+        transaction_type = 'topup' if amount > 0 else 'withdrawal'
+        with self.db.transaction() as cursor:
+            self._move_wallet(cursor, customer_id, amount, transaction_type,
+                              description or transaction_type.title(), None, when or datetime.now())
+    
+    def adjust_points(self, customer_id, points, description=None, when=None):
+        """Grant (positive) or redeem (negative) loyalty points"""
+        if not points:
+            raise PaymentError("Points must not be zero")
+        transaction_type = 'adjust' if points > 0 else 'redeem'
+        with self.db.transaction() as cursor:
+            self._move_points(cursor, customer_id, int(points), transaction_type,
+                              description or 'Manual adjustment', None, when or datetime.now())
+    
+    def pay_invoice(self, invoice_id, payment_method, when=None):
+        """Settle an invoice in one transaction
+        
+        Marks it paid (only if still unpaid), debits the wallet for wallet
+        payments, updates the customer's spending and credits loyalty
+        points. Returns {'invoice_id', 'amount', 'points', 'customer_id'}.
+        """
+        when = when or datetime.now()
+        rate = self.points_rate()
+        with self.db.transaction() as cursor:
+            invoice = cursor.execute(
+                "SELECT id, customer_id, final_amount FROM invoices WHERE id = ?", (invoice_id,)
+            ).fetchone()
+            if not invoice:
+                raise PaymentError("Invoice not found")
+            cursor.execute(
+                "UPDATE invoices SET is_paid = 1, payment_method = ? WHERE id = ? AND COALESCE(is_paid, 0) = 0",
+                (payment_method, invoice_id)
+            )
+            if cursor.rowcount != 1:
+                raise PaymentError("Invoice already paid")
+            
+            amount = invoice['final_amount'] or 0
+            customer_id = invoice['customer_id']
+            points = int(amount * rate)
+            if customer_id is None:
+                if payment_method == 'Wallet':
+                    raise PaymentError("Walk-in invoices cannot be paid from a wallet")
+                return {'invoice_id': invoice_id, 'amount': amount, 'points': 0, 'customer_id': None}
+            
+            if payment_method == 'Wallet' and amount > 0:
+                self._move_wallet(cursor, customer_id, -amount, 'payment',
+                                  f"Invoice #{invoice_id}", invoice_id, when)
+            cursor.execute(
+                """UPDATE customers SET total_spent = COALESCE(total_spent, 0) + ?, last_visit_date = ?
+                   WHERE id = ?""",
+                (amount, when.strftime('%Y-%m-%d'), customer_id)
+            )
+            if points > 0:
+                self._move_points(cursor, customer_id, points, 'earn', f"Invoice #{invoice_id}", invoice_id, when)
+        
+        return {'invoice_id': invoice_id, 'amount': amount, 'points': points, 'customer_id': customer_id}
+    
+    def wallet_history(self, customer_id, limit=20):
+        """Latest wallet ledger rows of a customer"""
+        return self.db.fetchall(
+            "SELECT * FROM wallet_transactions WHERE customer_id = ? ORDER BY id DESC LIMIT ?",
+            (customer_id, limit)
+        )
+    
+    def points_history(self, customer_id, limit=20):
+        """Latest loyalty ledger rows of a customer"""
+        return self.db.fetchall(
+            "SELECT * FROM loyalty_transactions WHERE customer_id = ? ORDER BY id DESC LIMIT ?",
+            (customer_id, limit)
+        )
+    
+    def reconcile(self, repair=False):
+        """Compare every customer's balances with the ledger sums in one pass
+        
+        Returns the customers whose wallet or points differ. With
+        repair=True the balances on customers are reset to the ledger.
+        """
+        with self.db.lock:
+            rows = self.db.fetchall(
+                """SELECT c.id, c.wallet_balance, COALESCE(w.total, 0) as wallet_ledger,
+                          c.loyalty_points, COALESCE(l.total, 0) as points_ledger
+                   FROM customers c
+                   LEFT JOIN (SELECT customer_id, SUM(amount) as total FROM wallet_transactions
+                              GROUP BY customer_id) w ON w.customer_id = c.id
+                   LEFT JOIN (SELECT customer_id, SUM(points) as total FROM loyalty_transactions
+                              GROUP BY customer_id) l ON l.customer_id = c.id
+                   WHERE ABS(COALESCE(c.wallet_balance, 0) - COALESCE(w.total, 0)) > ?
+                      OR COALESCE(c.loyalty_points, 0) != COALESCE(l.total, 0)""",
+                (BALANCE_TOLERANCE,)
+            )
+            mismatches = [dict(row) for row in rows]
+            if mismatches and repair:
+                with self.db.transaction() as cursor:
+                    cursor.executemany(
+                        "UPDATE customers SET wallet_balance = ROUND(?, 2), loyalty_points = ? WHERE id = ?",
+                        [(m['wallet_ledger'], m['points_ledger'], m['id']) for m in mismatches]
+                    )
+        
+        for m in mismatches:
+            log_warning(f"Customer #{m['id']} balance differs from ledger: wallet {m['wallet_balance']} "
+                        f"vs {m['wallet_ledger']:.2f}, points {m['loyalty_points']} vs {m['points_ledger']}")
+        log_info(f"Balance reconciliation: {len(mismatches)} mismatch(es){' repaired' if repair else ''}")
+        return mismatches
+
+# Global payment ledger instance
+payment_ledger = PaymentLedger()
@@ -0,0 +1,157 @@
+"""
+Receipt PDF Module
+Draws loaded invoices as PDF receipts with a QR code, using the bundled
+Vazir fonts. Needs no database, so batch render workers import only this
+module; run as a script it renders a JSON file of jobs.
+"""
+import json
+import os
+import sys
+from functools import lru_cache
+
+from app_logger import log_warning, log_exception
+
+try:
+    from reportlab.lib.units import mm
+    from reportlab.lib.utils import ImageReader
+    from reportlab.pdfbase import pdfmetrics
+    from reportlab.pdfbase.ttfonts import TTFont
+    from reportlab.pdfgen import canvas
+    PDF_SUPPORT = True
+except ImportError:
+    PDF_SUPPORT = False
+    mm = 72 / 25.4
+
+try:
+    import qrcode
+    QR_SUPPORT = True
+except ImportError:
+    QR_SUPPORT = False
+
+try:
+    import arabic_reshaper
+    from bidi.algorithm import get_display
+    BIDI_SUPPORT = True
+except ImportError:
+    BIDI_SUPPORT = False
+
+FONTS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'fonts')
+FONT_FILES = {'Vazir': 'Vazir-Regular.ttf', 'Vazir-Bold': 'Vazir-Bold.ttf'}
+FALLBACK_FONTS = {'Vazir': 'Helvetica', 'Vazir-Bold': 'Helvetica-Bold'}
+
+# 80 mm thermal-roll width; the height grows with the number of lines
+PAGE_WIDTH = 80 * mm
+MARGIN = 5 * mm
+LINE_HEIGHT = 5 * mm
+QR_SIZE = 30 * mm
+
+class RenderError(Exception):
+    """Raised when an invoice cannot be rendered"""
+
+@lru_cache(maxsize=None)
+def register_fonts():
+    """Register the Vazir fonts with reportlab once per process
+    
+    Returns font name -> registered name; the built-in Helvetica fonts are
+    used if a font file is missing.
+    """
+    names = {}
+    for name, filename in FONT_FILES.items():
+        path = os.path.join(FONTS_DIR, filename)
+        try:
+            pdfmetrics.registerFont(TTFont(name, path))
+            names[name] = name
+        except Exception as e:
+            log_warning(f"Could not load font {path}: {e}")
+            names[name] = FALLBACK_FONTS[name]
+    return names
+
+@lru_cache(maxsize=4096)
+def shape(text):
+    """Persian text reshaped and reordered for left-to-right drawing"""
+    text = str(text)
+    if not BIDI_SUPPORT or text.isascii():
+        return text
+    return get_display(arabic_reshaper.reshape(text))
+
+def qr_payload(invoice):
+    """Text encoded in an invoice's QR code"""
+    return f"INV:{invoice['id']};AMT:{invoice['final_amount'] or 0:.2f};DATE:{(invoice['invoice_date'] or '')[:10]}"
+
+def receipt_rows(invoice, template):
+    """(label, value, bold) rows printed on a receipt, top to bottom"""
+    currency = template['currency']
+    money = lambda amount: f"{amount or 0:,.2f} {currency}"
+    rows = [(template['title'], '', True)]
+    if template['contact_phone']:
+        rows.append((template['contact_phone'], '', False))
+    rows += [
+        (f"Invoice #{invoice['id']}", (invoice['invoice_date'] or '')[:16], False),
+        (invoice['customer_name'] or 'Walk-in', invoice['customer_phone'] or '', False),
+        ('', '', False),
+    ]
+    for line in invoice['lines']:
+        rows.append((f"{line['section']}: {line['description']}", money(line['amount']), False))
+    other = round((invoice['total_amount'] or 0) - sum(line['amount'] for line in invoice['lines']), 2)
+    if other > 0:
+        rows.append(('Other items', money(other), False))
+    rows += [('', '', False), ('Subtotal', money(invoice['total_amount']), False)]
+    if invoice['discount_amount']:
+        label = f"Discount ({invoice['campaign_code']})" if invoice['campaign_code'] else 'Discount'
+        rows.append((label, '-' + money(invoice['discount_amount']), False))
+    if invoice['tax_amount']:
+        rows.append(('Tax', money(invoice['tax_amount']), False))
+    rows.append(('Total', money(invoice['final_amount']), True))
+    rows.append(('Paid' if invoice['is_paid'] else 'Unpaid', invoice['payment_method'] or '', False))
+    return rows
+
+def render_pdf(invoice, template, path):
+    """Draw one loaded invoice to a PDF file; runs in the app or a render worker"""
+    if not PDF_SUPPORT:
+        raise RenderError("PDF rendering needs the reportlab package")
+    fonts = register_fonts()
+    rows = receipt_rows(invoice, template)
+    height = 2 * MARGIN + len(rows) * LINE_HEIGHT + (QR_SIZE + LINE_HEIGHT if QR_SUPPORT else 0)
+    
+    pdf = canvas.Canvas(path, pagesize=(PAGE_WIDTH, height))
+    pdf.setTitle(f"Invoice {invoice['id']}")
+    y = height - MARGIN - LINE_HEIGHT
+    for label, value, bold in rows:
+        pdf.setFont(fonts['Vazir-Bold' if bold else 'Vazir'], 9 if bold else 8)
+        if label and not value and bold:
+            pdf.drawCentredString(PAGE_WIDTH / 2, y, shape(label))
+        else:
+            pdf.drawString(MARGIN, y, shape(label))
+            pdf.drawRightString(PAGE_WIDTH - MARGIN, y, shape(value))
+        y -= LINE_HEIGHT
+    
+    if QR_SUPPORT:
+        image = qrcode.make(qr_payload(invoice), border=1).get_image()
+        pdf.drawImage(ImageReader(image), (PAGE_WIDTH - QR_SIZE) / 2, y - QR_SIZE + LINE_HEIGHT,
+                      width=QR_SIZE, height=QR_SIZE)
+    pdf.showPage()
+    pdf.save()
+    return path
+
+def render_job(job):
+    """Worker entry point: (invoice, template, path) -> path or None"""
+    invoice, template, path = job
+    try:
+        return render_pdf(invoice, template, path)
+    except Exception as e:
+        log_exception(f"Rendering invoice #{invoice['id']} failed", e)
+        return None
+
+def main():
+    """Render worker: render the jobs in the JSON file named on the command line
+    
+    Prints the written paths as a JSON list, null where an invoice failed.
+    """
+    with open(sys.argv[1], encoding='utf-8') as f:
+        jobs = json.load(f)
+    register_fonts()
+    json.dump([render_job(job) for job in jobs], sys.stdout)
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
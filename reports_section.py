@@ -2,11 +2,18 @@
 Reports and Analytics Section Module
 Handles overall business reports, charts, and statistics with Persian calendar support
 """
+import os
+import sqlite3
 import customtkinter as ctk
 from datetime import datetime, timedelta
 from ui_utils import *
 from database import db
 from translations import tr
+from commission_ledger import commission_ledger
+from day_close import day_closer
+from services import report_service, inventory_service, messaging_service
+from branch_consolidation import BranchReports
+from analytics_extract import analytics_extract, AnalyticsError
 try:
     import jdatetime
     JALALI_SUPPORT = True
@@ -17,6 +24,9 @@ class ReportsSection:
     def __init__(self, parent):
         self.parent = parent
         self.frame = GlassScrollableFrame(parent)
+        self.reports = report_service
+        self.inventory = inventory_service
+        self.branch_reports = None
         self.setup_ui()
     
     def setup_ui(self):
@@ -24,6 +34,7 @@ class ReportsSection:
         # Header
         header = create_section_header(self.frame, tr('reports_analytics'))
         header.pack(fill='x', padx=10, pady=10)
+        self.setup_branch_selector()
         
         # Create tabs
         self.tabview = ctk.CTkTabview(self.frame, fg_color=COLORS['surface'])
@@ -40,6 +51,44 @@ class ReportsSection:
         self.setup_stats_tab()
         self.setup_advanced_tab()
     
+    def setup_branch_selector(self):
+        """Offer the branches of the central database, when one is configured"""
+        row = db.fetchone("SELECT value FROM settings WHERE key = 'central_db_path'")
+        if not row or not row['value'] or not os.path.exists(row['value']):
+            return
+        self.branch_reports = BranchReports(row['value'])
+        try:
+            branches = self.branch_reports.branches()
+        except sqlite3.Error:
+            self.branch_reports = None
+            return
+        
+        branch_frame = GlassFrame(self.frame)
+        branch_frame.pack(fill='x', padx=10, pady=5)
+        GlassLabel(branch_frame, text="Branch:").pack(side='left', padx=10, pady=5)
+        self.branch_var = ctk.StringVar(value="This branch")
+        ctk.CTkOptionMenu(
+            branch_frame,
+            variable=self.branch_var,
+            values=["This branch", "All branches"] + branches,
+            command=self.select_branch,
+            fg_color=COLORS['surface'],
+            button_color=COLORS['primary']
+        ).pack(side='left', padx=10, pady=5)
+    
+    def select_branch(self, choice):
+        """Point the reports at this shop's database or the central one"""
+        if self.reports is not report_service:
+            self.reports.db.close()
+            self.inventory.db.close()
+        if choice == "This branch":
+            self.reports = report_service
+            self.inventory = inventory_service
+        else:
+            branch = None if choice == "All branches" else choice
+            self.reports = self.branch_reports.reports(branch)
+            self.inventory = self.branch_reports.inventory(branch)
+    
     def setup_sales_tab(self):
         """Setup sales reports interface"""
         tab = self.tabview.tab(tr('sales_reports'))
@@ -131,13 +180,13 @@ class ReportsSection:
         
         GlassLabel(options_frame, text="Section Performance", font=FONTS['heading']).pack(pady=10)
         
-        GlassButton(options_frame, text="Salon Performance", 
+        GlassButton(options_frame, text="Salon Performance",
                    command=self.show_salon_performance).pack(pady=5)
-        GlassButton(options_frame, text="Cafe Performance", 
+        GlassButton(options_frame, text="Cafe Performance",
                    command=self.show_cafe_performance).pack(pady=5)
-        GlassButton(options_frame, text="Gamnet Performance", 
+        GlassButton(options_frame, text="Gamnet Performance",
                    command=self.show_gamnet_performance).pack(pady=5)
-        GlassButton(options_frame, text="Compare Sections", 
+        GlassButton(options_frame, text="Compare Sections",
                    command=self.compare_sections).pack(pady=5)
         
         # Report display
@@ -161,11 +210,11 @@ class ReportsSection:
         
         GlassLabel(options_frame, text="Overall Statistics", font=FONTS['heading']).pack(pady=10)
         
-        GlassButton(options_frame, text="Today's Overview", 
+        GlassButton(options_frame, text="Today's Overview",
                    command=self.show_today_overview).pack(pady=5)
-        GlassButton(options_frame, text="Customer Statistics", 
+        GlassButton(options_frame, text="Customer Statistics",
                    command=self.show_customer_stats).pack(pady=5)
-        GlassButton(options_frame, text="Employee Performance", 
+        GlassButton(options_frame, text="Employee Performance",
                    command=self.show_employee_performance).pack(pady=5)
         
         # Report display
@@ -182,23 +231,14 @@ class ReportsSection:
     def show_daily_sales(self):
         """Show daily sales report"""
         self.sales_text.delete('1.0', 'end')
-        today = datetime.now().strftime('%Y-%m-%d')
-        
-        invoices = db.fetchall(
-            """SELECT COUNT(*) as count, 
-                      SUM(final_amount) as revenue,
-                      AVG(final_amount) as avg_invoice
-               FROM invoices
-               WHERE DATE(invoice_date) = ? AND is_paid = 1""",
-            (today,)
-        )
+        summary = day_closer.daily_summary()
         
-        self.sales_text.insert('end', f"Daily Sales Report - {today}\n\n")
+        self.sales_text.insert('end', f"Daily Sales Report - {summary['date']}\n\n")
         
-        if invoices and invoices[0]['count']:
-            self.sales_text.insert('end', f"Total Invoices: {invoices[0]['count']}\n")
-            self.sales_text.insert('end', f"Total Revenue: ${invoices[0]['revenue']:.2f}\n")
-            self.sales_text.insert('end', f"Average Invoice: ${invoices[0]['avg_invoice']:.2f}\n")
+        if summary['paid_count']:
+            self.sales_text.insert('end', f"Total Invoices: {summary['paid_count']}\n")
+            self.sales_text.insert('end', f"Total Revenue: ${summary['revenue']:.2f}\n")
+            self.sales_text.insert('end', f"Average Invoice: ${summary['revenue'] / summary['paid_count']:.2f}\n")
         else:
             self.sales_text.insert('end', "No sales data for today.\n")
     
@@ -207,24 +247,17 @@ class ReportsSection:
         self.sales_text.delete('1.0', 'end')
         
         # Last 7 days
-        end_date = datetime.now()
-        start_date = end_date - timedelta(days=7)
-        
-        invoices = db.fetchall(
-            """SELECT COUNT(*) as count, 
-                      SUM(final_amount) as revenue
-               FROM invoices
-               WHERE DATE(invoice_date) BETWEEN ? AND ? AND is_paid = 1""",
-            (start_date.strftime('%Y-%m-%d'), end_date.strftime('%Y-%m-%d'))
-        )
+        end_date = datetime.now().strftime('%Y-%m-%d')
+        start_date = (datetime.now() - timedelta(days=7)).strftime('%Y-%m-%d')
+        totals = self.reports.sales_totals(start_date, end_date)
         
         self.sales_text.insert('end', f"Weekly Sales Report\n")
-        self.sales_text.insert('end', f"{start_date.strftime('%Y-%m-%d')} to {end_date.strftime('%Y-%m-%d')}\n\n")
+        self.sales_text.insert('end', f"{start_date} to {end_date}\n\n")
         
-        if invoices and invoices[0]['count']:
-            self.sales_text.insert('end', f"Total Invoices: {invoices[0]['count']}\n")
-            self.sales_text.insert('end', f"Total Revenue: ${invoices[0]['revenue']:.2f}\n")
-            self.sales_text.insert('end', f"Daily Average: ${invoices[0]['revenue'] / 7:.2f}\n")
+        if totals['count']:
+            self.sales_text.insert('end', f"Total Invoices: {totals['count']}\n")
+            self.sales_text.insert('end', f"Total Revenue: ${totals['revenue']:.2f}\n")
+            self.sales_text.insert('end', f"Daily Average: ${totals['revenue'] / 7:.2f}\n")
         else:
             self.sales_text.insert('end', "No sales data for this week.\n")
     
@@ -234,54 +267,29 @@ class ReportsSection:
         
         # Current month
         now = datetime.now()
-        start_date = now.replace(day=1)
-        
-        invoices = db.fetchall(
-            """SELECT COUNT(*) as count, 
-                      SUM(final_amount) as revenue
-               FROM invoices
-               WHERE DATE(invoice_date) >= ? AND is_paid = 1""",
-            (start_date.strftime('%Y-%m-%d'),)
-        )
+        totals = self.reports.sales_totals(now.replace(day=1).strftime('%Y-%m-%d'), now.strftime('%Y-%m-%d'))
         
         self.sales_text.insert('end', f"Monthly Sales Report - {now.strftime('%B %Y')}\n\n")
         
-        if invoices and invoices[0]['count']:
-            self.sales_text.insert('end', f"Total Invoices: {invoices[0]['count']}\n")
-            self.sales_text.insert('end', f"Total Revenue: ${invoices[0]['revenue']:.2f}\n")
+        if totals['count']:
+            self.sales_text.insert('end', f"Total Invoices: {totals['count']}\n")
+            self.sales_text.insert('end', f"Total Revenue: ${totals['revenue']:.2f}\n")
         else:
             self.sales_text.insert('end', "No sales data for this month.\n")
     
     def show_salon_performance(self):
         """Show salon section performance"""
         self.performance_text.delete('1.0', 'end')
-        
-        # Get salon statistics
-        services = db.fetchall(
-            """SELECT COUNT(*) as count, SUM(price) as revenue
-               FROM salon_service_records
-               WHERE DATE(service_date) >= date('now', '-30 days')"""
-        )
+        salon = self.reports.section_activity(30)['Salon']
         
         self.performance_text.insert('end', "Salon Performance (Last 30 Days)\n\n")
         
-        if services and services[0]['count']:
-            self.performance_text.insert('end', f"Services Performed: {services[0]['count']}\n")
-            self.performance_text.insert('end', f"Revenue: ${services[0]['revenue']:.2f}\n")
-            
-            # Top stylists
-            stylists = db.fetchall(
-                """SELECT e.name, COUNT(*) as services, SUM(s.price) as revenue
-                   FROM salon_service_records s
-                   JOIN employees e ON s.stylist_id = e.id
-                   WHERE DATE(s.service_date) >= date('now', '-30 days')
-                   GROUP BY s.stylist_id
-                   ORDER BY revenue DESC
-                   LIMIT 5"""
-            )
+        if salon['count']:
+            self.performance_text.insert('end', f"Services Performed: {salon['count']}\n")
+            self.performance_text.insert('end', f"Revenue: ${salon['revenue']:.2f}\n")
             
             self.performance_text.insert('end', "\nTop Stylists:\n")
-            for stylist in stylists:
+            for stylist in self.reports.top_stylists(30):
                 self.performance_text.insert('end',
                     f"  {stylist['name']}: {stylist['services']} services, ${stylist['revenue']:.2f}\n"
                 )
@@ -289,34 +297,16 @@ class ReportsSection:
     def show_cafe_performance(self):
         """Show cafe section performance"""
         self.performance_text.delete('1.0', 'end')
-        
-        # Get cafe statistics
-        orders = db.fetchall(
-            """SELECT COUNT(*) as count, SUM(total_amount) as revenue
-               FROM cafe_orders
-               WHERE DATE(order_date) >= date('now', '-30 days')"""
-        )
+        cafe = self.reports.section_activity(30)['Cafe']
         
         self.performance_text.insert('end', "Cafe Performance (Last 30 Days)\n\n")
         
-        if orders and orders[0]['count']:
-            self.performance_text.insert('end', f"Orders: {orders[0]['count']}\n")
-            self.performance_text.insert('end', f"Revenue: ${orders[0]['revenue']:.2f}\n")
-            
-            # Popular items
-            items = db.fetchall(
-                """SELECT m.name, SUM(oi.quantity) as sold, SUM(oi.price * oi.quantity) as revenue
-                   FROM cafe_order_items oi
-                   JOIN cafe_menu m ON oi.menu_item_id = m.id
-                   JOIN cafe_orders o ON oi.order_id = o.id
-                   WHERE DATE(o.order_date) >= date('now', '-30 days')
-                   GROUP BY m.id
-                   ORDER BY revenue DESC
-                   LIMIT 5"""
-            )
+        if cafe['count']:
+            self.performance_text.insert('end', f"Orders: {cafe['count']}\n")
+            self.performance_text.insert('end', f"Revenue: ${cafe['revenue']:.2f}\n")
             
             self.performance_text.insert('end', "\nTop Items:\n")
-            for item in items:
+            for item in self.reports.top_menu_items(30):
                 self.performance_text.insert('end',
                     f"  {item['name']}: {item['sold']} sold, ${item['revenue']:.2f}\n"
                 )
@@ -324,68 +314,40 @@ class ReportsSection:
     def show_gamnet_performance(self):
         """Show gamnet section performance"""
         self.performance_text.delete('1.0', 'end')
-        
-        # Get gamnet statistics
-        sessions = db.fetchall(
-            """SELECT COUNT(*) as count, SUM(charge) as revenue, SUM(duration_minutes) as total_minutes
-               FROM gamnet_sessions
-               WHERE DATE(start_time) >= date('now', '-30 days') AND end_time IS NOT NULL"""
-        )
+        gamnet = self.reports.section_activity(30)['Gamnet']
         
         self.performance_text.insert('end', "Gamnet Performance (Last 30 Days)\n\n")
         
-        if sessions and sessions[0]['count']:
-            self.performance_text.insert('end', f"Sessions: {sessions[0]['count']}\n")
-            self.performance_text.insert('end', f"Revenue: ${sessions[0]['revenue']:.2f}\n")
-            self.performance_text.insert('end', f"Total Gaming Time: {sessions[0]['total_minutes']} minutes\n")
+        if gamnet['count']:
+            self.performance_text.insert('end', f"Sessions: {gamnet['count']}\n")
+            self.performance_text.insert('end', f"Revenue: ${gamnet['revenue']:.2f}\n")
+            self.performance_text.insert('end', f"Total Gaming Time: {gamnet['minutes']} minutes\n")
     
     def compare_sections(self):
         """Compare performance across all sections"""
         self.performance_text.delete('1.0', 'end')
         self.performance_text.insert('end', "Section Comparison (Last 30 Days)\n\n")
         
-        # Salon
-        salon = db.fetchone(
-            """SELECT SUM(price) as revenue FROM salon_service_records
-               WHERE DATE(service_date) >= date('now', '-30 days')"""
-        )
-        salon_rev = salon['revenue'] or 0
-        
-        # Cafe
-        cafe = db.fetchone(
-            """SELECT SUM(total_amount) as revenue FROM cafe_orders
-               WHERE DATE(order_date) >= date('now', '-30 days')"""
-        )
-        cafe_rev = cafe['revenue'] or 0
-        
-        # Gamnet
-        gamnet = db.fetchone(
-            """SELECT SUM(charge) as revenue FROM gamnet_sessions
-               WHERE DATE(start_time) >= date('now', '-30 days') AND end_time IS NOT NULL"""
-        )
-        gamnet_rev = gamnet['revenue'] or 0
+        activity = self.reports.section_activity(30)
+        total = sum(section['revenue'] for section in activity.values())
         
-        total = salon_rev + cafe_rev + gamnet_rev
-        
-        self.performance_text.insert('end', f"Salon: ${salon_rev:.2f} ({salon_rev/total*100 if total > 0 else 0:.1f}%)\n")
-        self.performance_text.insert('end', f"Cafe: ${cafe_rev:.2f} ({cafe_rev/total*100 if total > 0 else 0:.1f}%)\n")
-        self.performance_text.insert('end', f"Gamnet: ${gamnet_rev:.2f} ({gamnet_rev/total*100 if total > 0 else 0:.1f}%)\n")
+        for name, section in activity.items():
+            share = section['revenue'] / total * 100 if total > 0 else 0
+            self.performance_text.insert('end', f"{name}: ${section['revenue']:.2f} ({share:.1f}%)\n")
         self.performance_text.insert('end', f"\nTotal Revenue: ${total:.2f}\n")
     
     def show_today_overview(self):
         """Show today's overview"""
         self.stats_text.delete('1.0', 'end')
-        today = datetime.now().strftime('%Y-%m-%d')
+        summary = day_closer.daily_summary()
+        today = summary['date']
         
         self.stats_text.insert('end', f"Today's Overview - {today}\n\n")
+        if summary['closed_at']:
+            self.stats_text.insert('end', f"Day closed at {summary['closed_at']}\n\n")
         
         # Customers
-        customers = db.fetchone(
-            """SELECT COUNT(DISTINCT customer_id) as count FROM invoices
-               WHERE DATE(invoice_date) = ?""",
-            (today,)
-        )
-        self.stats_text.insert('end', f"Customers Served: {customers['count'] or 0}\n")
+        self.stats_text.insert('end', f"Customers Served: {summary['customers']}\n")
         
         # Appointments
         appointments = db.fetchone(
@@ -396,58 +358,27 @@ class ReportsSection:
         self.stats_text.insert('end', f"Salon Appointments: {appointments['count'] or 0}\n")
         
         # Active gaming sessions
-        active_sessions = db.fetchone(
-            """SELECT COUNT(*) as count FROM gamnet_sessions
-               WHERE DATE(start_time) = ? AND end_time IS NULL""",
-            (today,)
-        )
-        self.stats_text.insert('end', f"Active Gaming Sessions: {active_sessions['count'] or 0}\n")
+        self.stats_text.insert('end', f"Active Gaming Sessions: {summary['gamnet_running']}\n")
         
         # Revenue
-        revenue = db.fetchone(
-            """SELECT SUM(final_amount) as total FROM invoices
-               WHERE DATE(invoice_date) = ? AND is_paid = 1""",
-            (today,)
-        )
-        self.stats_text.insert('end', f"\nTotal Revenue: ${revenue['total'] or 0:.2f}\n")
+        self.stats_text.insert('end', f"\nTotal Revenue: ${summary['revenue']:.2f}\n")
+        for section, section_totals in summary['sections'].items():
+            self.stats_text.insert('end', f"  {section}: ${section_totals['amount']:.2f} ({section_totals['count']})\n")
     
     def show_customer_stats(self):
         """Show customer statistics"""
         self.stats_text.delete('1.0', 'end')
         self.stats_text.insert('end', "Customer Statistics\n\n")
         
-        # Total customers
-        total = db.fetchone("SELECT COUNT(*) as count FROM customers")
-        self.stats_text.insert('end', f"Total Customers: {total['count']}\n")
-        
-        # Active customers (visited in last 30 days)
-        active = db.fetchone(
-            """SELECT COUNT(*) as count FROM customers
-               WHERE last_visit_date IS NOT NULL
-               AND julianday('now') - julianday(last_visit_date) <= 30"""
-        )
-        self.stats_text.insert('end', f"Active (30 days): {active['count']}\n")
-        
-        # New customers this month
-        now = datetime.now()
-        new = db.fetchone(
-            """SELECT COUNT(*) as count FROM customers
-               WHERE DATE(registration_date) >= ?""",
-            (now.replace(day=1).strftime('%Y-%m-%d'),)
-        )
-        self.stats_text.insert('end', f"New This Month: {new['count']}\n")
-        
-        # Top spending customers
-        top = db.fetchall(
-            """SELECT name, phone, total_spent FROM customers
-               ORDER BY total_spent DESC
-               LIMIT 10"""
-        )
+        stats = self.reports.customer_stats()
+        self.stats_text.insert('end', f"Total Customers: {stats['total']}\n")
+        self.stats_text.insert('end', f"Active (30 days): {stats['active']}\n")
+        self.stats_text.insert('end', f"New This Month: {stats['new_this_month']}\n")
         
         self.stats_text.insert('end', "\nTop Customers:\n")
-        for customer in top:
+        for customer in stats['top']:
             self.stats_text.insert('end',
-                f"  {customer['name']} ({customer['phone']}): ${customer['total_spent']:.2f}\n"
+                f"  {customer['name']} ({customer['phone']}): ${customer['total_spent'] or 0:.2f}\n"
             )
     
     def show_employee_performance(self):
@@ -456,18 +387,10 @@ class ReportsSection:
         self.stats_text.insert('end', "Employee Performance Overview\n\n")
         
         # Top performing employees by commissions
-        employees = db.fetchall(
-            """SELECT e.name, e.section, SUM(c.amount) as total_commissions
-               FROM employees e
-               LEFT JOIN employee_commissions c ON e.id = c.employee_id
-               WHERE e.is_active = 1
-               GROUP BY e.id
-               ORDER BY total_commissions DESC
-               LIMIT 10"""
-        )
+        employees = commission_ledger.balances()[:10]
         
         for emp in employees:
-            commissions = emp['total_commissions'] or 0
+            commissions = emp['commission_earned']
             self.stats_text.insert('end',
                 f"{emp['name']} ({emp['section']}): ${commissions:.2f} in commissions\n"
             )
@@ -506,86 +429,34 @@ class ReportsSection:
         self.sales_text.insert('end', f"Period: {start_date} to {end_date}\n")
         self.sales_text.insert('end', "=" * 80 + "\n\n")
         
-        # Total revenue
-        revenue = db.fetchone(
-            """SELECT SUM(final_amount) as total, COUNT(*) as count
-               FROM invoices
-               WHERE DATE(invoice_date) BETWEEN ? AND ? AND is_paid = 1""",
-            (start_date, end_date)
-        )
-        
-        total_revenue = revenue['total'] or 0
-        invoice_count = revenue['count'] or 0
+        # Periods past the archive horizon also include the archived invoices
+        report = self.reports.sales_report(start_date, end_date)
+        total_revenue = report['revenue']
+        invoice_count = report['count']
         
         self.sales_text.insert('end', f"Total Revenue: ${total_revenue:.2f}\n")
         self.sales_text.insert('end', f"Total Invoices: {invoice_count}\n")
         self.sales_text.insert('end', f"Average Invoice: ${(total_revenue/invoice_count if invoice_count > 0 else 0):.2f}\n\n")
         
-        # Revenue by section (estimated from services/orders)
+        # Revenue by section, from the rows linked to each invoice
         self.sales_text.insert('end', "Revenue Breakdown by Section:\n")
         self.sales_text.insert('end', "-" * 40 + "\n")
-        
-        # Salon revenue
-        salon_revenue = db.fetchone(
-            """SELECT SUM(price) as total FROM salon_service_records
-               WHERE DATE(service_date) BETWEEN ? AND ?""",
-            (start_date, end_date)
-        )
-        salon_total = salon_revenue['total'] or 0
-        self.sales_text.insert('end', f"Salon: ${salon_total:.2f}\n")
-        
-        # Cafe revenue
-        cafe_revenue = db.fetchone(
-            """SELECT SUM(total_amount) as total FROM cafe_orders
-               WHERE DATE(order_date) BETWEEN ? AND ?""",
-            (start_date, end_date)
-        )
-        cafe_total = cafe_revenue['total'] or 0
-        self.sales_text.insert('end', f"Cafe: ${cafe_total:.2f}\n")
-        
-        # Gamnet revenue
-        gamnet_revenue = db.fetchone(
-            """SELECT SUM(charge) as total FROM gamnet_sessions
-               WHERE DATE(start_time) BETWEEN ? AND ? AND end_time IS NOT NULL""",
-            (start_date, end_date)
-        )
-        gamnet_total = gamnet_revenue['total'] or 0
-        self.sales_text.insert('end', f"Gamnet: ${gamnet_total:.2f}\n\n")
+        for section in ('Salon', 'Cafe', 'Gamnet'):
+            self.sales_text.insert('end', f"{section}: ${report['sections'].get(section, 0):.2f}\n")
+        self.sales_text.insert('end', "\n")
         
         # Payment methods
         self.sales_text.insert('end', "Payment Methods:\n")
         self.sales_text.insert('end', "-" * 40 + "\n")
-        
-        payments = db.fetchall(
-            """SELECT payment_method, SUM(final_amount) as total, COUNT(*) as count
-               FROM invoices
-               WHERE DATE(invoice_date) BETWEEN ? AND ? AND is_paid = 1
-               GROUP BY payment_method""",
-            (start_date, end_date)
-        )
-        
-        for payment in payments:
-            method = payment['payment_method'] or 'Unknown'
-            self.sales_text.insert('end', 
-                f"{method}: ${payment['total']:.2f} ({payment['count']} transactions)\n"
+        for method, totals in report['payment_methods'].items():
+            self.sales_text.insert('end',
+                f"{method}: ${totals['amount']:.2f} ({totals['count']} transactions)\n"
             )
         
         # Top services/products
         self.sales_text.insert('end', "\nTop Services:\n")
         self.sales_text.insert('end', "-" * 40 + "\n")
-        
-        top_services = db.fetchall(
-            """SELECT s.name, COUNT(*) as count, SUM(sr.price) as revenue
-               FROM salon_service_records sr
-               JOIN salon_services s ON sr.service_id = s.id
-               WHERE DATE(sr.service_date) BETWEEN ? AND ?
-               GROUP BY sr.service_id
-               ORDER BY revenue DESC
-               LIMIT 5""",
-            (start_date, end_date)
-        )
-        
-        for service in top_services:
+        for service in report['top_services']:
             self.sales_text.insert('end',
                 f"{service['name']}: {service['count']} services, ${service['revenue']:.2f}\n"
             )
@@ -607,6 +478,13 @@ class ReportsSection:
             width=300
         ).pack(pady=5)
         
+        GlassButton(
+            info_frame,
+            text="Sales Trends & Cohorts",
+            command=self.show_trends_and_cohorts,
+            width=300
+        ).pack(pady=5)
+        
         GlassButton(
             info_frame,
             text="Profit & Loss Statement",
@@ -643,47 +521,50 @@ class ReportsSection:
         self.analytics_text.insert('end', "=" * 80 + "\n\n")
         
         # Total customers
-        total = db.fetchone("SELECT COUNT(*) as count FROM customers")
-        self.analytics_text.insert('end', f"Total Customers: {total['count']}\n\n")
+        total = report_service.customer_stats()['total']
+        self.analytics_text.insert('end', f"Total Customers: {total}\n\n")
         
-        # Customer segments
-        self.analytics_text.insert('end', "Customer Segmentation:\n")
+        # RFM segments of the customers with paid invoices
+        self.analytics_text.insert('end', "Customer Segmentation (RFM):\n")
         self.analytics_text.insert('end', "-" * 40 + "\n")
+        for segment, count in messaging_service.score_segments().items():
+            self.analytics_text.insert('end', f"{segment}: {count}\n")
         
-        # VIP customers (top 10% by spending)
-        vip_count = db.fetchone(
-            """SELECT COUNT(*) as count FROM customers
-               WHERE total_spent > (SELECT AVG(total_spent) * 2 FROM customers)"""
-        )
-        self.analytics_text.insert('end', f"VIP Customers (high spenders): {vip_count['count']}\n")
-        
-        # Regular customers
-        regular = db.fetchone(
-            """SELECT COUNT(*) as count FROM customers
-               WHERE last_visit_date IS NOT NULL
-               AND julianday('now') - julianday(last_visit_date) <= 30"""
-        )
-        self.analytics_text.insert('end', f"Regular Customers (active): {regular['count']}\n")
-        
-        # At-risk customers
-        at_risk = db.fetchone(
-            """SELECT COUNT(*) as count FROM customers
-               WHERE last_visit_date IS NOT NULL
-               AND julianday('now') - julianday(last_visit_date) BETWEEN 30 AND 90"""
-        )
-        self.analytics_text.insert('end', f"At-Risk Customers (30-90 days inactive): {at_risk['count']}\n")
+        # Customer lifetime value
+        avg_ltv = messaging_service.average_customer_value()
+        self.analytics_text.insert('end', f"\nAverage Customer Lifetime Value: ${avg_ltv:.2f}\n")
+    
+    def refresh_analytics(self):
+        """Bring the analytics extract up to date; False (with a note) when it cannot be used"""
+        try:
+            analytics_extract.refresh()
+            return True
+        except AnalyticsError as e:
+            self.analytics_text.insert('end', f"Analytics extract unavailable: {e}\n")
+            return False
+    
+    def show_trends_and_cohorts(self):
+        """Show monthly revenue by section and customer retention by first-visit month"""
+        self.analytics_text.delete('1.0', 'end')
+        self.analytics_text.insert('end', "Sales Trends & Cohorts\n")
+        self.analytics_text.insert('end', "=" * 80 + "\n\n")
+        if not self.refresh_analytics():
+            return
         
-        # Lost customers
-        lost = db.fetchone(
-            """SELECT COUNT(*) as count FROM customers
-               WHERE last_visit_date IS NOT NULL
-               AND julianday('now') - julianday(last_visit_date) > 90"""
-        )
-        self.analytics_text.insert('end', f"Lost Customers (90+ days inactive): {lost['count']}\n\n")
+        trends = analytics_extract.section_trends('month')
+        self.analytics_text.insert('end', "Monthly Revenue by Section:\n")
+        self.analytics_text.insert('end', "-" * 40 + "\n")
+        periods = trends['periods'][-12:]
+        for index, period in enumerate(periods, start=len(trends['periods']) - len(periods)):
+            amounts = ', '.join(f"{section} ${values[index]:.2f}" for section, values in trends['sections'].items())
+            self.analytics_text.insert('end', f"{period[:7]}: {amounts}\n")
         
-        # Customer lifetime value
-        avg_ltv = db.fetchone("SELECT AVG(total_spent) as avg FROM customers")
-        self.analytics_text.insert('end', f"Average Customer Lifetime Value: ${avg_ltv['avg'] or 0:.2f}\n")
+        cohorts = analytics_extract.cohorts('month')
+        self.analytics_text.insert('end', "\nRetention by First Month (customers returning N months later):\n")
+        self.analytics_text.insert('end', "-" * 40 + "\n")
+        for cohort, size, row in zip(cohorts['cohorts'][-12:], cohorts['sizes'][-12:], cohorts['retention'][-12:]):
+            returning = ' '.join(f"{count * 100 // size:3d}%" for count in row[1:7])
+            self.analytics_text.insert('end', f"{cohort[:7]} ({size} customers): {returning}\n")
     
     def show_profit_loss(self):
         """Show profit and loss statement"""
@@ -696,32 +577,17 @@ class ReportsSection:
         start_date = today.replace(day=1).strftime('%Y-%m-%d')
         end_date = today.strftime('%Y-%m-%d')
         
-        # Revenue
-        revenue = db.fetchone(
-            """SELECT SUM(final_amount) as total FROM invoices
-               WHERE DATE(invoice_date) BETWEEN ? AND ? AND is_paid = 1""",
-            (start_date, end_date)
-        )
-        total_revenue = revenue['total'] or 0
+        statement = self.reports.profit_loss(start_date, end_date)
+        total_revenue = statement['revenue']
         
         self.analytics_text.insert('end', "REVENUE:\n")
         self.analytics_text.insert('end', f"  Total Revenue: ${total_revenue:.2f}\n\n")
         
-        # Expenses
-        expenses = db.fetchall(
-            """SELECT category, SUM(amount) as total FROM expenses
-               WHERE DATE(expense_date) BETWEEN ? AND ?
-               GROUP BY category""",
-            (start_date, end_date)
-        )
-        
         self.analytics_text.insert('end', "EXPENSES:\n")
-        total_expenses = 0
-        for expense in expenses:
-            amount = expense['total'] or 0
-            total_expenses += amount
-            self.analytics_text.insert('end', f"  {expense['category']}: ${amount:.2f}\n")
+        for category, amount in statement['expenses'].items():
+            self.analytics_text.insert('end', f"  {category}: ${amount:.2f}\n")
         
+        total_expenses = statement['total_expenses']
         self.analytics_text.insert('end', f"\n  Total Expenses: ${total_expenses:.2f}\n\n")
         
         # Profit/Loss
@@ -739,21 +605,27 @@ class ReportsSection:
         self.analytics_text.insert('end', "Employee Performance Report\n")
         self.analytics_text.insert('end', "=" * 80 + "\n\n")
         
-        employees = db.fetchall(
-            """SELECT e.*, 
-                   (SELECT COUNT(*) FROM salon_service_records WHERE stylist_id = e.id) as service_count,
-                   (SELECT SUM(amount) FROM employee_commissions WHERE employee_id = e.id) as total_commissions
-               FROM employees e
-               WHERE e.is_active = 1
-               ORDER BY total_commissions DESC"""
-        )
+        employees = commission_ledger.balances()
         
         for emp in employees:
             self.analytics_text.insert('end', f"\n{emp['name']} - {emp['role']} ({emp['section']})\n")
             self.analytics_text.insert('end', "-" * 40 + "\n")
-            self.analytics_text.insert('end', f"  Services Performed: {emp['service_count'] or 0}\n")
-            self.analytics_text.insert('end', f"  Total Commissions: ${emp['total_commissions'] or 0:.2f}\n")
+            self.analytics_text.insert('end', f"  Services Performed: {emp['service_count']}\n")
+            self.analytics_text.insert('end', f"  Total Commissions: ${emp['commission_earned']:.2f}\n")
+            self.analytics_text.insert('end', f"  Unpaid Commissions: ${emp['commission_due']:.2f}\n")
             self.analytics_text.insert('end', f"  Commission Rate: {emp['commission_rate']}%\n")
+        
+        if not self.refresh_analytics():
+            return
+        start_date = (datetime.now() - timedelta(days=30)).strftime('%Y-%m-%d')
+        names = {emp['id']: emp['name'] for emp in commission_ledger.balances(active_only=False)}
+        self.analytics_text.insert('end', "\nLast 30 Days by Sales:\n")
+        self.analytics_text.insert('end', "-" * 40 + "\n")
+        for row in analytics_extract.employee_performance(start_date):
+            self.analytics_text.insert('end',
+                f"  {names.get(row['employee_id'], row['employee_id'])} ({row['section']}): "
+                f"{row['count']} sales, ${row['revenue']:.2f}\n"
+            )
     
     def show_inventory_status(self):
         """Show inventory status and alerts"""
@@ -762,11 +634,7 @@ class ReportsSection:
         self.analytics_text.insert('end', "=" * 80 + "\n\n")
         
         # Low stock items
-        low_stock = db.fetchall(
-            """SELECT * FROM inventory_items
-               WHERE quantity <= reorder_level
-               ORDER BY (reorder_level - quantity) DESC"""
-        )
+        low_stock = self.inventory.low_stock()
         
         if low_stock:
             self.analytics_text.insert('end', f"⚠ {len(low_stock)} items need reordering:\n\n")
@@ -781,11 +649,8 @@ class ReportsSection:
         
         # Total inventory value
         self.analytics_text.insert('end', "\n" + "=" * 40 + "\n")
-        total_value = db.fetchone(
-            "SELECT SUM(quantity * unit_cost) as total FROM inventory_items"
-        )
-        self.analytics_text.insert('end', 
-            f"Total Inventory Value: ${total_value['total'] or 0:.2f}\n"
+        self.analytics_text.insert('end',
+            f"Total Inventory Value: ${self.inventory.stock_value():.2f}\n"
         )
     
     def get_frame(self):
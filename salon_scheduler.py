@@ -0,0 +1,271 @@
+"""
+Salon Scheduling Module
+Keeps per-stylist busy intervals and answers availability questions
+for appointments and walk-ins
+"""
+import threading
+from bisect import bisect_left, bisect_right
+from datetime import datetime, timedelta
+
+from database import db
+from app_logger import log_warning
+
+DEFAULT_DURATION = 30
+SLOT_STEP = 5
+# Appointments in these states no longer hold the stylist's time
+FREE_STATUSES = ('cancelled', 'no_show')
+
+class SchedulingError(Exception):
+    """Raised when a slot search gets a date or time it cannot read"""
+
+def parse_time(value):
+    """Convert 'HH:MM' to minutes after midnight, or None if invalid"""
+    try:
+        t = datetime.strptime(value.strip(), '%H:%M')
+    except (AttributeError, ValueError):
+        return None
+    return t.hour * 60 + t.minute
+
+def format_time(minutes):
+    """Convert minutes after midnight to 'HH:MM'"""
+    return f"{minutes // 60:02d}:{minutes % 60:02d}"
+
+class StylistSchedule:
+    """Sorted, non-overlapping busy intervals of one stylist on one day"""
+    def __init__(self):
+        self.starts = []
+        self.ends = []
+    
+    def overlaps(self, start, end):
+        """Check if [start, end) intersects any busy interval"""
+        i = bisect_right(self.starts, start)
+        if i > 0 and self.ends[i - 1] > start:
+            return True
+        return i < len(self.starts) and self.starts[i] < end
+    
+    def add(self, start, end):
+        """Record a busy interval, merging it with any it overlaps"""
+        lo = bisect_left(self.ends, start)
+        hi = bisect_right(self.starts, end)
+        if lo < hi:
+            start = min(start, self.starts[lo])
+            end = max(end, self.ends[hi - 1])
+        self.starts[lo:hi] = [start]
+        self.ends[lo:hi] = [end]
+    
+    def first_gap(self, after, duration, close):
+        """Earliest start >= after where `duration` minutes fit before close"""
+        start = after
+        i = bisect_right(self.starts, start)
+        if i > 0 and self.ends[i - 1] > start:
+            start = self.ends[i - 1]
+        while i < len(self.starts) and self.starts[i] < start + duration:
+            start = max(start, self.ends[i])
+            i += 1
+        if start + duration > close:
+            return None
+        return start
+
+class SalonScheduler:
+    """Availability engine over salon_appointments and salon_services
+    
+    Intervals are cached per date with the date's salon_schedule_versions
+    row, which triggers bump on every appointment change, so bookings made
+    by other instances, other connections or terminal sync are seen on the
+    next lookup at the cost of one primary-key read. book() checks the
+    slot again inside its write transaction.
+    """
+    def __init__(self, database=None):
+        self.db = database or db
+        self._days = {}
+        self._lock = threading.RLock()
+    
+    def invalidate(self, date=None):
+        """Drop cached intervals for one date, or all dates"""
+        with self._lock:
+            if date is None:
+                self._days.clear()
+            else:
+                self._days.pop(date, None)
+    
+    def business_hours(self):
+        """Opening and closing time in minutes, from the business_hours setting"""
+        row = self.db.fetchone("SELECT value FROM settings WHERE key = 'business_hours'")
+        value = row['value'] if row else '09:00-22:00'
+        try:
+            open_text, close_text = value.split('-')
+        except ValueError:
+            open_text, close_text = '09:00', '22:00'
+        opening = parse_time(open_text)
+        closing = parse_time(close_text)
+        if opening is None or closing is None or closing <= opening:
+            return 9 * 60, 22 * 60
+        return opening, closing
+    
+    def get_stylists(self):
+        """Ids of active salon stylists"""
+        rows = self.db.fetchall("SELECT id FROM employees WHERE section = 'Salon' AND is_active = 1 ORDER BY id")
+        return [row['id'] for row in rows]
+    
+    def service_duration(self, service_id):
+        """Duration of a service in minutes"""
+        row = self.db.fetchone("SELECT duration_minutes FROM salon_services WHERE id = ?", (service_id,))
+        if row and row['duration_minutes']:
+            return row['duration_minutes']
+        return DEFAULT_DURATION
+    
+    def _version(self, date):
+        row = self.db.fetchone("SELECT version FROM salon_schedule_versions WHERE appointment_date = ?", (date,))
+        return row['version'] if row else 0
+    
+    def _day(self, date):
+        """Busy intervals for every stylist on a date, loaded with one indexed query"""
+        with self._lock:
+            version = self._version(date)
+            cached = self._days.get(date)
+            if cached and cached[0] == version:
+                return cached[1]
+            
+            placeholders = ','.join('?' * len(FREE_STATUSES))
+            rows = self.db.fetchall(
+                f"""SELECT a.id, a.stylist_id, a.appointment_time,
+                           COALESCE(a.duration_minutes, s.duration_minutes) as duration
+                    FROM salon_appointments a
+                    LEFT JOIN salon_services s
+                      ON s.id = a.service_id OR (a.service_id IS NULL AND s.name = a.service_type)
+                    WHERE a.appointment_date = ? AND a.stylist_id IS NOT NULL
+                    AND COALESCE(a.status, 'pending') NOT IN ({placeholders})""",
+                (date,) + FREE_STATUSES
+            )
+            
+            schedules = {}
+            seen = set()
+            for row in rows:
+                # The name fallback join can match several services
+                if row['id'] in seen:
+                    continue
+                seen.add(row['id'])
+                start = parse_time(row['appointment_time'])
+                if start is None:
+                    log_warning(f"Skipping appointment #{row['id']} with invalid time {row['appointment_time']!r}")
+                    continue
+                duration = row['duration'] or DEFAULT_DURATION
+                schedules.setdefault(row['stylist_id'], StylistSchedule()).add(start, start + duration)
+            
+            self._days[date] = (version, schedules)
+            return schedules
+    
+    def is_available(self, stylist_id, date, time, duration):
+        """Check if a stylist is free for `duration` minutes from date/time"""
+        start = parse_time(time)
+        if start is None:
+            return False
+        opening, closing = self.business_hours()
+        if start < opening or start + duration > closing:
+            return False
+        schedule = self._day(date).get(stylist_id)
+        return schedule is None or not schedule.overlaps(start, start + duration)
+    
+    def book(self, customer_id, stylist_id, service_id, date, time, notes=None):
+        """Book an appointment after checking for overlaps
+        
+        Returns {'success': True, 'appointment_id': id} or
+        {'success': False, 'message': ...} when the slot is taken.
+        """
+        try:
+            # Stored zero-padded, so '2024-1-5' shares the day (and its overlap check) with '2024-01-05'
+            date = datetime.strptime(date.strip(), '%Y-%m-%d').strftime('%Y-%m-%d')
+        except (AttributeError, ValueError):
+            return {'success': False, 'message': 'Date must be YYYY-MM-DD'}
+        start = parse_time(time)
+        if start is None:
+            return {'success': False, 'message': 'Time must be HH:MM'}
+        
+        service = self.db.fetchone("SELECT name FROM salon_services WHERE id = ?", (service_id,))
+        if not service:
+            return {'success': False, 'message': 'Service not found'}
+        duration = self.service_duration(service_id)
+        time = format_time(start)
+        
+        with self._lock, self.db.transaction() as cursor:
+            if not self.is_available(stylist_id, date, time, duration):
+                slot = self.earliest_slot(service_id, date, time, stylist_id=stylist_id, days=1)
+                message = f"Stylist is not available at {date} {time} for {duration} minutes."
+                if slot:
+                    message += f" Next free slot: {slot['time']}."
+                return {'success': False, 'message': message, 'suggestion': slot}
+            
+            cursor.execute(
+                """INSERT INTO salon_appointments
+                   (customer_id, stylist_id, appointment_date, appointment_time, service_type,
+                    status, notes, service_id, duration_minutes)
+                   VALUES (?, ?, ?, ?, ?, 'pending', ?, ?, ?)""",
+                (customer_id, stylist_id, date, time, service['name'], notes, service_id, duration)
+            )
+            appointment_id = cursor.lastrowid
+        
+        return {'success': True, 'appointment_id': appointment_id}
+    
+    def earliest_slot(self, service_id, date=None, after_time=None, stylist_id=None, days=7, now=None):
+        """Earliest slot for a service with a given stylist, or any stylist
+        
+        Searches from date/after_time (default: now) up to `days` days ahead.
+        Returns {'stylist_id', 'date', 'time', 'duration'} or None; raises
+        SchedulingError for a date that is not YYYY-MM-DD or a time that is
+        not HH:MM.
+        """
+        now = now or datetime.now()
+        date = date or now.strftime('%Y-%m-%d')
+        try:
+            day = datetime.strptime(date.strip(), '%Y-%m-%d')
+        except (AttributeError, ValueError):
+            raise SchedulingError(f"Date must be YYYY-MM-DD, not {date!r}")
+        after = parse_time(after_time) if after_time else None
+        if after_time and after is None:
+            raise SchedulingError(f"Time must be HH:MM, not {after_time!r}")
+        
+        duration = self.service_duration(service_id)
+        stylists = [stylist_id] if stylist_id else self.get_stylists()
+        if not stylists:
+            return None
+        opening, closing = self.business_hours()
+        
+        for offset in range(days):
+            current = day + timedelta(days=offset)
+            if current.date() < now.date():
+                continue
+            current_text = current.strftime('%Y-%m-%d')
+            earliest = opening
+            if offset == 0 and after is not None:
+                earliest = max(earliest, after)
+            if current.date() == now.date():
+                # Round up to the next slot boundary
+                minute = now.hour * 60 + now.minute
+                earliest = max(earliest, -(-minute // SLOT_STEP) * SLOT_STEP)
+            
+            schedules = self._day(current_text)
+            best = None
+            for candidate in stylists:
+                schedule = schedules.get(candidate) or StylistSchedule()
+                start = schedule.first_gap(earliest, duration, closing)
+                if start is not None and (best is None or start < best[1]):
+                    best = (candidate, start)
+            if best:
+                return {'stylist_id': best[0], 'date': current_text,
+                        'time': format_time(best[1]), 'duration': duration}
+        return None
+    
+    def walk_in_wait(self, service_id, stylist_id=None, now=None):
+        """Estimate a walk-in's wait today using the same interval search
+        
+        Returns (minutes, slot) or None if nothing is free before closing.
+        """
+        now = now or datetime.now()
+        slot = self.earliest_slot(service_id, stylist_id=stylist_id, days=1, now=now)
+        if not slot:
+            return None
+        minute = now.hour * 60 + now.minute
+        return max(parse_time(slot['time']) - minute, 0), slot
+
+# Global scheduler instance
+salon_scheduler = SalonScheduler()
@@ -4,8 +4,10 @@ Handles appointments, services, stylist management, and customer ratings
 """
 import customtkinter as ctk
 from datetime import datetime
+from tkinter import messagebox
 from ui_utils import *
 from database import db
+from services import appointment_service, AppointmentError
 
 class SalonSection:
     def __init__(self, parent):
@@ -84,6 +86,8 @@ class SalonSection:
         
         # Book button
         GlassButton(form_frame, text="Book Appointment", command=self.book_appointment).pack(pady=20)
+        GlassButton(form_frame, text="Find Earliest Slot", command=self.find_earliest_slot).pack(pady=5)
+        GlassButton(form_frame, text="Walk-in Wait Time", command=self.show_walk_in_wait).pack(pady=5)
         
         # Appointments list
         list_frame = GlassFrame(tab)
@@ -201,45 +205,26 @@ class SalonSection:
             return [f"{s['id']}: {s['name']} (${s['price']})" for s in services]
         return ["No services available"]
     
+    def get_selected_id(self, text):
+        """Extract the id from an 'id: name' dropdown value"""
+        if ':' in text:
+            return int(text.split(':')[0])
+        return None
+    
     def book_appointment(self):
         """Book a new appointment"""
-        phone = self.customer_phone_entry.get()
-        date = self.appointment_date_entry.get()
-        time = self.appointment_time_entry.get()
-        
-        # Get customer ID
-        customer = db.fetchone("SELECT id FROM customers WHERE phone = ?", (phone,))
-        if not customer:
-            # Create new customer
-            db.execute(
-                "INSERT INTO customers (name, phone, registration_date) VALUES (?, ?, ?)",
-                (f"Customer {phone}", phone, datetime.now().strftime('%Y-%m-%d'))
-            )
-            customer = db.fetchone("SELECT id FROM customers WHERE phone = ?", (phone,))
-        
-        customer_id = customer['id']
-        
-        # Get stylist ID
-        stylist_text = self.stylist_var.get()
-        if ':' in stylist_text:
-            stylist_id = int(stylist_text.split(':')[0])
-        else:
-            stylist_id = None
-        
-        # Get service
-        service_text = self.service_type_var.get()
-        if ':' in service_text:
-            service_type = service_text.split(':')[1].split('(')[0].strip()
-        else:
-            service_type = "General"
-        
-        # Insert appointment
-        db.execute(
-            """INSERT INTO salon_appointments 
-               (customer_id, stylist_id, appointment_date, appointment_time, service_type, status)
-               VALUES (?, ?, ?, ?, ?, 'pending')""",
-            (customer_id, stylist_id, date, time, service_type)
-        )
+        service_id = self.get_selected_id(self.service_type_var.get())
+        if not service_id:
+            messagebox.showwarning("Booking", "Please select a service.")
+            return
+        
+        # Without a stylist, whoever is free at the requested time is booked
+        result = appointment_service.book(self.customer_phone_entry.get(), service_id,
+                                          self.appointment_date_entry.get(), self.appointment_time_entry.get(),
+                                          stylist_id=self.get_selected_id(self.stylist_var.get()))
+        if not result['success']:
+            messagebox.showwarning("Booking", result['message'])
+            return
         
         self.refresh_appointments()
         
@@ -247,18 +232,63 @@ class SalonSection:
         self.customer_phone_entry.delete(0, 'end')
         self.appointment_time_entry.delete(0, 'end')
     
+    def find_earliest_slot(self):
+        """Fill the booking form with the earliest free slot for the selected service"""
+        service_id = self.get_selected_id(self.service_type_var.get())
+        if not service_id:
+            messagebox.showwarning("Scheduling", "Please select a service.")
+            return
+        
+        stylist_id = self.get_selected_id(self.stylist_var.get())
+        try:
+            slot = appointment_service.earliest_slot(service_id, self.appointment_date_entry.get() or None,
+                                                     stylist_id=stylist_id)
+        except AppointmentError as e:
+            messagebox.showwarning("Scheduling", str(e))
+            return
+        if not slot:
+            messagebox.showinfo("Scheduling", "No free slot in the next 7 days.")
+            return
+        
+        self.appointment_date_entry.delete(0, 'end')
+        self.appointment_date_entry.insert(0, slot['date'])
+        self.appointment_time_entry.delete(0, 'end')
+        self.appointment_time_entry.insert(0, slot['time'])
+        for value in self.get_stylists():
+            if self.get_selected_id(value) == slot['stylist_id']:
+                self.stylist_var.set(value)
+                break
+    
+    def show_walk_in_wait(self):
+        """Show how long a walk-in would wait for the selected service"""
+        service_id = self.get_selected_id(self.service_type_var.get())
+        if not service_id:
+            messagebox.showwarning("Scheduling", "Please select a service.")
+            return
+        
+        estimate = appointment_service.walk_in_wait(service_id, self.get_selected_id(self.stylist_var.get()))
+        if estimate is None:
+            messagebox.showinfo("Walk-in", "No stylist is free before closing today.")
+            return
+        
+        minutes, slot = estimate
+        stylist = db.fetchone("SELECT name FROM employees WHERE id = ?", (slot['stylist_id'],))
+        messagebox.showinfo("Walk-in",
+                            f"Estimated wait: {minutes} minutes\n"
+                            f"Start at {slot['time']} with {stylist['name']}")
+    
     def add_service(self):
         """Add a new service"""
-        name = self.service_name_entry.get()
-        price = float(self.service_price_entry.get())
-        duration = int(self.service_duration_entry.get())
-        commission = float(self.service_commission_entry.get())
-        
-        db.execute(
-            """INSERT INTO salon_services (name, price, duration_minutes, commission_rate)
-               VALUES (?, ?, ?, ?)""",
-            (name, price, duration, commission)
-        )
+        try:
+            appointment_service.add_service(self.service_name_entry.get(), float(self.service_price_entry.get()),
+                                            int(self.service_duration_entry.get()),
+                                            float(self.service_commission_entry.get()))
+        except ValueError:
+            messagebox.showerror("Add Service", "Price, duration and commission must be numbers")
+            return
+        except AppointmentError as e:
+            messagebox.showerror("Add Service", str(e))
+            return
         
         self.refresh_services()
         
@@ -270,50 +300,19 @@ class SalonSection:
     
     def record_service(self):
         """Record a completed service"""
-        phone = self.record_customer_entry.get()
-        
-        # Get customer
-        customer = db.fetchone("SELECT id FROM customers WHERE phone = ?", (phone,))
-        if not customer:
+        stylist_id = self.get_selected_id(self.record_stylist_var.get())
+        service_id = self.get_selected_id(self.record_service_var.get())
+        if not stylist_id or not service_id:
             return
         
-        # Get stylist ID
-        stylist_text = self.record_stylist_var.get()
-        if ':' in stylist_text:
-            stylist_id = int(stylist_text.split(':')[0])
-        else:
-            return
-        
-        # Get service ID
-        service_text = self.record_service_var.get()
-        if ':' in service_text:
-            service_id = int(service_text.split(':')[0])
-        else:
-            return
-        
-        # Get service details
-        service = db.fetchone("SELECT price, commission_rate FROM salon_services WHERE id = ?", (service_id,))
-        price = service['price']
-        commission = price * (service['commission_rate'] / 100)
-        
         rating = int(self.rating_entry.get()) if self.rating_entry.get() else None
-        review = self.review_entry.get()
-        
-        # Insert record
-        db.execute(
-            """INSERT INTO salon_service_records 
-               (customer_id, stylist_id, service_id, service_date, price, commission, rating, review)
-               VALUES (?, ?, ?, ?, ?, ?, ?, ?)""",
-            (customer['id'], stylist_id, service_id, datetime.now().strftime('%Y-%m-%d %H:%M:%S'),
-             price, commission, rating, review)
-        )
         
-        # Record commission
-        db.execute(
-            """INSERT INTO employee_commissions (employee_id, service_date, service_type, amount)
-               VALUES (?, ?, 'Salon', ?)""",
-            (stylist_id, datetime.now().strftime('%Y-%m-%d'), commission)
-        )
+        # Customer, service record and commission are written together
+        result = appointment_service.record_service(self.record_customer_entry.get(), stylist_id, service_id,
+                                                    rating, self.review_entry.get())
+        if not result['success']:
+            messagebox.showwarning("Record Service", result['message'])
+            return
         
         # Clear form
         self.record_customer_entry.delete(0, 'end')
@@ -335,7 +334,7 @@ class SalonSection:
         )
         
         for apt in appointments:
-            self.appointments_text.insert('end', 
+            self.appointments_text.insert('end',
                 f"{apt['appointment_time']} - {apt['customer_name']} ({apt['phone']}) "
                 f"with {apt['stylist_name']} for {apt['service_type']} - {apt['status']}\n"
             )
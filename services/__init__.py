@@ -0,0 +1,26 @@
+"""
+Services Package
+Business operations with no Tk widgets, shared by the sections, batch jobs,
+API servers and benchmarks
+
+Each service takes an optional Database and otherwise works on the shared
+one; the module-level instances below use the shared database, unless
+KAGAN_API_URL names a terminal API server (api_server.py), in which case
+they are remote stand-ins that call that server with KAGAN_API_TOKEN.
+"""
+import os
+
+from services.customers import CustomerService, CustomerError, customer_service
+from services.sessions import SessionService, SessionError, session_service
+from services.orders import OrderService, OrderError, order_service
+from services.appointments import AppointmentService, AppointmentError, appointment_service
+from services.invoices import InvoiceService, invoice_service
+from services.payments import PaymentService, payment_service
+from services.inventory import InventoryService, InventoryError, inventory_service
+from services.reports import ReportService, report_service
+from services.sms import MessagingService, MessagingError, messaging_service
+
+API_URL = os.environ.get('KAGAN_API_URL', '').strip()
+if API_URL:
+    from services.remote import remote_services
+    globals().update(remote_services(API_URL, os.environ.get('KAGAN_API_TOKEN')))
@@ -0,0 +1,84 @@
+"""
+Salon Appointment Service
+Salon services, bookings with any free stylist, and completed service records
+"""
+from database import db
+from salon_scheduler import SalonScheduler, SchedulingError, salon_scheduler
+from commission_ledger import CommissionLedger, commission_ledger
+from services.customers import CustomerService, customer_service
+
+class AppointmentError(Exception):
+    """Raised when a salon service cannot be added"""
+
+class AppointmentService:
+    """Salon bookings and service records
+    
+    book() and record_service() return {'success': ...} dicts like the
+    scheduler and commission ledger they wrap, with a 'message' when
+    refused.
+    """
+    def __init__(self, database=None):
+        self.db = database or db
+        self.scheduler = SalonScheduler(self.db) if database else salon_scheduler
+        self.commissions = CommissionLedger(self.db) if database else commission_ledger
+        self.customers = CustomerService(self.db) if database else customer_service
+    
+    def services(self):
+        """Salon services by name"""
+        return self.db.fetchall("SELECT * FROM salon_services ORDER BY name")
+    
+    def add_service(self, name, price, duration_minutes, commission_rate):
+        """Add a salon service; returns its id"""
+        if not name:
+            raise AppointmentError("Service name is required")
+        if price < 0 or duration_minutes <= 0 or not 0 <= commission_rate <= 100:
+            raise AppointmentError("Price, duration or commission rate out of range")
+        with self.db.transaction() as cursor:
+            cursor.execute(
+                """INSERT INTO salon_services (name, price, duration_minutes, commission_rate)
+                   VALUES (?, ?, ?, ?)""",
+                (name, price, duration_minutes, commission_rate)
+            )
+            return cursor.lastrowid
+    
+    def free_stylist(self, service_id, date, time):
+        """Id of the first stylist free for the service at date/time, or None"""
+        duration = self.scheduler.service_duration(service_id)
+        for stylist_id in self.scheduler.get_stylists():
+            if self.scheduler.is_available(stylist_id, date, time, duration):
+                return stylist_id
+        return None
+    
+    def book(self, phone, service_id, date, time, stylist_id=None, notes=None):
+        """Book an appointment, with whichever stylist is free when stylist_id is None"""
+        if not phone:
+            return {'success': False, 'message': 'Customer phone is required'}
+        if not stylist_id:
+            stylist_id = self.free_stylist(service_id, date, time)
+            if not stylist_id:
+                return {'success': False, 'message': "No stylist is free at that time. Try 'Find Earliest Slot'."}
+        customer_id = self.customers.get_or_create(phone)
+        result = self.scheduler.book(customer_id, stylist_id, service_id, date, time, notes)
+        if result['success']:
+            result.update(customer_id=customer_id, stylist_id=stylist_id)
+        return result
+    
+    def record_service(self, phone, stylist_id, service_id, rating=None, review=None, when=None):
+        """Record a completed service and its commission; see CommissionLedger.record_salon_service"""
+        if not phone:
+            return {'success': False, 'message': 'Customer phone is required'}
+        return self.commissions.record_salon_service(phone, stylist_id, service_id, rating, review, when)
+    
+    def earliest_slot(self, service_id, date=None, stylist_id=None):
+        """Earliest free slot for a service in the next week, or None"""
+        try:
+            return self.scheduler.earliest_slot(service_id, date, stylist_id=stylist_id)
+        except SchedulingError as e:
+            raise AppointmentError(str(e))
+    
+    def walk_in_wait(self, service_id, stylist_id=None):
+        """(minutes, slot) a walk-in would wait today, or None"""
+        return self.scheduler.walk_in_wait(service_id, stylist_id)
+
+# Global appointment service instance
+appointment_service = AppointmentService()
@@ -0,0 +1,73 @@
+"""
+Customer Service
+Registration, lookup and balance adjustments of customers by phone
+"""
+from datetime import datetime
+
+from database import db
+from payments import PaymentLedger, payment_ledger
+
+class CustomerError(Exception):
+    """Raised when a customer operation is refused"""
+
+class CustomerService:
+    """Customers keyed by phone number, as every section identifies them"""
+    def __init__(self, database=None):
+        self.db = database or db
+        self.ledger = PaymentLedger(self.db) if database else payment_ledger
+    
+    def find(self, phone):
+        """The customer row for a phone number, or None"""
+        return self.db.fetchone("SELECT * FROM customers WHERE phone = ?", (phone,))
+    
+    def get_or_create(self, phone, cursor=None, when=None):
+        """Id of the customer with this phone, registering 'Customer <phone>' on first visit"""
+        if not phone:
+            raise CustomerError("Customer phone is required")
+        when = when or datetime.now()
+        if cursor is None:
+            with self.db.transaction() as cursor:
+                return self.get_or_create(phone, cursor, when)
+        cursor.execute(
+            "INSERT OR IGNORE INTO customers (name, phone, registration_date) VALUES (?, ?, ?)",
+            (f"Customer {phone}", phone, when.strftime('%Y-%m-%d'))
+        )
+        return cursor.execute("SELECT id FROM customers WHERE phone = ?", (phone,)).fetchone()['id']
+    
+    def register(self, name, phone, birthdate=None, when=None):
+        """Create a customer, or update the name and birthdate of an existing phone; returns the id"""
+        if not phone:
+            raise CustomerError("Customer phone is required")
+        when = when or datetime.now()
+        with self.db.transaction() as cursor:
+            cursor.execute(
+                """INSERT INTO customers (name, phone, birthdate, registration_date) VALUES (?, ?, ?, ?)
+                   ON CONFLICT(phone) DO UPDATE SET name = excluded.name, birthdate = excluded.birthdate""",
+                (name, phone, birthdate, when.strftime('%Y-%m-%d'))
+            )
+            return cursor.execute("SELECT id FROM customers WHERE phone = ?", (phone,)).fetchone()['id']
+    
+    def recent(self, limit=50):
+        """Most recently registered customers"""
+        return self.db.fetchall("SELECT * FROM customers ORDER BY registration_date DESC LIMIT ?", (limit,))
+    
+    def _require(self, phone):
+        customer = self.find(phone)
+        if not customer:
+            raise CustomerError("Customer not found")
+        return customer
+    
+    def adjust_points(self, phone, points, description=None):
+        """Add (or redeem, if negative) loyalty points; raises PaymentError past the balance"""
+        customer = self._require(phone)
+        self.ledger.adjust_points(customer['id'], points, description)
+        return self.find(phone)
+    
+    def adjust_wallet(self, phone, amount, description=None):
+        """Add money to (or withdraw, if negative, from) a wallet; raises PaymentError past the balance"""
+        customer = self._require(phone)
+        self.ledger.adjust_wallet(customer['id'], amount, description)
+        return self.find(phone)
+
+# Global customer service instance
+customer_service = CustomerService()
@@ -0,0 +1,68 @@
+"""
+Inventory Service
+Products, stock levels and reorder alerts
+"""
+from datetime import datetime
+
+from database import db
+
+SECTIONS = ('Salon', 'Cafe', 'Gamnet')
+
+class InventoryError(Exception):
+    """Raised when a product is refused"""
+
+class InventoryService:
+    """Inventory items with their supplier names"""
+    def __init__(self, database=None):
+        self.db = database or db
+    
+    def products(self, section=None):
+        """Products of a section, or of every section"""
+        where = "WHERE i.section = ?" if section else ""
+        return self.db.fetchall(
+            f"""SELECT i.*, s.name as supplier_name
+                FROM inventory_items i
+                LEFT JOIN suppliers s ON i.supplier_id = s.id
+                {where}
+                ORDER BY i.section, i.name""",
+            (section,) if section else ()
+        )
+    
+    def add_product(self, name, section, category='', sku=None, quantity=0, unit='piece', reorder_level=0,
+                    unit_cost=0, selling_price=0, supplier_id=None, when=None):
+        """Add a product; returns its id. A blank SKU is stored as NULL, as SKUs are unique"""
+        if not name:
+            raise InventoryError("Product name is required")
+        if section not in SECTIONS:
+            raise InventoryError(f"Section must be one of {', '.join(SECTIONS)}")
+        if min(quantity, reorder_level, unit_cost, selling_price) < 0:
+            raise InventoryError("Quantities and prices cannot be negative")
+        when = when or datetime.now()
+        with self.db.transaction() as cursor:
+            cursor.execute(
+                """INSERT INTO inventory_items
+                   (name, category, section, sku, quantity, unit, reorder_level,
+                    unit_cost, selling_price, supplier_id, last_updated)
+                   VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)""",
+                (name, category, section, sku or None, quantity, unit, reorder_level,
+                 unit_cost, selling_price, supplier_id, when.strftime('%Y-%m-%d %H:%M:%S'))
+            )
+            return cursor.lastrowid
+    
+    def low_stock(self):
+        """Products at or below their reorder level, largest shortage first"""
+        return self.db.fetchall(
+            """SELECT i.*, s.name as supplier_name
+               FROM inventory_items i
+               LEFT JOIN suppliers s ON i.supplier_id = s.id
+               WHERE i.quantity <= i.reorder_level
+               ORDER BY (i.reorder_level - i.quantity) DESC"""
+        )
+    
+    def stock_value(self):
+        """Cost of all stock on hand"""
+        row = self.db.fetchone("SELECT SUM(quantity * unit_cost) as total FROM inventory_items")
+        return row['total'] or 0
+
+# Global inventory service instance
+inventory_service = InventoryService()
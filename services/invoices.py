@@ -0,0 +1,63 @@
+"""
+Invoice Service
+Quotes, checkout of everything a customer has not been billed for, and day closing
+"""
+from database import db
+from checkout import CheckoutEngine, CheckoutError, checkout_engine
+from day_close import DayCloser, DayCloseError, day_closer
+from invoice_search import InvoiceSearch, invoice_search
+
+class InvoiceService:
+    """Invoices over the checkout engine, invoice search and day closer
+    
+    Errors surface as the engines raise them: CheckoutError and
+    DayCloseError.
+    """
+    def __init__(self, database=None):
+        self.db = database or db
+        self.checkout = CheckoutEngine(self.db) if database else checkout_engine
+        self.closer = DayCloser(self.db) if database else day_closer
+        self.search_index = InvoiceSearch(self.db) if database else invoice_search
+    
+    def unbilled(self, phone):
+        """Unbilled salon, cafe and gamnet lines of a customer ([] for unknown phones)"""
+        customer = self.db.fetchone("SELECT id FROM customers WHERE phone = ?", (phone,))
+        return self.checkout.unbilled_lines(customer['id']) if customer else []
+    
+    def find_campaign(self, code):
+        """The active campaign or voucher for a code, or None"""
+        return self.checkout.find_campaign(code)
+    
+    def totals(self, lines, campaign=None):
+        """Subtotal, discount, tax and final amount of lines, without saving anything"""
+        return self.checkout.totals(lines, campaign)
+    
+    def create(self, phone, campaign_code=None, extra_items=(), when=None):
+        """Create one invoice for the customer; see CheckoutEngine.checkout"""
+        if not phone:
+            raise CheckoutError("Customer phone is required")
+        return self.checkout.checkout(phone, campaign_code, extra_items, when)
+    
+    def get(self, invoice_id):
+        """An invoice row with its customer's name and phone, or None"""
+        rows = self.search_index.search(invoice_id=invoice_id)['rows']
+        return rows[0] if rows else None
+    
+    def search(self, after=None, limit=50, **filters):
+        """One page of invoices matching filters; see InvoiceSearch.search"""
+        return self.search_index.search(after=after, limit=limit, **filters)
+    
+    def search_totals(self, **filters):
+        """Count, billed and paid amount of every invoice matching filters"""
+        return self.search_index.totals(**filters)
+    
+    def daily_summary(self, day=None):
+        """A day's totals, closed or live"""
+        return self.closer.daily_summary(day)
+    
+    def close_day(self, day=None, closed_by=None, when=None):
+        """Close a day and return its Z-report"""
+        return self.closer.close_day(day, closed_by, when)
+
+# Global invoice service instance
+invoice_service = InvoiceService()
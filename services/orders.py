@@ -0,0 +1,71 @@
+"""
+Cafe Order Service
+Menu items and cafe orders, with recipe stock deduction done by cafe_orders
+"""
+from database import db, DayClosedError
+from cafe_orders import CafeOrders, cafe_orders
+
+class OrderError(Exception):
+    """Raised when a menu item or order is refused"""
+
+class OrderService:
+    """Cafe menu and order placement"""
+    def __init__(self, database=None):
+        self.db = database or db
+        self.orders = CafeOrders(self.db) if database else cafe_orders
+    
+    def menu(self, available_only=True):
+        """Menu items by category and name"""
+        where = "WHERE is_available = 1" if available_only else ""
+        return self.db.fetchall(f"SELECT * FROM cafe_menu {where} ORDER BY category, name")
+    
+    def add_menu_item(self, name, category, price, description=''):
+        """Add a menu item; returns its id"""
+        if not name:
+            raise OrderError("Menu item name is required")
+        if price < 0:
+            raise OrderError("Price cannot be negative")
+        with self.db.transaction() as cursor:
+            cursor.execute(
+                "INSERT INTO cafe_menu (name, category, price, description) VALUES (?, ?, ?, ?)",
+                (name, category, price, description)
+            )
+            return cursor.lastrowid
+    
+    def line(self, menu_item_id, quantity):
+        """An order line {'id', 'name', 'price', 'quantity'} at the item's current price"""
+        if quantity <= 0:
+            raise OrderError("Quantity must be positive")
+        item = self.db.fetchone("SELECT name, price FROM cafe_menu WHERE id = ?", (menu_item_id,))
+        if not item:
+            raise OrderError("Menu item not found")
+        return {'id': menu_item_id, 'name': item['name'], 'price': item['price'], 'quantity': quantity}
+    
+    def place(self, phone, items, barista_id=None, split_count=1, when=None):
+        """Save one order; returns {'order_id', 'customer_id', 'total', 'low_stock'}"""
+        return self.place_batch([{'phone': phone, 'barista_id': barista_id, 'items': items,
+                                  'split_count': split_count, 'when': when}])[0]
+    
+    def place_batch(self, orders):
+        """Save several orders in one transaction; see CafeOrders.place_orders"""
+        if not orders or any(not order['items'] for order in orders):
+            raise OrderError("An order needs at least one item")
+        try:
+            return self.orders.place_orders(orders)
+        except DayClosedError:
+            raise OrderError("The order's day is closed; no more orders can be dated on it")
+    
+    def popular_items(self, limit=10):
+        """Best selling menu items with quantity sold and revenue"""
+        return self.db.fetchall(
+            """SELECT m.name, SUM(oi.quantity) as total_sold, SUM(oi.price * oi.quantity) as revenue
+               FROM cafe_order_items oi
+               JOIN cafe_menu m ON oi.menu_item_id = m.id
+               GROUP BY m.id
+               ORDER BY total_sold DESC
+               LIMIT ?""",
+            (limit,)
+        )
+
+# Global order service instance
+order_service = OrderService()
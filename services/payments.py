@@ -0,0 +1,40 @@
+"""
+Payment Service
+Settles invoices in cash, from the wallet, or by card through the gateway
+"""
+from database import db
+from payments import PaymentLedger, PaymentError, payment_ledger
+from payment_gateway import CardPayments, card_payments
+
+class PaymentService:
+    """Invoice payments over the payment ledger and card payments
+    
+    Card payments only go to the gateway when one is configured;
+    otherwise a card payment is recorded directly like cash. Refusals
+    raise PaymentError.
+    """
+    def __init__(self, database=None, card=None):
+        self.db = database or db
+        self.ledger = PaymentLedger(self.db) if database else payment_ledger
+        self.card = card or (CardPayments(self.db) if database else card_payments)
+    
+    def uses_gateway(self, payment_method):
+        """Whether a payment with this method is authorised by the card gateway"""
+        return payment_method == 'Card' and self.card.is_configured()
+    
+    def pay(self, invoice_id, payment_method, when=None):
+        """Settle an invoice without the gateway; returns {'invoice_id', 'amount', 'points', 'customer_id'}"""
+        if self.uses_gateway(payment_method):
+            raise PaymentError("Card payments go through pay_by_card() while a gateway is configured")
+        return self.ledger.pay_invoice(invoice_id, payment_method, when)
+    
+    def pay_by_card(self, invoice_id, callback=None):
+        """Start a gateway card payment; returns a Future of the final transaction"""
+        return self.card.pay_invoice(invoice_id, callback=callback)
+    
+    def transactions(self, invoice_id):
+        """Card transactions of an invoice"""
+        return self.card.invoice_transactions(invoice_id)
+
+# Global payment service instance
+payment_service = PaymentService()
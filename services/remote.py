@@ -0,0 +1,164 @@
+"""
+Remote Services
+Stand-ins for the module-level services that call a terminal API server
+(api_server.py) over HTTP/JSON instead of opening the database
+"""
+import json
+import threading
+import urllib.error
+import urllib.request
+from concurrent.futures import Future
+from datetime import date, datetime
+
+from app_logger import log_exception
+from checkout import CheckoutError
+from day_close import DayCloseError
+from payments import PaymentError
+from services.customers import CustomerError
+from services.sessions import SessionError
+from services.orders import OrderError
+from services.appointments import AppointmentError
+from services.inventory import InventoryError
+from services.sms import MessagingError
+
+# Methods callable remotely per service; True when a read-only connection
+# can answer them, so the server may run them on its read pool
+REMOTE_METHODS = {
+    'customers': {'find': True, 'recent': True, 'register': False, 'adjust_points': False,
+                  'adjust_wallet': False},
+    'sessions': {'devices': True, 'active': True, 'pending_reservations': True, 'add_device': False,
+                 'start': False, 'end': False, 'reserve': False},
+    'orders': {'menu': True, 'line': True, 'popular_items': True, 'add_menu_item': False, 'place': False,
+               'place_batch': False},
+    'appointments': {'services': True, 'free_stylist': True, 'earliest_slot': True, 'walk_in_wait': True,
+                     'add_service': False, 'book': False, 'record_service': False},
+    'invoices': {'unbilled': True, 'find_campaign': True, 'totals': True, 'get': True, 'search': True,
+                 'search_totals': True, 'daily_summary': True, 'create': False, 'close_day': False},
+    'payments': {'transactions': True, 'uses_gateway': True, 'pay': False, 'pay_by_card': False},
+    'inventory': {'products': True, 'low_stock': True, 'stock_value': True, 'add_product': False},
+    'reports': {'sales_totals': True, 'sales_report': True, 'section_activity': True, 'top_stylists': True,
+                'top_menu_items': True, 'customer_stats': True, 'profit_loss': True},
+    'sms': {'audience': True, 'birthdays': True, 'lapsed': True, 'segment_counts': True, 'average_customer_value': True,
+            'score_segments': False, 'require_configured': False, 'send': False, 'send_bulk': False,
+            'send_birthday_greetings': False, 'send_reactivation': False},
+    'sync': {'pull': True, 'push': False},
+}
+
+# Service errors travel by class name and are raised again on the client
+ERRORS = {error.__name__: error for error in (CustomerError, SessionError, OrderError, AppointmentError,
+                                              InventoryError, MessagingError, CheckoutError, PaymentError,
+                                              DayCloseError)}
+
+class ApiError(Exception):
+    """Raised when the API server cannot be reached or refuses a request"""
+
+def encode(value):
+    """JSON text of call arguments or results; rows become dicts, datetimes are tagged"""
+    def default(obj):
+        if isinstance(obj, datetime):
+            return {'$datetime': obj.isoformat()}
+        if isinstance(obj, date):
+            return obj.isoformat()
+        if hasattr(obj, 'keys'):
+            return {key: obj[key] for key in obj.keys()}
+        if isinstance(obj, (set, frozenset)):
+            return list(obj)
+        raise TypeError(f"{type(obj).__name__} cannot be sent to the API server")
+    return json.dumps(value, default=default)
+
+def decode(text):
+    """Inverse of encode()"""
+    def hook(obj):
+        if len(obj) == 1 and '$datetime' in obj:
+            return datetime.fromisoformat(obj['$datetime'])
+        return obj
+    return json.loads(text, object_hook=hook)
+
+class ApiClient:
+    """Calls service methods on an API server
+    
+    POST /api/<service>/<method> {args, kwargs} -> {result}, or
+    {error, type} with a 4xx/5xx status; errors of a known service
+    error type are raised as that type, everything else as ApiError.
+    """
+    def __init__(self, url, timeout=30.0, token=None):
+        self.url = url.rstrip('/')
+        self.timeout = timeout
+        self.token = token or None
+    
+    def _request(self, path, payload=None):
+        data = encode(payload).encode('utf-8') if payload is not None else None
+        headers = {'Content-Type': 'application/json'}
+        if self.token:
+            headers['X-Api-Token'] = self.token
+        request = urllib.request.Request(self.url + path, data=data, headers=headers,
+                                         method='POST' if data is not None else 'GET')
+        try:
+            with urllib.request.urlopen(request, timeout=self.timeout) as response:
+                return decode(response.read().decode('utf-8'))
+        except urllib.error.HTTPError as e:
+            try:
+                answer = decode(e.read().decode('utf-8'))
+            except ValueError:
+                raise ApiError(f"API server answered {e.code}")
+            raise ERRORS.get(answer.get('type'), ApiError)(answer.get('error') or f"API server answered {e.code}")
+        except (urllib.error.URLError, OSError, ValueError) as e:
+            raise ApiError(f"API server {self.url}: {getattr(e, 'reason', e)}")
+    
+    def call(self, service, method, *args, **kwargs):
+        """Run service.method(*args, **kwargs) on the server and return its result"""
+        return self._request(f"/api/{service}/{method}", {'args': args, 'kwargs': kwargs})['result']
+    
+    def health(self):
+        return self._request('/health')
+    
+    def metrics(self):
+        """Per endpoint latency figures; see ApiMetrics.snapshot"""
+        return self._request('/metrics')
+
+class RemoteService:
+    """A service whose REMOTE_METHODS run on the API server"""
+    def __init__(self, client, name):
+        self.client = client
+        self.name = name
+    
+    def __getattr__(self, method):
+        if method not in REMOTE_METHODS.get(self.name, {}):
+            raise AttributeError(f"'{self.name}' service has no remote method '{method}'")
+        def call(*args, **kwargs):
+            return self.client.call(self.name, method, *args, **kwargs)
+        call.__name__ = method
+        return call
+
+class RemotePaymentService(RemoteService):
+    """Payments; card payments wait for the server's answer in a worker thread"""
+    def pay_by_card(self, invoice_id, callback=None):
+        """Start a card payment on the server; returns a Future of the final transaction"""
+        future = Future()
+        def run():
+            try:
+                future.set_result(self.client.call(self.name, 'pay_by_card', invoice_id))
+            except Exception as e:
+                log_exception(f"Remote card payment for invoice #{invoice_id} failed", e)
+                future.set_exception(e)
+        if callback:
+            future.add_done_callback(lambda done: callback(done.result()) if not done.exception() else None)
+        threading.Thread(target=run, name='remote-card-payment', daemon=True).start()
+        return future
+
+def remote_services(url, token=None):
+    """Module-level service names of the services package, bound to the server at url"""
+    client = ApiClient(url, token=token)
+    services = {name: RemoteService(client, name) for name in REMOTE_METHODS}
+    services['payments'] = RemotePaymentService(client, 'payments')
+    return {
+        'customer_service': services['customers'],
+        'session_service': services['sessions'],
+        'order_service': services['orders'],
+        'appointment_service': services['appointments'],
+        'invoice_service': services['invoices'],
+        'payment_service': services['payments'],
+        'inventory_service': services['inventory'],
+        'report_service': services['reports'],
+        'messaging_service': services['sms'],
+    }
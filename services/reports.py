@@ -0,0 +1,150 @@
+"""
+Report Service
+Sales, section, customer and profit figures as plain dicts
+"""
+from datetime import datetime, timedelta
+
+from database import db
+from checkout import CheckoutEngine, checkout_engine
+from archive import ArchiveManager, archive_manager
+
+class ReportService:
+    """Report figures for any date range
+    
+    Dates are 'YYYY-MM-DD' strings and ranges include both ends. Invoice
+    figures for ranges reaching past the archive horizon include the
+    archived invoices.
+    """
+    def __init__(self, database=None):
+        self.db = database or db
+        self.checkout = CheckoutEngine(self.db) if database else checkout_engine
+        self.archive = ArchiveManager(self.db) if database else archive_manager
+    
+    def sales_totals(self, start_date, end_date):
+        """{'count', 'revenue'} of paid invoices in a range"""
+        invoices = self.archive.table_for('invoices', start_date)
+        row = self.db.fetchone(
+            f"""SELECT COUNT(*) as count, COALESCE(SUM(final_amount), 0) as revenue
+                FROM {invoices}
+                WHERE DATE(invoice_date) BETWEEN ? AND ? AND is_paid = 1""",
+            (start_date, end_date)
+        )
+        return dict(row)
+    
+    def sales_report(self, start_date, end_date, top=5):
+        """Totals, revenue by section and payment method, and the top salon services of a range"""
+        report = self.sales_totals(start_date, end_date)
+        invoices = self.archive.table_for('invoices', start_date)
+        report['sections'] = self.checkout.section_revenue(start_date, end_date)
+        report['payment_methods'] = {
+            row['payment_method'] or 'Unknown': {'amount': row['total'], 'count': row['count']}
+            for row in self.db.fetchall(
+                f"""SELECT payment_method, SUM(final_amount) as total, COUNT(*) as count
+                    FROM {invoices}
+                    WHERE DATE(invoice_date) BETWEEN ? AND ? AND is_paid = 1
+                    GROUP BY payment_method""",
+                (start_date, end_date)
+            )
+        }
+        report['top_services'] = [dict(row) for row in self.db.fetchall(
+            """SELECT s.name, COUNT(*) as count, SUM(sr.price) as revenue
+               FROM salon_service_records sr
+               JOIN salon_services s ON sr.service_id = s.id
+               WHERE DATE(sr.service_date) BETWEEN ? AND ?
+               GROUP BY sr.service_id
+               ORDER BY revenue DESC
+               LIMIT ?""",
+            (start_date, end_date, top)
+        )]
+        return report
+    
+    def section_activity(self, days=30, today=None):
+        """Per section revenue and volume of the last `days` days, billed or not
+        
+        Returns {'Salon': {'count', 'revenue'}, 'Cafe': ..., 'Gamnet':
+        {..., 'minutes'}} from the salon records, cafe orders and finished
+        gamnet sessions themselves.
+        """
+        since = ((today or datetime.now()) - timedelta(days=days)).strftime('%Y-%m-%d')
+        salon = self.db.fetchone(
+            """SELECT COUNT(*) as count, COALESCE(SUM(price), 0) as revenue FROM salon_service_records
+               WHERE DATE(service_date) >= ?""",
+            (since,)
+        )
+        cafe = self.db.fetchone(
+            """SELECT COUNT(*) as count, COALESCE(SUM(total_amount), 0) as revenue FROM cafe_orders
+               WHERE DATE(order_date) >= ?""",
+            (since,)
+        )
+        gamnet = self.db.fetchone(
+            """SELECT COUNT(*) as count, COALESCE(SUM(charge), 0) as revenue,
+                      COALESCE(SUM(duration_minutes), 0) as minutes
+               FROM gamnet_sessions
+               WHERE DATE(start_time) >= ? AND end_time IS NOT NULL""",
+            (since,)
+        )
+        return {'Salon': dict(salon), 'Cafe': dict(cafe), 'Gamnet': dict(gamnet)}
+    
+    def top_stylists(self, days=30, limit=5, today=None):
+        """Stylists by salon revenue over the last `days` days"""
+        since = ((today or datetime.now()) - timedelta(days=days)).strftime('%Y-%m-%d')
+        return self.db.fetchall(
+            """SELECT e.name, COUNT(*) as services, SUM(s.price) as revenue
+               FROM salon_service_records s
+               JOIN employees e ON s.stylist_id = e.id
+               WHERE DATE(s.service_date) >= ?
+               GROUP BY s.stylist_id
+               ORDER BY revenue DESC
+               LIMIT ?""",
+            (since, limit)
+        )
+    
+    def top_menu_items(self, days=30, limit=5, today=None):
+        """Cafe menu items by revenue over the last `days` days"""
+        since = ((today or datetime.now()) - timedelta(days=days)).strftime('%Y-%m-%d')
+        return self.db.fetchall(
+            """SELECT m.name, SUM(oi.quantity) as sold, SUM(oi.price * oi.quantity) as revenue
+               FROM cafe_order_items oi
+               JOIN cafe_menu m ON oi.menu_item_id = m.id
+               JOIN cafe_orders o ON oi.order_id = o.id
+               WHERE DATE(o.order_date) >= ?
+               GROUP BY m.id
+               ORDER BY revenue DESC
+               LIMIT ?""",
+            (since, limit)
+        )
+    
+    def customer_stats(self, today=None, top=10):
+        """Customer counts (total, active in 30 days, new this month) and the top spenders"""
+        today = today or datetime.now()
+        row = self.db.fetchone(
+            """SELECT COUNT(*) as total,
+                      COALESCE(SUM(last_visit_date >= ?), 0) as active,
+                      COALESCE(SUM(DATE(registration_date) >= ?), 0) as new_this_month
+               FROM customers""",
+            ((today - timedelta(days=30)).strftime('%Y-%m-%d'), today.replace(day=1).strftime('%Y-%m-%d'))
+        )
+        stats = dict(row)
+        stats['top'] = self.db.fetchall(
+            "SELECT name, phone, total_spent FROM customers ORDER BY total_spent DESC LIMIT ?", (top,)
+        )
+        return stats
+    
+    def profit_loss(self, start_date, end_date):
+        """Paid revenue, expenses by category and the net result of a range"""
+        revenue = self.sales_totals(start_date, end_date)['revenue']
+        expenses = {
+            row['category']: row['total'] or 0
+            for row in self.db.fetchall(
+                """SELECT category, SUM(amount) as total FROM expenses
+                   WHERE DATE(expense_date) BETWEEN ? AND ?
+                   GROUP BY category""",
+                (start_date, end_date)
+            )
+        }
+        total_expenses = sum(expenses.values())
+        return {'revenue': revenue, 'expenses': expenses, 'total_expenses': total_expenses,
+                'net': revenue - total_expenses}
+
+# Global report service instance
+report_service = ReportService()
@@ -0,0 +1,133 @@
+"""
+Gamnet Session Service
+Devices, manually started and ended sessions, and reservations
+"""
+from datetime import datetime
+
+from database import db, DayClosedError
+from gamnet_telemetry import session_charge, TIME_FORMAT
+from services.customers import CustomerService, customer_service
+
+class SessionError(Exception):
+    """Raised when a session or reservation is refused"""
+
+class SessionService:
+    """Gamnet devices and sessions
+    
+    Sessions ended here are charged with the same rule the device agents
+    use, so manual and telemetry sessions bill alike.
+    """
+    def __init__(self, database=None):
+        self.db = database or db
+        self.customers = CustomerService(self.db) if database else customer_service
+    
+    def devices(self, available_only=False):
+        """Devices, optionally only the free ones"""
+        where = "WHERE is_available = 1" if available_only else ""
+        return self.db.fetchall(f"SELECT * FROM gamnet_devices {where} ORDER BY id")
+    
+    def add_device(self, number, device_type, hourly_rate):
+        """Add a device; returns its id"""
+        if not number:
+            raise SessionError("Device number is required")
+        if hourly_rate < 0:
+            raise SessionError("Hourly rate cannot be negative")
+        with self.db.transaction() as cursor:
+            cursor.execute(
+                "INSERT INTO gamnet_devices (device_number, device_type, hourly_rate) VALUES (?, ?, ?)",
+                (number, device_type, hourly_rate)
+            )
+            return cursor.lastrowid
+    
+    def active(self):
+        """Open sessions with device and customer; agent logins may have no customer"""
+        return self.db.fetchall(
+            """SELECT s.*, d.device_number,
+                      COALESCE(c.name, 'Walk-in') as customer_name, COALESCE(c.phone, '-') as phone
+               FROM gamnet_sessions s
+               JOIN gamnet_devices d ON s.device_id = d.id
+               LEFT JOIN customers c ON s.customer_id = c.id
+               WHERE s.end_time IS NULL"""
+        )
+    
+    def start(self, device_id, phone, when=None):
+        """Start a session for a customer on a device; returns the session id"""
+        when = when or datetime.now()
+        try:
+            with self.db.transaction() as cursor:
+                if not cursor.execute("SELECT 1 FROM gamnet_devices WHERE id = ?", (device_id,)).fetchone():
+                    raise SessionError("Device not found")
+                running = cursor.execute(
+                    "SELECT 1 FROM gamnet_sessions WHERE device_id = ? AND end_time IS NULL", (device_id,)
+                ).fetchone()
+                if running:
+                    raise SessionError("Device already has a running session")
+                customer_id = self.customers.get_or_create(phone, cursor, when)
+                cursor.execute(
+                    "INSERT INTO gamnet_sessions (device_id, customer_id, start_time) VALUES (?, ?, ?)",
+                    (device_id, customer_id, when.strftime(TIME_FORMAT))
+                )
+                session_id = cursor.lastrowid
+                cursor.execute("UPDATE gamnet_devices SET is_available = 0, status = 'in_use' WHERE id = ?",
+                               (device_id,))
+        except DayClosedError:
+            raise SessionError(f"{when:%Y-%m-%d} is closed; no more sessions can start on it")
+        return session_id
+    
+    def end(self, device_id, when=None):
+        """End the device's running session and free the device
+        
+        Returns {'session_id', 'duration_minutes', 'charge'}, or None when
+        nothing is running on the device.
+        """
+        end_time = (when or datetime.now()).strftime(TIME_FORMAT)
+        with self.db.transaction() as cursor:
+            session = cursor.execute(
+                """SELECT s.id, s.start_time, d.hourly_rate FROM gamnet_sessions s
+                   JOIN gamnet_devices d ON d.id = s.device_id
+                   WHERE s.device_id = ? AND s.end_time IS NULL
+                   ORDER BY s.start_time DESC LIMIT 1""",
+                (device_id,)
+            ).fetchone()
+            if not session:
+                return None
+            duration, charge = session_charge(session['start_time'], end_time, session['hourly_rate'] or 0)
+            cursor.execute(
+                "UPDATE gamnet_sessions SET end_time = ?, duration_minutes = ?, charge = ? WHERE id = ?",
+                (end_time, duration, charge, session['id'])
+            )
+            cursor.execute("UPDATE gamnet_devices SET is_available = 1, status = 'available' WHERE id = ?",
+                           (device_id,))
+        return {'session_id': session['id'], 'duration_minutes': duration, 'charge': charge}
+    
+    def reserve(self, device_id, phone, date, time, duration_minutes):
+        """Reserve a device for a customer; returns the reservation id"""
+        try:
+            datetime.strptime(f"{date} {time}", '%Y-%m-%d %H:%M')
+        except ValueError:
+            raise SessionError("Reservation date must be YYYY-MM-DD and time HH:MM")
+        if duration_minutes <= 0:
+            raise SessionError("Reservation duration must be positive")
+        with self.db.transaction() as cursor:
+            customer_id = self.customers.get_or_create(phone, cursor)
+            cursor.execute(
+                """INSERT INTO gamnet_reservations
+                   (device_id, customer_id, reservation_date, reservation_time, duration_minutes)
+                   VALUES (?, ?, ?, ?, ?)""",
+                (device_id, customer_id, date, time, duration_minutes)
+            )
+            return cursor.lastrowid
+    
+    def pending_reservations(self):
+        """Pending reservations, soonest first"""
+        return self.db.fetchall(
+            """SELECT r.*, d.device_number, c.name as customer_name, c.phone
+               FROM gamnet_reservations r
+               JOIN gamnet_devices d ON r.device_id = d.id
+               JOIN customers c ON r.customer_id = c.id
+               WHERE r.status = 'pending'
+               ORDER BY r.reservation_date, r.reservation_time"""
+        )
+
+# Global session service instance
+session_service = SessionService()
@@ -0,0 +1,110 @@
+"""
+SMS Service
+Audiences for manual and campaign SMS, and sending to them through sms_service
+"""
+from datetime import datetime, timedelta
+
+from database import db
+from sms_service import sms_service
+from customer_segments import RfmScorer, rfm_scorer, SEGMENT_NAMES
+
+AUDIENCES = ('all', 'active', 'inactive')
+
+class MessagingError(Exception):
+    """Raised when an SMS cannot be sent"""
+
+class MessagingService:
+    """Who to message, and sending to them
+    
+    The provider is the sender's concern: sender is any object with
+    is_configured(), send_sms(), send_birthday_sms() and
+    send_inactive_customer_sms() like sms_service. Bulk sends return
+    {'sent', 'failed'} counts.
+    """
+    def __init__(self, database=None, sender=None):
+        self.db = database or db
+        self.sender = sender or sms_service
+        self.rfm = RfmScorer(self.db) if database else rfm_scorer
+    
+    def require_configured(self):
+        """Raise MessagingError unless an SMS provider is set up"""
+        if not self.sender.is_configured():
+            raise MessagingError("SMS API is not configured. Please go to Settings > SMS Configuration first.")
+    
+    def audience(self, kind, today=None):
+        """Customers of an audience: 'all', 'active' (visited in 30 days), 'inactive' or an RFM segment
+        
+        Segments are as last scored; score_segments() brings them up to date.
+        """
+        if kind in SEGMENT_NAMES:
+            return self.rfm.customers(kind, today)
+        if kind not in AUDIENCES:
+            raise MessagingError(f"Unknown audience {kind!r}")
+        since = ((today or datetime.now()) - timedelta(days=30)).strftime('%Y-%m-%d')
+        where = {
+            'all': "",
+            'active': "WHERE last_visit_date >= ?",
+            'inactive': "WHERE last_visit_date IS NULL OR last_visit_date < ?",
+        }[kind]
+        return self.db.fetchall(f"SELECT * FROM customers {where} ORDER BY id", (since,) if where else ())
+    
+    def score_segments(self):
+        """Rescore the customers whose invoices changed; returns {segment: customers}"""
+        self.rfm.refresh()
+        return self.rfm.counts()
+    
+    def segment_counts(self):
+        """{segment: customers} as last scored"""
+        return self.rfm.counts()
+    
+    def average_customer_value(self):
+        """Average paid total per scored customer, as last scored"""
+        return self.rfm.average_monetary()
+    
+    def birthdays(self, today=None):
+        """Customers whose birthday is today"""
+        today = today or datetime.now()
+        return self.db.fetchall("SELECT * FROM customers WHERE birthdate LIKE ? ORDER BY id",
+                                (f"%-{today.month:02d}-{today.day:02d}",))
+    
+    def lapsed(self, days=30, today=None):
+        """Customers whose last visit was more than `days` days ago"""
+        since = ((today or datetime.now()) - timedelta(days=days)).strftime('%Y-%m-%d')
+        return self.db.fetchall("SELECT * FROM customers WHERE last_visit_date < ? ORDER BY id", (since,))
+    
+    def send(self, phone, message):
+        """Send a manual SMS to a registered customer; returns the provider result"""
+        self.require_configured()
+        if not message:
+            raise MessagingError("Please enter a message")
+        customer = self.db.fetchone("SELECT id FROM customers WHERE phone = ?", (phone,))
+        if not customer:
+            raise MessagingError("Customer not found")
+        return self.sender.send_sms(phone, message, 'manual', customer['id'])
+    
+    def _send_each(self, customers, send):
+        counts = {'sent': 0, 'failed': 0}
+        for customer in customers:
+            result = send(customer)
+            counts['sent' if result and result.get('success') else 'failed'] += 1
+        return counts
+    
+    def send_bulk(self, customers, message):
+        """Send the same manual message to each customer"""
+        self.require_configured()
+        if not message:
+            raise MessagingError("Please enter a message")
+        return self._send_each(customers, lambda c: self.sender.send_sms(c['phone'], message, 'manual', c['id']))
+    
+    def send_birthday_greetings(self, customers):
+        """Send the birthday greeting to each customer"""
+        self.require_configured()
+        return self._send_each(customers, lambda c: self.sender.send_birthday_sms(c['id']))
+    
+    def send_reactivation(self, customers):
+        """Send the we-miss-you message to each customer"""
+        self.require_configured()
+        return self._send_each(customers, lambda c: self.sender.send_inactive_customer_sms(c['id']))
+
+# Global messaging service instance
+messaging_service = MessagingService()
@@ -7,9 +7,12 @@ from ui_utils import *
 from database import db
 from translations import tr, translator
 from auth import session
+from invoice_renderer import invoice_renderer
+from backup import backup_manager, BackupError
+from archive import archive_manager, ArchiveError
 import hashlib
 import os
-import shutil
+import threading
 from datetime import datetime
 from tkinter import filedialog, messagebox
 
@@ -107,6 +110,12 @@ class SettingsSection:
         form_frame = GlassFrame(tab)
         form_frame.pack(fill='x', padx=10, pady=10)
         
+        # Business name
+        GlassLabel(form_frame, text="Business Name (printed on receipts)").pack(pady=5)
+        name_entry = GlassEntry(form_frame, width=300)
+        name_entry.insert(0, self.get_setting('business_name', 'Kagan Collection'))
+        name_entry.pack(pady=5)
+        
         # Currency
         GlassLabel(form_frame, text=tr('currency')).pack(pady=5)
         currency_entry = GlassEntry(form_frame, width=300)
@@ -144,12 +153,14 @@ class SettingsSection:
         loyalty_entry.pack(pady=5)
         
         def save_business():
+            self.save_setting('business_name', name_entry.get())
             self.save_setting('currency', currency_entry.get())
             self.save_setting('tax_rate', tax_entry.get())
             self.save_setting('business_hours', hours_entry.get())
             self.save_setting('contact_phone', phone_entry.get())
             self.save_setting('contact_email', email_entry.get())
             self.save_setting('loyalty_points_rate', loyalty_entry.get())
+            invoice_renderer.invalidate()
             messagebox.showinfo("Success", "Business settings saved successfully!")
         
         GlassButton(form_frame, text=tr('save'), command=save_business).pack(pady=20)
@@ -304,10 +315,33 @@ Important Notes:
         )
         freq_menu.pack(pady=5)
         
+        # Format
+        GlassLabel(form_frame, text="Backup Format").pack(pady=5)
+        mode_var = ctk.StringVar(value=self.get_setting('backup_mode', 'incremental'))
+        ctk.CTkOptionMenu(
+            form_frame,
+            variable=mode_var,
+            values=["incremental", "full"],
+            fg_color=COLORS['surface'],
+            button_color=COLORS['primary']
+        ).pack(pady=5)
+        
+        # Retention
+        GlassLabel(form_frame, text="Backups to Keep").pack(pady=5)
+        keep_entry = GlassEntry(form_frame, width=100)
+        keep_entry.insert(0, self.get_setting('backup_keep', '10'))
+        keep_entry.pack(pady=5)
+        
         def save_backup_settings():
+            keep = keep_entry.get().strip()
+            if not keep.isdigit() or int(keep) < 1:
+                messagebox.showerror("Error", "Backups to keep must be a whole number of at least 1")
+                return
             self.save_setting('backup_path', self.backup_path_entry.get())
             self.save_setting('auto_backup', '1' if auto_backup_var.get() else '0')
             self.save_setting('backup_frequency', freq_var.get())
+            self.save_setting('backup_keep', keep)
+            self.save_setting('backup_mode', mode_var.get())
             messagebox.showinfo("Success", "Backup settings saved successfully!")
         
         GlassButton(form_frame, text=tr('save'), command=save_backup_settings).pack(pady=10)
@@ -327,55 +361,109 @@ Important Notes:
             command=self.restore_database,
             fg_color=COLORS['warning']
         ).pack(pady=5)
+        
+        # Archival of old history
+        archive_frame = GlassFrame(tab)
+        archive_frame.pack(fill='x', padx=10, pady=10)
+        GlassLabel(archive_frame, text="Archive", font=FONTS['subheading']).pack(pady=5)
+        GlassLabel(archive_frame, text="Archive History Older Than (days)").pack(pady=5)
+        self.archive_days_entry = GlassEntry(archive_frame, width=100)
+        self.archive_days_entry.insert(0, self.get_setting('archive_after_days', '365'))
+        self.archive_days_entry.pack(pady=5)
+        GlassButton(archive_frame, text="Archive Now", command=self.archive_history).pack(pady=10)
+        
+        # Recent backups
+        history_frame = GlassFrame(tab)
+        history_frame.pack(fill='both', expand=True, padx=10, pady=10)
+        GlassLabel(history_frame, text="Recent Backups", font=FONTS['subheading']).pack(pady=5)
+        self.backup_history_text = ctk.CTkTextbox(
+            history_frame,
+            height=180,
+            fg_color=COLORS['surface'],
+            text_color=COLORS['text']
+        )
+        self.backup_history_text.pack(fill='both', expand=True, padx=10, pady=10)
+        self.refresh_backup_history()
     
-    def backup_database(self):
-        """Create database backup"""
-        try:
-            backup_dir = self.get_setting('backup_path', './backups')
-            os.makedirs(backup_dir, exist_ok=True)
-            
-            timestamp = datetime.now().strftime('%Y%m%d_%H%M%S')
-            backup_file = os.path.join(backup_dir, f'kagan_backup_{timestamp}.db')
-            
-            # Copy database
-            db_path = os.path.join(os.path.dirname(__file__), 'kagan.db')
-            shutil.copy2(db_path, backup_file)
-            
-            # Record backup
-            file_size = os.path.getsize(backup_file)
-            db.execute(
-                """INSERT INTO backup_history (backup_date, backup_path, backup_size, status)
-                   VALUES (?, ?, ?, ?)""",
-                (datetime.now().strftime('%Y-%m-%d %H:%M:%S'), backup_file, file_size, 'success')
+    def archive_history(self):
+        """Move history older than the horizon into the yearly archives in the background"""
+        days = self.archive_days_entry.get().strip()
+        if not days.isdigit() or int(days) < 1:
+            messagebox.showerror("Error", "Days must be a whole number of at least 1")
+            return
+        self.save_setting('archive_after_days', days)
+        if not messagebox.askyesno("Confirm", f"Move invoices, sessions, orders, SMS and attendance older than {days} days into the archive?"):
+            return
+        
+        def run():
+            try:
+                moved = archive_manager.archive()
+            except ArchiveError as e:
+                self.frame.after(0, lambda message=str(e): messagebox.showerror("Error", message))
+            else:
+                summary = '\n'.join(f"{table}: {count}" for table, count in moved.items())
+                self.frame.after(0, lambda: messagebox.showinfo("Success", f"Rows archived:\n{summary}"))
+        
+        threading.Thread(target=run, name='archive', daemon=True).start()
+    
+    def refresh_backup_history(self):
+        """Show the latest backup_history rows"""
+        self.backup_history_text.delete('1.0', 'end')
+        for backup in backup_manager.history():
+            self.backup_history_text.insert('end',
+                f"{backup['backup_date']} - {backup['status']} - {(backup['backup_size'] or 0) / 1024:.0f} KB - "
+                f"{os.path.basename(backup['backup_path'] or '')} {backup['notes'] or ''}\n"
             )
-            
-            messagebox.showinfo("Success", f"Backup created successfully!\n{backup_file}")
-        except Exception as e:
-            messagebox.showerror("Error", f"Backup failed: {str(e)}")
+    
+    def backup_database(self):
+        """Create a database backup in the background"""
+        directory = self.backup_path_entry.get().strip() or None
+        
+        def run():
+            try:
+                backup = backup_manager.create_backup(directory, notes='manual')
+            except BackupError as e:
+                self.frame.after(0, lambda message=str(e): messagebox.showerror("Error", message))
+            else:
+                self.frame.after(0, lambda: messagebox.showinfo(
+                    "Success",
+                    f"Backup created and verified in {backup['seconds']:.1f}s!\n{backup['path']}"
+                ))
+            self.frame.after(0, self.refresh_backup_history)
+        
+        threading.Thread(target=run, name='manual-backup', daemon=True).start()
     
     def restore_database(self):
-        """Restore database from backup"""
+        """Restore database from backup while the application keeps running"""
         backup_file = filedialog.askopenfilename(
             title="Select Backup File",
-            filetypes=[("Database Files", "*.db"), ("All Files", "*.*")]
+            filetypes=[("Backups", "*.db *.gz *.json"), ("All Files", "*.*")]
         )
         
         if not backup_file:
             return
         
-        if messagebox.askyesno("Confirm", "This will replace the current database. Continue?"):
+        if not messagebox.askyesno(
+            "Confirm",
+            "This will replace the current data with the backup. The current data is backed up first. Continue?"
+        ):
+            return
+        
+        # Sections, this one included, are rebuilt after a restore; report through the window
+        window = self.frame.winfo_toplevel()
+        
+        def run():
             try:
-                db_path = os.path.join(os.path.dirname(__file__), 'kagan.db')
-                
-                # Close database connection
-                db.close()
-                
-                # Restore backup
-                shutil.copy2(backup_file, db_path)
-                
-                messagebox.showinfo("Success", "Database restored successfully! Please restart the application.")
-            except Exception as e:
-                messagebox.showerror("Error", f"Restore failed: {str(e)}")
+                restored = backup_manager.restore(backup_file)
+            except BackupError as e:
+                window.after(0, lambda message=f"Restore failed: {e}": messagebox.showerror("Error", message))
+            else:
+                window.after(0, lambda: messagebox.showinfo(
+                    "Success",
+                    f"Database restored in {restored['seconds']:.1f}s.\nPrevious data saved to {restored['safety']}"
+                ))
+        
+        threading.Thread(target=run, name='restore', daemon=True).start()
     
     def setup_users_tab(self):
         """Setup user management (admin only)"""
@@ -7,6 +7,9 @@ from ui_utils import *
 from database import db
 from translations import tr
 from sms_service import sms_service
+from customer_search import customer_search
+from services import messaging_service, MessagingError
+from customer_segments import SEGMENT_NAMES
 from tkinter import messagebox
 
 class SMSSection:
@@ -119,9 +122,38 @@ class SMSSection:
         )
         inactive_radio.pack(pady=2)
         
+        segment_radio = ctk.CTkRadioButton(
+            form_frame,
+            text="Customer Segment (RFM)",
+            variable=send_type_var,
+            value="segment"
+        )
+        segment_radio.pack(pady=2)
+        
+        counts = messaging_service.score_segments()
+        segment_var = ctk.StringVar(value=SEGMENT_NAMES[0])
+        ctk.CTkOptionMenu(
+            form_frame,
+            variable=segment_var,
+            values=list(SEGMENT_NAMES),
+            fg_color=COLORS['surface'],
+            button_color=COLORS['primary']
+        ).pack(pady=2)
+        GlassLabel(
+            form_frame,
+            text=', '.join(f"{name}: {count}" for name, count in counts.items()),
+            font=FONTS['small']
+        ).pack(pady=2)
+        
         # Customer phone (for single)
-        GlassLabel(form_frame, text="Customer Phone (for single):").pack(pady=5)
-        phone_entry = GlassEntry(form_frame, width=300)
+        GlassLabel(form_frame, text="Customer Name or Phone (for single):").pack(pady=5)
+        phone_entry = SuggestionEntry(
+            form_frame,
+            customer_search.search,
+            describe=lambda customer: f"{customer['name']} - {customer['phone']}",
+            value=lambda customer: customer['phone'],
+            width=300
+        )
         phone_entry.pack(pady=5)
         
         # Message template
@@ -161,7 +193,9 @@ class SMSSection:
         # Send button
         def send_sms():
             # Check if SMS is configured
-            if not sms_service.is_configured():
+            try:
+                messaging_service.require_configured()
+            except MessagingError:
                 messagebox.showerror(
                     "SMS Not Configured",
                     "SMS API is not configured. Please go to Settings > SMS Configuration to set up your SMS provider, API key, and sender number before sending SMS."
@@ -171,44 +205,32 @@ class SMSSection:
             send_type = send_type_var.get()
             message = message_text.get('1.0', 'end-1c').strip()
             
-            if not message:
-                messagebox.showerror("Error", "Please enter a message")
-                return
-            
             if send_type == "single":
                 phone = phone_entry.get().strip()
                 if not phone:
                     messagebox.showerror("Error", "Please enter customer phone")
                     return
                 
-                customer = db.fetchone("SELECT * FROM customers WHERE phone = ?", (phone,))
-                if not customer:
-                    messagebox.showerror("Error", "Customer not found")
+                try:
+                    result = messaging_service.send(phone, message)
+                except MessagingError as e:
+                    messagebox.showerror("Error", str(e))
                     return
-                
-                result = sms_service.send_sms(phone, message, 'manual', customer['id'])
                 if result['success']:
                     messagebox.showinfo("Success", "SMS sent successfully!")
                 else:
                     messagebox.showerror("Error", f"Failed to send SMS: {result['message']}")
             
             else:
-                # Get recipients based on type
-                if send_type == "all":
-                    customers = db.fetchall("SELECT * FROM customers")
-                elif send_type == "active":
-                    customers = db.fetchall(
-                        """SELECT * FROM customers 
-                           WHERE last_visit_date IS NOT NULL
-                           AND julianday('now') - julianday(last_visit_date) <= 30"""
-                    )
-                else:  # inactive
-                    customers = db.fetchall(
-                        """SELECT * FROM customers 
-                           WHERE last_visit_date IS NULL
-                           OR julianday('now') - julianday(last_visit_date) > 30"""
-                    )
+                if not message:
+                    messagebox.showerror("Error", "Please enter a message")
+                    return
                 
+                # Recipients: all, active or inactive customers, or an RFM segment
+                if send_type == "segment":
+                    messaging_service.score_segments()
+                    send_type = segment_var.get()
+                customers = messaging_service.audience(send_type)
                 if not customers:
                     messagebox.showinfo("Info", "No customers found for this criteria")
                     return
@@ -217,18 +239,9 @@ class SMSSection:
                 if not messagebox.askyesno("Confirm", f"Send SMS to {len(customers)} customers?"):
                     return
                 
-                # Send to all
-                sent_count = 0
-                failed_count = 0
-                for customer in customers:
-                    result = sms_service.send_sms(customer['phone'], message, 'manual', customer['id'])
-                    if result.get('success'):
-                        sent_count += 1
-                    else:
-                        failed_count += 1
-                
-                messagebox.showinfo("Complete", 
-                    f"SMS sent to {sent_count} customers\nFailed: {failed_count}")
+                counts = messaging_service.send_bulk(customers, message)
+                messagebox.showinfo("Complete",
+                    f"SMS sent to {counts['sent']} customers\nFailed: {counts['failed']}")
             
             # Refresh history
             self.refresh_history()
@@ -421,68 +434,39 @@ Important Notes:
         ).pack(pady=5)
         
         def send_birthday_campaigns():
-            from datetime import datetime
-            from sms_service import sms_service
-            
             # Check if SMS is configured
-            if not sms_service.is_configured():
-                messagebox.showerror(
-                    "SMS Not Configured",
-                    "SMS API is not configured. Please go to Settings > SMS Configuration first."
-                )
+            try:
+                messaging_service.require_configured()
+            except MessagingError as e:
+                messagebox.showerror("SMS Not Configured", str(e))
                 return
             
-            now = datetime.now()
-            today_birthday = f"%-{now.month:02d}-{now.day:02d}"
-            birthdays = db.fetchall(
-                """SELECT * FROM customers 
-                   WHERE birthdate LIKE ?""",
-                (today_birthday,)
-            )
-            
+            birthdays = messaging_service.birthdays()
             if not birthdays:
                 messagebox.showinfo("Info", "No birthdays today")
                 return
             
             if messagebox.askyesno("Confirm", f"Send birthday SMS to {len(birthdays)} customers?"):
-                sent = 0
-                for customer in birthdays:
-                    result = sms_service.send_birthday_sms(customer['id'])
-                    if result and result.get('success'):
-                        sent += 1
-                messagebox.showinfo("Complete", f"Birthday SMS sent to {sent} customers")
+                counts = messaging_service.send_birthday_greetings(birthdays)
+                messagebox.showinfo("Complete", f"Birthday SMS sent to {counts['sent']} customers")
                 self.refresh_history()
         
         def send_reactivation_campaigns():
-            from datetime import datetime, timedelta
-            from sms_service import sms_service
-            
             # Check if SMS is configured
-            if not sms_service.is_configured():
-                messagebox.showerror(
-                    "SMS Not Configured",
-                    "SMS API is not configured. Please go to Settings > SMS Configuration first."
-                )
+            try:
+                messaging_service.require_configured()
+            except MessagingError as e:
+                messagebox.showerror("SMS Not Configured", str(e))
                 return
             
-            thirty_days_ago = (datetime.now() - timedelta(days=30)).strftime('%Y-%m-%d')
-            inactive = db.fetchall(
-                """SELECT * FROM customers 
-                   WHERE last_visit_date < ?""",
-                (thirty_days_ago,)
-            )
-            
+            inactive = messaging_service.lapsed(30)
             if not inactive:
                 messagebox.showinfo("Info", "No inactive customers found")
                 return
             
             if messagebox.askyesno("Confirm", f"Send reactivation SMS to {len(inactive)} customers?"):
-                sent = 0
-                for customer in inactive:
-                    result = sms_service.send_inactive_customer_sms(customer['id'])
-                    if result and result.get('success'):
-                        sent += 1
-                messagebox.showinfo("Complete", f"Reactivation SMS sent to {sent} customers")
+                counts = messaging_service.send_reactivation(inactive)
+                messagebox.showinfo("Complete", f"Reactivation SMS sent to {counts['sent']} customers")
                 self.refresh_history()
         
         GlassButton(
@@ -0,0 +1,511 @@
+"""
+Terminal Sync Module
+Offline-first terminals: every node logs its row changes through triggers,
+and terminals exchange batches of those changes with the main node
+whenever it can be reached
+"""
+import json
+import sqlite3
+import threading
+from datetime import datetime
+
+from database import db, Database
+from services.remote import ApiClient, ApiError, RemoteService
+from app_logger import log_info, log_warning, log_exception
+
+TIME_FORMAT = '%Y-%m-%d %H:%M:%S'
+
+# Replicated tables. 'key' names the key of tables without an id; rows of
+# the others keep their own id on every node and are matched through
+# sync_ids, or on 'match' columns for rows written on two nodes at once.
+# 'sum' columns merge by adding each change's delta, 'keep' tables keep the
+# row they have, 'local' rows are never logged; every other column is
+# last-writer-wins by (changed_at, origin).
+SYNC_TABLES = {
+    'customers': {'match': ('phone',), 'sum': ('loyalty_points', 'wallet_balance', 'total_spent')},
+    'wallet_transactions': {},
+    'loyalty_transactions': {},
+    'employees': {},
+    'attendance': {},
+    'employee_commissions': {},
+    'salon_services': {},
+    'salon_appointments': {},
+    'salon_service_records': {},
+    'cafe_menu': {},
+    'cafe_orders': {},
+    'cafe_order_items': {},
+    'cafe_recipes': {'key': ('menu_item_id', 'inventory_item_id')},
+    'gamnet_devices': {'match': ('device_number',)},
+    'gamnet_sessions': {},
+    'gamnet_reservations': {},
+    'invoices': {},
+    'payment_transactions': {'match': ('idempotency_key',)},
+    'campaigns': {'match': ('code',)},
+    'campaign_vouchers': {'key': ('code',)},
+    'inventory_items': {'match': ('sku',), 'sum': ('quantity',)},
+    'suppliers': {},
+    'purchase_orders': {},
+    'purchase_order_items': {},
+    'expenses': {},
+    'sms_history': {},
+    'messages': {},
+    'notifications': {},
+    'users': {'match': ('username',)},
+    # Machine settings (ports, paths, gateways) stay on their node
+    'settings': {'match': ('key',),
+                 'local': "{row}.category = 'system' OR {row}.key LIKE 'telemetry%' OR {row}.key LIKE 'payment_gateway%'"},
+    'day_closings': {'key': ('close_date',), 'keep': True},
+}
+
+# sync_ids.local_id of a peer's row whose insert was refused here
+REFUSED = 0
+
+# Id columns without a declared foreign key
+EXTRA_REFERENCES = {'invoice_id': 'invoices'}
+
+class SyncError(Exception):
+    """Raised when a node is not set up for sync or a change cannot be used"""
+
+def row_key(values):
+    """sync_log.row_key of a keyed row, as json_array() writes it"""
+    return json.dumps(list(values), separators=(',', ':'), ensure_ascii=False)
+
+class SyncEngine:
+    """Change log replication between a main node and its terminals
+    
+    Nodes are SQLite files: the main one (usually behind api_server.py) and
+    terminal replicas made from it by create_replica(). Triggers on the
+    SYNC_TABLES write every insert, update and delete to sync_log. A
+    terminal's sync() pushes the changes made on it in batches and pulls
+    everything else the main node logged, including changes it took from
+    other terminals; a terminal that cannot reach the main node keeps
+    working on its replica and catches up on the next sync.
+    
+    Rows inserted on another node get a new id here; sync_ids remembers
+    which, and foreign keys in incoming rows are translated through it.
+    Both sides record how far they got in the same transaction as the
+    changes, so a batch repeated after a lost answer is skipped.
+    """
+    def __init__(self, database=None):
+        self.db = database or db
+        self._columns = {}
+        self._references = {}
+        self._stop = threading.Event()
+        self._thread = None
+    
+    @property
+    def node(self):
+        """This node's name, or None while sync is not enabled"""
+        row = self.db.fetchone("SELECT node FROM sync_state WHERE id = 1")
+        return row['node'] if row else None
+    
+    @property
+    def upstream(self):
+        """Name of the main node a terminal syncs with"""
+        row = self.db.fetchone("SELECT upstream FROM sync_state WHERE id = 1")
+        return row['upstream'] if row else None
+    
+    def enable(self, node, upstream=None, pulled_through=0):
+        """Name this node and start logging its changes
+        
+        Terminals pass their main node's name and its last log id already
+        contained in their copy.
+        """
+        if not node:
+            raise SyncError("A node name is required")
+        with self.db.transaction() as cursor:
+            cursor.execute(
+                """INSERT INTO sync_state (id, node, upstream) VALUES (1, ?, ?)
+                   ON CONFLICT(id) DO UPDATE SET node = excluded.node, upstream = excluded.upstream""",
+                (node, upstream)
+            )
+            if upstream:
+                # A fresh replica: the copied bookkeeping is the main node's own
+                for table in ('sync_ids', 'sync_peers', 'sync_conflicts'):
+                    cursor.execute(f"DELETE FROM {table}")
+                cursor.execute("INSERT INTO sync_peers (peer, pulled_through) VALUES (?, ?)",
+                               (upstream, pulled_through))
+            self.install_triggers(cursor)
+        log_info(f"Sync enabled on node '{node}'" + (f" with main node '{upstream}'" if upstream else ""))
+    
+    def install_triggers(self, cursor):
+        """(Re)create the logging triggers for the current columns of SYNC_TABLES"""
+        self._columns.clear()
+        for table, config in SYNC_TABLES.items():
+            columns = self._table_columns(table, cursor)
+            if not columns:
+                continue
+            def row_json(row):
+                return "json_object(" + ', '.join(f"'{column}', {row}.{column}" for column in columns) + ")"
+            def key(row):
+                if 'key' in config:
+                    return "json_array(" + ', '.join(f"{row}.{column}" for column in config['key']) + ")"
+                return f"CAST({row}.id AS TEXT)"
+            for name, op, row, old, new in (('insert', 'I', 'NEW', 'NULL', row_json('NEW')),
+                                            ('update', 'U', 'NEW', row_json('OLD'), row_json('NEW')),
+                                            ('delete', 'D', 'OLD', row_json('OLD'), 'NULL')):
+                when = f"WHEN NOT ({config['local'].format(row=row)})" if config.get('local') else ''
+                cursor.execute(f"DROP TRIGGER IF EXISTS trg_{table}_sync_{name}")
+                cursor.execute(f"""
+                    CREATE TRIGGER trg_{table}_sync_{name}
+                    AFTER {name.upper()} ON {table} {when}
+                    BEGIN
+                        INSERT INTO sync_log (table_name, row_key, op, old_row, new_row, origin, changed_at)
+                        SELECT '{table}', {key(row)}, '{op}', {old}, {new}, COALESCE(applying_origin, node),
+                               COALESCE(applying_at, strftime('%Y-%m-%d %H:%M:%f', 'now'))
+                        FROM sync_state;
+                    END""")
+    
+    def create_replica(self, path, node):
+        """Copy this main node's database to path as terminal `node`; returns the replica's Database"""
+        main = self.node
+        if not main:
+            raise SyncError("Enable sync on the main node before making replicas")
+        if node == main:
+            raise SyncError("A terminal needs a name of its own")
+        with self.db.lock:
+            if self.db._transaction_depth:
+                raise SyncError("Replicas cannot be made inside an open transaction")
+            target = sqlite3.connect(path)
+            try:
+                self.db.conn.backup(target)
+            finally:
+                target.close()
+            through = self.db.fetchone("SELECT COALESCE(MAX(id), 0) as id FROM sync_log")['id']
+        replica = Database(path)
+        SyncEngine(replica).enable(node, upstream=main, pulled_through=through)
+        return replica
+    
+    # -- Applying changes -------------------------------------------------
+    
+    def _table_columns(self, table, cursor=None):
+        if table not in self._columns:
+            rows = (cursor or self.db.cursor).execute(f"PRAGMA table_info({table})").fetchall()
+            self._columns[table] = [row['name'] for row in rows]
+        return self._columns[table]
+    
+    def _table_references(self, table, cursor):
+        """{column: referenced table} of a table's id columns"""
+        if table not in self._references:
+            references = {row['from']: row['table']
+                          for row in cursor.execute(f"PRAGMA foreign_key_list({table})").fetchall()}
+            for column, target in EXTRA_REFERENCES.items():
+                if column in self._table_columns(table, cursor) and column not in references:
+                    references[column] = target
+            self._references[table] = references
+        return self._references[table]
+    
+    def _local_id(self, cursor, table, peer, peer_id):
+        row = cursor.execute(
+            "SELECT local_id FROM sync_ids WHERE table_name = ? AND peer = ? AND peer_id = ?", (table, peer, peer_id)
+        ).fetchone()
+        return row['local_id'] if row else None
+    
+    def _translate(self, cursor, peer, table, row):
+        """A peer's row with its references turned into local ids; ids the peer had from the start stay"""
+        row = dict(row)
+        for column, target in self._table_references(table, cursor).items():
+            if row.get(column) is not None and 'key' not in SYNC_TABLES.get(target, {'key': None}):
+                local_id = self._local_id(cursor, target, peer, row[column])
+                if local_id == REFUSED:
+                    raise SyncError(f"Refers to a {target} row that was refused")
+                if local_id is not None:
+                    row[column] = local_id
+        return row
+    
+    def _find(self, cursor, peer, table, change, row):
+        """(local id or key values, where clause, params) of the row a change is about, or None"""
+        config = SYNC_TABLES[table]
+        if 'key' in config:
+            values = [row[column] for column in config['key']]
+            where = ' AND '.join(f"{column} = ?" for column in config['key'])
+            found = cursor.execute(f"SELECT 1 FROM {table} WHERE {where}", values).fetchone()
+            return (values, where, values) if found else None
+        local_id = self._local_id(cursor, table, peer, row['id'])
+        if local_id is None and change['op'] != 'I':
+            local_id = row['id']
+        if local_id is None and config.get('match') and all(row.get(column) is not None for column in config['match']):
+            where = ' AND '.join(f"{column} = ?" for column in config['match'])
+            found = cursor.execute(f"SELECT id FROM {table} WHERE {where}",
+                                   [row[column] for column in config['match']]).fetchone()
+            local_id = found['id'] if found else None
+        if local_id is None or not cursor.execute(f"SELECT 1 FROM {table} WHERE id = ?", (local_id,)).fetchone():
+            return None
+        return local_id, "id = ?", (local_id,)
+    
+    def _newer(self, cursor, table, key, change):
+        """Whether a change wins last-writer-wins against this row's latest logged change"""
+        latest = cursor.execute(
+            """SELECT changed_at, origin FROM sync_log WHERE table_name = ? AND row_key = ?
+               ORDER BY changed_at DESC, origin DESC LIMIT 1""",
+            (table, key)
+        ).fetchone()
+        return latest is None or (change['changed_at'], change['origin']) >= (latest['changed_at'], latest['origin'])
+    
+    def _apply_change(self, cursor, peer, change, announce):
+        """Apply one change from a peer; returns [table, peer id, local id] when a row got matched or inserted"""
+        table = change['table']
+        config = SYNC_TABLES.get(table)
+        if config is None:
+            raise SyncError(f"{table} is not replicated")
+        columns = self._table_columns(table, cursor)
+        new = self._translate(cursor, peer, table, change['new']) if change['new'] else None
+        old = self._translate(cursor, peer, table, change['old']) if change['old'] else None
+        found = self._find(cursor, peer, table, change, new or old)
+        keys = config.get('key', ('id',))
+        
+        if change['op'] == 'D':
+            if found:
+                cursor.execute(f"DELETE FROM {table} WHERE {found[1]}", found[2])
+            return None
+        if not found:
+            if change['op'] == 'U':
+                # Deleted here: the delete wins
+                return None
+            names = [column for column in new if column in columns and (column != 'id' or 'key' in config)]
+            cursor.execute(f"INSERT INTO {table} ({', '.join(names)}) VALUES ({', '.join('?' for _ in names)})",
+                           [new[column] for column in names])
+            local_id = None if 'key' in config else cursor.lastrowid
+        else:
+            if config.get('keep'):
+                return None
+            local_id = None if 'key' in config else found[0]
+            sums = [column for column in config.get('sum', ()) if column in new and column in columns]
+            assignments = [f"{column} = COALESCE({column}, 0) + ?" for column in sums]
+            values = [(new[column] or 0) - ((old or {}).get(column) or 0) for column in sums]
+            key = row_key(found[0]) if 'key' in config else str(local_id)
+            if self._newer(cursor, table, key, change):
+                for column in new:
+                    if column in columns and column not in sums and column not in keys:
+                        assignments.append(f"{column} = ?")
+                        values.append(new[column])
+            if assignments:
+                cursor.execute(f"UPDATE {table} SET {', '.join(assignments)} WHERE {found[1]}",
+                               values + list(found[2]))
+        if local_id is None or change['op'] != 'I':
+            return None
+        cursor.execute(
+            "INSERT OR REPLACE INTO sync_ids (table_name, peer, peer_id, local_id, announced) VALUES (?, ?, ?, ?, ?)",
+            (table, peer, new['id'], local_id, 1 if announce else 0)
+        )
+        return [table, new['id'], local_id]
+    
+    def _apply(self, cursor, peer, changes, announce):
+        """Apply a batch of a peer's changes in the open transaction
+        
+        A change the database refuses (a closed day, a broken constraint)
+        is rolled back alone and recorded in sync_conflicts. Returns
+        {'applied', 'conflicts', 'ids'}.
+        """
+        applied, conflicts, ids = 0, 0, []
+        for change in changes:
+            cursor.execute("UPDATE sync_state SET applying_origin = ?, applying_at = ? WHERE id = 1",
+                           (change['origin'], change['changed_at']))
+            cursor.execute("SAVEPOINT sync_change")
+            try:
+                mapped = self._apply_change(cursor, peer, change, announce)
+            except (sqlite3.Error, SyncError, KeyError, TypeError) as e:
+                cursor.execute("ROLLBACK TO sync_change")
+                cursor.execute("RELEASE sync_change")
+                if change.get('op') == 'I' and 'key' not in SYNC_TABLES.get(change.get('table'), {'key': None}):
+                    # Later changes referring to the row are refused with it
+                    cursor.execute(
+                        """INSERT OR REPLACE INTO sync_ids (table_name, peer, peer_id, local_id, announced)
+                           VALUES (?, ?, ?, ?, 1)""",
+                        (change['table'], peer, change['new']['id'], REFUSED)
+                    )
+                cursor.execute(
+                    """INSERT INTO sync_conflicts (peer, table_name, row_key, op, reason, change, occurred_at)
+                       VALUES (?, ?, ?, ?, ?, ?, ?)""",
+                    (peer, change.get('table'), change.get('key'), change.get('op'), str(e), json.dumps(change),
+                     datetime.now().strftime(TIME_FORMAT))
+                )
+                conflicts += 1
+                continue
+            cursor.execute("RELEASE sync_change")
+            applied += 1
+            if mapped:
+                ids.append(mapped)
+        cursor.execute("UPDATE sync_state SET applying_origin = NULL, applying_at = NULL WHERE id = 1")
+        if conflicts:
+            log_warning(f"{conflicts} change(s) from '{peer}' could not be applied; see sync_conflicts")
+        return {'applied': applied, 'conflicts': conflicts, 'ids': ids}
+    
+    # -- Main node side ---------------------------------------------------
+    
+    def _change(self, row):
+        return {'id': row['id'], 'table': row['table_name'], 'key': row['row_key'], 'op': row['op'],
+                'old': json.loads(row['old_row']) if row['old_row'] else None,
+                'new': json.loads(row['new_row']) if row['new_row'] else None,
+                'origin': row['origin'], 'changed_at': row['changed_at']}
+    
+    def _require_node(self):
+        node = self.node
+        if not node:
+            raise SyncError("Sync is not enabled on this node")
+        return node
+    
+    def pull(self, node, cursor=0, limit=500):
+        """Main node: logged changes after log id `cursor` that did not come from `node`
+        
+        Returns {'node', 'changes', 'cursor', 'more'}; pass the returned
+        cursor to the next pull.
+        """
+        main = self._require_node()
+        rows = self.db.fetchall("SELECT * FROM sync_log WHERE id > ? ORDER BY id LIMIT ?", (cursor, limit))
+        return {'node': main, 'changes': [self._change(row) for row in rows if row['origin'] != node],
+                'cursor': rows[-1]['id'] if rows else cursor, 'more': len(rows) == limit}
+    
+    def push(self, node, changes, ids=()):
+        """Main node: apply a terminal's changes
+        
+        ids are [table, terminal id, main id] pairs the terminal matched
+        while pulling. Changes already applied are skipped. Returns
+        {'node', 'applied', 'conflicts', 'ids'} with [table, terminal id,
+        main id] of the rows inserted or matched here.
+        """
+        main = self._require_node()
+        with self.db.transaction() as cursor:
+            for table, peer_id, local_id in ids:
+                cursor.execute(
+                    """INSERT OR REPLACE INTO sync_ids (table_name, peer, peer_id, local_id, announced)
+                       VALUES (?, ?, ?, ?, 1)""",
+                    (table, node, peer_id, local_id)
+                )
+            cursor.execute("INSERT OR IGNORE INTO sync_peers (peer) VALUES (?)", (node,))
+            through = cursor.execute("SELECT applied_through FROM sync_peers WHERE peer = ?", (node,)).fetchone()[0]
+            result = self._apply(cursor, node, [change for change in changes if change['id'] > through], announce=True)
+            cursor.execute(
+                "UPDATE sync_peers SET applied_through = MAX(applied_through, ?), last_sync = ? WHERE peer = ?",
+                (max([change['id'] for change in changes], default=through), datetime.now().strftime(TIME_FORMAT), node)
+            )
+        result['node'] = main
+        return result
+    
+    # -- Terminal side ----------------------------------------------------
+    
+    def sync(self, peer, batch_size=500):
+        """Terminal: push this node's changes to the main node, then pull the rest
+        
+        peer is the main node's SyncEngine, or its API server's remote
+        'sync' service. Returns {'pushed', 'pulled', 'conflicts'}.
+        """
+        node, upstream = self._require_node(), self.upstream
+        if not upstream:
+            raise SyncError("This node has no main node to sync with")
+        totals = {'pushed': 0, 'pulled': 0, 'conflicts': 0}
+        
+        while True:
+            progress = self.db.fetchone("SELECT * FROM sync_peers WHERE peer = ?", (upstream,))
+            changes = [self._change(row) for row in self.db.fetchall(
+                "SELECT * FROM sync_log WHERE origin = ? AND id > ? ORDER BY id LIMIT ?",
+                (node, progress['pushed_through'], batch_size)
+            )]
+            ids = [[row['table_name'], row['local_id'], row['peer_id']] for row in self.db.fetchall(
+                "SELECT * FROM sync_ids WHERE peer = ? AND announced = 0", (upstream,)
+            )]
+            if not changes and not ids:
+                break
+            answer = peer.push(node, changes, ids)
+            with self.db.transaction() as cursor:
+                for table, local_id, peer_id in answer['ids']:
+                    cursor.execute(
+                        """INSERT OR REPLACE INTO sync_ids (table_name, peer, peer_id, local_id, announced)
+                           VALUES (?, ?, ?, ?, 1)""",
+                        (table, upstream, peer_id, local_id)
+                    )
+                cursor.executemany(
+                    "UPDATE sync_ids SET announced = 1 WHERE table_name = ? AND peer = ? AND peer_id = ?",
+                    [(table, upstream, peer_id) for table, local_id, peer_id in ids]
+                )
+                if changes:
+                    cursor.execute("UPDATE sync_peers SET pushed_through = ? WHERE peer = ?",
+                                   (changes[-1]['id'], upstream))
+            totals['pushed'] += answer['applied']
+            totals['conflicts'] += answer['conflicts']
+            if len(changes) < batch_size:
+                break
+        
+        while True:
+            progress = self.db.fetchone("SELECT * FROM sync_peers WHERE peer = ?", (upstream,))
+            answer = peer.pull(node, progress['pulled_through'], batch_size)
+            with self.db.transaction() as cursor:
+                result = self._apply(cursor, upstream, answer['changes'], announce=False)
+                cursor.execute("UPDATE sync_peers SET pulled_through = ?, last_sync = ? WHERE peer = ?",
+                               (answer['cursor'], datetime.now().strftime(TIME_FORMAT), upstream))
+            totals['pulled'] += result['applied']
+            totals['conflicts'] += result['conflicts']
+            if not answer['more']:
+                break
+        return totals
+    
+    def pending(self):
+        """Number of this node's changes not yet pushed to the main node"""
+        progress = self.db.fetchone("SELECT pushed_through FROM sync_peers WHERE peer = ?", (self.upstream,))
+        return self.db.fetchone(
+            "SELECT COUNT(*) as count FROM sync_log WHERE origin = ? AND id > ?",
+            (self.node, progress['pushed_through'] if progress else 0)
+        )['count']
+    
+    def conflicts(self, limit=50):
+        """Most recent changes that could not be applied"""
+        return self.db.fetchall("SELECT * FROM sync_conflicts ORDER BY id DESC LIMIT ?", (limit,))
+    
+    def start(self, peer, interval=60):
+        """Sync every `interval` seconds in the background until stopped"""
+        if self._thread:
+            return
+        self._stop.clear()
+        def run():
+            while not self._stop.is_set():
+                try:
+                    totals = self.sync(peer)
+                    if totals['pushed'] or totals['pulled']:
+                        log_info(f"Synced with main node: {totals}")
+                except SyncError as e:
+                    log_warning(f"Sync stopped: {e}")
+                    return
+                except (ApiError, OSError) as e:
+                    log_warning(f"Main node unreachable, working offline: {e}")
+                except Exception as e:
+                    log_exception("Sync with main node failed", e)
+                self._stop.wait(interval)
+        self._thread = threading.Thread(target=run, name='terminal-sync', daemon=True)
+        self._thread.start()
+    
+    def stop(self):
+        self._stop.set()
+        if self._thread:
+            self._thread.join(timeout=5)
+            self._thread = None
+    
+    def start_from_settings(self):
+        """Refresh the triggers if sync is enabled, and start syncing if this is a terminal
+        
+        sync_upstream_url is the main node's API server, called with this
+        node's api_token. Returns the URL
+        synced with, or None.
+        """
+        if not self.node:
+            return None
+        with self.db.transaction() as cursor:
+            self.install_triggers(cursor)
+        settings = {
+            row['key']: row['value']
+            for row in self.db.fetchall(
+                """SELECT key, value FROM settings
+                   WHERE key IN ('sync_upstream_url', 'sync_interval_seconds', 'api_token')"""
+            )
+        }
+        url = (settings.get('sync_upstream_url') or '').strip()
+        if not url or not self.upstream:
+            return None
+        try:
+            interval = float(settings.get('sync_interval_seconds') or 60)
+        except ValueError:
+            interval = 60.0
+        self.start(RemoteService(ApiClient(url, token=settings.get('api_token')), 'sync'), interval)
+        return url
+
+# Global sync engine instance
+sync_engine = SyncEngine()
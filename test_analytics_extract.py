@@ -0,0 +1,148 @@
+#!/usr/bin/env python3
+"""
+Test Analytics Extract
+Tests the columnar extract of invoices and section records, its
+incremental refresh, and the vectorised analytics over it
+"""
+import os
+import sys
+import tempfile
+from datetime import datetime
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from database import Database
+from analytics_extract import AnalyticsExtract, AnalyticsError, NUMPY_SUPPORT
+from services import OrderService, InvoiceService, PaymentService
+
+TODAY = datetime(2030, 4, 10)
+
+def sell(test_db, item_id, phone, quantity, when, pay=True):
+    """A cafe order of `quantity` teas, invoiced and paid unless pay is False"""
+    orders = OrderService(test_db)
+    orders.place(phone, [orders.line(item_id, quantity)], when=when)
+    if pay:
+        invoice = InvoiceService(test_db).create(phone, when=when)
+        PaymentService(test_db).pay(invoice['invoice_id'], 'Cash', when=when)
+
+def make_extract():
+    """A database with four paid orders of two customers from January to April"""
+    test_db = Database(os.path.join(tempfile.mkdtemp(), 'test.db'))
+    test_db.initialize_defaults()
+    item_id = OrderService(test_db).add_menu_item('Tea', 'Tea', 3)
+    sell(test_db, item_id, '09121234567', 1, datetime(2030, 1, 5))
+    sell(test_db, item_id, '09350000000', 2, datetime(2030, 1, 20))
+    sell(test_db, item_id, '09121234567', 3, datetime(2030, 2, 3))
+    sell(test_db, item_id, '09350000000', 4, datetime(2030, 4, 3))
+    return test_db, item_id, AnalyticsExtract(test_db)
+
+def test_incremental_refresh():
+    """Test new rows appended past the watermark and open rows read again"""
+    print("\n=== Testing Incremental Refresh ===\n")
+    test_db, item_id, extract = make_extract()
+    if not NUMPY_SUPPORT:
+        try:
+            extract.refresh()
+            raise AssertionError("Refreshing without NumPy should fail")
+        except AnalyticsError as e:
+            print(f"1. NumPy not installed: {e}")
+        return
+    
+    counts = extract.refresh(batch_size=3)
+    print(f"1. First refresh: {counts}")
+    assert counts == {'invoices': 4, 'salon': 0, 'cafe': 4, 'gamnet': 0}
+    assert extract.refresh() == {'invoices': 0, 'salon': 0, 'cafe': 0, 'gamnet': 0}
+    
+    # An open order is appended, then read again once it is invoiced
+    sell(test_db, item_id, '09121234567', 10, datetime(2030, 4, 5), pay=False)
+    assert extract.refresh()['cafe'] == 1
+    assert list(extract.columns('cafe')['open']) == [0, 0, 0, 0, 1]
+    invoice = InvoiceService(test_db).create('09121234567', when=datetime(2030, 4, 5))
+    PaymentService(test_db).pay(invoice['invoice_id'], 'Cash', when=datetime(2030, 4, 5))
+    counts = extract.refresh()
+    print(f"2. After invoicing the open order: {counts}")
+    assert counts == {'invoices': 1, 'salon': 0, 'cafe': 1, 'gamnet': 0}
+    cafe = extract.columns('cafe')
+    assert cafe['open'].sum() == 0 and cafe['invoice_id'][-1] == invoice['invoice_id']
+    
+    # A second instance reads the same files
+    again = AnalyticsExtract(test_db)
+    assert len(again.columns('invoices')['id']) == 5
+    assert again.columns('cafe')['amount'].sum() == 60
+    print("   ✓ Incremental refresh")
+
+def test_rebuild_after_restore():
+    """Test the extract rebuilt when the database no longer matches it"""
+    print("\n=== Testing Rebuild After Restore ===\n")
+    test_db, item_id, extract = make_extract()
+    if not NUMPY_SUPPORT:
+        print("1. NumPy not installed, skipped")
+        return
+    extract.refresh()
+    
+    # As after restoring an older backup: the last sale is gone and its ids are used again
+    test_db.execute("DELETE FROM cafe_orders WHERE id = 4")
+    test_db.execute("DELETE FROM invoices WHERE id = 4")
+    sell(test_db, item_id, '09121234567', 1, datetime(2030, 4, 8))
+    counts = extract.refresh()
+    print(f"1. Refresh after the ids were reused: {counts}")
+    assert counts['invoices'] == 4 and counts['cafe'] == 4 and counts['salon'] == 0
+    assert extract.columns('cafe')['amount'].sum() == 21
+    assert str(extract.columns('invoices')['at'][-1]) == '2030-04-08T00:00:00'
+    
+    extract.invalidate()
+    assert len(extract.columns('invoices')['id']) == 0
+    assert extract.refresh()['invoices'] == 4
+    print("   ✓ Stale extract rebuilt")
+
+def test_vectorised_analytics():
+    """Test time buckets, cohorts, segments and per section trends"""
+    print("\n=== Testing Vectorised Analytics ===\n")
+    test_db, item_id, extract = make_extract()
+    if not NUMPY_SUPPORT:
+        print("1. NumPy not installed, skipped")
+        return
+    extract.refresh()
+    paid = {row['period']: row['count'] for row in extract.revenue_by_period('month')}
+    print(f"1. Paid invoices per month: {paid}")
+    assert paid == {'2030-01-01': 2, '2030-02-01': 1, '2030-04-01': 1}
+    weeks = extract.revenue_by_period('week', start='2030-01-01', end='2030-01-31')
+    assert [row['period'] for row in weeks] == ['2029-12-31', '2030-01-14']
+    
+    trends = extract.section_trends('month')
+    assert trends['periods'] == ['2030-01-01', '2030-02-01', '2030-04-01']
+    assert trends['sections']['Cafe'] == [9.0, 9.0, 12.0] and trends['sections']['Salon'] == [0.0, 0.0, 0.0]
+    
+    cohorts = extract.cohorts('month')
+    print(f"2. Cohorts: {cohorts}")
+    assert cohorts == {'cohorts': ['2030-01-01'], 'sizes': [2], 'retention': [[2, 1, 0, 1]]}
+    
+    segments = extract.segments(today=TODAY)
+    assert (segments['customers'], segments['active'], segments['at_risk'], segments['lost']) == (2, 1, 1, 0)
+    summary = extract.customer_summary(today=TODAY)
+    assert list(summary['frequency']) == [2, 2] and list(summary['recency_days']) == [66, 7]
+    print("   ✓ Vectorised analytics")
+
+def main():
+    """Run all tests"""
+    print("=" * 60)
+    print("Testing Analytics Extract")
+    print("=" * 60)
+    
+    try:
+        test_incremental_refresh()
+        test_rebuild_after_restore()
+        test_vectorised_analytics()
+        
+        print("\n" + "=" * 60)
+        print("✅ All Analytics Extract Tests Passed!")
+        print("=" * 60)
+        return 0
+    except AssertionError as e:
+        print("\n" + "=" * 60)
+        print(f"❌ Test Failed: {str(e)}")
+        print("=" * 60)
+        return 1
+
+if __name__ == '__main__':
+    sys.exit(main())
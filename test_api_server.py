@@ -0,0 +1,180 @@
+#!/usr/bin/env python3
+"""
+Test API Server
+Tests the terminal API server and the remote services against a throwaway database
+"""
+import os
+import sys
+import tempfile
+import threading
+from datetime import datetime, timedelta
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from database import Database
+from api_server import ApiServer
+from services import SessionError, OrderError
+from payment_gateway import PaymentGateway
+from services.remote import ApiClient, ApiError, REMOTE_METHODS, remote_services
+
+DAY = '2030-05-01'
+OPEN = datetime(2030, 5, 1, 10, 0, 0)
+
+def start_server(pool_size=2, token=None):
+    """Serve a fresh database on a free port; returns (server, database)"""
+    test_db = Database(os.path.join(tempfile.mkdtemp(), 'api.db'))
+    test_db.initialize_defaults()
+    server = ApiServer(test_db, pool_size=pool_size, token=token)
+    server.start('127.0.0.1', 0)
+    return server, test_db
+
+def test_remote_checkout():
+    """Test a session, an order, an invoice, a payment and a report through the remote services"""
+    print("\n=== Testing Remote Checkout ===\n")
+    server, test_db = start_server()
+    try:
+        remote = remote_services(server.url)
+        customers, sessions = remote['customer_service'], remote['session_service']
+        orders, invoices, reports = remote['order_service'], remote['invoice_service'], remote['report_service']
+        
+        customers.register('Sara', '09121234567', when=OPEN)
+        assert customers.find('09121234567')['name'] == 'Sara'
+        assert customers.find('0000') is None
+        
+        device_id = sessions.add_device('PC-1', 'PC', 12)
+        sessions.start(device_id, '09121234567', when=OPEN)
+        try:
+            sessions.start(device_id, '09121234567', when=OPEN)
+            assert False, "second session started on a busy device"
+        except SessionError as e:
+            print(f"1. Refused remotely: {e}")
+        assert sessions.end(device_id, when=OPEN + timedelta(minutes=30))['charge'] == 6
+        
+        item_id = orders.add_menu_item('Tea', 'Tea', 3)
+        assert orders.place('09121234567', [orders.line(item_id, 2)], when=OPEN)['total'] == 6
+        try:
+            orders.line(item_id, 0)
+            assert False, "zero quantity accepted"
+        except OrderError:
+            pass
+        
+        invoice = invoices.create('09121234567', when=OPEN + timedelta(hours=1))
+        remote['payment_service'].pay(invoice['invoice_id'], 'Cash', when=OPEN + timedelta(hours=1))
+        report = reports.sales_report(DAY, DAY)
+        print(f"2. Sales report over HTTP: {report}")
+        assert report['count'] == 1 and report['sections'] == {'Salon': 0, 'Cafe': 6, 'Gamnet': 6}
+        assert test_db.fetchone("SELECT is_paid FROM invoices WHERE id = ?", (invoice['invoice_id'],))['is_paid'] == 1
+        
+        messaging = remote['messaging_service']
+        assert sum(messaging.score_segments().values()) == 1
+        assert messaging.average_customer_value() == invoice['final']
+        print("   ✓ Checkout through the API server")
+    finally:
+        server.stop()
+
+def test_pool_and_metrics():
+    """Test concurrent reads on the pool, read-only pooled connections and the metrics"""
+    print("\n=== Testing Pool and Metrics ===\n")
+    server, test_db = start_server(pool_size=3)
+    try:
+        client = ApiClient(server.url)
+        client.call('customers', 'register', 'Ali', '09350000000')
+        assert client.health()['pool_size'] == 3
+        
+        found, errors = [], []
+        def lookup():
+            try:
+                for _ in range(10):
+                    found.append(client.call('customers', 'find', '09350000000')['name'])
+            except Exception as e:
+                errors.append(e)
+        threads = [threading.Thread(target=lookup) for _ in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        assert not errors and found == ['Ali'] * 80, errors
+        
+        with server.pool.services() as services:
+            try:
+                services['customers'].register('Reza', '09120000000')
+                assert False, "pooled connection wrote"
+            except Exception as e:
+                print(f"1. Pooled connection is read-only: {e}")
+        
+        for path in (('customers', 'drop_all'), ('nothing', 'find')):
+            try:
+                client.call(*path)
+                assert False, "unknown endpoint answered"
+            except ApiError:
+                pass
+        try:
+            remote_services(server.url)['customer_service'].get_or_create('0912')
+            assert False, "unlisted method called remotely"
+        except AttributeError:
+            pass
+        
+        metrics = client.metrics()
+        print(f"2. Metrics: {metrics}")
+        lookups = metrics['endpoints']['customers/find']
+        assert lookups['count'] == 80 and lookups['errors'] == 0
+        assert lookups['p50_ms'] <= lookups['p95_ms'] <= lookups['max_ms']
+        assert metrics['in_flight'] == 0 and metrics['peak_in_flight'] >= 1
+        print("   ✓ Pool and metrics")
+    finally:
+        server.stop()
+
+def test_reads_first_and_access():
+    """Test reads on the pool before any write, the API token, and no access from the LAN without one"""
+    print("\n=== Testing Reads First and Access ===\n")
+    server, test_db = start_server(token='s3cret')
+    try:
+        remote = remote_services(server.url, token='s3cret')
+        assert remote['report_service'].sales_totals(DAY, DAY) == {'count': 0, 'revenue': 0}
+        assert remote['customer_service'].find('09121234567') is None
+        # The pooled payment services see the writer's gateway
+        assert remote['payment_service'].uses_gateway('Card') is False
+        server.services['payments'].card.gateway = PaymentGateway('http://127.0.0.1:9', 'local')
+        assert remote['payment_service'].uses_gateway('Card') is True
+        print("1. Pooled reads answered before any write")
+        
+        for token in (None, 'wrong'):
+            try:
+                remote_services(server.url, token=token)['customer_service'].find('09121234567')
+                assert False, "call without the right token answered"
+            except ApiError as e:
+                print(f"2. Refused: {e}")
+    finally:
+        server.stop()
+    
+    open_server = ApiServer(test_db)
+    assert open_server.refuse('192.168.1.20', None)
+    assert open_server.refuse('127.0.0.1', None) is None
+    assert open_server.refuse('::1', None) is None
+    assert open_server.refuse('192.168.1.20', 's3cret')
+    assert REMOTE_METHODS['payments']['uses_gateway'], "a pure read must run on the read pool"
+    print("   ✓ Reads first and access")
+
+def main():
+    """Run all tests"""
+    print("=" * 60)
+    print("Testing API Server")
+    print("=" * 60)
+    
+    try:
+        test_remote_checkout()
+        test_pool_and_metrics()
+        test_reads_first_and_access()
+        
+        print("\n" + "=" * 60)
+        print("✅ All API Server Tests Passed!")
+        print("=" * 60)
+        return 0
+    except AssertionError as e:
+        print("\n" + "=" * 60)
+        print(f"❌ Test Failed: {str(e)}")
+        print("=" * 60)
+        return 1
+
+if __name__ == '__main__':
+    sys.exit(main())
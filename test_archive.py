@@ -0,0 +1,168 @@
+#!/usr/bin/env python3
+"""
+Test Archive
+Tests moving old history into yearly archive databases and reading it back
+"""
+import os
+import sys
+import tempfile
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from database import Database
+from archive import ArchiveManager
+from checkout import CheckoutEngine
+from invoice_search import InvoiceSearch
+from customer_timeline import CustomerTimeline
+from invoice_renderer import InvoiceRenderer
+
+DAYS = ['2022-03-01', '2022-11-20', '2023-06-15', '2025-02-01']
+
+def make_history():
+    """Create a throwaway database with a day of activity on each of DAYS"""
+    test_db = Database(os.path.join(tempfile.mkdtemp(), 'archive.db'))
+    test_db.initialize_defaults()
+    test_db.execute("INSERT INTO customers (name, phone) VALUES ('Sara Ahmadi', '09121234567')")
+    test_db.execute("INSERT INTO employees (name, role, section) VALUES ('Mina', 'Barista', 'Cafe')")
+    test_db.execute("INSERT INTO gamnet_devices (device_number, hourly_rate) VALUES ('PC-1', 10)")
+    with test_db.transaction() as cursor:
+        for n, day in enumerate(DAYS):
+            cursor.execute(
+                """INSERT INTO invoices (customer_id, invoice_date, total_amount, final_amount, payment_method, is_paid)
+                   VALUES (1, ?, ?, ?, 'Cash', 1)""",
+                (f"{day} 10:00:00", 30 + n, 30 + n)
+            )
+            invoice_id = cursor.lastrowid
+            cursor.execute(
+                """INSERT INTO gamnet_sessions (device_id, customer_id, start_time, end_time, duration_minutes, charge, invoice_id)
+                   VALUES (1, 1, ?, ?, 60, 10, ?)""",
+                (f"{day} 11:00:00", f"{day} 12:00:00", invoice_id)
+            )
+            cursor.execute("INSERT INTO cafe_orders (customer_id, order_date, total_amount) VALUES (1, ?, 20)",
+                           (f"{day} 09:00:00",))
+            cursor.execute("INSERT INTO cafe_order_items (order_id, menu_item_id, quantity, price) VALUES (?, 1, 2, 10)",
+                           (cursor.lastrowid,))
+            cursor.execute("INSERT INTO sms_history (customer_id, message, status, sent_date) VALUES (1, 'Hi', 'sent', ?)",
+                           (f"{day} 08:00:00",))
+            cursor.execute("INSERT INTO attendance (employee_id, date, check_in_time) VALUES (1, ?, '09:00')", (day,))
+        # Unfinished old rows stay in the hot tables
+        cursor.execute("INSERT INTO invoices (customer_id, invoice_date, final_amount, is_paid) VALUES (1, '2022-05-05 10:00:00', 99, 0)")
+        cursor.execute("INSERT INTO gamnet_sessions (device_id, start_time) VALUES (1, '2022-05-05 10:00:00')")
+        cursor.execute(
+            """INSERT INTO day_closings (close_date, closed_at, totals)
+               VALUES ('2022-03-01', '2022-03-01 23:00:00', '{}')"""
+        )
+    return test_db, ArchiveManager(test_db)
+
+def count(test_db, table):
+    return test_db.fetchone(f"SELECT COUNT(*) as c FROM {table}")['c']
+
+def test_archive_moves_old_rows():
+    """Test that finished rows before the cutoff move to per-year files"""
+    print("\n=== Testing Archival ===\n")
+    test_db, archive = make_history()
+    activity = [tuple(row) for row in test_db.fetchall("SELECT * FROM customer_activity_totals ORDER BY section")]
+    triggers = count(test_db, "sqlite_master WHERE type = 'trigger'")
+    
+    moved = archive.archive(before='2024-01-01')
+    print(f"1. Moved: {moved}")
+    assert moved == {'invoices': 3, 'gamnet_sessions': 3, 'cafe_order_items': 3, 'sms_history': 3, 'attendance': 3}
+    assert archive.years() == [2022, 2023]
+    assert count(test_db, 'main.invoices') == 2 and count(test_db, 'main.gamnet_sessions') == 2
+    assert count(test_db, 'archive_2022.invoices') == 2 and count(test_db, 'archive_2023.attendance') == 1
+    
+    # Totals, closed-day locks and the other triggers are as they were
+    assert [tuple(row) for row in test_db.fetchall("SELECT * FROM customer_activity_totals ORDER BY section")] == activity
+    assert count(test_db, "sqlite_master WHERE type = 'trigger'") == triggers
+    assert archive.archived_before() == '2024-01-01'
+    
+    # Nothing left to move the second time
+    assert sum(archive.archive(before='2024-01-01').values()) == 0
+    assert count(test_db, 'invoices_all') == 5
+    print("   ✓ Old history archived by year")
+
+def test_reports_read_archives():
+    """Test that ranges past the cutoff read the views and recent ranges the hot tables"""
+    print("\n=== Testing Reads Across Archives ===\n")
+    test_db, archive = make_history()
+    checkout = CheckoutEngine(test_db)
+    expected = checkout.section_revenue('2022-01-01', '2025-12-31')
+    archive.archive(before='2024-01-01')
+    
+    assert archive.table_for('invoices', '2025-01-01') == 'invoices'
+    assert archive.table_for('invoices', '2022-01-01') == 'invoices_all'
+    assert archive.table_for('sms_history') == 'sms_history_all'
+    revenue = checkout.section_revenue('2022-01-01', '2025-12-31')
+    print(f"1. Section revenue before and after archiving: {expected}, {revenue}")
+    assert revenue == expected and revenue['Gamnet'] == 40
+    
+    # A new connection attaches the archives when a report first needs them
+    reopened = Database(test_db.path)
+    assert 'archive_2022' not in {row['name'] for row in reopened.fetchall("PRAGMA database_list")}
+    table = ArchiveManager(reopened).table_for('invoices', '2022-01-01')
+    total = reopened.fetchone(f"SELECT SUM(final_amount) as total FROM {table} WHERE is_paid = 1")['total']
+    print(f"2. Paid total through {table} after reopening: {total}")
+    assert total == 30 + 31 + 32 + 33
+    print("   ✓ Archived periods included transparently")
+
+def test_search_and_timeline_read_archives():
+    """Test that invoice search and the customer timeline still see archived history"""
+    print("\n=== Testing Search and Timeline Across Archives ===\n")
+    test_db, archive = make_history()
+    search, timeline = InvoiceSearch(test_db), CustomerTimeline(test_db)
+    before = [row['id'] for row in search.search()['rows']]
+    events = [(row['section'], row['ref_id']) for row in timeline.page(1, limit=100)['rows']]
+    archive.archive(before='2024-01-01')
+    
+    assert [row['id'] for row in search.search()['rows']] == before
+    assert search.totals(start_date='2022-01-01', end_date='2022-12-31')['count'] == 3
+    assert [row['id'] for row in search.search(start_date='2025-01-01')['rows']] == [4]
+    page = search.search(limit=2)
+    assert [row['id'] for row in search.search(after=page['next'], limit=2)['rows']] == before[2:4]
+    print(f"1. Search finds {len(before)} invoices after archiving")
+    
+    assert [(row['section'], row['ref_id']) for row in timeline.page(1, limit=100)['rows']] == events
+    gamnet = timeline.page(1, sections=['Gamnet', 'SMS'])['rows']
+    print(f"2. Timeline keeps {len(events)} events, {len(gamnet)} of them sessions and SMS")
+    assert len(gamnet) == 2 * len(DAYS)
+    print("   ✓ Archived history searchable")
+
+def test_rerender_archived_month():
+    """Test that receipts of an archived month can be loaded for rendering again"""
+    print("\n=== Testing Receipts from the Archives ===\n")
+    test_db, archive = make_history()
+    renderer = InvoiceRenderer(test_db, output_dir=tempfile.mkdtemp())
+    archive.archive(before='2024-01-01')
+    
+    ids = renderer.invoice_ids('2022-11-01', '2022-11-30')
+    invoices = renderer.load_invoices(ids, '2022-11-01')
+    print(f"1. November 2022: invoices {ids}, lines {[invoice['lines'] for invoice in invoices.values()]}")
+    assert ids == [2] and invoices[2]['final_amount'] == 31
+    assert [line['section'] for line in invoices[2]['lines']] == ['Gamnet']
+    assert renderer.invoice_ids('2025-01-01', '2025-12-31') == [4]
+    print("   ✓ Archived invoices found for rendering")
+
+def main():
+    """Run all tests"""
+    print("=" * 60)
+    print("Testing Archive")
+    print("=" * 60)
+    
+    try:
+        test_archive_moves_old_rows()
+        test_reports_read_archives()
+        test_search_and_timeline_read_archives()
+        test_rerender_archived_month()
+        
+        print("\n" + "=" * 60)
+        print("✅ All Archive Tests Passed!")
+        print("=" * 60)
+        return 0
+    except AssertionError as e:
+        print("\n" + "=" * 60)
+        print(f"❌ Test Failed: {str(e)}")
+        print("=" * 60)
+        return 1
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,241 @@
+#!/usr/bin/env python3
+"""
+Test Backup
+Tests online backups, verification, retention and the backup schedule
+"""
+import json
+import os
+import sqlite3
+import sys
+import tempfile
+import threading
+from datetime import datetime, timedelta
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from database import Database
+from backup import BackupManager, BackupError, CHUNK_DIR
+
+def set_setting(test_db, key, value):
+    test_db.execute("INSERT OR REPLACE INTO settings (key, value, category) VALUES (?, ?, 'system')", (key, value))
+
+def make_manager(rows=0):
+    """Create a throwaway database, optionally with filler customers, and its backup manager"""
+    folder = tempfile.mkdtemp()
+    test_db = Database(os.path.join(folder, 'backup.db'))
+    with test_db.transaction() as cursor:
+        cursor.executemany("INSERT INTO customers (name, phone) VALUES (?, ?)",
+                           [(f"Customer {n} " + 'x' * 200, f"0912{n:07d}") for n in range(rows)])
+    set_setting(test_db, 'backup_path', os.path.join(folder, 'backups'))
+    return test_db, BackupManager(test_db, pages_per_step=16, step_pause=0.001)
+
+def restored_count(manager, path):
+    """Number of customers in a backup file"""
+    scratch = os.path.join(tempfile.mkdtemp(), 'restored.db')
+    manager.extract(path, scratch)
+    conn = sqlite3.connect(scratch)
+    try:
+        return conn.execute("SELECT COUNT(*) FROM customers").fetchone()[0]
+    finally:
+        conn.close()
+
+def test_backup_during_writes():
+    """Test that a backup taken while another thread writes is consistent"""
+    print("\n=== Testing Online Backup ===\n")
+    test_db, manager = make_manager(rows=5000)
+    
+    done = threading.Event()
+    writes = []
+    def writer():
+        while not done.is_set():
+            test_db.execute("INSERT INTO customers (name, phone) VALUES ('Walk-in', ?)",
+                            (f"0935{len(writes):07d}",))
+            writes.append(1)
+    thread = threading.Thread(target=writer)
+    thread.start()
+    try:
+        backup = manager.create_backup(incremental=False)
+    finally:
+        done.set()
+        thread.join()
+    
+    raw = os.path.getsize(test_db.path)
+    print(f"1. {backup['pages']} pages in {backup['seconds']:.2f}s, "
+          f"{backup['size']} bytes compressed from {raw}, {len(writes)} writes meanwhile")
+    assert backup['path'].endswith('.db.gz') and backup['size'] < raw
+    assert writes, "writer was blocked for the whole backup"
+    assert manager.verify(backup['path'])
+    assert 5000 <= restored_count(manager, backup['path']) <= 5000 + len(writes)
+    
+    row = manager.history()[0]
+    assert row['status'] == 'success' and len(row['checksum']) == 64
+    print("   ✓ Copy verified while writes continued")
+
+def test_verify_detects_damage():
+    """Test that tampered or truncated backups fail verification"""
+    print("\n=== Testing Verification ===\n")
+    test_db, manager = make_manager(rows=200)
+    plain = manager.create_backup(compress=False, incremental=False)['path']
+    with open(plain, 'r+b') as f:
+        f.seek(4096)
+        f.write(b'\xff' * 64)
+    compressed = manager.create_backup(incremental=False)['path']
+    with open(compressed, 'r+b') as f:
+        f.truncate(os.path.getsize(compressed) // 2)
+    
+    for path in (plain, compressed):
+        try:
+            manager.verify(path)
+            assert False, f"{path} verified"
+        except BackupError as e:
+            print(f"   {os.path.basename(path)}: {e}")
+    
+    # A backup into an unwritable location is recorded as failed
+    blocker = os.path.join(tempfile.mkdtemp(), 'file')
+    open(blocker, 'w').close()
+    try:
+        manager.create_backup(os.path.join(blocker, 'backups'))
+        assert False, "backup into a file succeeded"
+    except BackupError:
+        pass
+    assert manager.history()[0]['status'] == 'failed'
+    print("   ✓ Damage and failures reported")
+
+def test_incremental_backups():
+    """Test that incremental backups store only changed chunks and restore every point"""
+    print("\n=== Testing Incremental Backups ===\n")
+    test_db, manager = make_manager(rows=20000)
+    first = manager.create_backup()
+    test_db.execute("UPDATE customers SET loyalty_points = 5 WHERE id IN (10, 15000)")
+    test_db.execute("INSERT INTO customers (name, phone) VALUES ('New Customer', '09990000000')")
+    second = manager.create_backup()
+    
+    raw = os.path.getsize(test_db.path)
+    print(f"1. First backup wrote {first['size']} bytes, second {second['size']} of a {raw} byte database")
+    print(f"   {manager.history()[0]['notes']}")
+    assert first['path'].endswith('.manifest.json')
+    assert second['size'] < first['size'] / 10
+    assert restored_count(manager, first['path']) == 20000
+    assert restored_count(manager, second['path']) == 20001
+    assert manager.verify(second['path'])
+    
+    # Pruning the first backup drops only the chunks nothing else uses
+    store = os.path.join(os.path.dirname(first['path']), CHUNK_DIR)
+    count = lambda: sum(len(files) for _, _, files in os.walk(store))
+    before = count()
+    manager.prune(1)
+    print(f"2. Chunks before and after pruning the first backup: {before}, {count()}")
+    with open(second['path']) as f:
+        assert count() == len(set(json.load(f)['chunks'])) < before
+    assert restored_count(manager, second['path']) == 20001
+    
+    # A damaged chunk fails verification
+    victim = next(os.path.join(folder, files[0]) for folder, _, files in os.walk(store) if files)
+    with open(victim, 'wb') as f:
+        f.write(b'garbage')
+    try:
+        manager.verify(second['path'])
+        assert False, "damaged chunk verified"
+    except BackupError as e:
+        print(f"   {e}")
+    print("   ✓ Only changed chunks written")
+
+def test_hot_restore():
+    """Test that a restore replaces the data under the open connection"""
+    print("\n=== Testing Hot Restore ===\n")
+    test_db, manager = make_manager()
+    test_db.execute("INSERT INTO customers (name, phone) VALUES ('Sara Ahmadi', '09121234567')")
+    first = manager.create_backup()['path']
+    test_db.execute("DELETE FROM customers")
+    test_db.execute("INSERT INTO customers (name, phone) VALUES ('Reza Karimi', '09351112222')")
+    damaged = manager.create_backup(incremental=False)['path']
+    with open(damaged, 'r+b') as f:
+        f.truncate(100)
+    
+    # A damaged backup leaves the database as it was
+    try:
+        manager.restore(damaged)
+        assert False, "damaged backup restored"
+    except BackupError:
+        pass
+    assert test_db.fetchone("SELECT name FROM customers")['name'] == 'Reza Karimi'
+    
+    calls = []
+    manager.on_restore(lambda: calls.append(1))
+    restored = manager.restore(first)
+    names = [row['name'] for row in test_db.fetchall("SELECT name FROM customers")]
+    print(f"1. Customers after restore: {names} in {restored['seconds']:.2f}s")
+    assert names == ['Sara Ahmadi'] and calls == [1]
+    
+    # The same connection keeps working, and the indexes came back with the data
+    test_db.execute("INSERT INTO customers (name, phone) VALUES ('Mina Rahimi', '09190000000')")
+    assert test_db.fetchone("SELECT COUNT(*) as c FROM customers")['c'] == 2
+    matches = test_db.fetchall("SELECT rowid FROM customer_name_search WHERE customer_name_search MATCH 'sara*'")
+    assert len(matches) == 1
+    
+    # Backups taken after the restored one are still on record, and the
+    # state before the restore can be restored in turn
+    statuses = [row['status'] for row in manager.history()]
+    print(f"2. History: {statuses}")
+    assert statuses[0] == 'restored' and 'failed' not in statuses and len(statuses) == 4
+    manager.restore(restored['safety'], safety_backup=False)
+    assert [row['name'] for row in test_db.fetchall("SELECT name FROM customers")] == ['Reza Karimi']
+    print("   ✓ Restored without reconnecting")
+
+def test_retention():
+    """Test that only backup_keep successful backups are kept"""
+    print("\n=== Testing Retention ===\n")
+    test_db, manager = make_manager()
+    set_setting(test_db, 'backup_keep', '3')
+    start = datetime(2024, 3, 1, 12, 0, 0)
+    paths = [manager.create_backup(when=start + timedelta(days=n))['path'] for n in range(5)]
+    
+    statuses = [row['status'] for row in manager.history()]
+    print(f"1. Statuses newest first: {statuses}")
+    assert statuses == ['success'] * 3 + ['pruned'] * 2
+    assert [os.path.exists(path) for path in paths] == [False, False, True, True, True]
+    print("   ✓ Oldest backups pruned")
+
+def test_schedule():
+    """Test that scheduled backups honour auto_backup and backup_frequency"""
+    print("\n=== Testing Schedule ===\n")
+    test_db, manager = make_manager()
+    set_setting(test_db, 'backup_frequency', 'weekly')
+    start = datetime(2024, 3, 1, 12, 0, 0)
+    
+    assert manager.run_scheduled(start) is not None
+    assert manager.run_scheduled(start + timedelta(days=6)) is None
+    assert manager.run_scheduled(start + timedelta(days=7)) is not None
+    
+    set_setting(test_db, 'auto_backup', '0')
+    assert not manager.is_due(start + timedelta(days=30))
+    print(f"1. Backups taken: {len(manager.history())}")
+    assert len(manager.history()) == 2
+    print("   ✓ Frequency and auto_backup honoured")
+
+def main():
+    """Run all tests"""
+    print("=" * 60)
+    print("Testing Backup")
+    print("=" * 60)
+    
+    try:
+        test_backup_during_writes()
+        test_verify_detects_damage()
+        test_incremental_backups()
+        test_hot_restore()
+        test_retention()
+        test_schedule()
+        
+        print("\n" + "=" * 60)
+        print("✅ All Backup Tests Passed!")
+        print("=" * 60)
+        return 0
+    except AssertionError as e:
+        print("\n" + "=" * 60)
+        print(f"❌ Test Failed: {str(e)}")
+        print("=" * 60)
+        return 1
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,164 @@
+#!/usr/bin/env python3
+"""
+Test Branch Consolidation
+Tests incremental ingestion of branch databases into a central analytics
+database, and reports per branch and across branches
+"""
+import os
+import sys
+import tempfile
+import threading
+from datetime import datetime
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from database import Database
+from branch_consolidation import Consolidator, BranchReports, ConsolidationError
+from services import CustomerService, OrderService, InvoiceService, PaymentService, ReportService, InventoryService
+
+DAY = '2030-05-01'
+OPEN = datetime(2030, 5, 1, 10, 0, 0)
+
+def make_branch(folder, name, orders):
+    """A branch database with one customer, a menu item and paid cafe orders of the given quantities"""
+    branch = Database(os.path.join(folder, f'{name}.db'))
+    branch.initialize_defaults()
+    CustomerService(branch).register(f'{name} customer', '09121234567', when=OPEN)
+    item_id = OrderService(branch).add_menu_item(f'{name} tea', 'Tea', 3)
+    for quantity in orders:
+        OrderService(branch).place('09121234567', [OrderService(branch).line(item_id, quantity)], when=OPEN)
+        pay(branch)
+    return branch, item_id
+
+def pay(branch):
+    """Invoice and pay everything the customer has open"""
+    invoice = InvoiceService(branch).create('09121234567', when=OPEN)
+    PaymentService(branch).pay(invoice['invoice_id'], 'Cash', when=OPEN)
+
+def test_incremental_ingest():
+    """Test new rows and changed open rows ingested on the next run, and a missing branch"""
+    print("\n=== Testing Incremental Ingest ===\n")
+    folder = tempfile.mkdtemp()
+    north, item_id = make_branch(folder, 'north', [1, 2])
+    south, _ = make_branch(folder, 'south', [4])
+    central = Consolidator(os.path.join(folder, 'central.db'))
+    central.add_branch('north', north.path)
+    central.add_branch('south', south.path)
+    try:
+        central.add_branch('west', os.path.join(folder, 'west.db'))
+        assert False, "registered a branch without a database"
+    except ConsolidationError:
+        pass
+    
+    counts = central.ingest(workers=2, batch_size=1)
+    print(f"1. First ingest: {counts}")
+    assert counts['north']['cafe_orders'] == 2 and counts['south']['cafe_orders'] == 1
+    assert central.conn.execute("SELECT COUNT(*) FROM invoices").fetchone()[0] == 3
+    
+    # An open order is read again until it is invoiced
+    order = OrderService(north).place('09121234567', [OrderService(north).line(item_id, 5)], when=OPEN)
+    counts = central.ingest(['north'])
+    assert counts['north']['cafe_orders'] == 1
+    pay(north)
+    counts = central.ingest()
+    print(f"2. After paying the open order: {counts}")
+    assert counts['north']['invoices'] == 1
+    assert 'cafe_orders' not in counts['south'] and 'invoices' not in counts['south']
+    assert central.conn.execute(
+        "SELECT invoice_id FROM cafe_orders WHERE branch = 'north' AND id = ?", (order['order_id'],)
+    ).fetchone()[0] is not None
+    
+    os.remove(south.path)
+    south.close()
+    assert 'error' in central.ingest()['south']
+    print("   ✓ Incremental ingest")
+
+def test_failed_central_write():
+    """Test that a failed central write raises instead of hanging, and the next run resumes"""
+    print("\n=== Testing Failed Central Write ===\n")
+    folder = tempfile.mkdtemp()
+    north, item_id = make_branch(folder, 'north', [1])
+    central = Consolidator(os.path.join(folder, 'central.db'))
+    central.add_branch('north', north.path)
+    central.ingest()
+    for quantity in range(2, 40):
+        OrderService(north).place('09121234567', [OrderService(north).line(item_id, quantity)], when=OPEN)
+    central.conn.execute(
+        """CREATE TEMP TRIGGER locked BEFORE INSERT ON cafe_orders WHEN NEW.id > 3
+           BEGIN SELECT RAISE(ABORT, 'database is locked'); END"""
+    )
+    
+    outcome = []
+    def run():
+        try:
+            central.ingest(workers=1, batch_size=1)
+            outcome.append('ingested')
+        except ConsolidationError as e:
+            outcome.append(str(e))
+    thread = threading.Thread(target=run, daemon=True)
+    thread.start()
+    thread.join(timeout=10)
+    print(f"1. Outcome: {outcome}")
+    assert not thread.is_alive(), "ingest hung after a failed write"
+    assert outcome and 'database is locked' in outcome[0]
+    assert central.conn.execute("SELECT COUNT(*) FROM cafe_orders").fetchone()[0] == 3
+    
+    central.conn.execute("DROP TRIGGER locked")
+    counts = central.ingest()
+    print(f"2. Next run: {counts}")
+    assert counts['north']['cafe_orders'] == 38  # 36 new, and the two open orders written before the failure
+    assert central.conn.execute("SELECT COUNT(*) FROM cafe_orders").fetchone()[0] == 39
+    print("   ✓ Failed write reported, next run resumed")
+
+def test_branch_reports():
+    """Test the report service over one branch and over all branches"""
+    print("\n=== Testing Branch Reports ===\n")
+    folder = tempfile.mkdtemp()
+    north, _ = make_branch(folder, 'north', [1, 2])
+    south, _ = make_branch(folder, 'south', [4])
+    central = Consolidator(os.path.join(folder, 'central.db'))
+    central.add_branch('north', north.path)
+    central.add_branch('south', south.path)
+    central.ingest()
+    
+    reports = BranchReports(central.path)
+    assert reports.branches() == ['north', 'south']
+    expected = {name: ReportService(branch).sales_totals(DAY, DAY)
+                for name, branch in (('north', north), ('south', south))}
+    for name in ('north', 'south'):
+        assert reports.reports(name).sales_totals(DAY, DAY) == expected[name]
+    
+    combined = reports.reports()
+    totals = combined.sales_totals(DAY, DAY)
+    print(f"1. All branches: {totals}")
+    assert totals['count'] == 3
+    assert totals['revenue'] == expected['north']['revenue'] + expected['south']['revenue']
+    items = {row['name']: row['sold'] for row in combined.top_menu_items(30, today=OPEN)}
+    assert items == {'north tea': 3, 'south tea': 4}
+    assert combined.customer_stats(today=OPEN)['total'] == 2
+    assert reports.inventory('south').stock_value() == InventoryService(south).stock_value()
+    print("   ✓ Branch reports")
+
+def main():
+    """Run all tests"""
+    print("=" * 60)
+    print("Testing Branch Consolidation")
+    print("=" * 60)
+    
+    try:
+        test_incremental_ingest()
+        test_failed_central_write()
+        test_branch_reports()
+        
+        print("\n" + "=" * 60)
+        print("✅ All Branch Consolidation Tests Passed!")
+        print("=" * 60)
+        return 0
+    except AssertionError as e:
+        print("\n" + "=" * 60)
+        print(f"❌ Test Failed: {str(e)}")
+        print("=" * 60)
+        return 1
+
+if __name__ == '__main__':
+    sys.exit(main())
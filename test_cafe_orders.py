@@ -0,0 +1,159 @@
+#!/usr/bin/env python3
+"""
+Test Cafe Orders
+Tests order placement with recipe-based inventory deduction
+"""
+import os
+import sqlite3
+import sys
+import tempfile
+from datetime import datetime
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from database import Database
+from cafe_orders import CafeOrders
+
+def make_cafe():
+    """Create a throwaway database with a small menu and its ingredients"""
+    test_db = Database(os.path.join(tempfile.mkdtemp(), 'cafe.db'))
+    test_db.execute("INSERT INTO cafe_menu (name, category, price) VALUES ('Latte', 'Drinks', 4.0)")
+    test_db.execute("INSERT INTO cafe_menu (name, category, price) VALUES ('Espresso', 'Drinks', 2.5)")
+    test_db.execute("INSERT INTO cafe_menu (name, category, price) VALUES ('Water', 'Drinks', 1.0)")
+    for name, quantity, reorder in (('Coffee beans', 1000, 100), ('Milk', 2000, 500), ('Cups', 50, 10)):
+        test_db.execute(
+            "INSERT INTO inventory_items (name, section, quantity, reorder_level) VALUES (?, 'Cafe', ?, ?)",
+            (name, quantity, reorder)
+        )
+    orders = CafeOrders(test_db)
+    orders.set_recipe_item(1, 1, 18)   # Latte: beans, milk, cup
+    orders.set_recipe_item(1, 2, 200)
+    orders.set_recipe_item(1, 3, 1)
+    orders.set_recipe_item(2, 1, 18)   # Espresso: beans, cup
+    orders.set_recipe_item(2, 3, 1)
+    return test_db, orders
+
+def stock(test_db):
+    rows = test_db.fetchall("SELECT id, quantity FROM inventory_items ORDER BY id")
+    return {row['id']: row['quantity'] for row in rows}
+
+def test_order_deducts_ingredients():
+    """Test that completing an order deducts every ingredient"""
+    print("\n=== Testing Ingredient Deduction ===\n")
+    test_db, orders = make_cafe()
+    items = [{'id': 1, 'price': 4.0, 'quantity': 2}, {'id': 2, 'price': 2.5, 'quantity': 1},
+             {'id': 3, 'price': 1.0, 'quantity': 3}, {'id': 1, 'price': 4.0, 'quantity': 1}]
+    result = orders.place_order('09120000001', None, items, when=datetime(2024, 5, 1, 9, 0))
+    print(f"1. Order #{result['order_id']} total ${result['total']:.2f}")
+    assert result['total'] == 17.5
+    
+    levels = stock(test_db)
+    print(f"2. Stock after order: {levels}")
+    assert levels == {1: 1000 - 18 * 4, 2: 2000 - 200 * 3, 3: 50 - 4}
+    assert result['low_stock'] == []
+    
+    assert orders.set_recipe_item(1, 2, 0) is None
+    assert [r['name'] for r in orders.get_recipe(1)] == ['Coffee beans', 'Cups']
+    print("   ✓ Ingredients deducted for all lines")
+
+def test_low_stock_crossing_event():
+    """Test that listeners hear about reorder-level crossings once"""
+    print("\n=== Testing Low Stock Events ===\n")
+    test_db, orders = make_cafe()
+    events = []
+    orders.add_low_stock_listener(events.append)
+    orders.add_low_stock_listener(lambda items: 1 / 0)  # a failing listener must not break orders
+    
+    # 2000 ml milk, reorder at 500: 7 lattes leave 600, the 8th leaves 400
+    for _ in range(7):
+        orders.place_order('0912', None, [{'id': 1, 'price': 4.0, 'quantity': 1}])
+    assert events == []
+    orders.place_order('0912', None, [{'id': 1, 'price': 4.0, 'quantity': 1}])
+    print(f"1. Events: {events}")
+    assert len(events) == 1 and events[0][0]['name'] == 'Milk' and events[0][0]['quantity'] == 400
+    
+    orders.place_order('0912', None, [{'id': 1, 'price': 4.0, 'quantity': 1}])
+    assert len(events) == 1, "Stock already below reorder level should not re-alert"
+    print("   ✓ One event per crossing")
+
+def test_order_is_atomic():
+    """Test that a failed order neither saves lines nor changes stock"""
+    print("\n=== Testing Atomic Order ===\n")
+    test_db, orders = make_cafe()
+    before = stock(test_db)
+    test_db.execute(
+        """CREATE TEMP TRIGGER fail_stock BEFORE UPDATE ON inventory_items
+           BEGIN SELECT RAISE(ABORT, 'simulated failure'); END"""
+    )
+    try:
+        orders.place_order('0913', None, [{'id': 1, 'price': 4.0, 'quantity': 1}])
+        raise AssertionError("Order should have failed")
+    except sqlite3.IntegrityError as e:
+        print(f"1. Order failed as expected: {e}")
+    
+    assert test_db.fetchone("SELECT COUNT(*) as c FROM cafe_orders")['c'] == 0
+    assert test_db.fetchone("SELECT COUNT(*) as c FROM cafe_order_items")['c'] == 0
+    assert test_db.fetchone("SELECT COUNT(*) as c FROM customers")['c'] == 0
+    assert stock(test_db) == before
+    print("   ✓ Nothing saved, stock unchanged")
+
+def test_batch_of_queued_orders():
+    """Test saving many queued orders at once and linking invoices"""
+    print("\n=== Testing Queued Order Batch ===\n")
+    test_db, orders = make_cafe()
+    test_db.execute("UPDATE inventory_items SET quantity = 100000")
+    test_db.execute("INSERT INTO invoices (customer_id, total_amount, final_amount) VALUES (NULL, 0, 0)")
+    batch = [{'phone': f"0912{n % 15:07d}", 'barista_id': None,
+              'items': [{'id': 1 + n % 3, 'price': 4.0, 'quantity': 1}, {'id': 2, 'price': 2.5, 'quantity': 2}],
+              'when': datetime(2024, 5, 1, 12, n % 60)}
+             for n in range(60)]
+    batch[0]['invoice_id'] = 1
+    
+    statements = []
+    test_db.conn.set_trace_callback(statements.append)
+    results = orders.place_orders(batch)
+    test_db.conn.set_trace_callback(None)
+    commits = [s for s in statements if s.strip().upper().startswith('COMMIT')]
+    print(f"1. {len(results)} orders in {len(statements)} statements, {len(commits)} commit(s)")
+    assert len(results) == 60 and len(commits) == 1
+    assert len({r['order_id'] for r in results}) == 60
+    assert test_db.fetchone("SELECT COUNT(*) as c FROM cafe_order_items")['c'] == 120
+    assert test_db.fetchone("SELECT COUNT(*) as c FROM customers")['c'] == 15
+    
+    linked = orders.link_invoice([r['order_id'] for r in results[1:5]], 1)
+    count = test_db.fetchone("SELECT COUNT(*) as c FROM cafe_orders WHERE invoice_id = 1")['c']
+    print(f"2. Orders linked to invoice #1: {count}")
+    assert linked == 4 and count == 5
+    
+    try:
+        orders.place_orders(batch[:2] + [{'phone': '0914', 'items': []}])
+        raise AssertionError("Empty order should be rejected")
+    except ValueError:
+        pass
+    assert test_db.fetchone("SELECT COUNT(*) as c FROM cafe_orders")['c'] == 60
+    print("   ✓ Batch saved in a single transaction")
+
+def main():
+    """Run all tests"""
+    print("=" * 60)
+    print("Testing Cafe Orders")
+    print("=" * 60)
+    
+    try:
+        test_order_deducts_ingredients()
+        test_low_stock_crossing_event()
+        test_order_is_atomic()
+        test_batch_of_queued_orders()
+        
+        print("\n" + "=" * 60)
+        print("✅ All Cafe Order Tests Passed!")
+        print("=" * 60)
+        return 0
+    except AssertionError as e:
+        print("\n" + "=" * 60)
+        print(f"❌ Test Failed: {str(e)}")
+        print("=" * 60)
+        return 1
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,144 @@
+#!/usr/bin/env python3
+"""
+Test Unified Checkout
+Tests invoicing of unbilled salon, cafe and gamnet rows
+"""
+import os
+import sqlite3
+import sys
+import tempfile
+from datetime import datetime
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from database import Database
+from checkout import CheckoutEngine, CheckoutError
+
+WHEN = datetime(2024, 6, 1, 18, 0)
+
+def make_shop():
+    """Create a throwaway database with one customer's unbilled activity"""
+    test_db = Database(os.path.join(tempfile.mkdtemp(), 'checkout.db'))
+    test_db.initialize_defaults()
+    test_db.execute("UPDATE settings SET value = '10' WHERE key = 'tax_rate'")
+    test_db.execute("INSERT INTO customers (name, phone) VALUES ('Sara', '0912')")
+    test_db.execute("INSERT INTO customers (name, phone) VALUES ('Reza', '0935')")
+    test_db.execute("INSERT INTO salon_services (name, price) VALUES ('Haircut', 30)")
+    test_db.execute("INSERT INTO gamnet_devices (device_number, hourly_rate) VALUES ('PC-1', 6)")
+    test_db.execute(
+        """INSERT INTO campaigns (name, code, discount_percentage, start_date, end_date)
+           VALUES ('Summer', 'SUMMER20', 20, '2024-06-01', '2024-08-31')"""
+    )
+    test_db.execute(
+        "INSERT INTO salon_service_records (customer_id, service_id, service_date, price) VALUES (1, 1, '2024-06-01 10:00:00', 30)"
+    )
+    test_db.execute("INSERT INTO cafe_orders (customer_id, order_date, total_amount) VALUES (1, '2024-06-01 11:00:00', 12)")
+    test_db.execute("INSERT INTO cafe_orders (customer_id, order_date, total_amount) VALUES (2, '2024-06-01 11:00:00', 5)")
+    test_db.execute(
+        """INSERT INTO gamnet_sessions (device_id, customer_id, start_time, end_time, duration_minutes, charge)
+           VALUES (1, 1, '2024-06-01 12:00:00', '2024-06-01 13:00:00', 60, 6)"""
+    )
+    # Still running, so not billable yet
+    test_db.execute("INSERT INTO gamnet_sessions (device_id, customer_id, start_time) VALUES (1, 1, '2024-06-01 17:00:00')")
+    return test_db, CheckoutEngine(test_db)
+
+def test_checkout_links_rows():
+    """Test that one invoice covers and stamps every unbilled row"""
+    print("\n=== Testing Unified Checkout ===\n")
+    test_db, engine = make_shop()
+    
+    quote = engine.quote(1, 'SUMMER20')
+    print(f"1. Quote: {[l['description'] for l in quote['lines']]}")
+    assert len(quote['lines']) == 3
+    
+    result = engine.checkout('0912', 'SUMMER20', [{'section': 'Cafe', 'description': 'Gift card', 'amount': 10}],
+                             when=WHEN)
+    print(f"2. Invoice #{result['invoice_id']}: subtotal {result['subtotal']}, discount {result['discount']}, "
+          f"tax {result['tax']}, final {result['final']}")
+    assert result['subtotal'] == 58 and result['discount'] == 11.6
+    assert result['tax'] == 4.64 and result['final'] == 51.04
+    
+    invoice = test_db.fetchone("SELECT * FROM invoices WHERE id = ?", (result['invoice_id'],))
+    assert invoice['tax_amount'] == 4.64 and invoice['campaign_code'] == 'SUMMER20'
+    for table in ('salon_service_records', 'cafe_orders', 'gamnet_sessions'):
+        linked = test_db.fetchone(f"SELECT COUNT(*) as c FROM {table} WHERE invoice_id = ?", (result['invoice_id'],))
+        assert linked['c'] == 1, table
+    assert test_db.fetchone("SELECT invoice_id FROM cafe_orders WHERE customer_id = 2")['invoice_id'] is None
+    
+    assert engine.unbilled_lines(1) == []
+    try:
+        engine.checkout('0912', when=WHEN)
+        raise AssertionError("Second checkout should have nothing to bill")
+    except CheckoutError as e:
+        print(f"3. Second checkout refused: {e}")
+    print("   ✓ Rows linked once and only once")
+
+def test_checkout_is_atomic():
+    """Test that a failure while stamping rows leaves no invoice"""
+    print("\n=== Testing Atomic Checkout ===\n")
+    test_db, engine = make_shop()
+    test_db.execute(
+        """CREATE TEMP TRIGGER fail_stamp BEFORE UPDATE OF invoice_id ON gamnet_sessions
+           BEGIN SELECT RAISE(ABORT, 'simulated failure'); END"""
+    )
+    try:
+        engine.checkout('0912', when=WHEN)
+        raise AssertionError("Checkout should have failed")
+    except sqlite3.IntegrityError as e:
+        print(f"1. Checkout failed as expected: {e}")
+    
+    assert test_db.fetchone("SELECT COUNT(*) as c FROM invoices")['c'] == 0
+    assert test_db.fetchone("SELECT COUNT(*) as c FROM cafe_orders WHERE invoice_id IS NOT NULL")['c'] == 0
+    assert test_db.fetchone("SELECT COUNT(*) as c FROM salon_service_records WHERE invoice_id IS NOT NULL")['c'] == 0
+    
+    try:
+        engine.checkout('0912', 'BOGUS', when=WHEN)
+        raise AssertionError("Invalid campaign should be rejected")
+    except CheckoutError:
+        pass
+    print("   ✓ Nothing written on failure")
+
+def test_section_revenue_by_invoice():
+    """Test section revenue read through invoice links"""
+    print("\n=== Testing Section Revenue ===\n")
+    test_db, engine = make_shop()
+    result = engine.checkout('0912', when=WHEN)
+    assert engine.section_revenue('2024-06-01', '2024-06-01') == {'Salon': 0, 'Cafe': 0, 'Gamnet': 0}
+    
+    test_db.execute("UPDATE invoices SET is_paid = 1 WHERE id = ?", (result['invoice_id'],))
+    revenue = engine.section_revenue('2024-06-01', '2024-06-01')
+    print(f"1. Revenue: {revenue}")
+    assert revenue == {'Salon': 30, 'Cafe': 12, 'Gamnet': 6}
+    
+    plan = test_db.fetchall(
+        "EXPLAIN QUERY PLAN SELECT SUM(r.charge) FROM invoices i JOIN gamnet_sessions r ON r.invoice_id = i.id "
+        "WHERE i.invoice_date >= ? AND i.invoice_date < ?", ('2024-06-01', '2024-06-02')
+    )
+    details = ' '.join(row['detail'] for row in plan)
+    print(f"2. Plan: {details}")
+    assert 'idx_gamnet_sessions_invoice' in details or 'idx_gamnet_sessions_unbilled' in details
+    print("   ✓ Revenue read by indexed join")
+
+def main():
+    """Run all tests"""
+    print("=" * 60)
+    print("Testing Unified Checkout")
+    print("=" * 60)
+    
+    try:
+        test_checkout_links_rows()
+        test_checkout_is_atomic()
+        test_section_revenue_by_invoice()
+        
+        print("\n" + "=" * 60)
+        print("✅ All Checkout Tests Passed!")
+        print("=" * 60)
+        return 0
+    except AssertionError as e:
+        print("\n" + "=" * 60)
+        print(f"❌ Test Failed: {str(e)}")
+        print("=" * 60)
+        return 1
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,109 @@
+#!/usr/bin/env python3
+"""
+Test Customer Search
+Tests as-you-type customer lookup by partial name and phone
+"""
+import os
+import random
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from database import Database
+from customer_search import CustomerSearch
+
+def make_customers(extra=0):
+    """Create a throwaway database with a few known customers and optional filler"""
+    test_db = Database(os.path.join(tempfile.mkdtemp(), 'customer_search.db'))
+    for name, phone in (('Sara Ahmadi', '09121234567'), ('Saman Karimi', '09351112222'),
+                        ('سارا احمدی', '09127654321'), ('علی رضایی', '09190000000')):
+        test_db.execute("INSERT INTO customers (name, phone) VALUES (?, ?)", (name, phone))
+    rng = random.Random(5)
+    with test_db.transaction() as cursor:
+        cursor.executemany(
+            "INSERT INTO customers (name, phone) VALUES (?, ?)",
+            [(f"Guest{rng.randint(1, 9999)} Family{n}", f"0930{n:07d}") for n in range(extra)]
+        )
+    return test_db, CustomerSearch(test_db)
+
+def names(results):
+    return sorted(customer['name'] for customer in results)
+
+def test_partial_name_and_phone():
+    """Test Latin and Persian name prefixes, phone prefixes and both together"""
+    print("\n=== Testing Partial Matches ===\n")
+    test_db, search = make_customers()
+    cases = [
+        ('sa', ['Saman Karimi', 'Sara Ahmadi']),
+        ('sara ahm', ['Sara Ahmadi']),
+        ('سا', ['سارا احمدی']),
+        ('علي', ['علی رضایی']),            # Arabic yeh typed, Persian yeh stored
+        ('0912', ['Sara Ahmadi', 'سارا احمدی']),
+        ('۰۹۳۵', ['Saman Karimi']),          # Persian digits
+        ('sa 0935', ['Saman Karimi']),
+        ('zz', []),
+        ('  ', []),
+    ]
+    for text, expected in cases:
+        found = names(search.search(text))
+        print(f"   {text!r}: {found}")
+        assert found == expected, text
+    print("   ✓ Names and phones matched by prefix")
+
+def test_index_follows_changes():
+    """Test that renames and deletions reach the name index through triggers"""
+    print("\n=== Testing Name Index Triggers ===\n")
+    test_db, search = make_customers()
+    test_db.execute("UPDATE customers SET name = 'Samira Ahmadi' WHERE phone = '09121234567'")
+    test_db.execute("DELETE FROM customers WHERE phone = '09351112222'")
+    print(f"1. 'sa' after rename and delete: {names(search.search('sa'))}")
+    assert names(search.search('sa')) == ['Samira Ahmadi']
+    assert search.search('sara') == []
+    
+    # Without FTS5 the same searches fall back to LIKE
+    test_db.name_search = False
+    print(f"2. Without FTS5: {names(search.search('ahm'))}")
+    assert names(search.search('ahm')) == ['Samira Ahmadi']
+    assert names(search.search('sam 0912')) == ['Samira Ahmadi']
+    print("   ✓ Index kept in step")
+
+def test_large_customer_base():
+    """Test that lookups stay index-only on a large customer table"""
+    print("\n=== Testing Search Speed ===\n")
+    test_db, search = make_customers(extra=50000)
+    for text in ('g', 'guest12', 'family4999', '0930001', 'guest1 0930004'):
+        sql, params = search.query(text)
+        plan = ' '.join(row['detail'] for row in test_db.fetchall("EXPLAIN QUERY PLAN " + sql, params))
+        started = time.perf_counter()
+        results = search.search(text)
+        elapsed = (time.perf_counter() - started) * 1000
+        print(f"   {text!r}: {len(results)} results in {elapsed:.1f} ms")
+        assert 'SCAN c' not in plan, plan
+        assert results and elapsed < 100
+    print("   ✓ No customer table scans")
+
+def main():
+    """Run all tests"""
+    print("=" * 60)
+    print("Testing Customer Search")
+    print("=" * 60)
+    
+    try:
+        test_partial_name_and_phone()
+        test_index_follows_changes()
+        test_large_customer_base()
+        
+        print("\n" + "=" * 60)
+        print("✅ All Customer Search Tests Passed!")
+        print("=" * 60)
+        return 0
+    except AssertionError as e:
+        print("\n" + "=" * 60)
+        print(f"❌ Test Failed: {str(e)}")
+        print("=" * 60)
+        return 1
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,142 @@
+#!/usr/bin/env python3
+"""
+Test Customer Segments
+Tests RFM scoring, incremental rescoring after invoice changes, and
+segments used as SMS audiences
+"""
+import os
+import sys
+import tempfile
+from datetime import datetime
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from database import Database
+from customer_segments import RfmScorer, SEGMENT_NAMES
+from services import OrderService, InvoiceService, PaymentService, MessagingService, MessagingError
+
+TODAY = datetime(2030, 6, 30)
+
+def sell(test_db, item_id, phone, quantity, when, pay=True):
+    """A cafe order of `quantity` teas, invoiced and paid unless pay is False; returns the invoice"""
+    orders = OrderService(test_db)
+    orders.place(phone, [orders.line(item_id, quantity)], when=when)
+    invoice = InvoiceService(test_db).create(phone, when=when)
+    if pay:
+        PaymentService(test_db).pay(invoice['invoice_id'], 'Cash', when=when)
+    return invoice
+
+def make_customers():
+    """Five customers from a recent big regular to one who came once long ago"""
+    test_db = Database(os.path.join(tempfile.mkdtemp(), 'test.db'))
+    test_db.initialize_defaults()
+    item_id = OrderService(test_db).add_menu_item('Tea', 'Tea', 3)
+    visits = {
+        '09120000001': [(datetime(2030, 6, day), 10) for day in (1, 10, 20, 28)],
+        '09120000002': [(datetime(2030, 5, day), 2) for day in (1, 15, 30)],
+        '09120000003': [(datetime(2030, 6, 25), 1)],
+        '09120000004': [(datetime(2030, 1, day), 3) for day in (5, 12, 19)],
+        '09120000005': [(datetime(2029, 11, 2), 1)],
+    }
+    for phone, sales in visits.items():
+        for when, quantity in sales:
+            sell(test_db, item_id, phone, quantity, when)
+    return test_db, item_id
+
+def segment_of(scorer, phone):
+    return scorer.db.fetchone(
+        "SELECT r.* FROM customer_rfm r JOIN customers c ON c.id = r.customer_id WHERE c.phone = ?", (phone,)
+    )
+
+def test_scoring():
+    """Test scores by percent rank, shared scores for ties, and segment labels"""
+    print("\n=== Testing RFM Scoring ===\n")
+    test_db, _ = make_customers()
+    scorer = RfmScorer(test_db)
+    assert scorer.refresh(when=TODAY) == 5
+    assert scorer.refresh(when=TODAY) == 0
+    
+    champion = segment_of(scorer, '09120000001')
+    print(f"1. Best customer: {dict(champion)}")
+    assert (champion['recency_score'], champion['frequency_score'], champion['monetary_score']) == (5, 5, 5)
+    assert champion['frequency'] == 4 and champion['segment'] == 'Champions'
+    # Equal frequencies share a score
+    assert segment_of(scorer, '09120000002')['frequency_score'] == segment_of(scorer, '09120000004')['frequency_score']
+    assert segment_of(scorer, '09120000003')['segment'] == 'New'
+    assert segment_of(scorer, '09120000004')['segment'] == 'At risk'
+    assert segment_of(scorer, '09120000005')['segment'] == 'Lost'
+    
+    counts = scorer.counts()
+    print(f"2. Segments: {counts}")
+    assert list(counts) == list(SEGMENT_NAMES) and sum(counts.values()) == 5
+    print("   ✓ RFM scoring")
+
+def test_incremental_rescoring():
+    """Test only customers with changed invoices recomputed, and unpaid invoices ignored"""
+    print("\n=== Testing Incremental Rescoring ===\n")
+    test_db, item_id = make_customers()
+    scorer = RfmScorer(test_db)
+    scorer.refresh(when=TODAY)
+    
+    # An unpaid invoice marks its customer but adds nothing
+    invoice = sell(test_db, item_id, '09120000005', 50, datetime(2030, 6, 29), pay=False)
+    assert scorer.refresh(when=TODAY) == 1
+    assert segment_of(scorer, '09120000005')['segment'] == 'Lost'
+    
+    # Paying it brings the customer back
+    PaymentService(test_db).pay(invoice['invoice_id'], 'Cash', when=datetime(2030, 6, 29))
+    assert scorer.refresh(when=TODAY) == 1
+    comeback = segment_of(scorer, '09120000005')
+    print(f"1. After paying: {dict(comeback)}")
+    assert comeback['frequency'] == 2 and comeback['recency_score'] == 5 and comeback['monetary_score'] == 5
+    assert segment_of(scorer, '09120000001')['monetary_score'] == 4
+    
+    # A customer whose only invoice is unpaid is not scored
+    sell(test_db, item_id, '09129999999', 1, datetime(2030, 6, 29), pay=False)
+    scorer.refresh(when=TODAY)
+    assert sum(scorer.counts().values()) == 5
+    print("   ✓ Incremental rescoring")
+
+def test_segments_as_audiences():
+    """Test segment lists through the messaging service"""
+    print("\n=== Testing Segment Audiences ===\n")
+    test_db, _ = make_customers()
+    messaging = MessagingService(test_db)
+    counts = messaging.score_segments()
+    assert counts == messaging.segment_counts()
+    monetary = [row['monetary'] for row in test_db.fetchall("SELECT monetary FROM customer_rfm")]
+    assert abs(messaging.average_customer_value() - sum(monetary) / 5) < 1e-9
+    audience = messaging.audience('At risk', today=TODAY)
+    print(f"1. At risk: {[(c['phone'], c['recency_days']) for c in audience]}")
+    assert [c['phone'] for c in audience] == ['09120000004'] and audience[0]['recency_days'] == 162
+    assert [c['phone'] for c in messaging.audience('Champions')] == ['09120000001']
+    try:
+        messaging.audience('Whales')
+        assert False, "unknown audience accepted"
+    except MessagingError:
+        pass
+    print("   ✓ Segment audiences")
+
+def main():
+    """Run all tests"""
+    print("=" * 60)
+    print("Testing Customer Segments")
+    print("=" * 60)
+    
+    try:
+        test_scoring()
+        test_incremental_rescoring()
+        test_segments_as_audiences()
+        
+        print("\n" + "=" * 60)
+        print("✅ All Customer Segments Tests Passed!")
+        print("=" * 60)
+        return 0
+    except AssertionError as e:
+        print("\n" + "=" * 60)
+        print(f"❌ Test Failed: {str(e)}")
+        print("=" * 60)
+        return 1
+
+if __name__ == '__main__':
+    sys.exit(main())
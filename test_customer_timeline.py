@@ -0,0 +1,137 @@
+#!/usr/bin/env python3
+"""
+Test Customer Timeline
+Tests the merged customer history, its paging and the per-section totals
+"""
+import os
+import random
+import sys
+import tempfile
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from database import Database
+from customer_timeline import CustomerTimeline
+
+def make_customers():
+    """Create a throwaway database with two customers' activity in every section"""
+    test_db = Database(os.path.join(tempfile.mkdtemp(), 'timeline.db'))
+    test_db.execute("INSERT INTO customers (name, phone) VALUES ('Sara', '0912')")
+    test_db.execute("INSERT INTO customers (name, phone) VALUES ('Reza', '0935')")
+    test_db.execute("INSERT INTO salon_services (name, price) VALUES ('Haircut', 20)")
+    test_db.execute("INSERT INTO gamnet_devices (device_number, hourly_rate) VALUES ('PC-1', 6)")
+    rng = random.Random(3)
+    # Few distinct dates, so many events share a timestamp
+    when = lambda: f"2024-0{rng.randint(1, 3)}-{rng.randint(10, 12)} 10:00:00"
+    for _ in range(40):
+        customer = rng.randint(1, 2)
+        test_db.execute("INSERT INTO salon_service_records (customer_id, service_id, service_date, price) "
+                        "VALUES (?, 1, ?, 20)", (customer, when()))
+        test_db.execute("INSERT INTO cafe_orders (customer_id, order_date, total_amount) VALUES (?, ?, 7.5)",
+                        (customer, when()))
+        test_db.execute("INSERT INTO gamnet_sessions (device_id, customer_id, start_time, duration_minutes, charge) "
+                        "VALUES (1, ?, ?, 30, 3)", (customer, when()))
+        test_db.execute("INSERT INTO invoices (customer_id, invoice_date, final_amount) VALUES (?, ?, 30.5)",
+                        (customer, when()))
+        test_db.execute("INSERT INTO payment_transactions (invoice_id, amount, status, transaction_date) "
+                        "VALUES (last_insert_rowid(), 30.5, 'approved', ?)", (when(),))
+        test_db.execute("INSERT INTO wallet_transactions (customer_id, amount, description, transaction_date) "
+                        "VALUES (?, 10, 'Top-up', ?)", (customer, when()))
+        test_db.execute("INSERT INTO loyalty_transactions (customer_id, points, description, transaction_date) "
+                        "VALUES (?, 5, 'Earned', ?)", (customer, when()))
+        test_db.execute("INSERT INTO sms_history (customer_id, message, sms_type, sent_date) "
+                        "VALUES (?, 'Hi', 'promo', ?)", (customer, when()))
+    return test_db, CustomerTimeline(test_db)
+
+def all_pages(timeline, customer_id, limit, sections=None):
+    """Every event of a timeline, fetched page by page"""
+    events, after = [], None
+    while True:
+        page = timeline.page(customer_id, after=after, limit=limit, sections=sections)
+        events += [(e['event_date'], e['section'], e['ref_id']) for e in page['rows']]
+        if not page['next']:
+            return events
+        after = page['next']
+
+def test_timeline_paging():
+    """Test that paging walks the whole merged history once, in order"""
+    print("\n=== Testing Timeline Paging ===\n")
+    test_db, timeline = make_customers()
+    expected = sorted((
+        (row['event_date'], row['section'], row['ref_id']) for row in test_db.fetchall(
+            """SELECT service_date as event_date, 'Salon' as section, id as ref_id FROM salon_service_records WHERE customer_id = 1
+               UNION ALL SELECT order_date, 'Cafe', id FROM cafe_orders WHERE customer_id = 1
+               UNION ALL SELECT start_time, 'Gamnet', id FROM gamnet_sessions WHERE customer_id = 1
+               UNION ALL SELECT invoice_date, 'Invoices', id FROM invoices WHERE customer_id = 1
+               UNION ALL SELECT p.transaction_date, 'Payments', p.id FROM payment_transactions p
+                         JOIN invoices i ON i.id = p.invoice_id WHERE i.customer_id = 1
+               UNION ALL SELECT transaction_date, 'Wallet', id FROM wallet_transactions WHERE customer_id = 1
+               UNION ALL SELECT transaction_date, 'Loyalty', id FROM loyalty_transactions WHERE customer_id = 1
+               UNION ALL SELECT sent_date, 'SMS', id FROM sms_history WHERE customer_id = 1""")
+    ), reverse=True)
+    events = all_pages(timeline, 1, 7)
+    print(f"1. {len(events)} events over {-(-len(events) // 7)} pages")
+    assert events == expected
+    
+    cafe = all_pages(timeline, 1, 4, sections=('Cafe',))
+    print(f"2. Cafe only: {len(cafe)} events")
+    assert cafe == [event for event in expected if event[1] == 'Cafe']
+    print("   ✓ Complete, ordered and without duplicates")
+
+def test_activity_totals_follow_changes():
+    """Test that the trigger-kept totals match a full recount after edits"""
+    print("\n=== Testing Activity Totals ===\n")
+    test_db, timeline = make_customers()
+    test_db.execute("UPDATE salon_service_records SET price = 50 WHERE id = 1")
+    test_db.execute("UPDATE cafe_orders SET customer_id = 3 - customer_id WHERE id <= 5")
+    test_db.execute("DELETE FROM gamnet_sessions WHERE id % 3 = 0")
+    test_db.execute("UPDATE invoices SET is_paid = 1")
+    
+    live = {customer: timeline.summary(customer) for customer in (1, 2)}
+    statements = []
+    test_db.conn.set_trace_callback(statements.append)
+    timeline.summary(1)
+    test_db.conn.set_trace_callback(None)
+    test_db.rebuild_activity_totals()
+    rebuilt = {customer: timeline.summary(customer) for customer in (1, 2)}
+    print(f"1. Sara: {live[1]}")
+    print(f"2. Header read with {len(statements)} query")
+    assert live == rebuilt and len(statements) == 1
+    salon = test_db.fetchone("SELECT COUNT(*) as c, SUM(price) as s FROM salon_service_records WHERE customer_id = 1")
+    assert live[1]['Salon'] == {'visits': salon['c'], 'spend': salon['s']}
+    print("   ✓ Totals kept in step by triggers")
+
+def test_timeline_plan():
+    """Test that every source is read from a per-customer index"""
+    print("\n=== Testing Timeline Query Plan ===\n")
+    test_db, timeline = make_customers()
+    sql, params = timeline.query(1, after=('2024-02-11 10:00:00', 'Gamnet', 12))
+    details = [row['detail'] for row in test_db.fetchall("EXPLAIN QUERY PLAN " + sql, params)]
+    scans = [d for d in details if d.startswith('SCAN') and 'subquery' not in d]
+    print(f"1. {sum(d.startswith('SEARCH') for d in details)} index searches, {len(scans)} table scans")
+    assert not scans, scans
+    print("   ✓ No table scans")
+
+def main():
+    """Run all tests"""
+    print("=" * 60)
+    print("Testing Customer Timeline")
+    print("=" * 60)
+    
+    try:
+        test_timeline_paging()
+        test_activity_totals_follow_changes()
+        test_timeline_plan()
+        
+        print("\n" + "=" * 60)
+        print("✅ All Customer Timeline Tests Passed!")
+        print("=" * 60)
+        return 0
+    except AssertionError as e:
+        print("\n" + "=" * 60)
+        print(f"❌ Test Failed: {str(e)}")
+        print("=" * 60)
+        return 1
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,211 @@
+#!/usr/bin/env python3
+"""
+Test Day Close
+Tests end-of-day Z-reports and locking of closed days
+"""
+import os
+import sqlite3
+import sys
+import tempfile
+from datetime import datetime
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from database import Database, DayClosedError
+from checkout import CheckoutEngine, CheckoutError
+from payments import PaymentLedger
+from day_close import DayCloser, DayCloseError, DAILY_TOTALS_QUERY
+from gamnet_telemetry import TelemetryIngestor
+from services import OrderService, OrderError, AppointmentService, SessionService, SessionError
+
+DAY = '2024-06-01'
+CLOSING_TIME = datetime(2024, 6, 1, 23, 0)
+
+def make_day():
+    """Create a throwaway database with one day of activity across sections"""
+    test_db = Database(os.path.join(tempfile.mkdtemp(), 'day_close.db'))
+    test_db.initialize_defaults()
+    test_db.execute("UPDATE settings SET value = '0' WHERE key = 'tax_rate'")
+    test_db.execute("INSERT INTO employees (name, role, section) VALUES ('Mina', 'Stylist', 'Salon')")
+    test_db.execute("INSERT INTO employees (name, role, section) VALUES ('Ali', 'Barista', 'Cafe')")
+    test_db.execute("INSERT INTO customers (name, phone) VALUES ('Sara', '0912')")
+    test_db.execute("INSERT INTO customers (name, phone) VALUES ('Reza', '0935')")
+    test_db.execute("INSERT INTO gamnet_devices (device_number, hourly_rate) VALUES ('PC-1', 6)")
+    test_db.execute(
+        """INSERT INTO campaigns (name, code, discount_percentage, start_date, end_date)
+           VALUES ('Summer', 'SUMMER', 10, '2024-06-01', '2024-08-31')"""
+    )
+    test_db.execute(
+        """INSERT INTO salon_service_records (customer_id, stylist_id, service_date, price)
+           VALUES (1, 1, '2024-06-01 10:00:00', 40)"""
+    )
+    test_db.execute("INSERT INTO cafe_orders (customer_id, barista_id, order_date, total_amount) VALUES (2, 2, '2024-06-01 11:00:00', 10)")
+    test_db.execute("INSERT INTO cafe_order_items (order_id, quantity, price) VALUES (1, 2, 5)")
+    test_db.execute(
+        """INSERT INTO gamnet_sessions (device_id, customer_id, start_time, end_time, duration_minutes, charge)
+           VALUES (1, 2, '2024-06-01 12:00:00', '2024-06-01 13:00:00', 60, 6)"""
+    )
+    test_db.execute("INSERT INTO gamnet_sessions (device_id, customer_id, start_time) VALUES (1, 1, '2024-06-01 22:30:00')")
+    # Yesterday's unbilled service, billed today
+    test_db.execute(
+        "INSERT INTO salon_service_records (customer_id, stylist_id, service_date, price) VALUES (2, 1, '2024-05-31 18:00:00', 20)"
+    )
+    
+    checkout = CheckoutEngine(test_db)
+    payments = PaymentLedger(test_db)
+    first = checkout.checkout('0912', 'SUMMER', when=datetime(2024, 6, 1, 14, 0))
+    checkout.checkout('0935', when=datetime(2024, 6, 1, 15, 0))
+    payments.pay_invoice(first['invoice_id'], 'Card', when=datetime(2024, 6, 1, 14, 5))
+    return test_db, DayCloser(test_db)
+
+def test_z_report_totals():
+    """Test that one closing captures every dimension and reads back as one row"""
+    print("\n=== Testing Z-Report Totals ===\n")
+    test_db, closer = make_day()
+    report = closer.close_day(DAY, closed_by='admin', when=CLOSING_TIME)
+    print(f"1. Invoices {report['invoice_count']}, billed {report['billed']}, revenue {report['revenue']}")
+    assert report['invoice_count'] == 2 and report['customers'] == 2
+    assert report['billed'] == 72 and report['discount'] == 4 and report['revenue'] == 36
+    assert report['payment_methods'] == {'Card': {'count': 1, 'amount': 36}, 'Unpaid': {'count': 1, 'amount': 36}}
+    assert report['campaigns']['SUMMER'] == {'count': 1, 'amount': 36, 'discount': 4}
+    assert report['sections']['Salon'] == {'count': 1, 'amount': 40}
+    assert report['sections']['Gamnet'] == {'count': 1, 'amount': 6} and report['gamnet_running'] == 1
+    assert report['employees'] == {'Mina': {'count': 1, 'amount': 40}, 'Ali': {'count': 1, 'amount': 10}}
+    
+    statements = []
+    test_db.conn.set_trace_callback(statements.append)
+    stored = closer.daily_summary(DAY)
+    test_db.conn.set_trace_callback(None)
+    print(f"2. Closed day read with {len(statements)} query")
+    assert len(statements) == 1 and stored == report
+    
+    try:
+        closer.close_day(DAY, when=CLOSING_TIME)
+        raise AssertionError("Closing twice should fail")
+    except DayCloseError as e:
+        print(f"3. Second close refused: {e}")
+    print("   ✓ Z-report stored once")
+
+def test_closed_day_is_locked():
+    """Test that a closed day's rows and its closing cannot change"""
+    print("\n=== Testing Closed Day Locks ===\n")
+    test_db, closer = make_day()
+    closer.close_day(DAY, when=CLOSING_TIME)
+    
+    refused = [
+        "UPDATE salon_service_records SET price = 1 WHERE id = 1",
+        "DELETE FROM cafe_order_items WHERE order_id = 1",
+        "UPDATE invoices SET final_amount = 0 WHERE id = 1",
+        "INSERT INTO cafe_orders (customer_id, order_date, total_amount) VALUES (1, '2024-06-01 20:00:00', 99)",
+        "UPDATE gamnet_sessions SET charge = 0 WHERE id = 1",
+        "UPDATE day_closings SET revenue = 0",
+        "DELETE FROM day_closings",
+    ]
+    for statement in refused:
+        try:
+            test_db.execute(statement)
+            raise AssertionError(f"Should be refused: {statement}")
+        except sqlite3.IntegrityError:
+            pass
+    print(f"1. {len(refused)} changes to the closed day refused")
+    
+    # Moving a later row into the closed day is refused too
+    test_db.execute("INSERT INTO cafe_orders (customer_id, order_date, total_amount) VALUES (1, '2024-06-02 09:00:00', 5)")
+    try:
+        test_db.execute("UPDATE cafe_orders SET order_date = '2024-06-01 09:00:00' WHERE order_date LIKE '2024-06-02%'")
+        raise AssertionError("Backdating into a closed day should fail")
+    except sqlite3.IntegrityError:
+        pass
+    
+    # Settling, billing and ending running sessions still work
+    PaymentLedger(test_db).pay_invoice(2, 'Cash', when=datetime(2024, 6, 2, 9, 0))
+    test_db.execute(
+        "UPDATE gamnet_sessions SET end_time = '2024-06-01 23:30:00', duration_minutes = 60, charge = 6 WHERE id = 2"
+    )
+    test_db.execute(
+        "INSERT INTO salon_service_records (customer_id, stylist_id, service_date, price) VALUES (1, 1, '2024-06-02 10:00:00', 25)"
+    )
+    CheckoutEngine(test_db).checkout('0912', when=datetime(2024, 6, 2, 12, 0))
+    assert closer.get_closing(DAY)['revenue'] == 36
+    print("2. Payments, billing and running sessions unaffected")
+    print("   ✓ Closed day frozen")
+
+def test_writes_after_closing_today():
+    """Test that sales dated on a closed day raise the services' own errors"""
+    print("\n=== Testing Writes After Closing ===\n")
+    test_db, closer = make_day()
+    test_db.execute("INSERT INTO gamnet_devices (device_number, hourly_rate) VALUES ('PC-2', 6)")
+    item_id = OrderService(test_db).add_menu_item('Tea', 'Tea', 3)
+    service_id = AppointmentService(test_db).add_service('Cut', 20, 30, 10)
+    closer.close_day(DAY, when=CLOSING_TIME)
+    late = datetime(2024, 6, 1, 23, 30)
+    
+    try:
+        test_db.execute("INSERT INTO cafe_orders (customer_id, order_date, total_amount) VALUES (1, '2024-06-01 23:30:00', 1)")
+        raise AssertionError("Insert into a closed day should fail")
+    except DayClosedError:
+        pass
+    refused = {
+        'checkout': (CheckoutError, lambda: CheckoutEngine(test_db).checkout(
+            '0912', extra_items=[{'section': 'Cafe', 'description': 'Tip', 'amount': 1}], when=late)),
+        'cafe order': (OrderError, lambda: OrderService(test_db).place(
+            '0912', [OrderService(test_db).line(item_id, 1)], when=late)),
+        'gamnet session': (SessionError, lambda: SessionService(test_db).start(3, '0912', when=late)),
+    }
+    for name, (error, write) in refused.items():
+        try:
+            write()
+            raise AssertionError(f"{name} on a closed day should fail")
+        except error as e:
+            print(f"1. {name}: {e}")
+    result = AppointmentService(test_db).record_service('0912', 1, service_id, when=late)
+    assert not result['success'] and 'closed' in result['message']
+    
+    # Telemetry drops the refused login but writes the rest of the batch
+    ingestor = TelemetryIngestor(database=test_db)
+    ingestor.submit({'event': 'login', 'device': 'PC-2', 'ts': '2024-06-01 23:30:00'})
+    ingestor.submit({'event': 'heartbeat', 'device': 'PC-1', 'ts': '2024-06-01 23:30:00'})
+    ingestor.submit({'event': 'logout', 'device': 'PC-1', 'ts': '2024-06-01 23:31:00'})
+    assert ingestor.flush(now=late) == 3 and ingestor.pending() == 0
+    assert ingestor.stats['rejected'] == 1
+    assert test_db.fetchone("SELECT end_time FROM gamnet_sessions WHERE id = 2")['end_time'] == '2024-06-01 23:31:00'
+    assert test_db.fetchone("SELECT COUNT(*) FROM gamnet_sessions WHERE device_id = 3")[0] == 0
+    print("2. Telemetry login refused, running session ended")
+    print("   ✓ Closed day refusals surface as service errors")
+
+def test_daily_totals_use_indexes():
+    """Test that the daily totals query reads date ranges from indexes"""
+    print("\n=== Testing Daily Totals Plan ===\n")
+    test_db, closer = make_day()
+    plan = test_db.fetchall("EXPLAIN QUERY PLAN " + DAILY_TOTALS_QUERY, {'day': DAY, 'next_day': '2024-06-02'})
+    details = ' '.join(row['detail'] for row in plan)
+    assert 'SCAN invoices' not in details and 'SCAN salon_service_records' not in details
+    assert 'SCAN cafe_orders' not in details and 'SCAN gamnet_sessions' not in details
+    assert closer.daily_summary(DAY)['closed_at'] is None
+    print("1. No full table scans")
+    print("   ✓ Indexed date ranges")
+
+def main():
+    """Run all tests"""
+    print("=" * 60)
+    print("Testing Day Close")
+    print("=" * 60)
+    
+    try:
+        test_z_report_totals()
+        test_closed_day_is_locked()
+        test_writes_after_closing_today()
+        test_daily_totals_use_indexes()
+        
+        print("\n" + "=" * 60)
+        print("✅ All Day Close Tests Passed!")
+        print("=" * 60)
+        return 0
+    except AssertionError as e:
+        print("\n" + "=" * 60)
+        print(f"❌ Test Failed: {str(e)}")
+        print("=" * 60)
+        return 1
+
+if __name__ == '__main__':
+    sys.exit(main())
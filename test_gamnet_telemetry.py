@@ -0,0 +1,233 @@
+#!/usr/bin/env python3
+"""
+Test Gamnet Device Telemetry
+Drives the ingestion service with a simulated fleet of device agents
+"""
+import json
+import os
+import socket
+import sqlite3
+import sys
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from database import Database
+from gamnet_telemetry import TelemetryIngestor, TIME_FORMAT
+
+FLEET_SIZE = 300
+
+def make_fleet_db(size=FLEET_SIZE):
+    """Create a throwaway database with `size` gaming devices"""
+    path = os.path.join(tempfile.mkdtemp(), 'telemetry.db')
+    test_db = Database(path)
+    test_db.conn.executemany(
+        "INSERT INTO gamnet_devices (device_number, device_type, hourly_rate) VALUES (?, ?, ?)",
+        [(f"PC-{n:03d}", 'PC', 6.0) for n in range(size)]
+    )
+    test_db.conn.commit()
+    return test_db
+
+def wait_for(condition, timeout=15.0):
+    """Poll condition() until it is truthy or timeout expires"""
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if condition():
+            return True
+        time.sleep(0.05)
+    return bool(condition())
+
+def count(test_db, query, params=()):
+    return test_db.fetchone(query, params)[0]
+
+def test_login_heartbeat_logout():
+    """Test that one agent's events become a charged session"""
+    print("\n=== Testing Single Agent Session ===\n")
+    test_db = make_fleet_db(1)
+    ingestor = TelemetryIngestor(database=test_db)
+    
+    ingestor.submit({'event': 'login', 'device': 'PC-000', 'phone': '09120000000', 'ts': '2024-01-01 10:00:00'})
+    ingestor.submit({'event': 'heartbeat', 'device': 'PC-000', 'ts': '2024-01-01 10:30:00'})
+    ingestor.submit({'event': 'logout', 'device': 'PC-000', 'ts': '2024-01-01 11:30:00'})
+    ingestor.submit({'event': 'logout', 'device': 'UNKNOWN'})
+    ingestor.submit({'event': 'shutdown', 'device': 'PC-000'})
+    ingestor.flush(now=datetime(2024, 1, 1, 11, 31))
+    
+    session = test_db.fetchone("SELECT * FROM gamnet_sessions")
+    print(f"1. Session: {session['start_time']} -> {session['end_time']}, "
+          f"{session['duration_minutes']} min, ${session['charge']:.2f}")
+    assert session['duration_minutes'] == 90
+    assert abs(session['charge'] - 9.0) < 1e-9
+    assert session['customer_id'] is not None
+    
+    device = test_db.fetchone("SELECT * FROM gamnet_devices")
+    assert device['is_available'] == 1 and device['last_heartbeat'] == '2024-01-01 11:30:00'
+    assert ingestor.stats['rejected'] == 2
+    print("   ✓ Session opened, charged and closed; bad events rejected")
+
+def test_timestamps_and_failed_flush():
+    """Test event timestamps normalised or rejected, and a refused batch kept"""
+    print("\n=== Testing Timestamps and Failed Flush ===\n")
+    test_db = make_fleet_db(2)
+    ingestor = TelemetryIngestor(database=test_db)
+    
+    epoch = datetime(2024, 1, 1, 10, 0).timestamp()
+    assert ingestor.submit({'event': 'login', 'device': 'PC-000', 'ts': epoch})
+    assert not ingestor.submit({'event': 'login', 'device': 'PC-001', 'ts': '2024-01-01T10:00:00Z'})
+    assert not ingestor.submit({'event': 'login', 'device': 'PC-001', 'ts': ['10:00']})
+    assert ingestor.submit({'event': 'login', 'device': 'PC-001', 'ts': '2024-01-01 10:05:00'})
+    assert ingestor.stats['rejected'] == 2
+    print(f"1. Unix seconds stored as {ingestor._buffer[0]['ts']}, ISO and list timestamps rejected")
+    
+    # The database refuses the write: nothing is lost, the batch is retried in order
+    test_db.execute(
+        """CREATE TEMP TRIGGER refuse_sessions BEFORE INSERT ON gamnet_sessions
+           BEGIN SELECT RAISE(ABORT, 'refused'); END"""
+    )
+    try:
+        ingestor.flush(now=datetime(2024, 1, 1, 10, 6))
+        raise AssertionError("Refused write should raise")
+    except sqlite3.IntegrityError:
+        pass
+    assert ingestor.pending() == 2
+    test_db.execute("DROP TRIGGER refuse_sessions")
+    assert ingestor.flush(now=datetime(2024, 1, 1, 10, 6)) == 2
+    starts = [row['start_time'] for row in test_db.fetchall("SELECT start_time FROM gamnet_sessions ORDER BY device_id")]
+    assert starts == ['2024-01-01 10:00:00', '2024-01-01 10:05:00']
+    print("2. Refused batch re-queued and written on the next flush")
+    
+    # A legacy row with an unreadable start time is skipped by the idle sweep
+    test_db.execute("UPDATE gamnet_sessions SET start_time = '2024-01-01T10:00:00Z' WHERE device_id = 1")
+    test_db.execute("UPDATE gamnet_devices SET last_heartbeat = '2024-01-01 10:05:00'")
+    assert ingestor.close_idle_sessions(now=datetime(2024, 1, 1, 11, 0)) == 1
+    print("   ✓ Timestamps validated; failed flush keeps its events")
+
+def test_idle_sessions_closed():
+    """Test that sessions without heartbeats are closed at the last heartbeat"""
+    print("\n=== Testing Idle Session Sweep ===\n")
+    test_db = make_fleet_db(2)
+    ingestor = TelemetryIngestor(database=test_db, idle_minutes=5)
+    
+    ingestor.submit({'event': 'login', 'device': 'PC-000', 'ts': '2024-01-01 10:00:00'})
+    ingestor.submit({'event': 'heartbeat', 'device': 'PC-000', 'ts': '2024-01-01 10:20:00'})
+    ingestor.submit({'event': 'login', 'device': 'PC-001', 'ts': '2024-01-01 10:00:00'})
+    ingestor.submit({'event': 'heartbeat', 'device': 'PC-001', 'ts': '2024-01-01 10:58:00'})
+    ingestor.flush(now=datetime(2024, 1, 1, 11, 0))
+    
+    sessions = test_db.fetchall("SELECT * FROM gamnet_sessions ORDER BY device_id")
+    print(f"1. PC-000 end: {sessions[0]['end_time']}, PC-001 end: {sessions[1]['end_time']}")
+    assert sessions[0]['end_time'] == '2024-01-01 10:20:00'
+    assert sessions[0]['duration_minutes'] == 20
+    assert sessions[1]['end_time'] is None
+    assert ingestor.stats['idle_closed'] == 1
+    
+    # PC-000's agent stays offline; a session started by hand afterwards is not swept
+    test_db.execute(
+        """INSERT INTO gamnet_sessions (device_id, customer_id, start_time)
+           SELECT id, NULL, '2024-01-01 10:30:00' FROM gamnet_devices WHERE device_number = 'PC-000'"""
+    )
+    assert ingestor.close_idle_sessions(now=datetime(2024, 1, 1, 12, 0)) == 1  # PC-001 went silent
+    manual = test_db.fetchone("SELECT * FROM gamnet_sessions WHERE start_time = '2024-01-01 10:30:00'")
+    print(f"2. Session started by hand after the last heartbeat: end {manual['end_time']}")
+    assert manual['end_time'] is None and manual['charge'] in (None, 0)
+    print("   ✓ Only the silent device's session was closed")
+
+def test_simulated_fleet():
+    """Test a fleet of agents over TCP (login/logout) and UDP (heartbeats)"""
+    print(f"\n=== Testing Simulated Fleet of {FLEET_SIZE} Agents ===\n")
+    test_db = make_fleet_db()
+    ingestor = TelemetryIngestor(database=test_db, idle_minutes=120, flush_interval=0.05)
+    host, port = ingestor.start('127.0.0.1', 0)
+    login_time = (datetime.now() - timedelta(hours=1)).strftime(TIME_FORMAT)
+    
+    def agent(n):
+        device = f"PC-{n:03d}"
+        with socket.create_connection((host, port)) as conn:
+            lines = [{'event': 'login', 'device': device, 'phone': f"0912{n:07d}", 'ts': login_time}]
+            if n % 2 == 0:
+                lines.append({'event': 'logout', 'device': device})
+            conn.sendall(''.join(json.dumps(line) + '\n' for line in lines).encode())
+    
+    try:
+        started = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=50) as pool:
+            list(pool.map(agent, range(FLEET_SIZE)))
+        
+        assert wait_for(lambda: count(test_db, "SELECT COUNT(*) FROM gamnet_sessions") == FLEET_SIZE)
+        assert wait_for(lambda: count(test_db,
+            "SELECT COUNT(*) FROM gamnet_sessions WHERE end_time IS NOT NULL") == FLEET_SIZE // 2)
+        elapsed = time.perf_counter() - started
+        print(f"1. {FLEET_SIZE} logins and {FLEET_SIZE // 2} logouts stored in {elapsed:.2f}s "
+              f"over {ingestor.stats['batches']} batch(es)")
+        
+        # Heartbeats are fire-and-forget; agents keep resending until seen
+        udp = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        missing = lambda: count(test_db, "SELECT COUNT(*) FROM gamnet_devices WHERE last_heartbeat IS NULL "
+                                         "OR last_heartbeat = ?", (login_time,))
+        for _ in range(20):
+            for n in range(FLEET_SIZE):
+                udp.sendto(json.dumps({'event': 'heartbeat', 'device': f"PC-{n:03d}"}).encode(), (host, port))
+            if wait_for(lambda: missing() == 0, timeout=1.0):
+                break
+        udp.close()
+        assert missing() == 0
+        print("2. ✓ UDP heartbeats recorded for every device")
+        
+        charged = count(test_db, "SELECT COUNT(*) FROM gamnet_sessions WHERE charge >= 6.0")
+        in_use = count(test_db, "SELECT COUNT(*) FROM gamnet_devices WHERE status = 'in_use'")
+        print(f"3. Charged sessions: {charged}, devices still in use: {in_use}")
+        assert charged == FLEET_SIZE // 2
+        assert in_use == FLEET_SIZE - FLEET_SIZE // 2
+    finally:
+        ingestor.stop()
+
+def test_batch_throughput():
+    """Test that a large burst of heartbeats is written in one batch quickly"""
+    print("\n=== Testing Batch Throughput ===\n")
+    test_db = make_fleet_db()
+    ingestor = TelemetryIngestor(database=test_db)
+    ts = datetime.now().strftime(TIME_FORMAT)
+    for n in range(FLEET_SIZE):
+        ingestor.submit({'event': 'login', 'device': f"PC-{n:03d}", 'ts': ts})
+    for _ in range(30):
+        for n in range(FLEET_SIZE):
+            ingestor.submit({'event': 'heartbeat', 'device': f"PC-{n:03d}", 'ts': ts})
+    
+    total = ingestor.pending()
+    started = time.perf_counter()
+    ingestor.flush()
+    elapsed = time.perf_counter() - started
+    rate = total / elapsed if elapsed else float('inf')
+    print(f"1. Flushed {total} events in {elapsed * 1000:.1f} ms ({rate:,.0f} events/s)")
+    assert count(test_db, "SELECT COUNT(*) FROM gamnet_sessions") == FLEET_SIZE
+    assert elapsed < 5.0
+    print("   ✓ Burst written in a single batch")
+
+def main():
+    """Run all tests"""
+    print("=" * 60)
+    print("Testing Gamnet Device Telemetry")
+    print("=" * 60)
+    
+    try:
+        test_login_heartbeat_logout()
+        test_timestamps_and_failed_flush()
+        test_idle_sessions_closed()
+        test_simulated_fleet()
+        test_batch_throughput()
+        
+        print("\n" + "=" * 60)
+        print("✅ All Gamnet Telemetry Tests Passed!")
+        print("=" * 60)
+        return 0
+    except AssertionError as e:
+        print("\n" + "=" * 60)
+        print(f"❌ Test Failed: {str(e)}")
+        print("=" * 60)
+        return 1
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,109 @@
+#!/usr/bin/env python3
+"""
+Test Global Search
+Tests the trigger-maintained search index over every searchable table
+"""
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from database import Database
+from global_search import GlobalSearch
+
+def make_shop():
+    """Create a throwaway database with one row in every searchable table"""
+    test_db = Database(os.path.join(tempfile.mkdtemp(), 'global_search.db'))
+    test_db.execute("INSERT INTO customers (name, phone) VALUES ('Sara Ahmadi', '09121234567')")
+    test_db.execute("INSERT INTO cafe_menu (name, category, price) VALUES ('Latte', 'Coffee', 4)")
+    test_db.execute("INSERT INTO salon_services (name, price) VALUES ('Haircut', 20)")
+    test_db.execute("INSERT INTO inventory_items (name, sku, category) VALUES ('Coffee Beans', 'CAF-001', 'Cafe')")
+    test_db.execute("INSERT INTO suppliers (name, contact_person, phone) VALUES ('Bean Traders', 'Karim', '0215550000')")
+    test_db.execute("INSERT INTO employees (name, role, section) VALUES ('مینا کریمی', 'Stylist', 'Salon')")
+    test_db.execute("INSERT INTO invoices (customer_id, final_amount, campaign_code) VALUES (1, 30, 'SUMMER')")
+    return test_db, GlobalSearch(test_db)
+
+def found(search, text, **kwargs):
+    return [(result['table'], result['ref_id']) for result in search.search(text, **kwargs)]
+
+def test_every_source_is_searchable():
+    """Test that each source table is found by its name, SKU, phone or number"""
+    print("\n=== Testing Search Sources ===\n")
+    test_db, search = make_shop()
+    cases = [
+        ('sara', [('customers', 1), ('invoices', 1)]),
+        ('0912', [('customers', 1), ('invoices', 1)]),
+        ('lat', [('cafe_menu', 1)]),
+        ('hair', [('salon_services', 1)]),
+        ('caf-001', [('inventory_items', 1)]),
+        ('karim', [('suppliers', 1)]),
+        ('کريمی', [('employees', 1)]),     # Arabic yeh typed
+        ('summer', [('invoices', 1)]),
+        ('1', [('invoices', 1)]),
+    ]
+    for text, expected in cases:
+        results = found(search, text)
+        print(f"   {text!r}: {results}")
+        assert results == expected, text
+    assert found(search, 'coffee') == [('inventory_items', 1), ('cafe_menu', 1)]
+    assert found(search, 'coffee', tables=['cafe_menu']) == [('cafe_menu', 1)]
+    print("   ✓ Every table found, title matches ranked first")
+
+def test_index_follows_changes():
+    """Test that inserts, updates and deletes reach the index through triggers"""
+    print("\n=== Testing Index Triggers ===\n")
+    test_db, search = make_shop()
+    test_db.execute("UPDATE cafe_menu SET name = 'Cappuccino' WHERE id = 1")
+    test_db.execute("DELETE FROM salon_services WHERE id = 1")
+    test_db.execute("INSERT INTO salon_services (name, price) VALUES ('Hair Color', 50)")
+    test_db.execute("UPDATE inventory_items SET quantity = 5 WHERE id = 1")
+    print(f"1. 'cap': {found(search, 'cap')}, 'hair': {found(search, 'hair')}")
+    assert found(search, 'latte') == [] and found(search, 'cap') == [('cafe_menu', 1)]
+    assert found(search, 'hair') == [('salon_services', 2)]
+    assert test_db.fetchone("SELECT COUNT(*) as c FROM global_search")['c'] == 7
+    print("   ✓ Index kept in step")
+
+def test_exact_number_first_and_speed():
+    """Test that an exact invoice number wins and broad prefixes stay fast"""
+    print("\n=== Testing Ranking and Speed ===\n")
+    test_db, search = make_shop()
+    with test_db.transaction() as cursor:
+        cursor.executemany("INSERT INTO customers (name, phone) VALUES (?, ?)",
+                           [(f"Guest {n}", f"0935{n:07d}") for n in range(20000)])
+        cursor.executemany("INSERT INTO invoices (customer_id, final_amount) VALUES (?, 10)",
+                           [(n % 20000 + 2,) for n in range(20000)])
+    # Invoice #123 and customer 'Guest 123' are the two whole-word matches
+    assert sorted(found(search, '123')[:2]) == [('customers', 125), ('invoices', 123)]
+    for text in ('g', 'guest', '1', '0935'):
+        started = time.perf_counter()
+        results = search.search(text)
+        elapsed = (time.perf_counter() - started) * 1000
+        print(f"   {text!r}: {len(results)} results in {elapsed:.1f} ms")
+        assert len(results) == 12 and elapsed < 150
+    print("   ✓ Exact match first, bounded ranking cost")
+
+def main():
+    """Run all tests"""
+    print("=" * 60)
+    print("Testing Global Search")
+    print("=" * 60)
+    
+    try:
+        test_every_source_is_searchable()
+        test_index_follows_changes()
+        test_exact_number_first_and_speed()
+        
+        print("\n" + "=" * 60)
+        print("✅ All Global Search Tests Passed!")
+        print("=" * 60)
+        return 0
+    except AssertionError as e:
+        print("\n" + "=" * 60)
+        print(f"❌ Test Failed: {str(e)}")
+        print("=" * 60)
+        return 1
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,135 @@
+#!/usr/bin/env python3
+"""
+Test Invoice Renderer
+Tests receipt content, QR payload and PDF rendering of invoices
+"""
+import os
+import subprocess
+import sys
+import tempfile
+from datetime import datetime
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from database import Database
+from checkout import CheckoutEngine
+from invoice_renderer import InvoiceRenderer, RenderError, PDF_SUPPORT, RENDER_WORKER, qr_payload, receipt_rows, shape
+
+def make_invoices(count=3):
+    """Create a throwaway database with `count` invoiced customers"""
+    test_db = Database(os.path.join(tempfile.mkdtemp(), 'renderer.db'))
+    test_db.initialize_defaults()
+    test_db.execute("INSERT INTO salon_services (name, price) VALUES ('Haircut', 30)")
+    checkout = CheckoutEngine(test_db)
+    for n in range(count):
+        test_db.execute("INSERT INTO customers (name, phone) VALUES (?, ?)", (f"سارا {n}", f"0912{n:04d}"))
+        test_db.execute(
+            "INSERT INTO salon_service_records (customer_id, service_id, service_date, price) VALUES (?, 1, ?, 30)",
+            (n + 1, '2024-06-01 10:00:00')
+        )
+        checkout.checkout(f"0912{n:04d}", extra_items=[{'section': 'Cafe', 'description': 'Tea', 'amount': 5}],
+                          when=datetime(2024, 6, 1 + n, 12, 0))
+    return test_db, InvoiceRenderer(test_db, os.path.join(os.path.dirname(test_db.path), 'pdf'))
+
+def test_receipt_content():
+    """Test that a receipt lists linked rows, hand-entered items and totals"""
+    print("\n=== Testing Receipt Content ===\n")
+    test_db, renderer = make_invoices(1)
+    invoice = renderer.load_invoices([1])[1]
+    rows = receipt_rows(invoice, renderer.template())
+    labels = [label for label, _, _ in rows]
+    print(f"1. Receipt rows: {labels}")
+    assert labels[0] == 'Kagan Collection'
+    assert 'Salon: Haircut' in labels and 'Other items' in labels
+    assert rows[-2][0] == 'Total' and rows[-2][1].startswith(f"{invoice['final_amount']:,.2f}")
+    
+    payload = qr_payload(invoice)
+    print(f"2. QR payload: {payload}")
+    assert payload.startswith('INV:1;AMT:') and payload.endswith('DATE:2024-06-01')
+    assert shape('Haircut') == 'Haircut'
+    print("   ✓ Receipt built from invoice links")
+
+def test_batch_loading():
+    """Test that a batch of invoices is loaded with a fixed number of queries"""
+    print("\n=== Testing Batch Loading ===\n")
+    test_db, renderer = make_invoices(20)
+    statements = []
+    test_db.conn.set_trace_callback(statements.append)
+    invoices = renderer.load_invoices(list(range(1, 21)))
+    test_db.conn.set_trace_callback(None)
+    # Besides the archive horizon lookups in settings
+    statements = [statement for statement in statements if 'FROM settings' not in statement]
+    print(f"1. Loaded {len(invoices)} invoices with {len(statements)} queries")
+    assert len(invoices) == 20 and len(statements) == 2
+    assert all(len(invoice['lines']) == 1 for invoice in invoices.values())
+    print("   ✓ Two queries regardless of batch size")
+
+def test_pdf_rendering():
+    """Test rendering one invoice and archiving a period in parallel"""
+    print("\n=== Testing PDF Rendering ===\n")
+    test_db, renderer = make_invoices(3)
+    if not PDF_SUPPORT:
+        try:
+            renderer.render(1)
+            raise AssertionError("Rendering without reportlab should fail")
+        except RenderError as e:
+            print(f"1. reportlab not installed: {e}")
+        return
+    
+    path = renderer.render(1)
+    print(f"1. Rendered {path}")
+    with open(path, 'rb') as f:
+        assert f.read(5) == b'%PDF-'
+    
+    paths = renderer.render_batch('2024-06-01', '2024-06-30', workers=2)
+    print(f"2. Archived {len(paths)} invoices")
+    assert len(paths) == 3 and all(os.path.exists(p) for p in paths)
+    print("   ✓ PDFs written")
+
+def test_render_workers():
+    """Test that batch workers render from plain dicts without importing the database"""
+    print("\n=== Testing Render Workers ===\n")
+    test_db, renderer = make_invoices(3)
+    probe = subprocess.run(
+        [sys.executable, '-c', "import sys, runpy; runpy.run_path(sys.argv[1]); print('database' in sys.modules)",
+         RENDER_WORKER],
+        capture_output=True, text=True
+    )
+    assert probe.stdout.strip() == 'False', probe.stdout + probe.stderr
+    print("1. receipt_pdf.py loads without the database module")
+    
+    jobs = [(invoice, renderer.template(), renderer.pdf_path(invoice))
+            for invoice in renderer.load_invoices([1, 2, 3]).values()]
+    paths = renderer._render_in_workers(jobs, 2)
+    print(f"2. Two workers returned {paths}")
+    assert len(paths) == 3
+    if PDF_SUPPORT:
+        assert sorted(paths) == sorted(job[2] for job in jobs) and all(os.path.exists(p) for p in paths)
+    else:
+        assert paths == [None, None, None]
+    print("   ✓ Workers isolated from the database")
+
+def main():
+    """Run all tests"""
+    print("=" * 60)
+    print("Testing Invoice Renderer")
+    print("=" * 60)
+    
+    try:
+        test_receipt_content()
+        test_batch_loading()
+        test_pdf_rendering()
+        test_render_workers()
+        
+        print("\n" + "=" * 60)
+        print("✅ All Invoice Renderer Tests Passed!")
+        print("=" * 60)
+        return 0
+    except AssertionError as e:
+        print("\n" + "=" * 60)
+        print(f"❌ Test Failed: {str(e)}")
+        print("=" * 60)
+        return 1
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,136 @@
+#!/usr/bin/env python3
+"""
+Test Invoice Search
+Tests filtered invoice search, keyset paging and index use
+"""
+import os
+import random
+import sys
+import tempfile
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from database import Database
+from invoice_search import InvoiceSearch
+
+def make_history(count=20000):
+    """Create a throwaway database with several years of random invoices"""
+    test_db = Database(os.path.join(tempfile.mkdtemp(), 'search.db'))
+    rng = random.Random(7)
+    test_db.conn.executemany(
+        "INSERT INTO customers (name, phone) VALUES (?, ?)",
+        [(f"Customer {n}", f"0912{n:07d}") for n in range(500)]
+    )
+    invoices = []
+    for _ in range(count):
+        invoices.append((
+            rng.randint(1, 500),
+            f"20{rng.randint(21, 24)}-{rng.randint(1, 12):02d}-{rng.randint(1, 28):02d} {rng.randint(9, 21):02d}:00:00",
+            round(rng.uniform(1, 200), 2),
+            rng.choice(['Cash', 'Card', 'Wallet', None]),
+            rng.choice([None] * 9 + ['SUMMER']),
+            1 if rng.random() < 0.9 else 0,
+        ))
+    test_db.conn.executemany(
+        """INSERT INTO invoices (customer_id, invoice_date, final_amount, payment_method, campaign_code, is_paid)
+           VALUES (?, ?, ?, ?, ?, ?)""",
+        invoices
+    )
+    test_db.conn.commit()
+    return test_db, InvoiceSearch(test_db)
+
+def all_pages(search, limit, **filters):
+    """Every row of a search, fetched page by page"""
+    rows, after = [], None
+    while True:
+        page = search.search(after=after, limit=limit, **filters)
+        rows += page['rows']
+        if not page['next']:
+            return rows
+        after = page['next']
+
+FILTER_CASES = [
+    {'phone': '09120000042'},
+    {'phone': '0912000004', 'is_paid': True},
+    {'start_date': '2023-01-01', 'end_date': '2023-01-31'},
+    {'min_amount': 150, 'max_amount': 152.5},
+    {'max_amount': 2},
+    {'min_amount': 20},
+    {'payment_method': 'Card', 'start_date': '2022-03-01', 'end_date': '2022-05-31'},
+    {'campaign_code': 'SUMMER', 'is_paid': False},
+]
+
+def test_filters_and_paging():
+    """Test that paged results match a brute-force filter exactly"""
+    print("\n=== Testing Filters and Paging ===\n")
+    test_db, search = make_history()
+    every = [dict(row) for row in test_db.fetchall(
+        """SELECT i.*, c.phone FROM invoices i LEFT JOIN customers c ON c.id = i.customer_id"""
+    )]
+    
+    def matches(row, f):
+        return ((not f.get('phone') or row['phone'].startswith(f['phone']))
+                and (not f.get('start_date') or row['invoice_date'] >= f['start_date'])
+                and (not f.get('end_date') or row['invoice_date'][:10] <= f['end_date'])
+                and (f.get('min_amount') is None or row['final_amount'] >= f['min_amount'])
+                and (f.get('max_amount') is None or row['final_amount'] <= f['max_amount'])
+                and (not f.get('payment_method') or row['payment_method'] == f['payment_method'])
+                and (not f.get('campaign_code') or row['campaign_code'] == f['campaign_code'])
+                and (f.get('is_paid') is None or row['is_paid'] == int(f['is_paid'])))
+    
+    for n, filters in enumerate(FILTER_CASES, 1):
+        expected = sorted((r for r in every if matches(r, filters)),
+                          key=lambda r: (r['invoice_date'], r['id']), reverse=True)
+        found = all_pages(search, 37, **filters)
+        print(f"{n}. {filters}: {len(found)} invoices")
+        assert [r['id'] for r in found] == [r['id'] for r in expected], filters
+        assert search.totals(**filters)['count'] == len(expected)
+    print("   ✓ Every page matches, no duplicates or gaps")
+
+def test_search_plans():
+    """Test that every search seeks on a filter and sorts only a narrow amount range"""
+    print("\n=== Testing Search Query Plans ===\n")
+    test_db, search = make_history(2000)
+    cases = [{}] + [f for f in FILTER_CASES if not f.get('phone', '').endswith('04')]
+    for filters in cases:
+        for after in (None, ('2023-06-01 12:00:00', 500)):
+            sql, params = search.query(after, **filters)
+            plan = [row['detail'] for row in test_db.fetchall("EXPLAIN QUERY PLAN " + sql, params)]
+            driver = plan[0]
+            if after is None:
+                print(f"   {filters}: {driver}")
+            # Walking the date index past rows a filter rejects is unbounded; only an unfiltered page may
+            unbounded = driver.startswith('SCAN i') or driver.endswith('idx_invoices_date (invoice_date<?)')
+            assert not (filters and unbounded), f"Unbounded walk for {filters}: {plan}"
+            assert not driver.startswith('SCAN i') or 'USING INDEX idx_invoices_date' in driver, plan
+            if any('TEMP B-TREE' in d for d in plan):
+                assert 'idx_invoices_amount_date' in driver, f"Sort for {filters}: {plan}"
+        where, params, _ = search._conditions(**filters)
+        if where:
+            plan = [row['detail'] for row in test_db.fetchall(
+                f"EXPLAIN QUERY PLAN SELECT COUNT(*) FROM invoices i WHERE {' AND '.join(where)}", params)]
+            assert not plan[0].startswith('SCAN'), f"Totals scan for {filters}: {plan}"
+    print("   ✓ Every filter seeks on an index")
+
+def main():
+    """Run all tests"""
+    print("=" * 60)
+    print("Testing Invoice Search")
+    print("=" * 60)
+    
+    try:
+        test_filters_and_paging()
+        test_search_plans()
+        
+        print("\n" + "=" * 60)
+        print("✅ All Invoice Search Tests Passed!")
+        print("=" * 60)
+        return 0
+    except AssertionError as e:
+        print("\n" + "=" * 60)
+        print(f"❌ Test Failed: {str(e)}")
+        print("=" * 60)
+        return 1
+
+if __name__ == '__main__':
+    sys.exit(main())
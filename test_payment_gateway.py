@@ -0,0 +1,149 @@
+#!/usr/bin/env python3
+"""
+Test Payment Gateway
+Tests card authorisation, timeouts, idempotency and reconciliation
+against the local stand-in gateway
+"""
+import os
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from database import Database
+from payments import PaymentError
+from payment_gateway import CardPayments, PaymentGateway, LocalGatewayServer
+
+def make_shop(delay=0.0, timeout=2.0, decline_over=None, invoices=(40.0,)):
+    """Create a throwaway database with unpaid invoices and a running stand-in gateway"""
+    test_db = Database(os.path.join(tempfile.mkdtemp(), 'gateway.db'))
+    test_db.initialize_defaults()
+    test_db.execute("INSERT INTO customers (name, phone) VALUES ('Sara', '0912')")
+    for amount in invoices:
+        test_db.execute("INSERT INTO invoices (customer_id, total_amount, final_amount) VALUES (1, ?, ?)",
+                        (amount, amount))
+    server = LocalGatewayServer(delay=delay, decline_over=decline_over)
+    payments = CardPayments(test_db, PaymentGateway(server.start(), 'local', timeout))
+    return test_db, server, payments
+
+def test_card_payment_approved_and_declined():
+    """Test that an approval settles the invoice and a decline leaves it unpaid"""
+    print("\n=== Testing Card Approval ===\n")
+    test_db, server, payments = make_shop(decline_over=100, invoices=(40.0, 250.0))
+    try:
+        approved = payments.pay_invoice(1).result(timeout=5)
+        declined = payments.pay_invoice(2).result(timeout=5)
+        print(f"1. Invoice 1: {approved['status']} {approved['transaction_id']}, "
+              f"invoice 2: {declined['status']} ({declined['notes']})")
+        assert approved['status'] == 'approved' and declined['status'] == 'declined'
+        
+        invoice = test_db.fetchone("SELECT is_paid, payment_method FROM invoices WHERE id = 1")
+        assert invoice['is_paid'] == 1 and invoice['payment_method'] == 'Card'
+        assert test_db.fetchone("SELECT is_paid FROM invoices WHERE id = 2")['is_paid'] == 0
+        assert test_db.fetchone("SELECT loyalty_points FROM customers WHERE id = 1")['loyalty_points'] == 40
+        
+        try:
+            payments.pay_invoice(1)
+            raise AssertionError("Paying a paid invoice should fail")
+        except PaymentError as e:
+            print(f"2. Second payment refused: {e}")
+        print("   ✓ Gateway answers recorded")
+    finally:
+        payments.stop()
+        server.stop()
+
+def test_timeout_then_reconcile():
+    """Test that a slow gateway leaves a pending row that the reconciler settles once"""
+    print("\n=== Testing Timeout and Reconciliation ===\n")
+    test_db, server, payments = make_shop(delay=1.0, timeout=0.2)
+    try:
+        started = time.perf_counter()
+        future = payments.pay_invoice(1)
+        returned = time.perf_counter() - started
+        pending = future.result(timeout=5)
+        print(f"1. pay_invoice returned in {returned * 1000:.0f} ms; status after timeout: {pending['status']}")
+        assert returned < 0.2 and pending['status'] == 'pending'
+        assert test_db.fetchone("SELECT is_paid FROM invoices WHERE id = 1")['is_paid'] == 0
+        
+        retry = payments.pay_invoice(1).result(timeout=5)
+        assert retry['idempotency_key'] == pending['idempotency_key']
+        assert test_db.fetchone("SELECT COUNT(*) as c FROM payment_transactions")['c'] == 1
+        
+        result = payments.reconcile_pending()
+        print(f"2. Reconciler: {result}")
+        assert result == {'checked': 1, 'resolved': 1, 'expired': 0}
+        assert test_db.fetchone("SELECT is_paid FROM invoices WHERE id = 1")['is_paid'] == 1
+        assert len(server.lookup([pending['idempotency_key']])) == 1
+        assert payments.reconcile_pending()['checked'] == 0
+        print("   ✓ Charged once, settled by the reconciler")
+    finally:
+        payments.stop()
+        server.stop()
+
+def test_unknown_pending_expires():
+    """Test that transactions the gateway never saw are failed after the expiry"""
+    print("\n=== Testing Pending Expiry ===\n")
+    test_db, server, payments = make_shop(invoices=(10.0, 20.0))
+    try:
+        old = (datetime.now() - timedelta(hours=1)).strftime('%Y-%m-%d %H:%M:%S')
+        new = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+        for invoice_id, key, when in ((1, 'lost-old', old), (2, 'lost-new', new)):
+            test_db.execute(
+                """INSERT INTO payment_transactions (invoice_id, gateway, amount, status, transaction_date, idempotency_key)
+                   VALUES (?, 'local', 10, 'pending', ?, ?)""",
+                (invoice_id, when, key)
+            )
+        result = payments.reconcile_pending()
+        statuses = {row['idempotency_key']: row['status']
+                    for row in test_db.fetchall("SELECT * FROM payment_transactions")}
+        print(f"1. Reconciler: {result}, statuses {statuses}")
+        assert statuses == {'lost-old': 'failed', 'lost-new': 'pending'}
+        print("   ✓ Only stale unknown transactions failed")
+    finally:
+        payments.stop()
+        server.stop()
+
+def test_parallel_payments():
+    """Test many card payments in flight at once"""
+    print("\n=== Testing Parallel Card Payments ===\n")
+    test_db, server, payments = make_shop(delay=0.1, invoices=[5.0] * 20)
+    try:
+        started = time.perf_counter()
+        futures = [payments.pay_invoice(invoice_id) for invoice_id in range(1, 21)]
+        results = [future.result(timeout=10) for future in futures]
+        elapsed = time.perf_counter() - started
+        print(f"1. 20 payments with a 100 ms gateway in {elapsed:.2f}s")
+        assert all(r['status'] == 'approved' for r in results)
+        assert test_db.fetchone("SELECT COUNT(*) as c FROM invoices WHERE is_paid = 1")['c'] == 20
+        assert elapsed < 2
+        print("   ✓ Authorisations overlap")
+    finally:
+        payments.stop()
+        server.stop()
+
+def main():
+    """Run all tests"""
+    print("=" * 60)
+    print("Testing Payment Gateway")
+    print("=" * 60)
+    
+    try:
+        test_card_payment_approved_and_declined()
+        test_timeout_then_reconcile()
+        test_unknown_pending_expires()
+        test_parallel_payments()
+        
+        print("\n" + "=" * 60)
+        print("✅ All Payment Gateway Tests Passed!")
+        print("=" * 60)
+        return 0
+    except AssertionError as e:
+        print("\n" + "=" * 60)
+        print(f"❌ Test Failed: {str(e)}")
+        print("=" * 60)
+        return 1
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,165 @@
+#!/usr/bin/env python3
+"""
+Test Payments
+Tests ledger-based invoice payment, wallet and loyalty balances
+"""
+import os
+import random
+import sys
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from database import Database
+from payments import PaymentLedger, PaymentError
+
+def make_ledger():
+    """Create a throwaway database with one customer"""
+    path = os.path.join(tempfile.mkdtemp(), 'payments.db')
+    test_db = Database(path)
+    test_db.initialize_defaults()
+    test_db.execute("INSERT INTO customers (name, phone) VALUES ('Sara', '0912')")
+    return test_db, PaymentLedger(test_db)
+
+def add_invoice(test_db, amount, customer_id=1):
+    test_db.execute("INSERT INTO invoices (customer_id, total_amount, final_amount) VALUES (?, ?, ?)",
+                    (customer_id, amount, amount))
+    return test_db.fetchone("SELECT MAX(id) as id FROM invoices")['id']
+
+def test_wallet_payment():
+    """Test paying from the wallet, with balance checks and loyalty points"""
+    print("\n=== Testing Wallet Payment ===\n")
+    test_db, ledger = make_ledger()
+    ledger.adjust_wallet(1, 50, 'Top up')
+    
+    big = add_invoice(test_db, 80)
+    try:
+        ledger.pay_invoice(big, 'Wallet')
+        raise AssertionError("Payment above wallet balance should fail")
+    except PaymentError as e:
+        print(f"1. Refused: {e}")
+    invoice = test_db.fetchone("SELECT is_paid FROM invoices WHERE id = ?", (big,))
+    assert invoice['is_paid'] == 0, "Refused payment must leave the invoice unpaid"
+    
+    small = add_invoice(test_db, 45.5)
+    result = ledger.pay_invoice(small, 'Wallet', when=datetime(2024, 1, 2, 10, 0))
+    customer = test_db.fetchone("SELECT * FROM customers WHERE id = 1")
+    print(f"2. Paid ${result['amount']}: wallet {customer['wallet_balance']}, points {customer['loyalty_points']}")
+    assert customer['wallet_balance'] == 4.5 and customer['loyalty_points'] == 45
+    assert customer['total_spent'] == 45.5 and customer['last_visit_date'] == '2024-01-02'
+    
+    try:
+        ledger.pay_invoice(small, 'Cash')
+        raise AssertionError("Paying twice should fail")
+    except PaymentError as e:
+        print(f"3. Second payment refused: {e}")
+    
+    wallet = ledger.wallet_history(1)
+    points = ledger.points_history(1)
+    assert [w['amount'] for w in wallet] == [-45.5, 50]
+    assert points[0]['points'] == 45 and points[0]['invoice_id'] == small
+    assert ledger.reconcile() == []
+    print("   ✓ Ledger rows match balances")
+
+def test_concurrent_debits_never_overdraw():
+    """Test that concurrent wallet payments cannot overdraw the balance"""
+    print("\n=== Testing Concurrent Wallet Debits ===\n")
+    test_db, ledger = make_ledger()
+    ledger.adjust_wallet(1, 100)
+    invoices = [add_invoice(test_db, 7) for _ in range(40)]
+    
+    def pay(invoice_id):
+        try:
+            ledger.pay_invoice(invoice_id, 'Wallet')
+            return True
+        except PaymentError:
+            return False
+    
+    with ThreadPoolExecutor(max_workers=8) as pool:
+        paid = sum(pool.map(pay, invoices))
+    balance = test_db.fetchone("SELECT wallet_balance FROM customers WHERE id = 1")['wallet_balance']
+    print(f"1. Paid {paid} of 40 invoices, wallet left {balance}")
+    assert paid == 14 and balance == 2
+    assert ledger.reconcile() == []
+    
+    try:
+        ledger.adjust_points(1, -10000)
+        raise AssertionError("Redeeming more points than held should fail")
+    except PaymentError:
+        pass
+    print("   ✓ No overdraft")
+
+def test_opening_balances_migrated():
+    """Test that balances set before the ledger existed become opening rows"""
+    print("\n=== Testing Opening Balance Migration ===\n")
+    test_db, ledger = make_ledger()
+    test_db.execute("DROP TABLE wallet_transactions")
+    test_db.execute("UPDATE customers SET wallet_balance = 12.5, loyalty_points = 30 WHERE id = 1")
+    
+    reopened = Database(test_db.path)
+    rows = reopened.fetchall("SELECT transaction_type, amount FROM wallet_transactions")
+    print(f"1. Opening wallet rows: {[tuple(r) for r in rows]}")
+    assert [tuple(r) for r in rows] == [('opening', 12.5)]
+    assert PaymentLedger(reopened).reconcile() == []
+    print("   ✓ Existing balances carried into the ledger")
+
+def test_bulk_reconciliation():
+    """Test reconciling many customers and repairing drift"""
+    print("\n=== Testing Bulk Reconciliation ===\n")
+    test_db, ledger = make_ledger()
+    rng = random.Random(3)
+    customers = 5000
+    test_db.conn.executemany(
+        "INSERT INTO customers (name, phone, wallet_balance, loyalty_points) VALUES (?, ?, 0, 0)",
+        [(f"C{n}", f"0913{n:07d}") for n in range(customers)]
+    )
+    wallet_rows = [(rng.randint(2, customers + 1), rng.choice([10.0, 20.0, -5.0]), 'topup', '2024-01-01 00:00:00')
+                   for _ in range(50000)]
+    test_db.conn.executemany(
+        "INSERT INTO wallet_transactions (customer_id, amount, transaction_type, transaction_date) VALUES (?, ?, ?, ?)",
+        wallet_rows
+    )
+    test_db.conn.execute(
+        """UPDATE customers SET wallet_balance = COALESCE(
+               (SELECT SUM(amount) FROM wallet_transactions w WHERE w.customer_id = customers.id), 0)"""
+    )
+    test_db.conn.execute("UPDATE customers SET wallet_balance = wallet_balance + 1 WHERE id % 500 = 0")
+    test_db.conn.execute("UPDATE customers SET loyalty_points = 7 WHERE id % 1000 = 1")
+    test_db.conn.commit()
+    
+    started = time.perf_counter()
+    mismatches = ledger.reconcile(repair=True)
+    elapsed = time.perf_counter() - started
+    print(f"1. {customers} customers, {len(wallet_rows)} ledger rows: "
+          f"{len(mismatches)} mismatches in {elapsed * 1000:.0f} ms")
+    assert len(mismatches) == 16
+    assert ledger.reconcile() == []
+    print("   ✓ Drift found and repaired")
+
+def main():
+    """Run all tests"""
+    print("=" * 60)
+    print("Testing Payments")
+    print("=" * 60)
+    
+    try:
+        test_wallet_payment()
+        test_concurrent_debits_never_overdraw()
+        test_opening_balances_migrated()
+        test_bulk_reconciliation()
+        
+        print("\n" + "=" * 60)
+        print("✅ All Payment Tests Passed!")
+        print("=" * 60)
+        return 0
+    except AssertionError as e:
+        print("\n" + "=" * 60)
+        print(f"❌ Test Failed: {str(e)}")
+        print("=" * 60)
+        return 1
+
+if __name__ == '__main__':
+    sys.exit(main())
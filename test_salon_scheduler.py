@@ -0,0 +1,215 @@
+#!/usr/bin/env python3
+"""
+Test Salon Scheduling
+Tests overlap checks, earliest-slot search and walk-in estimates
+"""
+import os
+import sys
+import tempfile
+import time
+from datetime import datetime
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from database import Database
+from salon_scheduler import SalonScheduler, StylistSchedule, SchedulingError
+from services import AppointmentService, AppointmentError
+
+DAY = '2030-05-01'
+
+def make_salon_db():
+    """Create a throwaway database with two stylists and two services"""
+    test_db = Database(os.path.join(tempfile.mkdtemp(), 'salon.db'))
+    test_db.initialize_defaults()
+    test_db.execute("UPDATE settings SET value = '09:00-18:00' WHERE key = 'business_hours'")
+    for name in ('Ali', 'Reza'):
+        test_db.execute(
+            "INSERT INTO employees (name, role, section) VALUES (?, 'Stylist', 'Salon')", (name,)
+        )
+    test_db.execute("INSERT INTO salon_services (name, price, duration_minutes) VALUES ('Haircut', 25, 45)")
+    test_db.execute("INSERT INTO salon_services (name, price, duration_minutes) VALUES ('Full Service', 80, 120)")
+    test_db.execute("INSERT INTO customers (name, phone) VALUES ('Test', '0912')")
+    return test_db
+
+def test_interval_schedule():
+    """Test the per-stylist interval structure"""
+    print("\n=== Testing Interval Schedule ===\n")
+    schedule = StylistSchedule()
+    schedule.add(600, 645)
+    schedule.add(700, 760)
+    schedule.add(630, 660)  # overlaps the first one (legacy data)
+    print(f"1. Intervals: {list(zip(schedule.starts, schedule.ends))}")
+    assert list(zip(schedule.starts, schedule.ends)) == [(600, 660), (700, 760)]
+    
+    assert schedule.overlaps(650, 670)
+    assert not schedule.overlaps(660, 700)
+    assert schedule.first_gap(600, 40, 1080) == 660
+    assert schedule.first_gap(600, 45, 1080) == 760
+    assert schedule.first_gap(1050, 45, 1080) is None
+    print("   ✓ Overlaps and gaps found correctly")
+
+def test_booking_rejects_overlap():
+    """Test that overlapping bookings for one stylist are rejected"""
+    print("\n=== Testing Overlapping Bookings ===\n")
+    test_db = make_salon_db()
+    scheduler = SalonScheduler(test_db)
+    
+    first = scheduler.book(1, 1, 1, DAY, '10:00')
+    print(f"1. First booking: {first}")
+    assert first['success']
+    
+    clash = scheduler.book(1, 1, 2, DAY, '10:30')
+    print(f"2. Overlapping booking: {clash['message']}")
+    assert not clash['success']
+    assert clash['suggestion']['time'] == '10:45'
+    
+    other = scheduler.book(1, 2, 2, DAY, '10:30')
+    assert other['success'], "Another stylist should be free"
+    
+    # A date without zero padding is the same day
+    unpadded = scheduler.book(1, 1, 1, '2030-5-1', '10:15')
+    print(f"3. Unpadded date: {unpadded['message']}")
+    assert not unpadded['success']
+    moved = scheduler.book(1, 1, 1, '2030-5-2', '10:15')
+    assert test_db.fetchone("SELECT appointment_date FROM salon_appointments WHERE id = ?",
+                            (moved['appointment_id'],))['appointment_date'] == '2030-05-02'
+    assert scheduler.earliest_slot(1, '2030-05-02', '10:00', stylist_id=1, days=1,
+                                   now=datetime(2030, 5, 1))['time'] == '11:00'
+    
+    late = scheduler.book(1, 1, 2, DAY, '17:00')
+    assert not late['success'], "Service must finish before closing"
+    
+    row = test_db.fetchone("SELECT * FROM salon_appointments WHERE id = ?", (first['appointment_id'],))
+    assert row['duration_minutes'] == 45 and row['service_type'] == 'Haircut'
+    print("   ✓ Overlaps rejected, durations stored")
+
+def test_bookings_made_elsewhere():
+    """Test that appointments written by other code or instances are seen by a cached scheduler"""
+    print("\n=== Testing Bookings Made Elsewhere ===\n")
+    test_db = make_salon_db()
+    scheduler = SalonScheduler(test_db)
+    assert scheduler.is_available(1, DAY, '10:00', 45)
+    
+    # As terminal sync would: a direct insert on the same database
+    test_db.execute(
+        """INSERT INTO salon_appointments (customer_id, stylist_id, appointment_date, appointment_time,
+                                           service_type, service_id, duration_minutes)
+           VALUES (1, 1, ?, '10:00', 'Haircut', 1, 45)""", (DAY,)
+    )
+    clash = scheduler.book(1, 1, 1, DAY, '10:15')
+    print(f"1. After a direct insert: {clash['message']}")
+    assert not clash['success']
+    
+    # A second scheduler, as the API server holds
+    other = SalonScheduler(test_db)
+    assert other.book(1, 1, 1, DAY, '11:00')['success']
+    assert not scheduler.book(1, 1, 1, DAY, '11:30')['success']
+    
+    # Cancelling frees the slot again
+    test_db.execute("UPDATE salon_appointments SET appointment_date = '2030-05-02' WHERE appointment_time = '10:00'")
+    assert scheduler.book(1, 1, 1, DAY, '10:00')['success']
+    print("   ✓ Changes from elsewhere seen")
+
+def test_bad_search_input():
+    """Test that unreadable dates and times raise the scheduler's error"""
+    print("\n=== Testing Bad Search Input ===\n")
+    test_db = make_salon_db()
+    scheduler = SalonScheduler(test_db)
+    for date, after in (('2030/05/01', None), ('tomorrow', None), (DAY, '25:99'), (DAY, 'noon')):
+        try:
+            scheduler.earliest_slot(1, date, after)
+            raise AssertionError(f"{date} {after} accepted")
+        except SchedulingError as e:
+            print(f"1. {date} {after}: {e}")
+    try:
+        AppointmentService(test_db).earliest_slot(1, '01-05-2030')
+        raise AssertionError("Service accepted a bad date")
+    except AppointmentError:
+        pass
+    print("   ✓ Bad input refused")
+
+def test_earliest_slot_and_walk_in():
+    """Test earliest-slot search for any stylist and a given stylist"""
+    print("\n=== Testing Earliest Slot Search ===\n")
+    test_db = make_salon_db()
+    # Legacy free-text booking without service_id is still honoured
+    test_db.execute(
+        """INSERT INTO salon_appointments (customer_id, stylist_id, appointment_date, appointment_time, service_type)
+           VALUES (1, 2, ?, '09:00', 'Full Service')""", (DAY,)
+    )
+    scheduler = SalonScheduler(test_db)
+    scheduler.book(1, 1, 1, DAY, '09:00')
+    
+    now = datetime(2030, 5, 1, 8, 0)
+    any_slot = scheduler.earliest_slot(1, DAY, now=now)
+    print(f"1. Earliest haircut, any stylist: {any_slot}")
+    assert any_slot['stylist_id'] == 1 and any_slot['time'] == '09:45'
+    
+    given = scheduler.earliest_slot(1, DAY, stylist_id=2, now=now)
+    print(f"2. Earliest haircut with stylist 2: {given}")
+    assert given['time'] == '11:00'
+    
+    wait, slot = scheduler.walk_in_wait(1, now=datetime(2030, 5, 1, 9, 12))
+    print(f"3. Walk-in at 09:12 waits {wait} min for {slot['time']}")
+    assert wait == 33
+    
+    assert scheduler.walk_in_wait(2, now=datetime(2030, 5, 1, 17, 0)) is None
+    print("   ✓ Slots and waits computed from the same intervals")
+
+def test_search_scales():
+    """Test earliest-slot search over a busy day with many stylists"""
+    print("\n=== Testing Search on a Busy Day ===\n")
+    test_db = make_salon_db()
+    test_db.conn.executemany(
+        "INSERT INTO employees (name, role, section) VALUES (?, 'Stylist', 'Salon')",
+        [(f"Stylist {n}",) for n in range(50)]
+    )
+    rows = []
+    for stylist in range(1, 53):
+        for start in range(9 * 60, 17 * 60, 45):
+            rows.append((1, stylist, DAY, f"{start // 60:02d}:{start % 60:02d}", 'Haircut', 1, 45))
+    test_db.conn.executemany(
+        """INSERT INTO salon_appointments
+           (customer_id, stylist_id, appointment_date, appointment_time, service_type, service_id, duration_minutes)
+           VALUES (?, ?, ?, ?, ?, ?, ?)""", rows
+    )
+    test_db.conn.commit()
+    
+    scheduler = SalonScheduler(test_db)
+    started = time.perf_counter()
+    slot = scheduler.earliest_slot(1, DAY, now=datetime(2030, 5, 1, 8, 0))
+    cold = time.perf_counter() - started
+    started = time.perf_counter()
+    for _ in range(100):
+        scheduler.earliest_slot(1, DAY, now=datetime(2030, 5, 1, 8, 0))
+    warm = (time.perf_counter() - started) / 100
+    print(f"1. {len(rows)} appointments, slot {slot}, cold {cold * 1000:.1f} ms, warm {warm * 1000:.2f} ms")
+    assert slot['time'] == '17:15' and slot['stylist_id'] == 1
+    print("   ✓ Busy day searched")
+
+def main():
+    """Run all tests"""
+    print("=" * 60)
+    print("Testing Salon Scheduling")
+    print("=" * 60)
+    
+    try:
+        test_interval_schedule()
+        test_booking_rejects_overlap()
+        test_bookings_made_elsewhere()
+        test_bad_search_input()
+        test_earliest_slot_and_walk_in()
+        test_search_scales()
+        
+        print("\n" + "=" * 60)
+        print("✅ All Salon Scheduling Tests Passed!")
+        print("=" * 60)
+        return 0
+    except AssertionError as e:
+        print("\n" + "=" * 60)
+        print(f"❌ Test Failed: {str(e)}")
+        print("=" * 60)
+        return 1
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,220 @@
+#!/usr/bin/env python3
+"""
+Test Services
+Tests the headless service layer end to end, without any widgets
+"""
+import os
+import sys
+import tempfile
+from datetime import datetime, timedelta
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from database import Database
+from services import (CustomerService, SessionService, SessionError, OrderService, OrderError,
+                      AppointmentService, InvoiceService, PaymentService, InventoryService, InventoryError,
+                      ReportService, MessagingService, MessagingError)
+
+DAY = '2030-05-01'
+OPEN = datetime(2030, 5, 1, 10, 0, 0)
+
+def make_shop():
+    """Create a throwaway database with a stylist, a device and a menu item"""
+    test_db = Database(os.path.join(tempfile.mkdtemp(), 'services.db'))
+    test_db.initialize_defaults()
+    test_db.execute("UPDATE settings SET value = '09:00-18:00' WHERE key = 'business_hours'")
+    test_db.execute("INSERT INTO employees (name, role, section) VALUES ('Ali', 'Stylist', 'Salon')")
+    return test_db
+
+class FakeSender:
+    """Stands in for sms_service; fails numbers ending in 9"""
+    def __init__(self, configured=True):
+        self.configured = configured
+        self.sent = []
+    
+    def is_configured(self):
+        return self.configured
+    
+    def send_sms(self, phone, message, sms_type='manual', customer_id=None):
+        self.sent.append((phone, sms_type))
+        return {'success': not phone.endswith('9')}
+    
+    def send_birthday_sms(self, customer_id):
+        self.sent.append((customer_id, 'birthday'))
+        return {'success': True}
+    
+    def send_inactive_customer_sms(self, customer_id):
+        self.sent.append((customer_id, 'reactivation'))
+        return {'success': True}
+
+def test_customers_and_sessions():
+    """Test registration and a gamnet session charged by the hourly rate"""
+    print("\n=== Testing Customers and Sessions ===\n")
+    test_db = make_shop()
+    customers = CustomerService(test_db)
+    sessions = SessionService(test_db)
+    
+    customer_id = customers.register('Sara', '09121234567', '1995-05-01')
+    assert customers.register('Sara Ahmadi', '09121234567', '1995-05-01') == customer_id
+    assert customers.find('09121234567')['name'] == 'Sara Ahmadi'
+    assert customers.adjust_wallet('09121234567', 50)['wallet_balance'] == 50
+    
+    device_id = sessions.add_device('PC-1', 'PC', 10)
+    sessions.start(device_id, '09121234567', when=OPEN)
+    try:
+        sessions.start(device_id, '09350000000', when=OPEN)
+        assert False, "second session started on a busy device"
+    except SessionError as e:
+        print(f"   {e}")
+    assert [row['customer_name'] for row in sessions.active()] == ['Sara Ahmadi']
+    
+    ended = sessions.end(device_id, when=OPEN + timedelta(minutes=90))
+    print(f"1. Ended session: {ended}")
+    assert ended['duration_minutes'] == 90 and ended['charge'] == 15
+    assert sessions.end(device_id) is None
+    assert sessions.devices(available_only=True)[0]['id'] == device_id
+    
+    try:
+        sessions.reserve(device_id, '09121234567', DAY, 'noon', 60)
+        assert False, "reservation with a bad time accepted"
+    except SessionError:
+        pass
+    sessions.reserve(device_id, '09121234567', DAY, '18:00', 60)
+    assert len(sessions.pending_reservations()) == 1
+    print("   ✓ Customers and sessions")
+
+def test_orders_and_appointments():
+    """Test cafe orders and salon bookings with any free stylist"""
+    print("\n=== Testing Orders and Appointments ===\n")
+    test_db = make_shop()
+    orders = OrderService(test_db)
+    appointments = AppointmentService(test_db)
+    
+    item_id = orders.add_menu_item('Latte', 'Coffee', 4)
+    order = orders.place('09121234567', [orders.line(item_id, 2)], when=OPEN)
+    assert order['total'] == 8
+    for bad in (lambda: orders.line(item_id, 0), lambda: orders.line(999, 1), lambda: orders.place('0912', [])):
+        try:
+            bad()
+            assert False, "bad order accepted"
+        except OrderError:
+            pass
+    
+    service_id = appointments.add_service('Haircut', 25, 45, 10)
+    first = appointments.book('09121234567', service_id, DAY, '10:00')
+    second = appointments.book('09350000000', service_id, DAY, '10:15')
+    print(f"1. Bookings: {first}, {second}")
+    assert first['success'] and first['stylist_id'] == 1
+    assert not second['success']
+    assert appointments.earliest_slot(service_id, DAY)['date'] >= DAY
+    
+    record = appointments.record_service('09121234567', 1, service_id, 5, when=OPEN)
+    assert record['success'] and record['commission'] == 2.5
+    assert not appointments.record_service('', 1, service_id)['success']
+    print("   ✓ Orders and appointments")
+
+def test_invoice_payment_and_reports():
+    """Test checkout, payment, reports and day close through the services"""
+    print("\n=== Testing Invoices, Payments and Reports ===\n")
+    test_db = make_shop()
+    sessions = SessionService(test_db)
+    orders = OrderService(test_db)
+    appointments = AppointmentService(test_db)
+    invoices = InvoiceService(test_db)
+    payments = PaymentService(test_db)
+    reports = ReportService(test_db)
+    
+    device_id = sessions.add_device('PC-1', 'PC', 12)
+    sessions.start(device_id, '09121234567', when=OPEN)
+    sessions.end(device_id, when=OPEN + timedelta(minutes=30))
+    orders.place('09121234567', [orders.line(orders.add_menu_item('Tea', 'Tea', 3), 1)], when=OPEN)
+    appointments.record_service('09121234567', 1, appointments.add_service('Haircut', 25, 45, 10), when=OPEN)
+    
+    lines = invoices.unbilled('09121234567')
+    assert sorted(line['section'] for line in lines) == ['Cafe', 'Gamnet', 'Salon']
+    invoice = invoices.create('09121234567', when=OPEN + timedelta(hours=1))
+    assert invoice['subtotal'] == 6 + 3 + 25 and invoices.unbilled('09121234567') == []
+    
+    assert not payments.uses_gateway('Card')
+    paid = payments.pay(invoice['invoice_id'], 'Cash', when=OPEN + timedelta(hours=1))
+    print(f"1. Invoice #{invoice['invoice_id']} paid: {paid}")
+    assert paid['amount'] == invoice['final'] and invoices.get(invoice['invoice_id'])['is_paid'] == 1
+    
+    report = reports.sales_report(DAY, DAY)
+    print(f"2. Sales report: {report}")
+    assert report['count'] == 1 and report['revenue'] == invoice['final']
+    assert report['sections'] == {'Salon': 25, 'Cafe': 3, 'Gamnet': 6}
+    assert report['payment_methods']['Cash']['count'] == 1
+    activity = reports.section_activity(30, today=OPEN)
+    assert activity['Gamnet']['minutes'] == 30 and activity['Salon']['revenue'] == 25
+    stats = reports.customer_stats(today=OPEN)
+    assert stats['total'] == 1 and stats['active'] == 1 and stats['top'][0]['total_spent'] == invoice['final']
+    assert reports.profit_loss(DAY, DAY)['net'] == invoice['final']
+    
+    z_report = invoices.close_day(DAY, 'admin', when=OPEN + timedelta(hours=12))
+    assert z_report['revenue'] == invoice['final'] and invoices.daily_summary(DAY)['closed_by'] == 'admin'
+    print("   ✓ Checkout to Z-report without widgets")
+
+def test_inventory_and_sms():
+    """Test products with blank SKUs, low stock, and SMS audiences"""
+    print("\n=== Testing Inventory and SMS ===\n")
+    test_db = make_shop()
+    inventory = InventoryService(test_db)
+    inventory.add_product('Shampoo', 'Salon', quantity=2, reorder_level=5, unit_cost=3)
+    inventory.add_product('Gel', 'Salon', sku='', quantity=10, reorder_level=5, unit_cost=1)
+    try:
+        inventory.add_product('Beans', 'Kitchen')
+        assert False, "unknown section accepted"
+    except InventoryError:
+        pass
+    assert [row['name'] for row in inventory.low_stock()] == ['Shampoo']
+    assert inventory.stock_value() == 16
+    
+    test_db.execute("INSERT INTO customers (name, phone, birthdate, last_visit_date) VALUES ('A', '0911', '1990-05-01', ?)",
+                    (DAY,))
+    test_db.execute("INSERT INTO customers (name, phone, last_visit_date) VALUES ('B', '0919', '2030-01-01')")
+    test_db.execute("INSERT INTO customers (name, phone) VALUES ('C', '0912')")
+    sender = FakeSender()
+    messaging = MessagingService(test_db, sender)
+    
+    audiences = {kind: [row['name'] for row in messaging.audience(kind, today=OPEN)]
+                 for kind in ('all', 'active', 'inactive')}
+    print(f"1. Audiences: {audiences}")
+    assert audiences == {'all': ['A', 'B', 'C'], 'active': ['A'], 'inactive': ['B', 'C']}
+    assert messaging.send_bulk(messaging.audience('all'), 'Hello') == {'sent': 2, 'failed': 1}
+    assert [row['name'] for row in messaging.birthdays(today=OPEN)] == ['A']
+    assert messaging.send_reactivation(messaging.lapsed(30, today=OPEN)) == {'sent': 1, 'failed': 0}
+    
+    for bad in (lambda: messaging.send('0000', 'Hi'), lambda: messaging.send('0911', ''),
+                lambda: MessagingService(test_db, FakeSender(configured=False)).send('0911', 'Hi')):
+        try:
+            bad()
+            assert False, "bad SMS sent"
+        except MessagingError as e:
+            print(f"   {e}")
+    print("   ✓ Inventory and SMS")
+
+def main():
+    """Run all tests"""
+    print("=" * 60)
+    print("Testing Services")
+    print("=" * 60)
+    
+    try:
+        test_customers_and_sessions()
+        test_orders_and_appointments()
+        test_invoice_payment_and_reports()
+        test_inventory_and_sms()
+        
+        print("\n" + "=" * 60)
+        print("✅ All Services Tests Passed!")
+        print("=" * 60)
+        return 0
+    except AssertionError as e:
+        print("\n" + "=" * 60)
+        print(f"❌ Test Failed: {str(e)}")
+        print("=" * 60)
+        return 1
+
+if __name__ == '__main__':
+    sys.exit(main())
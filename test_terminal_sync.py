@@ -0,0 +1,202 @@
+#!/usr/bin/env python3
+"""
+Test Terminal Sync
+Tests change log replication between a main node and terminal replicas,
+each a database file of its own
+"""
+import os
+import sys
+import tempfile
+import time
+from datetime import datetime
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from database import Database
+from api_server import ApiServer
+from terminal_sync import SyncEngine, SyncError
+from archive import ArchiveManager
+from services import CustomerService, SessionService, OrderService, InvoiceService
+from services.remote import ApiClient, RemoteService
+
+DAY = '2030-05-01'
+OPEN = datetime(2030, 5, 1, 10, 0, 0)
+
+def make_nodes(*terminals):
+    """A main node with one customer and a device, and replicas named terminals"""
+    folder = tempfile.mkdtemp()
+    main_db = Database(os.path.join(folder, 'main.db'))
+    main_db.initialize_defaults()
+    CustomerService(main_db).register('Sara', '09121234567', when=OPEN)
+    SessionService(main_db).add_device('PC-1', 'PC', 12)
+    main = SyncEngine(main_db)
+    main.enable('main')
+    replicas = [main.create_replica(os.path.join(folder, f'{name}.db'), name) for name in terminals]
+    return main, [SyncEngine(replica) for replica in replicas]
+
+def wallet(database, phone):
+    return database.fetchone("SELECT wallet_balance FROM customers WHERE phone = ?", (phone,))['wallet_balance']
+
+def test_offline_changes_merge():
+    """Test balances summed, rows inserted on both sides, and settings last-writer-wins"""
+    print("\n=== Testing Offline Changes ===\n")
+    main, (till,) = make_nodes('till-1')
+    try:
+        main.sync(main)
+        assert False, "main node synced with itself"
+    except SyncError:
+        pass
+    
+    # Both nodes work while apart
+    CustomerService(till.db).adjust_wallet('09121234567', 30)
+    CustomerService(main.db).adjust_wallet('09121234567', 20)
+    CustomerService(till.db).register('Reza (till)', '09350000000', when=OPEN)
+    CustomerService(main.db).register('Reza', '09350000000', when=OPEN)
+    CustomerService(till.db).adjust_wallet('09350000000', 5)
+    SessionService(till.db).start(1, '09350000000', when=OPEN)
+    till.db.execute("UPDATE settings SET value = 'Till name' WHERE key = 'business_name'")
+    time.sleep(0.01)  # Later by the log's millisecond clock, so the main node's name wins
+    main.db.execute("UPDATE settings SET value = 'Kagan Main' WHERE key = 'business_name'")
+    till.db.execute("UPDATE settings SET value = '/mnt/till' WHERE key = 'backup_path'")
+    assert till.pending() > 0
+    
+    totals = till.sync(main)
+    print(f"1. First sync: {totals}")
+    assert totals['conflicts'] == 0 and till.pending() == 0
+    
+    for node in (main, till):
+        assert wallet(node.db, '09121234567') == 50
+        assert wallet(node.db, '09350000000') == 5
+        assert node.db.fetchone("SELECT COUNT(*) as n FROM customers WHERE phone = '09350000000'")['n'] == 1
+        assert node.db.fetchone("SELECT value FROM settings WHERE key = 'business_name'")['value'] == 'Kagan Main'
+        session = node.db.fetchone(
+            """SELECT c.phone, d.device_number FROM gamnet_sessions s
+               JOIN customers c ON c.id = s.customer_id JOIN gamnet_devices d ON d.id = s.device_id"""
+        )
+        assert (session['phone'], session['device_number']) == ('09350000000', 'PC-1')
+    assert main.db.fetchone("SELECT value FROM settings WHERE key = 'backup_path'")['value'] != '/mnt/till'
+    
+    # Ending the session on the main node (session and device rows) reaches the till
+    # through the id mapping
+    SessionService(main.db).end(1, when=datetime(2030, 5, 1, 11, 0, 0))
+    assert till.sync(main) == {'pushed': 0, 'pulled': 2, 'conflicts': 0}
+    assert till.db.fetchone("SELECT charge FROM gamnet_sessions")['charge'] == 12
+    assert till.sync(main) == {'pushed': 0, 'pulled': 0, 'conflicts': 0}
+    assert wallet(till.db, '09121234567') == 50
+    print("   ✓ Offline changes merged")
+
+def test_two_terminals_and_conflicts():
+    """Test changes relayed between terminals, repeated batches, and refused changes"""
+    print("\n=== Testing Terminals and Conflicts ===\n")
+    main, (first, second) = make_nodes('till-1', 'till-2')
+    
+    item_id = OrderService(first.db).add_menu_item('Tea', 'Tea', 3)
+    OrderService(first.db).place('09121234567', [OrderService(first.db).line(item_id, 2)], when=OPEN)
+    first.sync(main)
+    second.sync(main)
+    order = second.db.fetchone(
+        """SELECT c.phone, o.total_amount, m.name FROM cafe_orders o
+           JOIN customers c ON c.id = o.customer_id
+           JOIN cafe_order_items i ON i.order_id = o.id JOIN cafe_menu m ON m.id = i.menu_item_id"""
+    )
+    print(f"1. Order relayed to the second till: {dict(order)}")
+    assert (order['phone'], order['total_amount'], order['name']) == ('09121234567', 6, 'Tea')
+    
+    # A batch sent again after a lost answer changes nothing
+    CustomerService(first.db).adjust_points('09121234567', 7)
+    changes = first.db.fetchall("SELECT * FROM sync_log WHERE origin = 'till-1'")
+    batch = [first._change(row) for row in changes]
+    first.sync(main)
+    assert main.push('till-1', batch)['applied'] == 0
+    assert main.db.fetchone("SELECT loyalty_points FROM customers WHERE phone = '09121234567'")['loyalty_points'] == 7
+    
+    # The main node closed the day while the second till was still selling
+    InvoiceService(main.db).close_day(DAY, 'admin', when=datetime(2030, 5, 1, 23, 0, 0))
+    OrderService(second.db).place('09121234567', [OrderService(second.db).line(item_id, 1)], when=OPEN)
+    totals = second.sync(main)
+    print(f"2. Sync into a closed day: {totals}")
+    assert totals['conflicts'] == 2
+    assert [row['reason'] for row in main.conflicts()] == ["Refers to a cafe_orders row that was refused",
+                                                            'Day is closed']
+    assert main.db.fetchone("SELECT COUNT(*) as n FROM cafe_orders")['n'] == 1
+    assert main.db.fetchone("SELECT COUNT(*) as n FROM cafe_order_items")['n'] == 1
+    print("   ✓ Terminals and conflicts")
+
+def test_archiving_is_not_synced():
+    """Test that rows archived on one node are not deleted on the others"""
+    print("\n=== Testing Archiving and Sync ===\n")
+    main, (till,) = make_nodes('till-1')
+    OrderService(main.db).add_menu_item('Tea', 'Tea', 3)
+    with main.db.transaction() as cursor:
+        cursor.execute(
+            """INSERT INTO invoices (customer_id, invoice_date, total_amount, final_amount, payment_method, is_paid)
+               VALUES (1, '2020-06-01 10:00:00', 30, 30, 'Cash', 1)"""
+        )
+        cursor.execute("INSERT INTO cafe_orders (customer_id, order_date, total_amount) VALUES (1, '2020-06-01 09:00:00', 6)")
+        cursor.execute("INSERT INTO cafe_order_items (order_id, menu_item_id, quantity, price) VALUES (?, 1, 2, 3)",
+                       (cursor.lastrowid,))
+    till.sync(main)
+    assert till.db.fetchone("SELECT COUNT(*) as n FROM invoices")['n'] == 1
+    triggers = till.db.fetchone("SELECT COUNT(*) as n FROM sqlite_master WHERE type = 'trigger'")['n']
+    
+    moved = ArchiveManager(till.db, directory=tempfile.mkdtemp()).archive(before='2021-01-01')
+    print(f"1. Archived on the till: {moved}")
+    assert moved['invoices'] == 1 and moved['cafe_order_items'] == 1
+    assert till.pending() == 0
+    assert till.db.fetchone("SELECT COUNT(*) as n FROM sqlite_master WHERE type = 'trigger'")['n'] == triggers
+    
+    till.sync(main)
+    assert main.db.fetchone("SELECT COUNT(*) as n FROM invoices")['n'] == 1
+    assert main.db.fetchone("SELECT COUNT(*) as n FROM cafe_order_items")['n'] == 1
+    
+    # Deletes outside archiving are still sent
+    till.db.execute("INSERT INTO sms_history (customer_id, message, status, sent_date) VALUES (1, 'Hi', 'sent', ?)",
+                    (DAY,))
+    till.sync(main)
+    till.db.execute("DELETE FROM sms_history")
+    assert till.pending() == 1
+    till.sync(main)
+    assert main.db.fetchone("SELECT COUNT(*) as n FROM sms_history")['n'] == 0
+    print("   ✓ Archived rows stay on the main node")
+
+def test_sync_over_api_server():
+    """Test a terminal syncing through the main node's API server"""
+    print("\n=== Testing Sync over HTTP ===\n")
+    main, (till,) = make_nodes('till-1')
+    server = ApiServer(main.db, pool_size=2)
+    server.start('127.0.0.1', 0)
+    try:
+        CustomerService(till.db).adjust_wallet('09121234567', 12)
+        CustomerService(main.db).register('Ali', '09190000000', when=OPEN)
+        totals = till.sync(RemoteService(ApiClient(server.url), 'sync'))
+        print(f"1. Synced over HTTP: {totals}")
+        assert wallet(main.db, '09121234567') == 12
+        assert till.db.fetchone("SELECT name FROM customers WHERE phone = '09190000000'")['name'] == 'Ali'
+    finally:
+        server.stop()
+    print("   ✓ Sync over HTTP")
+
+def main():
+    """Run all tests"""
+    print("=" * 60)
+    print("Testing Terminal Sync")
+    print("=" * 60)
+    
+    try:
+        test_offline_changes_merge()
+        test_two_terminals_and_conflicts()
+        test_archiving_is_not_synced()
+        test_sync_over_api_server()
+        
+        print("\n" + "=" * 60)
+        print("✅ All Terminal Sync Tests Passed!")
+        print("=" * 60)
+        return 0
+    except AssertionError as e:
+        print("\n" + "=" * 60)
+        print(f"❌ Test Failed: {str(e)}")
+        print("=" * 60)
+        return 1
+
+if __name__ == '__main__':
+    sys.exit(main())
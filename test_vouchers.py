@@ -0,0 +1,207 @@
+#!/usr/bin/env python3
+"""
+Test Campaign Vouchers
+Tests bulk voucher issue, cached validation and redeem-once
+"""
+import os
+import sys
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from database import Database
+from vouchers import VoucherEngine, VoucherError
+from checkout import CheckoutEngine, CheckoutError
+
+TODAY = '2024-07-01'
+WHEN = datetime(2024, 7, 1, 12, 0)
+
+def make_campaign_db():
+    """Create a throwaway database with one running and one finished campaign"""
+    test_db = Database(os.path.join(tempfile.mkdtemp(), 'vouchers.db'))
+    test_db.initialize_defaults()
+    test_db.execute(
+        """INSERT INTO campaigns (name, code, discount_percentage, start_date, end_date)
+           VALUES ('Summer', 'SUMMER', 25, '2024-06-01', '2024-08-31')"""
+    )
+    test_db.execute(
+        """INSERT INTO campaigns (name, code, discount_percentage, start_date, end_date)
+           VALUES ('Spring', 'SPRING', 10, '2024-03-01', '2024-05-31')"""
+    )
+    return test_db, VoucherEngine(test_db)
+
+def test_issue_and_validate():
+    """Test issuing vouchers and validating them from the cache"""
+    print("\n=== Testing Voucher Issue and Validation ===\n")
+    test_db, engine = make_campaign_db()
+    codes = engine.generate(1, 500)
+    expired = engine.generate(2, 5)
+    print(f"1. Issued {len(codes)} codes, e.g. {codes[:3]}")
+    assert len(set(codes)) == 500
+    assert test_db.fetchone("SELECT COUNT(*) as c FROM campaign_vouchers")['c'] == 505
+    
+    found = engine.validate(codes[0].lower(), TODAY)
+    assert found['voucher'] and found['discount_percentage'] == 25 and found['code'] == codes[0]
+    assert engine.validate('SUMMER', TODAY)['voucher'] is False
+    assert engine.validate(expired[0], TODAY) is None
+    assert engine.validate('NOPE', TODAY) is None
+    
+    statements = []
+    test_db.conn.set_trace_callback(statements.append)
+    for code in codes:
+        assert engine.validate(code, TODAY)
+    test_db.conn.set_trace_callback(None)
+    print(f"2. Validated 500 codes with {len(statements)} queries")
+    assert statements == []
+    print("   ✓ Validation served from the cache")
+
+def test_incremental_cache_refresh():
+    """Test that an expired cache reads only new vouchers, and campaigns without dates"""
+    print("\n=== Testing Cache Refresh ===\n")
+    test_db, _ = make_campaign_db()
+    engine = VoucherEngine(test_db, cache_ttl=0)
+    codes = engine.generate(1, 200)
+    assert engine.validate(codes[0], TODAY)
+    
+    # Issued by another instance (e.g. the API server): picked up past the rowid mark
+    newer = VoucherEngine(test_db).generate(1, 3)
+    statements = []
+    test_db.conn.set_trace_callback(statements.append)
+    assert engine.validate(newer[0], TODAY)['voucher']
+    test_db.conn.set_trace_callback(None)
+    print(f"1. Refresh queries: {len(statements)}")
+    assert any('rowid > 200' in statement for statement in statements)
+    
+    # A deactivated campaign's vouchers stop validating without a full reload
+    test_db.execute("UPDATE campaigns SET is_active = 0 WHERE id = 1")
+    assert engine.validate(codes[1], TODAY) is None and engine.validate('SUMMER', TODAY) is None
+    
+    # Open-ended campaigns validate and redeem alike
+    test_db.execute("INSERT INTO campaigns (name, discount_percentage) VALUES ('Always', 5)")
+    code = engine.generate(3, 1)[0]
+    assert engine.validate(code, TODAY)
+    engine.redeem(code, when=WHEN)
+    assert engine.validate(code, TODAY) is None
+    print("   ✓ Cache refreshed incrementally")
+
+def test_redeem_once():
+    """Test that a voucher can only be redeemed once, even concurrently"""
+    print("\n=== Testing Redeem Once ===\n")
+    test_db, engine = make_campaign_db()
+    code = engine.generate(1, 1)[0]
+    
+    def attempt(_):
+        try:
+            VoucherEngine(test_db).redeem(code, when=WHEN)
+            return True
+        except VoucherError:
+            return False
+    
+    with ThreadPoolExecutor(max_workers=8) as pool:
+        successes = sum(pool.map(attempt, range(20)))
+    print(f"1. {successes} of 20 concurrent redemptions succeeded")
+    assert successes == 1
+    
+    engine.invalidate()
+    assert engine.validate(code, TODAY) is None
+    print("   ✓ Redeemed exactly once")
+
+def test_checkout_redeems_voucher():
+    """Test that checkout applies and consumes a voucher atomically"""
+    print("\n=== Testing Voucher at Checkout ===\n")
+    test_db, _ = make_campaign_db()
+    checkout = CheckoutEngine(test_db)
+    code = checkout.vouchers.generate(1, 1)[0]
+    item = [{'section': 'Cafe', 'description': 'Cake', 'amount': 40}]
+    
+    result = checkout.checkout('0912', code, item, when=WHEN)
+    voucher = test_db.fetchone("SELECT * FROM campaign_vouchers WHERE code = ?", (code,))
+    print(f"1. Invoice #{result['invoice_id']} discount {result['discount']}, voucher invoice {voucher['invoice_id']}")
+    assert result['discount'] == 10 and voucher['invoice_id'] == result['invoice_id']
+    
+    try:
+        checkout.checkout('0912', code, item, when=WHEN)
+        raise AssertionError("A used voucher must be refused")
+    except CheckoutError as e:
+        print(f"2. Reuse refused: {e}")
+    assert test_db.fetchone("SELECT COUNT(*) as c FROM invoices")['c'] == 1
+    print("   ✓ Voucher consumed with the invoice")
+
+def test_failed_checkout_keeps_voucher():
+    """Test that a voucher stays usable at the till when its checkout rolls back"""
+    print("\n=== Testing Voucher After a Failed Checkout ===\n")
+    test_db, _ = make_campaign_db()
+    checkout = CheckoutEngine(test_db)
+    code = checkout.vouchers.generate(1, 1)[0]
+    assert checkout.find_campaign(code, TODAY)
+    test_db.execute("INSERT INTO customers (name, phone) VALUES ('Test', '0912')")
+    test_db.execute("INSERT INTO cafe_orders (customer_id, order_date, total_amount) VALUES (1, ?, 40)", (TODAY,))
+    # As if another till billed the order first: the link update touches no row
+    test_db.execute(
+        """CREATE TEMP TRIGGER billed_elsewhere BEFORE UPDATE OF invoice_id ON cafe_orders
+           BEGIN SELECT RAISE(IGNORE); END"""
+    )
+    try:
+        checkout.checkout('0912', code, when=WHEN)
+        raise AssertionError("Checkout should have failed")
+    except CheckoutError as e:
+        print(f"1. Checkout failed: {e}")
+    assert test_db.fetchone("SELECT redeemed_at FROM campaign_vouchers WHERE code = ?", (code,))['redeemed_at'] is None
+    assert checkout.find_campaign(code, TODAY), "Rolled-back voucher refused from the cache"
+    
+    test_db.execute("DROP TRIGGER billed_elsewhere")
+    result = checkout.checkout('0912', code, when=WHEN)
+    print(f"2. Retried: invoice #{result['invoice_id']} discount {result['discount']}")
+    assert result['discount'] == 10
+    assert checkout.find_campaign(code, TODAY) is None
+    print("   ✓ Voucher kept until the checkout commits")
+
+def test_bulk_issue_speed():
+    """Test issuing 100k vouchers and validating in constant time"""
+    print("\n=== Testing Bulk Issue ===\n")
+    test_db, engine = make_campaign_db()
+    started = time.perf_counter()
+    codes = engine.generate(1, 100000)
+    issued = time.perf_counter() - started
+    started = time.perf_counter()
+    engine.validate(codes[0], TODAY)
+    loaded = time.perf_counter() - started
+    started = time.perf_counter()
+    for code in codes[:10000]:
+        engine.validate(code, TODAY)
+    per_check = (time.perf_counter() - started) / 10000
+    print(f"1. Issued 100k in {issued:.2f}s, cache load {loaded * 1000:.0f} ms, "
+          f"validation {per_check * 1e6:.1f} µs each")
+    assert len(set(codes)) == 100000
+    assert issued < 10
+    print("   ✓ Issued in seconds")
+
+def main():
+    """Run all tests"""
+    print("=" * 60)
+    print("Testing Campaign Vouchers")
+    print("=" * 60)
+    
+    try:
+        test_issue_and_validate()
+        test_incremental_cache_refresh()
+        test_redeem_once()
+        test_checkout_redeems_voucher()
+        test_failed_checkout_keeps_voucher()
+        test_bulk_issue_speed()
+        
+        print("\n" + "=" * 60)
+        print("✅ All Voucher Tests Passed!")
+        print("=" * 60)
+        return 0
+    except AssertionError as e:
+        print("\n" + "=" * 60)
+        print(f"❌ Test Failed: {str(e)}")
+        print("=" * 60)
+        return 1
+
+if __name__ == '__main__':
+    sys.exit(main())
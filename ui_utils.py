@@ -101,6 +101,88 @@ class GlassScrollableFrame(ctk.CTkScrollableFrame):
         }
         super().__init__(master, **_set_default_kwargs(kwargs, defaults))
 
+class SuggestionEntry(ctk.CTkFrame):
+    """Entry that lists matches for the text typed so far
+    
+    search(text) runs once typing has paused for delay_ms, so a fast typist
+    triggers one lookup rather than one per key. describe(item) is the text
+    of a suggestion; choosing one sets the entry to value(item) and calls
+    on_select(item); Return chooses the top suggestion.
+    """
+    def __init__(self, master, search, describe=str, value=str, on_select=None, delay_ms=200, **kwargs):
+        super().__init__(master, fg_color='transparent')
+        self.search = search
+        self.describe = describe
+        self.value = value
+        self.on_select = on_select
+        self.delay_ms = delay_ms
+        self._pending = None
+        self._searched = ''
+        self._items = []
+        
+        self.entry = GlassEntry(self, **kwargs)
+        self.entry.pack(fill='x')
+        self.entry.bind('<KeyRelease>', self._schedule)
+        self.entry.bind('<Return>', self._choose_first)
+        self.suggestions = GlassFrame(self, corner_radius=10)
+    
+    def _schedule(self, event=None):
+        """Restart the pause timer after each key"""
+        if self._pending:
+            self.after_cancel(self._pending)
+        self._pending = self.after(self.delay_ms, self._refresh)
+    
+    def _refresh(self):
+        """Show the matches for the current text"""
+        self._pending = None
+        text = self.entry.get().strip()
+        if text == self._searched:
+            return
+        self._searched = text
+        for child in self.suggestions.winfo_children():
+            child.destroy()
+        items = self._items = self.search(text) if text else []
+        for item in items:
+            ctk.CTkButton(
+                self.suggestions,
+                text=self.describe(item),
+                anchor='w',
+                fg_color='transparent',
+                hover_color=COLORS['primary'],
+                text_color=COLORS['text'],
+                command=lambda item=item: self._choose(item)
+            ).pack(fill='x', padx=5, pady=1)
+        if items:
+            self.suggestions.pack(fill='x', pady=(2, 0))
+        else:
+            self.suggestions.pack_forget()
+    
+    def _choose_first(self, event=None):
+        """Choose the top suggestion, searching first if typing has not paused yet"""
+        if self._pending:
+            self.after_cancel(self._pending)
+            self._refresh()
+        if self._items:
+            self._choose(self._items[0])
+    
+    def _choose(self, item):
+        """Fill the entry with the chosen suggestion"""
+        self.entry.delete(0, 'end')
+        self.entry.insert(0, self.value(item))
+        self._searched = self.entry.get().strip()
+        self.suggestions.pack_forget()
+        if self.on_select:
+            self.on_select(item)
+    
+    def get(self):
+        return self.entry.get()
+    
+    def delete(self, first, last=None):
+        self.entry.delete(first, last)
+    
+    def insert(self, index, string):
+        self.entry.insert(index, string)
+
 
 def setup_vazir_font():
     """Setup Vazir font for Persian text support"""
@@ -0,0 +1,193 @@
+"""
+Vouchers Module
+Issues single-use campaign vouchers in bulk and validates campaign and
+voucher codes at the till from an in-memory cache
+"""
+import secrets
+import threading
+import time
+from datetime import datetime
+
+from database import db
+from app_logger import log_info
+
+# No 0/O or 1/I, so codes can be read out over the phone
+CODE_ALPHABET = '23456789ABCDEFGHJKLMNPQRSTUVWXYZ'
+CODE_LENGTH = 10
+CACHE_TTL = 60
+
+class VoucherError(Exception):
+    """Raised when a voucher cannot be issued or redeemed"""
+
+class VoucherEngine:
+    """Voucher issue, cached validation and redeem-once
+    
+    The cache maps every shared campaign code and unredeemed voucher to
+    its campaign, so validate() is a dict lookup. After CACHE_TTL seconds
+    or refresh() it is brought up to date cheaply: the active campaigns
+    (a small table) are read again, and only vouchers issued since the
+    last load by rowid are added. invalidate() drops it for a full reload.
+    redeem() always checks the database, so a stale cache can never
+    redeem a code twice. A code redeemed inside a caller's transaction
+    stays cached until the caller calls discard() after committing, so a
+    rolled-back checkout leaves the voucher usable at the till.
+    """
+    def __init__(self, database=None, cache_ttl=CACHE_TTL):
+        self.db = database or db
+        self.cache_ttl = cache_ttl
+        self._campaigns = {}
+        self._shared = {}
+        self._codes = None
+        self._voucher_mark = 0
+        self._loaded_at = None
+        self._lock = threading.Lock()
+    
+    def invalidate(self):
+        """Drop the code cache; it is reloaded in full on the next validate()"""
+        with self._lock:
+            self._codes = None
+    
+    def refresh(self):
+        """Pick up campaign changes and newly issued vouchers on the next validate()"""
+        with self._lock:
+            self._loaded_at = None
+    
+    def _active_codes(self):
+        """(campaign id -> active campaign, shared code -> campaign id, voucher code -> campaign id)
+        
+        Campaigns are read again when older than cache_ttl; vouchers are
+        loaded in full once and then only past the rowid mark.
+        """
+        with self._lock:
+            if (self._codes is not None and self._loaded_at is not None
+                    and time.monotonic() - self._loaded_at < self.cache_ttl):
+                return self._campaigns, self._shared, self._codes
+            self._campaigns = {
+                row['id']: dict(row)
+                for row in self.db.fetchall(
+                    """SELECT id, name, code, discount_percentage, start_date, end_date
+                       FROM campaigns WHERE is_active = 1"""
+                )
+            }
+            self._shared = {campaign['code']: campaign_id
+                            for campaign_id, campaign in self._campaigns.items() if campaign['code']}
+            if self._codes is None:
+                self._codes, self._voucher_mark = {}, 0
+            mark = self.db.fetchone("SELECT COALESCE(MAX(rowid), 0) as mark FROM campaign_vouchers")['mark']
+            added = 0
+            if mark > self._voucher_mark:
+                # Vouchers of inactive campaigns are kept too, in case the campaign is switched back on
+                for row in self.db.fetchall(
+                    """SELECT code, campaign_id FROM campaign_vouchers
+                       WHERE rowid > ? AND rowid <= ? AND redeemed_at IS NULL""",
+                    (self._voucher_mark, mark)
+                ):
+                    self._codes[row['code']] = row['campaign_id']
+                    added += 1
+                self._voucher_mark = mark
+            self._loaded_at = time.monotonic()
+            if added:
+                log_info(f"Loaded {added} voucher code(s); {len(self._codes)} cached")
+            return self._campaigns, self._shared, self._codes
+    
+    def validate(self, code, today=None):
+        """Campaign details for a usable code on a date, or None
+        
+        The result has the campaign's columns plus 'code' (the code given)
+        and 'voucher' (True for single-use vouchers).
+        """
+        if not code:
+            return None
+        campaigns, shared, vouchers = self._active_codes()
+        code = code.strip()
+        if code not in vouchers and code not in shared:
+            code = code.upper()
+        is_voucher = code in vouchers
+        campaign = campaigns.get(vouchers[code] if is_voucher else shared.get(code))
+        if campaign is None:
+            return None
+        today = today or datetime.now().strftime('%Y-%m-%d')
+        if not (campaign['start_date'] or '') <= today <= (campaign['end_date'] or '9999-12-31'):
+            return None
+        return dict(campaign, code=code, voucher=is_voucher)
+    
+    def generate(self, campaign_id, count, length=CODE_LENGTH, when=None):
+        """Issue `count` new unique vouchers for a campaign in one transaction
+        
+        Returns the list of codes.
+        """
+        if count <= 0:
+            raise VoucherError("Count must be positive")
+        when = (when or datetime.now()).strftime('%Y-%m-%d %H:%M:%S')
+        issued = set()
+        with self.db.transaction() as cursor:
+            if not cursor.execute("SELECT 1 FROM campaigns WHERE id = ?", (campaign_id,)).fetchone():
+                raise VoucherError("Campaign not found")
+            while len(issued) < count:
+                batch = set()
+                while len(batch) < count - len(issued):
+                    batch.add(''.join(secrets.choice(CODE_ALPHABET) for _ in range(length)))
+                cursor.execute("SAVEPOINT voucher_batch")
+                cursor.executemany(
+                    "INSERT OR IGNORE INTO campaign_vouchers (code, campaign_id, issued_at) VALUES (?, ?, ?)",
+                    [(code, campaign_id, when) for code in batch]
+                )
+                if cursor.rowcount == len(batch):
+                    issued |= batch
+                else:
+                    # A code already exists (very rare): find out which ones went in
+                    cursor.execute("ROLLBACK TO voucher_batch")
+                    for code in batch:
+                        cursor.execute(
+                            "INSERT OR IGNORE INTO campaign_vouchers (code, campaign_id, issued_at) VALUES (?, ?, ?)",
+                            (code, campaign_id, when)
+                        )
+                        if cursor.rowcount == 1:
+                            issued.add(code)
+                cursor.execute("RELEASE voucher_batch")
+        self.refresh()
+        log_info(f"Issued {len(issued)} vouchers for campaign #{campaign_id}")
+        return sorted(issued)
+    
+    def redeem(self, code, invoice_id=None, customer_id=None, when=None, cursor=None):
+        """Mark a voucher used, exactly once
+        
+        Pass `cursor` to redeem inside a caller's transaction (e.g. checkout),
+        and call discard(code) once it has committed.
+        Raises VoucherError if the voucher is unknown, expired or already used.
+        """
+        when = when or datetime.now()
+        params = (when.strftime('%Y-%m-%d %H:%M:%S'), invoice_id, customer_id, code, when.strftime('%Y-%m-%d'))
+        query = """UPDATE campaign_vouchers SET redeemed_at = ?, invoice_id = ?, customer_id = ?
+                   WHERE code = ? AND redeemed_at IS NULL
+                   AND campaign_id IN (SELECT id FROM campaigns
+                                       WHERE is_active = 1
+                                       AND ? BETWEEN COALESCE(start_date, '') AND COALESCE(end_date, '9999-12-31'))"""
+        if cursor is None:
+            with self.db.transaction() as cursor:
+                cursor.execute(query, params)
+                redeemed = cursor.rowcount == 1
+            if redeemed:
+                self.discard(code)
+        else:
+            cursor.execute(query, params)
+            redeemed = cursor.rowcount == 1
+        if not redeemed:
+            raise VoucherError(f"Voucher {code} is not valid or has already been used")
+    
+    def discard(self, code):
+        """Drop a redeemed code from the cache once its transaction has committed"""
+        with self._lock:
+            if self._codes is not None:
+                self._codes.pop(code, None)
+    
+    def campaign_usage(self, campaign_id):
+        """Issued and redeemed voucher counts for a campaign"""
+        return self.db.fetchone(
+            """SELECT COUNT(*) as issued, COUNT(redeemed_at) as redeemed
+               FROM campaign_vouchers WHERE campaign_id = ?""",
+            (campaign_id,)
+        )
+
+# Global voucher engine instance
+voucher_engine = VoucherEngine()